@@ -31,9 +31,8 @@ from typing import Any
 # Long-running progress
 # -----------------------
 ORDERS_PROGRESS: dict[int, dict[str, object]] = {}
-FINANCE_PROGRESS: dict[int, dict[str, object]] = {}
-FINANCE_RESULTS: dict[int, dict[str, Any]] = {}  # Хранит результаты финансового отчета по user_id
-FINANCE_LOADING: dict[int, bool] = {}  # Флаг загрузки финансового отчета
+# Прогресс, флаг загрузки и результаты фин. отчётов — на диске (utils.report_results),
+# чтобы их видели все воркеры и они переживали перезапуск
 
 # -----------------------
 # FBW planning in-memory cache (per user)
@@ -68,17 +67,19 @@ def _clear_orders_progress(user_id: int, key: str | None = None) -> None:
 
 def _set_finance_progress(user_id: int, current: int, total: int, period: str = "") -> None:
     try:
-        FINANCE_PROGRESS[user_id] = {"current": current, "total": total, "period": period}
+        from utils.report_results import REPORT_KIND_FINANCE, set_report_job_progress
+        set_report_job_progress(user_id, REPORT_KIND_FINANCE, current, total, period)
     except Exception:
         pass
 
 def _get_finance_progress(user_id: int) -> dict[str, object]:
-    return FINANCE_PROGRESS.get(user_id) or {"current": 0, "total": 0, "period": ""}
+    from utils.report_results import REPORT_KIND_FINANCE, get_report_job
+    return dict(get_report_job(user_id, REPORT_KIND_FINANCE)["progress"])
 
 def _clear_finance_progress(user_id: int) -> None:
     try:
-        if user_id in FINANCE_PROGRESS:
-            del FINANCE_PROGRESS[user_id]
+        from utils.report_results import REPORT_KIND_FINANCE, clear_report_job_progress
+        clear_report_job_progress(user_id, REPORT_KIND_FINANCE)
     except Exception:
         pass
 from datetime import datetime, timedelta, timezone
@@ -109,14 +110,40 @@ from flask_login import (
 APP_VERSION = "1.0.1"
 
 from utils.constants import (
-    LAST_RESULTS_CACHE_MAX_BYTES,
     WB_ORDERS_FETCH_MAX_PAGES,
     WB_ORDERS_FETCH_MAX_PAGES_INTRADAY,
     WB_ORDERS_PAGE_SLEEP_S,
     WB_ORDERS_PAGE_SLEEP_INTRADAY_S,
     ORDERS_TODAY_CACHE_TTL_SECONDS,
 )
-from utils.cache import period_cache_day_entry_is_fresh
+from utils.cache import (
+    period_cache_day_entry_is_fresh,
+    load_last_results,
+    save_last_results,
+    save_products_cache,
+    save_stocks_cache,
+    save_stocks_cache_for_user,
+    find_product_item,
+    stock_items_for_barcodes,
+)
+from utils.cache_layout import (
+    FEATURE_AUTO_UPDATE,
+    auto_update_enabled,
+    feature_index_exists,
+    rebuild_feature_index,
+    remove_user_cache,
+    set_user_feature,
+    user_cache_path,
+    users_with_feature,
+)
+from utils.interning import intern_row, intern_rows
+from utils.finance_columnar import FinanceColumns
+from utils.datetime_parse import (
+    parse_date as _fast_parse_date,
+    parse_iso_datetime as _fast_parse_iso_datetime,
+    parse_wb_datetime as _fast_parse_wb_datetime,
+    strptime_fixed,
+)
 
 # --- Throttling for WB supplies API ---
 _last_supplies_api_call_ts: float = 0.0
@@ -145,15 +172,9 @@ DEFAULT_MARGIN_SETTINGS = {
     "localization_index": 1.0,  # Индекс локализации
 }
 
-def _get_cache_dir() -> str:
-    cache_dir = os.path.join(os.path.dirname(__file__), "cache")
-    os.makedirs(cache_dir, exist_ok=True)
-    return cache_dir
-
 def load_user_margin_settings(user_id: int) -> dict:
     try:
-        cache_dir = _get_cache_dir()
-        path = os.path.join(cache_dir, f"margin_settings_{user_id}.json")
+        path = user_cache_path(user_id, "margin_settings")
         if os.path.exists(path):
             with open(path, "r", encoding="utf-8") as f:
                 data = json.load(f) or {}
@@ -188,8 +209,7 @@ def save_user_margin_settings(user_id: int, settings: dict) -> dict:
             except Exception:
                 normalized[key] = default_val
     try:
-        cache_dir = _get_cache_dir()
-        path = os.path.join(cache_dir, f"margin_settings_{user_id}.json")
+        path = user_cache_path(user_id, "margin_settings")
         with open(path, "w", encoding="utf-8") as f:
             json.dump(normalized, f, ensure_ascii=False)
     except Exception as e:
@@ -588,21 +608,7 @@ def format_int_thousands(value: Any) -> str:
 
 
 def _parse_iso_datetime(value: str | None) -> datetime | None:
-    if not value:
-        return None
-    try:
-        # Support trailing 'Z'
-        s = value.replace("Z", "+00:00")
-        return datetime.fromisoformat(s)
-    except Exception:
-        try:
-            # Fallback common formats
-            return datetime.strptime(value, "%Y-%m-%dT%H:%M:%S%z")
-        except Exception:
-            try:
-                return datetime.strptime(value, "%Y-%m-%dT%H:%M:%S")
-            except Exception:
-                return None
+    return _fast_parse_iso_datetime(value)
 
 
 def _fmt_dt_moscow(value: str | None, with_time: bool = True) -> str:
@@ -1145,18 +1151,18 @@ def _get_session_id() -> str:
 
 def _cache_path_for_user() -> str:
     if current_user.is_authenticated:
-        return os.path.join(CACHE_DIR, f"orders_user_{current_user.id}.json")
+        return user_cache_path(current_user.id, "orders")
     return os.path.join(CACHE_DIR, f"orders_{_get_session_id()}.json")
 
 
 def _cache_path_for_user_id(user_id: int) -> str:
-    return os.path.join(CACHE_DIR, f"orders_user_{user_id}.json")
+    return user_cache_path(user_id, "orders")
 
 
 # Products cache helpers (per user)
 def _products_cache_path_for_user() -> str:
     if current_user.is_authenticated:
-        return os.path.join(CACHE_DIR, f"products_user_{current_user.id}.json")
+        return user_cache_path(current_user.id, "products")
     return os.path.join(CACHE_DIR, "products_anon.json")
 
 
@@ -1169,16 +1175,6 @@ def load_products_cache() -> Dict[str, Any] | None:
             return json.load(f)
     except Exception:
         return None
-def save_products_cache(payload: Dict[str, Any]) -> None:
-    path = _products_cache_path_for_user()
-    try:
-        enriched = dict(payload)
-        if current_user.is_authenticated:
-            enriched["_user_id"] = current_user.id
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(enriched, f, ensure_ascii=False)
-    except Exception:
-        pass
 
 def _articles_cache_path_for_user() -> str:
     """Возвращает путь к файлу кэша артикулов для текущего пользователя"""
@@ -1213,7 +1209,7 @@ def save_articles_cache(payload: Dict[str, Any]) -> None:
 # Stocks cache helpers (per user)
 def _stocks_cache_path_for_user() -> str:
     if current_user.is_authenticated:
-        return os.path.join(CACHE_DIR, f"stocks_user_{current_user.id}.json")
+        return user_cache_path(current_user.id, "stocks")
     return os.path.join(CACHE_DIR, "stocks_anon.json")
 
 
@@ -1228,21 +1224,9 @@ def load_stocks_cache() -> Dict[str, Any] | None:
         return None
 
 
-def save_stocks_cache(payload: Dict[str, Any]) -> None:
-    path = _stocks_cache_path_for_user()
-    try:
-        enriched = dict(payload)
-        if current_user.is_authenticated:
-            enriched["_user_id"] = current_user.id
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(enriched, f, ensure_ascii=False)
-    except Exception:
-        pass
-
-
 def load_stocks_cache_for_user(user_id: int) -> Dict[str, Any] | None:
     """Загружает кэш остатков для конкретного пользователя"""
-    path = os.path.join(CACHE_DIR, f"stocks_user_{user_id}.json")
+    path = user_cache_path(user_id, "stocks")
     try:
         if os.path.isfile(path):
             with open(path, "r", encoding="utf-8") as f:
@@ -1252,21 +1236,9 @@ def load_stocks_cache_for_user(user_id: int) -> Dict[str, Any] | None:
     return None
 
 
-def save_stocks_cache_for_user(user_id: int, payload: Dict[str, Any]) -> None:
-    """Сохраняет кэш остатков для конкретного пользователя"""
-    path = os.path.join(CACHE_DIR, f"stocks_user_{user_id}.json")
-    try:
-        enriched = dict(payload)
-        enriched["_user_id"] = user_id
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(enriched, f, ensure_ascii=False)
-    except Exception:
-        pass
-
-
 def clear_stocks_cache_for_user(user_id: int) -> None:
     """Очищает кэш остатков для конкретного пользователя"""
-    path = os.path.join(CACHE_DIR, f"stocks_user_{user_id}.json")
+    path = user_cache_path(user_id, "stocks")
     try:
         if os.path.exists(path):
             os.remove(path)
@@ -1278,7 +1250,7 @@ def clear_stocks_cache_for_user(user_id: int) -> None:
 # FBS supplies cache helpers (per user)
 def _fbs_supplies_cache_path_for_user() -> str:
     if current_user.is_authenticated:
-        return os.path.join(CACHE_DIR, f"fbs_supplies_user_{current_user.id}.json")
+        return user_cache_path(current_user.id, "fbs_supplies")
     return os.path.join(CACHE_DIR, "fbs_supplies_anon.json")
 
 
@@ -1308,7 +1280,7 @@ def save_fbs_supplies_cache(payload: Dict[str, Any]) -> None:
 # FBW supplies cache helpers (per user)
 def _fbw_supplies_cache_path_for_user() -> str:
     if current_user.is_authenticated:
-        return os.path.join(CACHE_DIR, f"fbw_supplies_user_{current_user.id}.json")
+        return user_cache_path(current_user.id, "fbw_supplies")
     return os.path.join(CACHE_DIR, "fbw_supplies_anon.json")
 
 
@@ -1338,11 +1310,11 @@ def save_fbw_supplies_cache(payload: Dict[str, Any]) -> None:
 # Расширенный кэш поставок с товарами (для быстрой аналитики)
 def _fbw_supplies_detailed_cache_path_for_user(user_id: int | None = None) -> str:
     if user_id is not None:
-        return os.path.join(CACHE_DIR, f"fbw_supplies_detailed_user_{user_id}.json")
+        return user_cache_path(user_id, "fbw_supplies_detailed")
     # fallback без current_user в фоновых задачах
     try:
         if current_user and getattr(current_user, "is_authenticated", False):
-            return os.path.join(CACHE_DIR, f"fbw_supplies_detailed_user_{current_user.id}.json")
+            return user_cache_path(current_user.id, "fbw_supplies_detailed")
     except Exception:
         pass
     return os.path.join(CACHE_DIR, "fbw_supplies_detailed_anon.json")
@@ -1537,9 +1509,9 @@ def build_supplies_detailed_cache(
 # -------------------- Orders warm cache (6 months) --------------------
 def _orders_cache_meta_path_for_user(user_id: int = None) -> str:
     if user_id:
-        return os.path.join(CACHE_DIR, f"orders_warm_meta_user_{user_id}.json")
+        return user_cache_path(user_id, "orders_warm_meta")
     elif current_user.is_authenticated:
-        return os.path.join(CACHE_DIR, f"orders_warm_meta_user_{current_user.id}.json")
+        return user_cache_path(current_user.id, "orders_warm_meta")
     return os.path.join(CACHE_DIR, "orders_warm_meta_anon.json")
 
 
@@ -1613,9 +1585,9 @@ def build_orders_warm_cache(token: str, user_id: int = None) -> Dict[str, Any]:
 # Orders per-day cache helpers (per user)
 def _orders_period_cache_path_for_user(user_id: int = None) -> str:
     if user_id:
-        return os.path.join(CACHE_DIR, f"orders_period_user_{user_id}.json")
+        return user_cache_path(user_id, "orders_period")
     elif current_user.is_authenticated:
-        return os.path.join(CACHE_DIR, f"orders_period_user_{current_user.id}.json")
+        return user_cache_path(current_user.id, "orders_period")
     return os.path.join(CACHE_DIR, f"orders_period_{_get_session_id()}.json")
 
 
@@ -1805,7 +1777,7 @@ def get_orders_with_period_cache(
             )
             normalized["is_cancelled"] = cancel_raw is True or str(cancel_raw).lower() in ("true", "1", "истина")
 
-        return normalized
+        return intern_row(normalized)
 
     def _cached_orders(entry: Dict[str, Any]) -> list[dict[str, Any]]:
         """Backward-compatible extractor for orders list stored in a day cache entry.
@@ -1922,7 +1894,7 @@ def _update_period_cache_with_data(
 
 def _fbs_tasks_cache_path_for_user() -> str:
     if current_user.is_authenticated:
-        return os.path.join(CACHE_DIR, f"fbs_tasks_user_{current_user.id}.json")
+        return user_cache_path(current_user.id, "fbs_tasks")
     return os.path.join(CACHE_DIR, "fbs_tasks_anon.json")
 
 
@@ -1939,7 +1911,7 @@ def load_fbs_tasks_cache() -> Dict[str, Any] | None:
 
 def load_fbs_tasks_cache_by_user_id(user_id: int) -> Dict[str, Any] | None:
     """Load FBS tasks cache by user ID (for background threads)"""
-    path = os.path.join(CACHE_DIR, f"fbs_tasks_user_{user_id}.json")
+    path = user_cache_path(user_id, "fbs_tasks")
     print(f"Loading FBS tasks cache from: {path}")
     if not os.path.isfile(path):
         print(f"FBS tasks cache file not found: {path}")
@@ -1965,55 +1937,6 @@ def save_fbs_tasks_cache(payload: Dict[str, Any]) -> None:
     except Exception:
         pass
 
-def load_last_results() -> Dict[str, Any] | None:
-    path = _cache_path_for_user()
-    if not os.path.isfile(path):
-        return None
-    
-    try:
-        file_size = os.path.getsize(path)
-        if file_size > LAST_RESULTS_CACHE_MAX_BYTES:
-            lim_mb = LAST_RESULTS_CACHE_MAX_BYTES / (1024 * 1024)
-            print(
-                f"last_results cache too large ({file_size / 1024 / 1024:.1f} MB, limit {lim_mb:.0f} MB), skip load"
-            )
-            return None
-    except Exception:
-        pass
-    
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception as e:
-        print(f"Ошибка загрузки кэша: {e}")
-        return None
-def save_last_results(payload: Dict[str, Any]) -> None:
-    """
-    Сохраняет результаты в кэш, объединяя с существующими данными.
-    Это позволяет сохранять данные для разных страниц (заказы, финансовый отчет) без перезаписи друг друга.
-    """
-    path = _cache_path_for_user()
-    try:
-        # Загружаем существующий кэш, если он есть
-        existing_cache = load_last_results() or {}
-        
-        # Объединяем существующий кэш с новыми данными (новые данные имеют приоритет)
-        enriched = dict(existing_cache)
-        enriched.update(payload)
-        
-        try:
-            if current_user.is_authenticated:
-                enriched["_user_id"] = current_user.id
-                enriched["_username"] = getattr(current_user, "username", None)
-        except Exception:
-            # If current_user unavailable outside request context, ignore
-            pass
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(enriched, f, ensure_ascii=False)
-    except Exception:
-        pass
-
-
 # -------------------------
 # Models & Auth
 # -------------------------
@@ -2054,32 +1977,11 @@ def _enforce_account_validity():
 
 def parse_date(date_str: str) -> datetime:
     """Parse date string in either YYYY-MM-DD or DD.MM.YYYY format"""
-    try:
-        # Try YYYY-MM-DD format first
-        return datetime.strptime(date_str, "%Y-%m-%d")
-    except ValueError:
-        try:
-            # Try DD.MM.YYYY format
-            return datetime.strptime(date_str, "%d.%m.%Y")
-        except ValueError:
-            raise ValueError(f"Unable to parse date '{date_str}'. Expected formats: YYYY-MM-DD or DD.MM.YYYY")
+    return _fast_parse_date(date_str)
 
 
 def parse_wb_datetime(value: str) -> datetime | None:
-    if not value:
-        return None
-    s = str(value)
-    # Trim subseconds if present to 6 digits max for fromisoformat
-    try:
-        # Normalize Z to +00:00
-        s_norm = s.replace("Z", "+00:00")
-        dt = datetime.fromisoformat(s_norm[:26] + s_norm[26:])  # be forgiving on microseconds length
-        return dt
-    except Exception:
-        try:
-            return datetime.strptime(s[:19], "%Y-%m-%dT%H:%M:%S")
-        except Exception:
-            return None
+    return _fast_parse_wb_datetime(value)
 
 
 def get_with_retry(url: str, headers: Dict[str, str], params: Dict[str, Any], max_retries: int = 3, timeout_s: int = 30) -> requests.Response:
@@ -2294,7 +2196,15 @@ def _split_date_range(date_from: str, date_to: str, days_per_chunk: int = 7) ->
     return intervals
 
 
-def fetch_finance_report(token: str, date_from: str, date_to: str, limit: int = 100000, progress_callback=None) -> List[Dict[str, Any]]:
+def fetch_finance_report(
+    token: str,
+    date_from: str,
+    date_to: str,
+    limit: int = 100000,
+    progress_callback=None,
+    columnar: bool = False,
+    strict: bool = False,
+) -> List[Dict[str, Any]] | FinanceColumns:
     """Fetch financial report details v5 with rrdid pagination.
     
     Разбивает период на интервалы по 7 дней для избежания лимитов API.
@@ -2309,13 +2219,17 @@ def fetch_finance_report(token: str, date_from: str, date_to: str, limit: int =
         date_to: End date in YYYY-MM-DD format
         limit: Maximum rows per request
         progress_callback: Optional callback function(current, total, current_period) for progress updates
+        columnar: True — вернуть FinanceColumns (только нужные финансам колонки,
+            строки складываются по интервалам и не копятся словарями)
+        strict: True — не пропускать интервал, который не удалось загрузить, а поднять
+            RuntimeError; пустой результат тогда означает, что строк за период действительно нет
     """
     headers = {"Authorization": f"Bearer {token}"}
     
     # Разбиваем период на интервалы по 7 дней
     intervals = _split_date_range(date_from, date_to, days_per_chunk=7)
     total_intervals = len(intervals)
-    all_rows: List[Dict[str, Any]] = []
+    all_rows: List[Dict[str, Any]] | FinanceColumns = FinanceColumns() if columnar else []
     
     logging.info(f"Начинаем загрузку финансового отчета за период {date_from} - {date_to}, интервалов: {total_intervals}")
     for idx, (interval_from, interval_to) in enumerate(intervals, 1):
@@ -2462,6 +2376,8 @@ def fetch_finance_report(token: str, date_from: str, date_to: str, limit: int =
                 logging.info(f"Интервал {interval_from} - {interval_to}: даты в данных от {min_date} до {max_date}")
         elif interval_error:
             logging.error(f"ВНИМАНИЕ: Интервал {interval_from} - {interval_to} не загружен из-за ошибки: {interval_error}")
+            if strict:
+                raise RuntimeError(f"Интервал {interval_from} - {interval_to} не загружен: {interval_error}")
         else:
             logging.warning(f"Интервал {interval_from} - {interval_to}: не загружено ни одной записи")
         
@@ -2484,307 +2400,6 @@ def fetch_finance_report(token: str, date_from: str, date_to: str, limit: int =
     
     return all_rows
 
-def _process_finance_data(raw: List[Dict[str, Any]], req_from: str, req_to: str, user_id: int = None) -> Dict[str, Any]:
-    """Обрабатывает сырые данные финансового отчета и возвращает вычисленные метрики.
-    
-    Args:
-        raw: Список сырых записей из API
-        req_from: Начальная дата периода
-        req_to: Конечная дата периода
-        user_id: ID пользователя (для получения tax_rate)
-    
-    Returns:
-        Словарь с обработанными данными и метриками
-    """
-    from flask_login import current_user
-    
-    total_qty = 0
-    total_sum = 0.0
-    wbr_plus = 0.0
-    wbr_minus = 0.0
-    total_logistics = 0.0
-    total_storage = 0.0
-    total_acceptance = 0.0
-    total_for_pay = 0.0
-    total_buyouts = 0.0
-    total_returns = 0.0
-    total_acquiring = 0.0
-    total_commission_wb = 0.0
-    total_other_deductions = 0.0
-    total_penalties = 0.0
-    total_additional_payment = 0.0
-    total_paid_delivery = 0.0
-    x1 = x2 = x3 = x4 = x5 = x6 = x7 = x8 = 0.0
-    k1 = k2 = k3 = k4 = k5 = k6 = k7 = k8 = k9 = 0.0
-    u1 = u2 = u3 = u4 = u5 = u6 = u7 = u8 = u9 = u10 = u11 = u12 = u13 = u14 = 0.0
-    buyout_oper_values_lower = {"продажа", "сторно возвратов", "корректная продажа", "коррекция продаж"}
-    return_oper_values_lower = {"возврат", "сторно продаж", "корректный возврат"}
-
-    def _norm_text(v: Any) -> str:
-        return str(v or "").strip().lower()
-
-    def _is_sale_doc(doc_name: str) -> bool:
-        d = _norm_text(doc_name)
-        return d == "продажа" or "продаж" in d
-
-    def _is_return_doc(doc_name: str) -> bool:
-        d = _norm_text(doc_name)
-        return d == "возврат" or "возврат" in d
-    
-    for r in raw:
-        try:
-            total_qty += int(r.get("quantity") or 0)
-        except Exception:
-            pass
-        try:
-            total_sum += float(r.get("retail_amount") or 0.0)
-        except Exception:
-            pass
-        try:
-            total_logistics += float(r.get("delivery_rub") or 0.0)
-        except Exception:
-            pass
-        try:
-            total_storage += float(r.get("storage_fee") or 0.0)
-        except Exception:
-            pass
-        try:
-            total_acceptance += float(r.get("acceptance") or 0.0)
-        except Exception:
-            pass
-        try:
-            total_for_pay += float(r.get("ppvz_for_pay") or 0.0)
-        except Exception:
-            pass
-        try:
-            oper_lc = _norm_text(r.get("supplier_oper_name"))
-            if oper_lc in buyout_oper_values_lower:
-                total_buyouts += float(r.get("retail_price") or 0.0)
-        except Exception:
-            pass
-        try:
-            oper_lc = _norm_text(r.get("supplier_oper_name"))
-            amt = float(r.get("retail_amount") or 0.0)
-            if oper_lc in buyout_oper_values_lower:
-                wbr_plus += amt
-            elif oper_lc in return_oper_values_lower:
-                wbr_minus += amt
-        except Exception:
-            pass
-        try:
-            oper_lc = _norm_text(r.get("supplier_oper_name"))
-            if oper_lc in return_oper_values_lower:
-                total_returns += float(r.get("retail_price") or 0.0)
-        except Exception:
-            pass
-        try:
-            dt_name = _norm_text(r.get("doc_type_name"))
-            acq_pct = float(r.get("acquiring_percent") or 0.0)
-            afee = float(r.get("acquiring_fee") or 0.0)
-            if _is_sale_doc(dt_name) and acq_pct > 0:
-                total_acquiring += afee
-            elif _is_return_doc(dt_name) and acq_pct > 0:
-                total_acquiring -= afee
-        except Exception:
-            pass
-        try:
-            total_commission_wb += float(r.get("ppvz_vw") or 0.0)
-        except Exception:
-            pass
-        try:
-            total_other_deductions += float(r.get("deduction") or 0.0)
-            total_other_deductions += float(r.get("additional_payment") or 0.0)
-        except Exception:
-            pass
-        try:
-            total_penalties += float(r.get("penalty") or 0.0)
-        except Exception:
-            pass
-        try:
-            total_additional_payment += float(r.get("additional_payment") or 0.0)
-        except Exception:
-            pass
-        try:
-            oper_l = _norm_text(r.get("supplier_oper_name"))
-            doc_l = _norm_text(r.get("doc_type_name"))
-            pay_val = float(r.get("ppvz_for_pay") or 0.0)
-            if "логистик" in oper_l and pay_val > 0:
-                total_paid_delivery += pay_val
-            if oper_l == "добровольная компенсация при возврате" and _is_sale_doc(doc_l):
-                x1 += pay_val
-            if oper_l == "частичная компенсация брака" and _is_sale_doc(doc_l):
-                x2 += pay_val
-            if oper_l == "добровольная компенсация при возврате" and _is_return_doc(doc_l):
-                x3 += pay_val
-            if oper_l == "частичная компенсация брака" and _is_return_doc(doc_l):
-                x4 += pay_val
-            if oper_l == "компенсация подмененного товара" and _is_sale_doc(doc_l):
-                x5 += pay_val
-            if oper_l == "компенсация подмененного товара" and _is_return_doc(doc_l):
-                x6 += pay_val
-            if oper_l == "компенсация потерянного товара" and _is_sale_doc(doc_l):
-                x7 += pay_val
-            if oper_l == "компенсация потерянного товара" and _is_return_doc(doc_l):
-                x8 += pay_val
-            if oper_l == "продажа":
-                k1 += pay_val
-            if oper_l == "сторно возвратов":
-                k2 += pay_val
-            if oper_l == "корректная продажа":
-                k3 += pay_val
-            if oper_l == "коррекция продаж" and _is_sale_doc(doc_l):
-                k4 += pay_val
-            if oper_l == "возврат":
-                k5 += pay_val
-            if oper_l == "сторно продаж":
-                k6 += pay_val
-            if oper_l == "коррекция продаж" and _is_return_doc(doc_l):
-                k7 += pay_val
-            if oper_l == "корректный возврат":
-                k8 += pay_val
-            if "коррект" in oper_l and "эквайр" in oper_l:
-                k9 += pay_val
-            if oper_l == "частичная компенсация брака" and _is_sale_doc(doc_l):
-                u1 += pay_val
-            if oper_l == "добровольная компенсация брака" and _is_sale_doc(doc_l):
-                u2 += pay_val
-            if oper_l == "частичная компенсация брака" and _is_return_doc(doc_l):
-                u3 += pay_val
-            if oper_l == "добровольная компенсация брака" and _is_return_doc(doc_l):
-                u4 += pay_val
-            if oper_l == "компенсация брака до возврата товара" and _is_sale_doc(doc_l):
-                u5 += pay_val
-            if oper_l == "компенсация брака до возврата товара" and _is_return_doc(doc_l):
-                u6 += pay_val
-            if oper_l == "добровольная компенсация подмены товара" and _is_sale_doc(doc_l):
-                u7 += pay_val
-            if oper_l == "добровольная компенсация подмены товара" and _is_return_doc(doc_l):
-                u8 += pay_val
-            if oper_l == "компенсация подмененного товара" and _is_sale_doc(doc_l):
-                u9 += pay_val
-            if oper_l == "компенсация подмененного товара" and _is_return_doc(doc_l):
-                u10 += pay_val
-            if oper_l == "добровольная компенсация утилизации товара" and _is_sale_doc(doc_l):
-                u11 += pay_val
-            if oper_l == "добровольная компенсация утилизации товара" and _is_return_doc(doc_l):
-                u12 += pay_val
-            if oper_l == "компенсация утилизации товара" and _is_sale_doc(doc_l):
-                u13 += pay_val
-            if oper_l == "компенсация утилизации товара" and _is_return_doc(doc_l):
-                u14 += pay_val
-        except Exception:
-            pass
-    
-    date_from_fmt = datetime.strptime(req_from, "%Y-%m-%d").strftime("%d.%m.%Y")
-    date_to_fmt = datetime.strptime(req_to, "%Y-%m-%d").strftime("%d.%m.%Y")
-    revenue_calc = total_buyouts - total_returns
-    defect_comp = x1 + x2 - x3 - x4 + x5 - x6 + x7 - x8
-    total_wb_realized = wbr_plus - wbr_minus
-    commission_total = (
-        revenue_calc
-        - (k1 + k2 + k3 + k4)
-        + (k5 + k6 + k7 + k8)
-        - total_acquiring
-    )
-    damage_comp = u1 + u2 - u3 - u4 + u5 - u6 + u7 + u8 - u9 - u10 + u11 - u12 + u13 - u14
-    
-    total_deductions = (
-        commission_total + 
-        total_acquiring + 
-        total_logistics + 
-        total_storage + 
-        total_other_deductions + 
-        total_acceptance - 
-        defect_comp - 
-        damage_comp - 
-        total_paid_delivery + 
-        total_penalties + 
-        total_additional_payment
-    )
-    
-    e3_correction = 0
-    for r in raw:
-        try:
-            oper_name = _norm_text(r.get("supplier_oper_name"))
-            if "коррект" in oper_name and "эквайр" in oper_name:
-                e3_correction += float(r.get("ppvz_for_pay") or 0.0)
-        except Exception:
-            pass
-    
-    total_for_transfer = revenue_calc - total_deductions + e3_correction
-    
-    # Расчет налога
-    tax_amount = 0.0
-    tax_rate = None
-    if user_id:
-        try:
-            user = User.query.get(user_id)
-            if user and user.tax_rate is not None:
-                tax_rate = float(user.tax_rate)
-                tax_amount = (total_wb_realized * tax_rate) / 100.0
-        except Exception:
-            pass
-    
-    return {
-        "rows": raw,
-        "total_qty": int(total_qty),
-        "total_sum": round(total_sum, 2),
-        "total_logistics": round(total_logistics, 2),
-        "total_storage": round(total_storage, 2),
-        "total_acceptance": round(total_acceptance, 2),
-        "total_for_pay": round(total_for_pay, 2),
-        "total_buyouts": round(total_buyouts, 2),
-        "total_returns": round(total_returns, 2),
-        "revenue": round(revenue_calc, 2),
-        "total_wb_realized": round(total_wb_realized, 2),
-        "total_commission": round(commission_total, 2),
-        "total_acquiring": round(total_acquiring, 2),
-        "total_commission_wb": round(total_commission_wb, 2),
-        "total_other_deductions": round(total_other_deductions, 2),
-        "total_penalties": round(total_penalties, 2),
-        "total_defect_compensation": round(defect_comp, 2),
-        "total_damage_compensation": round(damage_comp, 2),
-        "total_paid_delivery": round(total_paid_delivery, 2),
-        "total_additional_payment": round(total_additional_payment, 2),
-        "total_deductions": round(total_deductions, 2),
-        "total_for_transfer": round(total_for_transfer, 2),
-        "tax_amount": round(tax_amount, 2),
-        "tax_rate": tax_rate,
-        "date_from_fmt": date_from_fmt,
-        "date_to_fmt": date_to_fmt,
-    }
-
-def aggregate_finance_rows(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    """Aggregate rows by product (nm_id + supplierArticle) to qty and revenue.
-    Fields per docs: realize/prices/quantities. We'll use 'quantity' and 'retail_amount' if present.
-    """
-    by_key: Dict[tuple[Any, Any], Dict[str, Any]] = {}
-    for r in rows:
-        nm_id = r.get("nm_id") or r.get("nmId") or r.get("nm")
-        prod = r.get("supplier_article") or r.get("supplierArticle") or r.get("supplierArticleName") or ""
-        key = (nm_id, prod)
-        item = by_key.get(key)
-        qty = 0
-        rev = 0.0
-        # common fields in WB v5: quantity, retail_amount
-        try:
-            qty = int(r.get("quantity") or r.get("sale_qty") or r.get("qty") or 0)
-        except Exception:
-            qty = 0
-        try:
-            rev = float(r.get("retail_amount") or r.get("retailAmount") or r.get("sum_price") or 0)
-        except Exception:
-            rev = 0.0
-        if item is None:
-            by_key[key] = {"nm_id": nm_id, "product": prod, "qty": max(qty, 0), "revenue": max(rev, 0.0)}
-        else:
-            item["qty"] = int(item.get("qty", 0)) + max(qty, 0)
-            item["revenue"] = float(item.get("revenue", 0.0)) + max(rev, 0.0)
-    items = list(by_key.values())
-    items.sort(key=lambda x: (x.get("revenue") or 0.0), reverse=True)
-    return items
-
-
 def _normalize_and_group_orders(orders: List[Dict[str, Any]]) -> tuple:
     """
     Нормализует и группирует заказы по товарам.
@@ -2793,125 +2408,10 @@ def _normalize_and_group_orders(orders: List[Dict[str, Any]]) -> tuple:
     Returns:
         tuple: (counts_total, by_wh, revenue_total, by_wh_sum, nm_by_product, barcode_by_product, supplier_article_by_product)
     """
-    counts_total: Dict[str, int] = defaultdict(int)
-    by_wh: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
-    revenue_total: Dict[str, float] = defaultdict(float)
-    by_wh_sum: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
-    nm_by_product: Dict[str, Any] = {}
-    barcode_by_product: Dict[str, Any] = {}
-    supplier_article_by_product: Dict[str, Any] = {}
-    
-    # Маппинги для нормализации: баркод -> Артикул WB, артикул продавца -> Артикул WB
-    barcode_to_nm: Dict[str, Any] = {}
-    supplier_article_to_nm: Dict[str, Any] = {}
-    
-    def _row_barcode(row: Dict[str, Any]) -> Any:
-        return (
-            row.get("_barcode")
-            or row.get("\u0411\u0430\u0440\u043a\u043e\u0434")
-            or row.get("Баркод")
-            or row.get("barcode")
-        )
-
-    def _row_nm_id(row: Dict[str, Any]) -> Any:
-        return (
-            row.get("_nm_id")
-            or row.get("\u0410\u0440\u0442\u0438\u043a\u0443\u043b WB")
-            or row.get("Артикул WB")
-            or row.get("nmId")
-            or row.get("nmID")
-        )
-
-    def _row_supplier_article(row: Dict[str, Any]) -> Any:
-        return (
-            row.get("_supplier_article")
-            or row.get("\u0410\u0440\u0442\u0438\u043a\u0443\u043b \u043f\u0440\u043e\u0434\u0430\u0432\u0446\u0430")
-            or row.get("Артикул продавца")
-            or row.get("supplierArticle")
-        )
-
-    def _row_warehouse(row: Dict[str, Any]) -> str:
-        return str(
-            row.get("_warehouse")
-            or row.get("\u0421\u043a\u043b\u0430\u0434 \u043e\u0442\u0433\u0440\u0443\u0437\u043a\u0438")
-            or row.get("Склад отгрузки")
-            or row.get("warehouseName")
-            or "Не указан"
-        )
-
-    def _row_price(row: Dict[str, Any]) -> float:
-        raw = row.get("_price")
-        if raw is None:
-            raw = row.get("\u0426\u0435\u043d\u0430 \u0441\u043e \u0441\u043a\u0438\u0434\u043a\u043e\u0439 \u043f\u0440\u043e\u0434\u0430\u0432\u0446\u0430")
-        if raw is None:
-            raw = row.get("Цена со скидкой продавца")
-        if raw is None:
-            raw = row.get("priceWithDisc")
-        try:
-            return float(raw or 0)
-        except (TypeError, ValueError):
-            return 0.0
+    # Один проход по строкам: общий движок агрегатов заказов (utils.orders_processing)
+    from utils.orders_processing import aggregate_orders
 
-    # Первый проход: собираем связи для нормализации
-    for r in (orders or []):
-        if r.get("is_cancelled", False):
-            continue
-        barcode = _row_barcode(r)
-        nmv = _row_nm_id(r)
-        supplier_article = _row_supplier_article(r)
-        
-        # Сохраняем связи: если есть Артикул WB, связываем его с баркодом и артикулом продавца
-        if nmv:
-            if barcode:
-                barcode_to_nm[barcode] = nmv
-            if supplier_article:
-                supplier_article_to_nm[supplier_article] = nmv
-    
-    # Второй проход: группируем с использованием нормализации
-    for r in (orders or []):
-        # Пропускаем отмененные заказы в отчете
-        if r.get("is_cancelled", False):
-            continue
-        # Группируем по Артикулу WB (приоритет 1 - самый стабильный), затем по баркоду (приоритет 2), затем по артикулу продавца (приоритет 3)
-        barcode = _row_barcode(r)
-        nmv = _row_nm_id(r)
-        supplier_article = _row_supplier_article(r)
-        
-        # Нормализация: если Артикула WB нет, но есть известный баркод или артикул продавца, используем связанный Артикул WB
-        if not nmv:
-            if barcode and barcode in barcode_to_nm:
-                nmv = barcode_to_nm[barcode]
-            elif supplier_article and supplier_article in supplier_article_to_nm:
-                nmv = supplier_article_to_nm[supplier_article]
-        
-        # Определяем ключ для группировки
-        # Используем Артикул WB как основной идентификатор, так как он более стабилен
-        if nmv:
-            prod_key = f"NM_{nmv}"
-        elif barcode:
-            prod_key = f"BARCODE_{barcode}"
-        elif supplier_article:
-            prod_key = str(supplier_article)
-        else:
-            prod_key = "Не указан"
-        
-        wh = _row_warehouse(r)
-        counts_total[prod_key] += 1
-        by_wh[prod_key][wh] += 1
-        price = _row_price(r)
-        revenue_total[prod_key] += price
-        by_wh_sum[prod_key][wh] += price
-        
-        # Сохраняем данные о товаре, всегда обновляя артикул продавца на последний (актуальный)
-        if nmv:
-            nm_by_product[prod_key] = nmv
-        if barcode:
-            barcode_by_product[prod_key] = barcode
-        if supplier_article:
-            # Всегда обновляем артикул продавца на последний (актуальный)
-            supplier_article_by_product[prod_key] = supplier_article
-    
-    return (counts_total, by_wh, revenue_total, by_wh_sum, nm_by_product, barcode_by_product, supplier_article_by_product)
+    return aggregate_orders(orders or [], ("product_matrix",))["product_matrix"]
 
 
 def to_rows(data: List[Dict[str, Any]], start_date: str, end_date: str) -> List[Dict[str, Any]]:
@@ -2924,7 +2424,7 @@ def to_rows(data: List[Dict[str, Any]], start_date: str, end_date: str) -> List[
         # Фильтруем по реальной дате заказа (date), а не по lastChangeDate
         date_str = str(sale.get("date", ""))[:10]
         try:
-            d = datetime.strptime(date_str, "%Y-%m-%d").date()
+            d = strptime_fixed(date_str, "%Y-%m-%d").date()
         except ValueError:
             continue
         if not (start <= d <= end):
@@ -2977,7 +2477,7 @@ def to_rows(data: List[Dict[str, Any]], start_date: str, end_date: str) -> List[
             "Уникальный ID заказа": sale.get("srid"),
             "is_cancelled": is_cancelled_bool,  # Добавляем флаг отмены для удобства
         })
-    return rows
+    return intern_rows(rows)
 
 
 def to_sales_rows(data: List[Dict[str, Any]], start_date: str, end_date: str) -> List[Dict[str, Any]]:
@@ -2987,7 +2487,7 @@ def to_sales_rows(data: List[Dict[str, Any]], start_date: str, end_date: str) ->
     for sale in data:
         date_str = str(sale.get("date", ""))[:10]
         try:
-            d = datetime.strptime(date_str, "%Y-%m-%d").date()
+            d = strptime_fixed(date_str, "%Y-%m-%d").date()
         except ValueError:
             continue
         if not (start <= d <= end):
@@ -4086,7 +3586,7 @@ def update_fbs_stocks_by_warehouse(token: str, warehouse_id: int, items: list[di
 
 def _fbs_stock_cache_path_for_user() -> str:
     if current_user.is_authenticated:
-        return os.path.join(CACHE_DIR, f"fbs_stock_user_{current_user.id}.json")
+        return user_cache_path(current_user.id, "fbs_stock")
     return os.path.join(CACHE_DIR, "fbs_stock_anon.json")
 
 
@@ -4115,7 +3615,7 @@ def save_fbs_stock_cache(payload: Dict[str, Any]) -> None:
 
 def _auto_update_settings_path_for_user() -> str:
     if current_user.is_authenticated:
-        return os.path.join(CACHE_DIR, f"auto_update_settings_user_{current_user.id}.json")
+        return user_cache_path(current_user.id, "auto_update_settings")
     return os.path.join(CACHE_DIR, "auto_update_settings_anon.json")
 
 
@@ -4210,7 +3710,7 @@ def check_fbs_new_orders_for_notifications():
                     if not user_may_call_wb_api(user):
                         continue
                     # Get last check time and processed orders from cache
-                    cache_path = os.path.join(CACHE_DIR, f"fbs_notifications_user_{user.id}.json")
+                    cache_path = user_cache_path(user.id, "fbs_notifications")
                     last_check = None
                     processed_order_ids = set()
                     
@@ -4335,7 +3835,7 @@ def check_dbs_new_orders_for_notifications():
                     if not user_may_call_wb_api(user):
                         continue
                     # Get last check time from cache
-                    cache_path = os.path.join(CACHE_DIR, f"dbs_notifications_user_{user.id}.json")
+                    cache_path = user_cache_path(user.id, "dbs_notifications")
                     last_check = None
                     if os.path.exists(cache_path):
                         with open(cache_path, 'r', encoding='utf-8') as f:
@@ -4474,6 +3974,8 @@ _last_fbs_check_at = None
 _last_dbs_check_at = None
 _last_version_check_at = None
 _last_stocks_refresh_at = None
+_last_cache_quota_check_at = None
+_last_finance_precompute_date = None
 
 def start_notification_monitoring():
     """Start background monitoring for notifications"""
@@ -4484,6 +3986,7 @@ def start_notification_monitoring():
     
     def monitor_loop():
         global _last_cache_refresh_hour, _last_fbs_check_at, _last_dbs_check_at, _last_version_check_at, _last_stocks_refresh_at
+        global _last_cache_quota_check_at, _last_finance_precompute_date
         while True:
             try:
                 current_time = datetime.now()
@@ -4505,6 +4008,17 @@ def start_notification_monitoring():
                 if current_time.minute == 0:
                     cleanup_old_notifications()
                 
+                # Квота CACHE_DIR: вытесняем самые холодные пересобираемые кэши
+                try:
+                    from utils.constants import CACHE_QUOTA_CHECK_INTERVAL_S
+                    from utils.cache_manager import enforce_cache_quota, flush_access_index
+                    if _last_cache_quota_check_at is None or (current_time - _last_cache_quota_check_at).total_seconds() >= CACHE_QUOTA_CHECK_INTERVAL_S:
+                        _last_cache_quota_check_at = current_time
+                        enforce_cache_quota()
+                    flush_access_index()
+                except Exception as e:
+                    print(f"Error in cache quota check: {e}")
+
                 # Auto-refresh stocks every 30 minutes
                 try:
                     from utils.constants import STOCKS_AUTO_REFRESH_INTERVAL_S
@@ -4532,6 +4046,22 @@ def start_notification_monitoring():
                         auto_refresh_orders_cache_for_all_users()
                     except Exception as e:
                         print(f"Error in auto orders cache refresh: {e}")
+
+                # Предрасчёт расшифровки фин. отчёта раз в сутки вне пиковых часов (по Москве);
+                # идёт в своём потоке — загрузка из WB по всем пользователям занимает долго
+                try:
+                    from utils.constants import FINANCE_PRECOMPUTE_AUTO, FINANCE_PRECOMPUTE_HOUR
+                    moscow_now = datetime.now(MOSCOW_TZ)
+                    if (
+                        FINANCE_PRECOMPUTE_AUTO
+                        and moscow_now.hour == FINANCE_PRECOMPUTE_HOUR
+                        and _last_finance_precompute_date != moscow_now.date()
+                    ):
+                        _last_finance_precompute_date = moscow_now.date()
+                        print(f"Triggering finance breakdown precompute at {moscow_now.strftime('%H:%M:%S')}")
+                        threading.Thread(target=auto_precompute_finance_breakdown_for_all_users, daemon=True).start()
+                except Exception as e:
+                    print(f"Error in finance breakdown precompute trigger: {e}")
                     
             except Exception as e:
                 print(f"Error in monitoring loop: {e}")
@@ -4756,6 +4286,63 @@ def auto_refresh_orders_cache_for_all_users():
         print(f"Error in auto_refresh_orders_cache_for_all_users: {e}")
 
 
+_finance_precompute_running = threading.Event()
+
+
+def auto_precompute_finance_breakdown_for_all_users():
+    """Предрасчёт расшифровки фин. отчёта (прошлая неделя, прошлый месяц) для всех пользователей с токенами"""
+    from utils.constants import FINANCE_PRECOMPUTE_USER_PAUSE_S
+    from utils.finance_precompute import finance_precompute_due, precompute_finance_breakdown
+
+    if _finance_precompute_running.is_set():
+        print("Finance breakdown precompute is already running")
+        return
+    _finance_precompute_running.set()
+    try:
+        with app.app_context():
+            users_with_tokens = User.query.filter(User.wb_token.isnot(None), User.wb_token != '').all()
+            if not users_with_tokens:
+                print("No users with tokens found for finance breakdown precompute")
+                return
+
+            print(f"Precomputing finance breakdown for {len(users_with_tokens)} users")
+            done = 0
+            for user in users_with_tokens:
+                try:
+                    token = effective_wb_api_token(user)
+                    if not token or not finance_precompute_due(user.id):
+                        continue
+                    # Пауза между пользователями — не упираться в лимиты WB подряд
+                    if done > 0:
+                        time.sleep(FINANCE_PRECOMPUTE_USER_PAUSE_S)
+                    done += 1
+                    user_id = user.id
+                    stats = precompute_finance_breakdown(
+                        user_id,
+                        # Заодно сохраняется ответ /report/finance за тот же период
+                        lambda date_from, date_to: _compute_finance_breakdown(
+                            user_id,
+                            token,
+                            date_from,
+                            date_to,
+                            tax_rate=_finance_tax_rate(user),
+                            finance_version=_finance_result_version(user),
+                        ),
+                        _breakdown_result_version(user_id),
+                        _breakdown_result_precomputable,
+                    )
+                    print(f"Finance breakdown precompute for user {user_id}: {stats}")
+                except Exception as e:
+                    print(f"Error precomputing finance breakdown for user {user.id}: {e}")
+                    continue
+
+            print("Finance breakdown precompute cycle completed")
+    except Exception as e:
+        print(f"Error in auto_precompute_finance_breakdown_for_all_users: {e}")
+    finally:
+        _finance_precompute_running.clear()
+
+
 def load_auto_update_settings() -> Dict[str, Any]:
     path = _auto_update_settings_path_for_user()
     if not os.path.isfile(path):
@@ -4802,7 +4389,7 @@ def save_auto_update_settings(settings: Dict[str, Any], user_id: int = None) ->
     if user_id is None:
         path = _auto_update_settings_path_for_user()
     else:
-        path = os.path.join(CACHE_DIR, f"auto_update_settings_user_{user_id}.json")
+        path = user_cache_path(user_id, "auto_update_settings")
     
     try:
         enriched = dict(settings)
@@ -4812,6 +4399,9 @@ def save_auto_update_settings(settings: Dict[str, Any], user_id: int = None) ->
             enriched["_user_id"] = current_user.id
         with open(path, "w", encoding="utf-8") as f:
             json.dump(enriched, f, ensure_ascii=False)
+        # Индекс включённого автообновления — воркер не сканирует CACHE_DIR
+        if enriched.get("_user_id") is not None:
+            set_user_feature(enriched["_user_id"], FEATURE_AUTO_UPDATE, auto_update_enabled(enriched))
     except Exception:
         pass
 
@@ -5107,15 +4697,22 @@ def update_stocks_from_remote_data(file_data: Dict[str, int], user_id: int, enab
 
 def auto_update_worker():
     """Background worker for automatic stock updates"""
+    # Индекс ещё не строился (первый запуск после обновления) — один обход папок пользователей
+    if not feature_index_exists():
+        try:
+            index = rebuild_feature_index()
+            print(f"Auto update index built: {len(index.get(FEATURE_AUTO_UPDATE, []))} users")
+        except Exception as e:
+            print(f"Error building auto update index: {e}")
     while True:
         try:
-            # Get all user settings
-            settings_files = [f for f in os.listdir(CACHE_DIR) if f.startswith('auto_update_settings_user_')]
-            
-            for settings_file in settings_files:
+            # Только пользователи с включённым автообновлением (индекс, без os.listdir)
+            for user_id in users_with_feature(FEATURE_AUTO_UPDATE):
                 try:
-                    user_id = int(settings_file.replace('auto_update_settings_user_', '').replace('.json', ''))
-                    settings_path = os.path.join(CACHE_DIR, settings_file)
+                    settings_path = user_cache_path(user_id, "auto_update_settings")
+                    if not os.path.isfile(settings_path):
+                        set_user_feature(user_id, FEATURE_AUTO_UPDATE, False)
+                        continue
                     
                     with open(settings_path, 'r', encoding='utf-8') as f:
                         settings = json.load(f)
@@ -5231,9 +4828,11 @@ def auto_update_worker():
             time.sleep(60)
 
 
-# Start auto-update worker in background
+# Start auto-update worker in background (не в процессах пула utils.finance_parallel:
+# spawn заново импортирует app.py под именем __mp_main__)
 auto_update_thread = threading.Thread(target=auto_update_worker, daemon=True)
-auto_update_thread.start()
+if __name__ != "__mp_main__":
+    auto_update_thread.start()
 
 # Context processor to add organization info to all templates
 # Organization (seller) info is fetched from WB API.
@@ -5249,7 +4848,7 @@ _SELLER_INFO_MIN_INTERVAL_SECONDS = 60  # WB doc: 1 request per minute per selle
 
 
 def _seller_info_cache_path(user_id: int) -> str:
-    return os.path.join(CACHE_DIR, f"seller_info_user_{user_id}.json")
+    return user_cache_path(user_id, "seller_info")
 
 
 def _load_seller_info_cache(user_id: int) -> dict[str, Any] | None:
@@ -8208,10 +7807,25 @@ def api_refresh_orders_cache():
 def api_cache_status():
     """Проверка статуса обновления кэша"""
     user_id = current_user.id
-    return jsonify({
+    payload = {
         "supplies_cache_updating": _supplies_cache_updating.get(user_id, False),
         "orders_cache_updating": _orders_cache_updating.get(user_id, False)
-    })
+    }
+    try:
+        from utils.cache_manager import cache_usage_summary
+        usage = cache_usage_summary(user_id)
+        payload["cache_usage"] = {
+            "total_bytes": usage.get("total_bytes", 0),
+            "quota_bytes": usage.get("quota_bytes", 0),
+            "by_type": usage.get("by_type", {}),
+            "user": usage.get("user", {}),
+        }
+        # Разбивку по всем пользователям отдаём только администратору
+        if getattr(current_user, "is_admin", False):
+            payload["cache_usage"]["by_user"] = usage.get("by_user", {})
+    except Exception as e:
+        print(f"Ошибка подсчёта использования кэша: {e}")
+    return jsonify(payload)
 @app.route("/api/fbw/supplies/<supply_id>/package-count", methods=["GET"]) 
 @login_required
 def api_fbw_supply_package_count(supply_id: str):
@@ -9941,10 +9555,13 @@ def api_report_finance_progress():
     """Endpoint для получения прогресса загрузки финансового отчета"""
     if not current_user.is_authenticated:
         return jsonify({"current": 0, "total": 0, "period": "", "ready": False}), 200
-    progress = _get_finance_progress(current_user.id)
-    # Проверяем, готовы ли результаты
+    from utils.report_results import REPORT_KIND_FINANCE, get_report_job
+
     user_id = current_user.id
-    results_ready = user_id in FINANCE_RESULTS and not FINANCE_LOADING.get(user_id, False)
+    job = get_report_job(user_id, REPORT_KIND_FINANCE)
+    progress = dict(job["progress"])
+    # Проверяем, готовы ли результаты (загрузка могла идти в другом воркере)
+    results_ready = bool(job.get("ready")) and not job.get("loading")
     progress["ready"] = results_ready
     if results_ready:
         progress["has_results"] = True
@@ -9956,67 +9573,118 @@ def api_report_finance_result():
     """Endpoint для получения результатов финансового отчета после асинхронной загрузки"""
     if not current_user.is_authenticated:
         return jsonify({"error": "Not authenticated"}), 401
-    user_id = current_user.id
-    if user_id in FINANCE_RESULTS:
-        result = FINANCE_RESULTS[user_id]
-        # Удаляем результаты после получения
-        del FINANCE_RESULTS[user_id]
+    from utils.report_results import REPORT_KIND_FINANCE, load_report_job_result
+
+    result = load_report_job_result(current_user.id, REPORT_KIND_FINANCE)
+    if result is not None:
         return jsonify(result), 200
     return jsonify({"error": "Results not ready"}), 404
 
 
 # --- Расшифровка финансового отчёта (DASHBOARD) ---
-_BREAKDOWN_LOADING: dict[int, bool] = {}
-_BREAKDOWN_LOADING_STARTED: dict[int, float] = {}
-_BREAKDOWN_RESULTS: dict[int, dict] = {}
-_BREAKDOWN_PROGRESS: dict[int, dict] = {}
+# Прогресс, флаг загрузки и результат — в utils.report_results (общие для воркеров)
 _BREAKDOWN_STALE_AFTER_S = 12 * 60  # если загрузка «висит» дольше — разрешаем перезапуск
+_FINANCE_STALE_AFTER_S = 60 * 60  # то же для /report/finance (годовой отчёт качается долго)
+# Версия схемы результатов /api/report/finance (при изменении finance_report_from_partial — увеличить)
+_FINANCE_RESULT_SCHEMA = 2
 
 
-def _set_breakdown_progress(user_id: int, current: int, total: int, period: str = "") -> None:
-    _BREAKDOWN_PROGRESS[user_id] = {"current": current, "total": total, "period": period}
-
+def _finance_result_version(user) -> str:
+    """Версия данных результата /report/finance: схема расчёта + ставка налога пользователя."""
+    return f"{_FINANCE_RESULT_SCHEMA}:tax={getattr(user, 'tax_rate', None)}"
 
-def _clear_breakdown_progress(user_id: int) -> None:
-    _BREAKDOWN_PROGRESS.pop(user_id, None)
 
+def _finance_period_closed(req_to: str) -> bool:
+    """Период до req_to закрыт: итоги больше не меняются, готовый результат можно отдавать повторно."""
+    from utils.finance_partials import finance_period_closed
 
-def _reset_stale_breakdown_load(user_id: int) -> bool:
-    """Сбрасывает зависший флаг загрузки. True, если сброс выполнен."""
-    if not _BREAKDOWN_LOADING.get(user_id, False):
-        return False
-    started = _BREAKDOWN_LOADING_STARTED.get(user_id) or 0.0
-    age = time.time() - started if started else _BREAKDOWN_STALE_AFTER_S + 1
-    if age < _BREAKDOWN_STALE_AFTER_S:
+    try:
+        return finance_period_closed(req_to)
+    except ValueError:
         return False
-    logging.warning(
-        "Сброс зависшей загрузки finance-breakdown для user_id=%s (возраст %.0f с)",
-        user_id,
-        age,
-    )
-    _BREAKDOWN_LOADING[user_id] = False
-    _BREAKDOWN_LOADING_STARTED.pop(user_id, None)
-    _clear_breakdown_progress(user_id)
-    return True
 
 
-@app.route("/api/report/finance-breakdown/progress", methods=["GET"])
-@login_required
-def api_finance_breakdown_progress():
-    user_id = current_user.id
-    progress = dict(_BREAKDOWN_PROGRESS.get(user_id) or {"current": 0, "total": 0, "period": ""})
-    progress["ready"] = user_id in _BREAKDOWN_RESULTS and not _BREAKDOWN_LOADING.get(user_id, False)
-    progress["loading"] = bool(_BREAKDOWN_LOADING.get(user_id, False))
-    return jsonify(progress), 200
+def _finance_result_ttl(req_to: str) -> int | None:
+    """Срок хранения результата: обычный для закрытого периода, для открытого — короткий, только для опроса /result."""
+    from utils.constants import REPORT_RESULT_OPEN_TTL_SECONDS
 
+    return None if _finance_period_closed(req_to) else REPORT_RESULT_OPEN_TTL_SECONDS
 
-@app.route("/api/report/finance-breakdown/result", methods=["GET"])
-@login_required
-def api_finance_breakdown_result():
-    user_id = current_user.id
-    if user_id not in _BREAKDOWN_RESULTS:
-        return jsonify({"error": "Results not ready"}), 404
-    return jsonify(_BREAKDOWN_RESULTS.pop(user_id)), 200
+
+def _finance_tax_rate(user) -> float | None:
+    """Ставка налога пользователя для /report/finance (None — не указана)."""
+    try:
+        if user is not None and user.tax_rate is not None:
+            return float(user.tax_rate)
+    except Exception:
+        pass
+    return None
+
+
+def _finance_rows_fetcher(token: str):
+    """fetch_rows(с, по) для агрегатов фин. отчёта: строки WB сразу в колонках, ошибка загрузки — исключение."""
+    return lambda seg_from, seg_to: fetch_finance_report(token, seg_from, seg_to, columnar=True, strict=True)
+
+
+def _breakdown_result_version(user_id: int) -> str:
+    """Версия данных расшифровки: формат агрегатов + кэш товаров (названия и баркоды)."""
+    from utils.finance_dashboard import FINANCE_PARTIAL_VERSION
+
+    try:
+        products_mtime = int(os.path.getmtime(user_cache_path(user_id, "products")))
+    except OSError:
+        products_mtime = 0
+    return f"{FINANCE_PARTIAL_VERSION}:products={products_mtime}"
+
+
+def _breakdown_result_complete(result: Dict[str, Any]) -> bool:
+    """Сохранять ли расшифровку за период: без ошибок загрузки фин. отчёта, хранения и продвижения."""
+    return (
+        bool(result.get("success"))
+        and not result.get("finance_error")
+        and not result.get("paid_storage_error")
+        and not result.get("promotion_error")
+    )
+
+
+def _breakdown_result_precomputable(result: Dict[str, Any]) -> bool:
+    """Для фонового предрасчёта — ещё и без пустых ответов WB: пустая неделя перепроверяется следующим запуском."""
+    return _breakdown_result_complete(result) and not result.get("finance_empty_segments")
+
+
+def _set_breakdown_progress(user_id: int, current: int, total: int, period: str = "") -> None:
+    from utils.report_results import REPORT_KIND_BREAKDOWN, set_report_job_progress
+
+    set_report_job_progress(user_id, REPORT_KIND_BREAKDOWN, current, total, period)
+
+
+def _clear_breakdown_progress(user_id: int) -> None:
+    from utils.report_results import REPORT_KIND_BREAKDOWN, clear_report_job_progress
+
+    clear_report_job_progress(user_id, REPORT_KIND_BREAKDOWN)
+
+
+@app.route("/api/report/finance-breakdown/progress", methods=["GET"])
+@login_required
+def api_finance_breakdown_progress():
+    from utils.report_results import REPORT_KIND_BREAKDOWN, get_report_job
+
+    job = get_report_job(current_user.id, REPORT_KIND_BREAKDOWN)
+    progress = dict(job["progress"])
+    progress["ready"] = bool(job.get("ready")) and not job.get("loading")
+    progress["loading"] = bool(job.get("loading"))
+    return jsonify(progress), 200
+
+
+@app.route("/api/report/finance-breakdown/result", methods=["GET"])
+@login_required
+def api_finance_breakdown_result():
+    from utils.report_results import REPORT_KIND_BREAKDOWN, load_report_job_result
+
+    result = load_report_job_result(current_user.id, REPORT_KIND_BREAKDOWN)
+    if result is None:
+        return jsonify({"error": "Results not ready"}), 404
+    return jsonify(result), 200
 
 
 @app.route("/api/report/finance-breakdown/products/export", methods=["POST"])
@@ -10034,113 +9702,233 @@ def api_finance_breakdown_products_export():
     if mode not in ("full", "1c"):
         mode = "full"
 
-    wb = Workbook()
-    ws = wb.active
-
     period = ""
     if date_from_fmt and date_to_fmt:
         period = f"_{date_from_fmt.replace('.', '-')}_{date_to_fmt.replace('.', '-')}"
 
+    from itertools import chain
+    from utils.xlsx_stream import iter_xlsx
+
     if mode == "1c":
-        ws.title = "Для 1С"
-        ws.append(["Баркод", "Товар", "Кол-во", "Цена с услугами", "Сумма с услугами"])
-        for row in products:
-            if not isinstance(row, dict):
-                continue
-            qty = int(row.get("sales_qty") or 0)
-            if qty <= 0:
-                continue
-            amount_svc = row.get("for_pay_with_services")
-            try:
-                amount_svc_f = float(amount_svc) if amount_svc is not None else None
-            except (TypeError, ValueError):
-                amount_svc_f = None
-            price_svc = row.get("price_with_services")
-            if price_svc is None and amount_svc_f is not None:
-                price_svc = round(amount_svc_f / qty, 2)
-            try:
-                price_svc_f = float(price_svc) if price_svc is not None else None
-            except (TypeError, ValueError):
-                price_svc_f = None
-            ws.append([
-                str(row.get("barcode") or ""),
-                str(row.get("name") or ""),
-                qty,
-                price_svc_f if price_svc_f is not None else "",
-                round(amount_svc_f, 2) if amount_svc_f is not None else "",
-            ])
-        if ws.max_row < 2:
+        rows = _breakdown_products_1c_rows(products)
+        first = next(rows, None)
+        if first is None:
             return jsonify({"success": False, "message": "Нет товаров с продажами для выгрузки в 1С."}), 400
+        chunks = iter_xlsx(
+            chain([first], rows),
+            header=["Баркод", "Товар", "Кол-во", "Цена с услугами", "Сумма с услугами"],
+            sheet_title="Для 1С",
+        )
         filename = f"dlya_1c{period}.xlsx"
     else:
-        ws.title = "По товарам"
-        ws.append([
-            "Баркод",
-            "Товар",
-            "Кол-во",
-            "Цена",
-            "Сумма",
-            "Логистика",
-            "Хранение",
-            "Платная приёмка",
-            "Продвижение",
-            "Цена с услугами",
-            "Сумма с услугами",
-        ])
-        for row in products:
-            if not isinstance(row, dict):
-                continue
-            qty = int(row.get("sales_qty") or 0)
-            amount = float(row.get("for_pay") or 0)
-            amount_svc = row.get("for_pay_with_services")
-            try:
-                amount_svc_f = float(amount_svc) if amount_svc is not None else None
-            except (TypeError, ValueError):
-                amount_svc_f = None
-            price = round(amount / qty, 2) if qty > 0 else ""
-            price_svc = row.get("price_with_services")
-            if price_svc is None and amount_svc_f is not None and qty > 0:
-                price_svc = round(amount_svc_f / qty, 2)
-            try:
-                price_svc_f = float(price_svc) if price_svc is not None else None
-            except (TypeError, ValueError):
-                price_svc_f = None
-
-            ws.append([
-                str(row.get("barcode") or ""),
-                str(row.get("name") or ""),
-                qty,
-                price,
-                round(amount, 2),
-                round(float(row.get("logistics") or 0), 2),
-                round(float(row.get("storage") or 0), 2),
-                round(float(row.get("acceptance") or 0), 2),
-                round(float(row.get("promotion") or 0), 2),
-                price_svc_f if price_svc_f is not None else "",
-                round(amount_svc_f, 2) if amount_svc_f is not None else "",
-            ])
-        if ws.max_row < 2:
+        rows = _breakdown_products_full_rows(products)
+        first = next(rows, None)
+        if first is None:
             return jsonify({"success": False, "message": "Нет товаров для выгрузки."}), 400
+        chunks = iter_xlsx(
+            chain([first], rows),
+            header=[
+                "Баркод",
+                "Товар",
+                "Кол-во",
+                "Цена",
+                "Сумма",
+                "Логистика",
+                "Хранение",
+                "Платная приёмка",
+                "Продвижение",
+                "Цена с услугами",
+                "Сумма с услугами",
+            ],
+            sheet_title="По товарам",
+        )
         filename = f"rasshifrovka_po_tovaram{period}.xlsx"
 
-    bio = io.BytesIO()
-    wb.save(bio)
-    bio.seek(0)
-    return send_file(
-        bio,
-        as_attachment=True,
-        download_name=filename,
+    return _xlsx_stream_response(chunks, filename)
+
+
+def _breakdown_products_1c_rows(products: List[Any]):
+    """Строки выгрузки «Для 1С»: товары с продажами, цена и сумма с услугами."""
+    for row in products:
+        if not isinstance(row, dict):
+            continue
+        qty = int(row.get("sales_qty") or 0)
+        if qty <= 0:
+            continue
+        amount_svc = row.get("for_pay_with_services")
+        try:
+            amount_svc_f = float(amount_svc) if amount_svc is not None else None
+        except (TypeError, ValueError):
+            amount_svc_f = None
+        price_svc = row.get("price_with_services")
+        if price_svc is None and amount_svc_f is not None:
+            price_svc = round(amount_svc_f / qty, 2)
+        try:
+            price_svc_f = float(price_svc) if price_svc is not None else None
+        except (TypeError, ValueError):
+            price_svc_f = None
+        yield [
+            str(row.get("barcode") or ""),
+            str(row.get("name") or ""),
+            qty,
+            price_svc_f if price_svc_f is not None else "",
+            round(amount_svc_f, 2) if amount_svc_f is not None else "",
+        ]
+
+
+def _breakdown_products_full_rows(products: List[Any]):
+    """Строки выгрузки «Расшифровка по товарам»: суммы, затраты и цены с услугами."""
+    for row in products:
+        if not isinstance(row, dict):
+            continue
+        qty = int(row.get("sales_qty") or 0)
+        amount = float(row.get("for_pay") or 0)
+        amount_svc = row.get("for_pay_with_services")
+        try:
+            amount_svc_f = float(amount_svc) if amount_svc is not None else None
+        except (TypeError, ValueError):
+            amount_svc_f = None
+        price = round(amount / qty, 2) if qty > 0 else ""
+        price_svc = row.get("price_with_services")
+        if price_svc is None and amount_svc_f is not None and qty > 0:
+            price_svc = round(amount_svc_f / qty, 2)
+        try:
+            price_svc_f = float(price_svc) if price_svc is not None else None
+        except (TypeError, ValueError):
+            price_svc_f = None
+        yield [
+            str(row.get("barcode") or ""),
+            str(row.get("name") or ""),
+            qty,
+            price,
+            round(amount, 2),
+            round(float(row.get("logistics") or 0), 2),
+            round(float(row.get("storage") or 0), 2),
+            round(float(row.get("acceptance") or 0), 2),
+            round(float(row.get("promotion") or 0), 2),
+            price_svc_f if price_svc_f is not None else "",
+            round(amount_svc_f, 2) if amount_svc_f is not None else "",
+        ]
+
+
+def _xlsx_stream_response(chunks, filename: str) -> Response:
+    """Выгрузка XLSX, отдаваемая кусками по мере записи строк (utils.xlsx_stream)."""
+    response = Response(
+        chunks,
         mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        headers={"Cache-Control": "no-store"},
+    )
+    # Имя может прийти из параметров запроса — кавычки и экранирование делает Werkzeug
+    response.headers.set("Content-Disposition", "attachment", filename=filename)
+    return response
+
+
+def _compute_finance_breakdown(
+    user_id: int,
+    token: str,
+    req_from: str,
+    req_to: str,
+    progress_callback=None,
+    *,
+    tax_rate: float | None = None,
+    finance_version: str | None = None,
+    refresh: bool = False,
+) -> Dict[str, Any]:
+    """
+    Расшифровка фин. отчёта за период: агрегат периода (общий с /report/finance) + хранение
+    и продвижение из WB. С finance_version из того же агрегата сохраняется и ответ
+    /report/finance за период — открытие второй страницы берётся из кэша.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from utils.api import fetch_paid_storage_report
+    from utils.finance_dashboard import finance_dashboard_from_partial
+    from utils.finance_engine import finance_report_from_partial, load_or_collect_finance_partial
+    from utils.report_results import REPORT_KIND_FINANCE, save_report_result
+
+    progress_lock = threading.Lock()
+
+    def safe_progress(current, total, period):
+        if progress_callback:
+            with progress_lock:
+                progress_callback(current, total, period)
+
+    # Агрегат периода, сохранённый /report/finance, или закрытые недели с диска + края периода из WB
+    partial = load_or_collect_finance_partial(
+        user_id,
+        req_from,
+        req_to,
+        _finance_rows_fetcher(token),
+        progress_callback=safe_progress,
+        refresh=refresh,
     )
+    if finance_version is not None and not partial.get("failed_segments"):
+        save_report_result(
+            user_id,
+            REPORT_KIND_FINANCE,
+            req_from,
+            req_to,
+            finance_version,
+            finance_report_from_partial(partial, req_from, req_to, tax_rate=tax_rate),
+            ttl_s=_finance_result_ttl(req_to),
+        )
+
+    paid_storage: list = []
+    paid_storage_error = None
+    promotion_spend: list = []
+    promotion_error = None
+
+    def _load_storage():
+        return fetch_paid_storage_report(
+            token, req_from, req_to, progress_callback=safe_progress
+        )
+
+    def _load_promo():
+        from utils.advertising import fetch_promotion_spend_by_nm
+        return fetch_promotion_spend_by_nm(
+            token, req_from, req_to, progress_callback=safe_progress, user_id=user_id
+        )
+
+    # Хранение и продвижение — параллельно (раньше шли друг за другом)
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        fut_storage = pool.submit(_load_storage)
+        fut_promo = pool.submit(_load_promo)
+        try:
+            paid_storage = fut_storage.result()
+        except Exception as e:
+            logging.exception("Не удалось загрузить отчёт платного хранения")
+            paid_storage_error = str(e)
+        try:
+            promotion_spend = fut_promo.result()
+        except Exception as e:
+            logging.exception("Не удалось загрузить статистику продвижения")
+            promotion_error = str(e)
+
+    if progress_callback:
+        progress_callback(1, 1, "расчёт сводки…")
+
+    result = finance_dashboard_from_partial(
+        partial,
+        req_from,
+        req_to,
+        user_id=user_id,
+        paid_storage=paid_storage,
+        promotion_spend=promotion_spend,
+    )
+    if paid_storage_error:
+        result["paid_storage_error"] = paid_storage_error
+    if promotion_error:
+        result["promotion_error"] = promotion_error
+    if partial.get("failed_segments"):
+        result["finance_error"] = "Не загружены периоды фин. отчёта: " + ", ".join(partial["failed_segments"])
+    if partial.get("empty_segments"):
+        result["finance_empty_segments"] = list(partial["empty_segments"])
+    return result
 
 
 @app.route("/api/report/finance-breakdown", methods=["GET"])
 @login_required
 def api_finance_breakdown():
     """Загрузка фин. отчёта WB и расчёт сводки как на листе DASHBOARD."""
-    from utils.finance_dashboard import compute_finance_dashboard
-    from utils.api import fetch_paid_storage_report
-
     token = effective_wb_api_token(current_user)
     req_from = (request.args.get("date_from") or "").strip()
     req_to = (request.args.get("date_to") or "").strip()
@@ -10162,93 +9950,66 @@ def api_finance_breakdown():
     days_diff = (date_to_obj - date_from_obj).days
     use_async = request.args.get("async", "0") == "1" or days_diff > 60
 
-    def _load_breakdown(progress_callback=None):
-        from concurrent.futures import ThreadPoolExecutor
-
-        progress_lock = threading.Lock()
-
-        def safe_progress(current, total, period):
-            if progress_callback:
-                with progress_lock:
-                    progress_callback(current, total, period)
-
-        raw = fetch_finance_report(token, req_from, req_to, progress_callback=safe_progress)
-
-        paid_storage: list = []
-        paid_storage_error = None
-        promotion_spend: list = []
-        promotion_error = None
-
-        def _load_storage():
-            return fetch_paid_storage_report(
-                token, req_from, req_to, progress_callback=safe_progress
-            )
-
-        def _load_promo():
-            from utils.advertising import fetch_promotion_spend_by_nm
-            return fetch_promotion_spend_by_nm(
-                token, req_from, req_to, progress_callback=safe_progress, user_id=user_id
-            )
-
-        # Хранение и продвижение — параллельно (раньше шли друг за другом)
-        with ThreadPoolExecutor(max_workers=2) as pool:
-            fut_storage = pool.submit(_load_storage)
-            fut_promo = pool.submit(_load_promo)
-            try:
-                paid_storage = fut_storage.result()
-            except Exception as e:
-                logging.exception("Не удалось загрузить отчёт платного хранения")
-                paid_storage_error = str(e)
-            try:
-                promotion_spend = fut_promo.result()
-            except Exception as e:
-                logging.exception("Не удалось загрузить статистику продвижения")
-                promotion_error = str(e)
-
-        if progress_callback:
-            progress_callback(1, 1, "расчёт сводки…")
+    from utils.report_results import (
+        REPORT_KIND_BREAKDOWN,
+        finish_report_job,
+        load_report_result,
+        save_report_result,
+        start_report_job,
+    )
+    result_version = _breakdown_result_version(user_id)
+    # Готовая расшифровка за закрытый период (из любого воркера, до перезапуска) — без загрузки
+    # из WB; за период с открытыми неделями всегда считаем заново (закрытые недели — с диска)
+    if request.args.get("refresh") != "1" and _finance_period_closed(req_to):
+        cached_result = load_report_result(user_id, REPORT_KIND_BREAKDOWN, req_from, req_to, result_version)
+        if cached_result is not None:
+            return jsonify(cached_result), 200
+
+    # Ставка и версия ответа /report/finance — из запроса (в фоновом потоке current_user недоступен)
+    tax_rate = _finance_tax_rate(current_user)
+    finance_version = _finance_result_version(current_user)
+    refresh = request.args.get("refresh") == "1"
 
-        result = compute_finance_dashboard(
-            raw,
+    def _load_breakdown(progress_callback=None):
+        return _compute_finance_breakdown(
+            user_id,
+            token,
             req_from,
             req_to,
-            user_id=user_id,
-            paid_storage=paid_storage,
-            promotion_spend=promotion_spend,
+            progress_callback=progress_callback,
+            tax_rate=tax_rate,
+            finance_version=finance_version,
+            refresh=refresh,
         )
-        if paid_storage_error:
-            result["paid_storage_error"] = paid_storage_error
-        if promotion_error:
-            result["promotion_error"] = promotion_error
-        return result
 
     if use_async:
-        _reset_stale_breakdown_load(user_id)
-        if _BREAKDOWN_LOADING.get(user_id, False):
+        # Зависшая дольше _BREAKDOWN_STALE_AFTER_S загрузка перезапускается
+        job_id = start_report_job(user_id, REPORT_KIND_BREAKDOWN, req_from, req_to, result_version, _BREAKDOWN_STALE_AFTER_S)
+        if job_id is None:
             return jsonify({"loading": True, "message": "Загрузка уже выполняется"}), 200
 
-        _BREAKDOWN_RESULTS.pop(user_id, None)
-        _clear_breakdown_progress(user_id)
-        _BREAKDOWN_LOADING[user_id] = True
-        _BREAKDOWN_LOADING_STARTED[user_id] = time.time()
-
         def _worker() -> None:
             try:
                 def progress_callback(current, total, period):
                     _set_breakdown_progress(user_id, current, total, period)
 
-                _BREAKDOWN_RESULTS[user_id] = _load_breakdown(progress_callback=progress_callback)
+                result = _load_breakdown(progress_callback=progress_callback)
+                finish_report_job(
+                    user_id,
+                    REPORT_KIND_BREAKDOWN,
+                    result,
+                    job_id=job_id,
+                    reusable=_breakdown_result_complete(result),
+                    ttl_s=_finance_result_ttl(req_to),
+                )
             except Exception as e:
                 logging.exception("Ошибка загрузки расшифровки фин. отчёта")
-                _BREAKDOWN_RESULTS[user_id] = {
+                # Ошибку отдаём ближайшему опросу /result, но не сохраняем за период
+                finish_report_job(user_id, REPORT_KIND_BREAKDOWN, {
                     "success": False,
                     "error": "load_failed",
                     "message": str(e),
-                }
-            finally:
-                _BREAKDOWN_LOADING[user_id] = False
-                _BREAKDOWN_LOADING_STARTED.pop(user_id, None)
-                _clear_breakdown_progress(user_id)
+                }, job_id=job_id, reusable=False)
 
         threading.Thread(target=_worker, daemon=True).start()
         return jsonify({"loading": True, "message": "Загрузка начата"}), 200
@@ -10259,6 +10020,8 @@ def api_finance_breakdown():
 
         result = _load_breakdown(progress_callback=progress_callback)
         _clear_breakdown_progress(user_id)
+        if _breakdown_result_complete(result) and _finance_period_closed(req_to):
+            save_report_result(user_id, REPORT_KIND_BREAKDOWN, req_from, req_to, result_version, result)
         return jsonify(result), 200
     except Exception as e:
         logging.exception("Ошибка синхронной загрузки расшифровки фин. отчёта")
@@ -10266,6 +10029,33 @@ def api_finance_breakdown():
         return jsonify({"success": False, "error": "load_failed", "message": str(e)}), 500
 
 
+def _compute_finance_report(
+    user_id: int,
+    token: str,
+    req_from: str,
+    req_to: str,
+    *,
+    tax_rate: float | None = None,
+    progress_callback=None,
+    refresh: bool = False,
+) -> Dict[str, Any]:
+    """Ответ /report/finance за период по агрегату, общему с расшифровкой (utils.finance_engine)."""
+    from utils.finance_engine import finance_report_from_partial, load_or_collect_finance_partial
+
+    partial = load_or_collect_finance_partial(
+        user_id,
+        req_from,
+        req_to,
+        _finance_rows_fetcher(token),
+        progress_callback=progress_callback,
+        refresh=refresh,
+    )
+    result = finance_report_from_partial(partial, req_from, req_to, tax_rate=tax_rate)
+    if partial.get("failed_segments"):
+        result["finance_error"] = "Не загружены периоды фин. отчёта: " + ", ".join(partial["failed_segments"])
+    return result
+
+
 @app.route("/api/report/finance", methods=["GET"]) 
 @login_required
 def api_report_finance():
@@ -10277,7 +10067,24 @@ def api_report_finance():
     if not (token and req_from and req_to):
         return jsonify({"items": [], "error": None}), 200
     
-    user_id = current_user.id if current_user.is_authenticated else None
+    user_id = current_user.id
+    
+    from utils.report_results import (
+        REPORT_KIND_FINANCE,
+        finish_report_job,
+        load_report_result,
+        save_report_result,
+        start_report_job,
+    )
+    result_version = _finance_result_version(current_user)
+    tax_rate = _finance_tax_rate(current_user)
+    refresh = request.args.get("refresh") == "1"
+    # Готовый результат за закрытый период (из любого воркера, до перезапуска, или посчитанный
+    # вместе с расшифровкой) — без повторной загрузки; открытые недели ещё меняются
+    if not refresh and _finance_period_closed(req_to):
+        cached_result = load_report_result(user_id, REPORT_KIND_FINANCE, req_from, req_to, result_version)
+        if cached_result is not None:
+            return jsonify(cached_result), 200
     
     # Если запрошена асинхронная загрузка или период большой (более 60 дней), используем фоновую задачу
     from datetime import datetime as dt
@@ -10289,18 +10096,13 @@ def api_report_finance():
     except Exception:
         use_async = async_mode
     
-    if use_async and user_id:
+    if use_async:
         # Асинхронная загрузка через фоновую задачу
-        # Проверяем, не идет ли уже загрузка
-        if FINANCE_LOADING.get(user_id, False):
+        # Проверяем, не идет ли уже загрузка (флаг общий для воркеров); заодно сбрасываем прошлый результат
+        job_id = start_report_job(user_id, REPORT_KIND_FINANCE, req_from, req_to, result_version, _FINANCE_STALE_AFTER_S)
+        if job_id is None:
             return jsonify({"loading": True, "message": "Загрузка уже выполняется"}), 200
         
-        # Очищаем предыдущие результаты и прогресс
-        if user_id in FINANCE_RESULTS:
-            del FINANCE_RESULTS[user_id]
-        _clear_finance_progress(user_id)
-        FINANCE_LOADING[user_id] = True
-        
         # Запускаем загрузку в фоновом потоке
         import threading
         def load_finance_background():
@@ -10309,26 +10111,31 @@ def api_report_finance():
                 def progress_callback(current, total, period):
                     _set_finance_progress(user_id, current, total, period)
                 
-                # Загружаем данные
-                raw = fetch_finance_report(token, req_from, req_to, progress_callback=progress_callback)
-                
-                # Обрабатываем данные (копируем логику из основного потока)
-                result = _process_finance_data(raw, req_from, req_to, user_id)
-                
-                # Сохраняем результаты
-                FINANCE_RESULTS[user_id] = result
+                # Агрегат периода (общий с расшифровкой) и итоги по нему
+                result = _compute_finance_report(
+                    user_id,
+                    token,
+                    req_from,
+                    req_to,
+                    tax_rate=tax_rate,
+                    progress_callback=progress_callback,
+                    refresh=refresh,
+                )
                 
-                # Очищаем прогресс и флаг загрузки
-                _clear_finance_progress(user_id)
-                FINANCE_LOADING[user_id] = False
+                # Сохраняем результаты, очищаем прогресс и флаг загрузки
+                finish_report_job(
+                    user_id,
+                    REPORT_KIND_FINANCE,
+                    result,
+                    job_id=job_id,
+                    reusable=not result.get("finance_error"),
+                    ttl_s=_finance_result_ttl(req_to),
+                )
                 
                 logging.info(f"Фоновая загрузка финансового отчета завершена для пользователя {user_id}")
             except Exception as e:
                 logging.error(f"Ошибка фоновой загрузки финансового отчета: {e}")
-                FINANCE_LOADING[user_id] = False
-                if user_id in FINANCE_RESULTS:
-                    del FINANCE_RESULTS[user_id]
-                _clear_finance_progress(user_id)
+                finish_report_job(user_id, REPORT_KIND_FINANCE, None, job_id=job_id)
         
         thread = threading.Thread(target=load_finance_background)
         thread.daemon = True
@@ -10339,293 +10146,32 @@ def api_report_finance():
     
     # Синхронная загрузка (для небольших периодов)
     # Очищаем предыдущий прогресс
-    if current_user.is_authenticated:
-        _clear_finance_progress(current_user.id)
+    _clear_finance_progress(user_id)
     
     try:
         # Создаем callback для обновления прогресса
         def progress_callback(current, total, period):
-            if current_user.is_authenticated:
-                _set_finance_progress(current_user.id, current, total, period)
+            _set_finance_progress(user_id, current, total, period)
         
-        # Always fetch fresh report for the period (не кэшируем данные отчёта)
-        # Теперь с разбиением на интервалы по 7 дней
-        raw = fetch_finance_report(token, req_from, req_to, progress_callback=progress_callback)
+        # Закрытые недели — из сохранённых агрегатов, из WB только края периода и текущая неделя
+        result = _compute_finance_report(
+            user_id,
+            token,
+            req_from,
+            req_to,
+            tax_rate=tax_rate,
+            progress_callback=progress_callback,
+            refresh=refresh,
+        )
         
         # Очищаем прогресс после завершения
-        if current_user.is_authenticated:
-            _clear_finance_progress(current_user.id)
-        
-        # Используем функцию обработки данных
-        user_id_for_tax = current_user.id if current_user.is_authenticated else None
-        result = _process_finance_data(raw, req_from, req_to, user_id_for_tax)
+        _clear_finance_progress(user_id)
+        if not result.get("finance_error") and _finance_period_closed(req_to):
+            save_report_result(user_id, REPORT_KIND_FINANCE, req_from, req_to, result_version, result)
         
         return jsonify(result), 200
     except Exception as exc:
         return jsonify({"items": [], "error": str(exc)}), 200
-        # WB реализовал (по retail_amount с фильтрами по основаниям оплаты)
-        wbr_plus = 0.0
-        wbr_minus = 0.0
-        total_logistics = 0.0
-        total_storage = 0.0
-        total_acceptance = 0.0
-        total_for_pay = 0.0
-        total_buyouts = 0.0
-        total_returns = 0.0
-        total_acquiring = 0.0
-        total_commission_wb = 0.0
-        total_other_deductions = 0.0
-        total_penalties = 0.0
-        total_additional_payment = 0.0
-        # Платная доставка (компенсация): sum(ppvz_for_pay) where supplier_oper_name == "Услуга платная доставка"
-        total_paid_delivery = 0.0
-        # Компенсация брака составная метрика по ppvz_for_pay
-        x1 = x2 = x3 = x4 = x5 = x6 = x7 = x8 = 0.0
-        # Комиссия компоненты K1..K9
-        k1 = k2 = k3 = k4 = k5 = k6 = k7 = k8 = k9 = 0.0
-        # Компенсация ущерба компоненты U1..U14
-        u1 = u2 = u3 = u4 = u5 = u6 = u7 = u8 = u9 = u10 = u11 = u12 = u13 = u14 = 0.0
-        # Выкупы и возвраты считаем по колонке "supplier_oper_name"
-        # Выкупы: one of ["Продажа","Сторно возвратов","Корректная продажа","коррекция продаж"] -> sum(retail_price)
-        buyout_oper_values_lower = {"продажа", "сторно возвратов", "корректная продажа", "коррекция продаж"}
-        for r in raw:
-            try:
-                total_qty += int(r.get("quantity") or 0)
-            except Exception:
-                pass
-            try:
-                total_sum += float(r.get("retail_amount") or 0.0)
-            except Exception:
-                pass
-            try:
-                total_logistics += float(r.get("delivery_rub") or 0.0)
-            except Exception:
-                pass
-            try:
-                total_storage += float(r.get("storage_fee") or 0.0)
-            except Exception:
-                pass
-            try:
-                total_acceptance += float(r.get("acceptance") or 0.0)
-            except Exception:
-                pass
-            try:
-                total_for_pay += float(r.get("ppvz_for_pay") or 0.0)
-            except Exception:
-                pass
-            # Выкупы: суммируем розничную цену для нужных оснований оплаты
-            try:
-                oper = (r.get("supplier_oper_name") or "").strip()
-                if oper and oper.lower() in buyout_oper_values_lower:
-                    total_buyouts += float(r.get("retail_price") or 0.0)
-            except Exception:
-                pass
-            # WB реализовал: retail_amount с суммированием по основаниям оплаты
-            try:
-                oper_lc = (r.get("supplier_oper_name") or "").strip().lower()
-                amt = float(r.get("retail_amount") or 0.0)
-                if oper_lc in {"продажа","сторно возвратов","корректная продажа","коррекция продаж"}:
-                    wbr_plus += amt
-                elif oper_lc in {"возврат","сторно продаж","корректный возврат"}:
-                    wbr_minus += amt
-            except Exception:
-                pass
-            # Возвраты: supplier_oper_name == "Возврат"; суммируем retail_price
-            try:
-                oper = (r.get("supplier_oper_name") or "").strip()
-                if oper == "Возврат":
-                    total_returns += float(r.get("retail_price") or 0.0)
-            except Exception:
-                pass
-            # Эквайринг по формуле: E1 - E2 + E3
-            # E1: doc_type_name == "Продажа" AND acquiring_percent > 0 -> sum acquiring_fee
-            # E2: doc_type_name == "Возврат" AND acquiring_percent > 0 -> sum acquiring_fee
-            # E3: supplier_oper_name == "Корректировка эквайринга" -> sum ppvz_for_pay
-            try:
-                dt_name = (r.get("doc_type_name") or "").strip()
-                acq_pct = float(r.get("acquiring_percent") or 0.0)
-                afee = float(r.get("acquiring_fee") or 0.0)
-                if dt_name == "Продажа" and acq_pct > 0:
-                    total_acquiring += afee
-                elif dt_name == "Возврат" and acq_pct > 0:
-                    total_acquiring -= afee
-                # Корректировка эквайринга не включается в "Эквайринг", 
-                # а учитывается отдельно в формуле "К перечислению"
-            except Exception:
-                pass
-            try:
-                total_commission_wb += float(r.get("ppvz_vw") or 0.0)
-            except Exception:
-                pass
-            try:
-                total_other_deductions += float(r.get("deduction") or 0.0)
-                total_other_deductions += float(r.get("additional_payment") or 0.0)
-            except Exception:
-                pass
-            try:
-                total_penalties += float(r.get("penalty") or 0.0)
-            except Exception:
-                pass
-            try:
-                total_additional_payment += float(r.get("additional_payment") or 0.0)
-            except Exception:
-                pass
-            # Компенсация брака: считаем X1..X8 по supplier_oper_name + doc_type_name, суммируя ppvz_for_pay
-            try:
-                oper_l = (r.get("supplier_oper_name") or "").strip().lower()
-                doc_l = (r.get("doc_type_name") or "").strip().lower()
-                pay_val = float(r.get("ppvz_for_pay") or 0.0)
-                # Платная доставка — учитываем как компенсацию, отдельная метрика
-                if oper_l == "услуга платная доставка":
-                    total_paid_delivery += pay_val
-                if oper_l == "компенсация брака" and doc_l == "продажа":
-                    x1 += pay_val
-                if oper_l == "оплата брака" and doc_l == "продажа":
-                    x2 += pay_val
-                if oper_l == "компенсация брака" and doc_l == "возврат":
-                    x3 += pay_val
-                if oper_l == "оплата брака" and doc_l == "возврат":
-                    x4 += pay_val
-                if oper_l == "частичная компенсация брака" and doc_l == "продажа":
-                    x5 += pay_val
-                if oper_l == "частичная компенсация брака" and doc_l == "возврат":
-                    x6 += pay_val
-                if oper_l == "добровольная компенсация при возврате" and doc_l == "продажа":
-                    x7 += pay_val
-                if oper_l == "добровольная компенсация при возврате" and doc_l == "возврат":
-                    x8 += pay_val
-                # Комиссия: K1..K9 — также на основе ppvz_for_pay
-                if oper_l == "продажа":
-                    k1 += pay_val
-                if oper_l == "сторно возвратов":
-                    k2 += pay_val
-                if oper_l == "корректная продажа":
-                    k3 += pay_val
-                if oper_l == "коррекция продаж" and doc_l == "продажа":
-                    k4 += pay_val
-                if oper_l == "возврат":
-                    k5 += pay_val
-                if oper_l == "сторно продаж":
-                    k6 += pay_val
-                if oper_l == "коррекция продаж" and doc_l == "возврат":
-                    k7 += pay_val
-                if oper_l == "корректный возврат":
-                    k8 += pay_val
-                if oper_l == "корректировка эквайринга":
-                    k9 += pay_val
-                # Компенсация ущерба: U1..U14 по условиям, суммируем ppvz_for_pay
-                if oper_l == "оплата потерянного товара" and doc_l == "продажа":
-                    u1 += pay_val
-                if oper_l == "компенсация потерянного товара" and doc_l == "продажа":
-                    u2 += pay_val
-                if oper_l == "оплата потерянного товара" and doc_l == "возврат":
-                    u3 += pay_val
-                if oper_l == "компенсация потерянного товара" and doc_l == "возврат":
-                    u4 += pay_val
-                if oper_l == "авансовая оплата за товар без движения" and doc_l == "продажа":
-                    u5 += pay_val
-                if oper_l == "авансовая оплата за товар без движения" and doc_l == "возврат":
-                    u6 += pay_val
-                if oper_l == "компенсация подмененного товара" and doc_l == "продажа":
-                    u7 += pay_val
-                if oper_l == "компенсация подмененного товара" and doc_l == "возврат":
-                    u8 += pay_val
-                if oper_l == "компенсация подмененного товара" and doc_l == "продажа":
-                    u9 += pay_val
-                if oper_l == "компенсация подмененного товара" and doc_l == "возврат":
-                    u10 += pay_val
-                if oper_l == "компенсация ущерба" and doc_l == "продажа":
-                    u11 += pay_val
-                if oper_l == "компенсация ущерба" and doc_l == "возврат":
-                    u12 += pay_val
-                if oper_l == "компенсация подмен" and doc_l == "продажа":
-                    u13 += pay_val
-                if oper_l == "компенсация подмен" and doc_l == "возврат":
-                    u14 += pay_val
-            except Exception:
-                pass
-        date_from_fmt = datetime.strptime(req_from, "%Y-%m-%d").strftime("%d.%m.%Y")
-        date_to_fmt = datetime.strptime(req_to, "%Y-%m-%d").strftime("%d.%m.%Y")
-        revenue_calc = total_buyouts - total_returns
-        defect_comp = x1 + x2 - x3 - x4 + x5 - x6 + x7 - x8
-        total_wb_realized = wbr_plus - wbr_minus
-        # Комиссия = Выручка - (K1+K2+K3+K4 - (K5+K6+K7+K8)) - Эквайринг
-        # (K9 - корректировка эквайринга учитывается отдельно в формуле "К перечислению")
-        commission_total = (
-            revenue_calc
-            - (k1 + k2 + k3 + k4)
-            + (k5 + k6 + k7 + k8)
-            - total_acquiring
-        )
-        damage_comp = u1 + u2 - u3 - u4 + u5 - u6 + u7 + u8 - u9 - u10 + u11 - u12 + u13 - u14
-        
-        # Удержания и компенсации WB = Комиссия + Эквайринг + Логистика + Хранение + Прочие удержания + Приёмка - Компенсация брака - Компенсация ущерба - Платная доставка + Штрафы + Доплаты
-        total_deductions = (
-            commission_total + 
-            total_acquiring + 
-            total_logistics + 
-            total_storage + 
-            total_other_deductions + 
-            total_acceptance - 
-            defect_comp - 
-            damage_comp - 
-            total_paid_delivery + 
-            total_penalties + 
-            total_additional_payment
-        )
-        
-        # К перечислению = Выручка - Удержания и компенсации WB + E3
-        # E3: supplier_oper_name == "Корректировка эквайринга" -> sum ppvz_for_pay
-        e3_correction = 0
-        for r in raw:
-            try:
-                oper_name = (r.get("supplier_oper_name") or "").strip()
-                if oper_name == "Корректировка эквайринга":
-                    e3_correction += float(r.get("ppvz_for_pay") or 0.0)
-            except Exception:
-                pass
-        
-        total_for_transfer = revenue_calc - total_deductions + e3_correction
-        
-        # Расчет налога от суммы "WB реализовал"
-        tax_amount = 0.0
-        tax_rate = None
-        if current_user.tax_rate is not None:
-            tax_rate = float(current_user.tax_rate)
-            tax_amount = (total_wb_realized * tax_rate) / 100.0
-        
-        # Кэширование отключено - не сохраняем данные финансового отчета
-        
-        return jsonify({
-            "rows": raw,
-            "total_qty": int(total_qty),
-            "total_sum": round(total_sum, 2),
-            "total_logistics": round(total_logistics, 2),
-            "total_storage": round(total_storage, 2),
-            "total_acceptance": round(total_acceptance, 2),
-            "total_for_pay": round(total_for_pay, 2),
-            "total_buyouts": round(total_buyouts, 2),
-            "total_returns": round(total_returns, 2),
-            "revenue": round(revenue_calc, 2),
-            "total_wb_realized": round(total_wb_realized, 2),
-            "total_commission": round(commission_total, 2),
-            "total_acquiring": round(total_acquiring, 2),
-            "total_commission_wb": round(total_commission_wb, 2),
-            "total_other_deductions": round(total_other_deductions, 2),
-            "total_penalties": round(total_penalties, 2),
-            "total_defect_compensation": round(defect_comp, 2),
-            "total_damage_compensation": round(damage_comp, 2),
-            "total_paid_delivery": round(total_paid_delivery, 2),
-            "total_additional_payment": round(total_additional_payment, 2),
-            "total_deductions": round(total_deductions, 2),
-            "total_for_transfer": round(total_for_transfer, 2),
-            "tax_amount": round(tax_amount, 2),
-            "tax_rate": tax_rate,
-            "date_from_fmt": date_from_fmt,
-            "date_to_fmt": date_to_fmt,
-        }), 200
-    except Exception as exc:
-        return jsonify({"items": [], "error": str(exc)}), 200
 
 
 @app.route("/report/finance/export", methods=["GET"]) 
@@ -10636,48 +10182,60 @@ def export_finance_xls():
     req_to = (request.args.get("date_to") or "").strip()
     if not (token and req_from and req_to):
         return ("Требуются даты и токен", 400)
+    from utils.constants import FINANCE_WEEK_FETCH_PAUSE_S
+    from utils.finance_partials import plan_finance_segments
+    from utils.xlsx_stream import iter_xlsx
+
     try:
-        # Always fetch fresh for export
-        rows = fetch_finance_report(token, req_from, req_to)
-        # Build XLS (not XLSX) to match requirement "XLS"
-        try:
-            import xlwt  # type: ignore
-        except Exception:
-            return ("На сервере отсутствует зависимость xlwt (для .xls)", 500)
-        wb = xlwt.Workbook()
-        ws = wb.add_sheet("finance")
-        header_style = xlwt.easyxf("font: bold on; align: horiz center")
-        num_style = xlwt.easyxf("align: horiz right")
-        cols = [
-            'realizationreport_id','date_from','date_to','create_dt','currency_name','suppliercontract_code','rrd_id','gi_id','dlv_prc','fix_tariff_date_from','fix_tariff_date_to','subject_name','nm_id','brand_name','sa_name','ts_name','barcode','doc_type_name','quantity','retail_price','retail_amount','sale_percent','commission_percent','office_name','supplier_oper_name','order_dt','sale_dt','rr_dt','shk_id','retail_price_withdisc_rub','delivery_amount','return_amount','delivery_rub','gi_box_type_name','product_discount_for_report','supplier_promo','ppvz_spp_prc','ppvz_kvw_prc_base','ppvz_kvw_prc','sup_rating_prc_up','is_kgvp_v2','ppvz_sales_commission','ppvz_for_pay','ppvz_reward','acquiring_fee','acquiring_percent','payment_processing','acquiring_bank','ppvz_vw','ppvz_vw_nds','ppvz_office_name','ppvz_office_id','ppvz_supplier_id','ppvz_supplier_name','ppvz_inn','declaration_number','bonus_type_name','sticker_id','site_country','srv_dbs','penalty','additional_payment','rebill_logistic_cost','rebill_logistic_org','storage_fee','deduction','acceptance','assembly_id','kiz','srid','report_type','is_legal_entity','trbx_id','installment_cofinancing_amount','wibes_wb_discount_percent','cashback_amount','cashback_discount'
-        ]
-        headers_ru = [
-            "Номер отчёта","Дата начала периода","Дата конца периода","Дата формирования","Валюта","Договор","Номер строки","Номер поставки","Фикс. коэф. склада","Начало фиксации","Конец фиксации","Предмет","Артикул WB","Бренд","Артикул продавца","Размер","Баркод","Тип документа","Количество","Цена розничная","Реализовано (Пр)","Скидка, %","кВВ, %","Склад","Обоснование оплаты","Дата заказа","Дата продажи","Дата операции","Штрихкод","Розничная с уч. скидки","Кол-во доставок","Кол-во возвратов","Доставка, руб","Тип коробов","Итог. продукт. скидка, %","Промокод, %","СПП, %","Базовый кВВ без НДС, %","Итоговый кВВ без НДС, %","Снижение кВВ (рейтинг), %","Снижение кВВ (акция), %","Вознаграждение с продаж","К перечислению продавцу","Возмещение ПВЗ","Эквайринг","Эквайринг, %","Тип платежа эквайринга","Банк-эквайер","Вознаграждение ВВ","НДС ВВ","Офис доставки","ID офиса","ID партнёра","Партнёр","ИНН партнёра","№ декларации","Тип логистики/штрафа","ID стикера","Страна продажи","Платная доставка","Штрафы","Корректировка ВВ","Возмещение логистики","Организатор перевозки","Хранение","Удержания","Платная приёмка","ID сборочного","Код маркировки","SRID","Тип отчёта","B2B","ID короба приёмки","Софинансирование","Скидка Wibes, %","Баллы (удержано)","Компенсация скидки"
-        ]
-        for ci, title in enumerate(headers_ru, start=1):
-            ws.write(0, ci-1, title, header_style)
-        row_idx = 1
-        for r in rows:
-            for ci, key in enumerate(cols, start=1):
-                val = r.get(key)
-                if isinstance(val, (dict, list)):
-                    try:
-                        import json as _json
-                        val = _json.dumps(val, ensure_ascii=False)
-                    except Exception:
-                        val = str(val)
-                ws.write(row_idx, ci-1, val if val is not None else "")
-            row_idx += 1
-        out = io.BytesIO()
-        wb.save(out)
-        out.seek(0)
-        filename = f"finance_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xls"
-        return send_file(out, mimetype="application/vnd.ms-excel", as_attachment=True, download_name=filename)
+        segments = plan_finance_segments(req_from, req_to)
+    except ValueError:
+        return ("Неверный формат даты", 400)
+    cols = [
+        'realizationreport_id','date_from','date_to','create_dt','currency_name','suppliercontract_code','rrd_id','gi_id','dlv_prc','fix_tariff_date_from','fix_tariff_date_to','subject_name','nm_id','brand_name','sa_name','ts_name','barcode','doc_type_name','quantity','retail_price','retail_amount','sale_percent','commission_percent','office_name','supplier_oper_name','order_dt','sale_dt','rr_dt','shk_id','retail_price_withdisc_rub','delivery_amount','return_amount','delivery_rub','gi_box_type_name','product_discount_for_report','supplier_promo','ppvz_spp_prc','ppvz_kvw_prc_base','ppvz_kvw_prc','sup_rating_prc_up','is_kgvp_v2','ppvz_sales_commission','ppvz_for_pay','ppvz_reward','acquiring_fee','acquiring_percent','payment_processing','acquiring_bank','ppvz_vw','ppvz_vw_nds','ppvz_office_name','ppvz_office_id','ppvz_supplier_id','ppvz_supplier_name','ppvz_inn','declaration_number','bonus_type_name','sticker_id','site_country','srv_dbs','penalty','additional_payment','rebill_logistic_cost','rebill_logistic_org','storage_fee','deduction','acceptance','assembly_id','kiz','srid','report_type','is_legal_entity','trbx_id','installment_cofinancing_amount','wibes_wb_discount_percent','cashback_amount','cashback_discount'
+    ]
+    headers_ru = [
+        "Номер отчёта","Дата начала периода","Дата конца периода","Дата формирования","Валюта","Договор","Номер строки","Номер поставки","Фикс. коэф. склада","Начало фиксации","Конец фиксации","Предмет","Артикул WB","Бренд","Артикул продавца","Размер","Баркод","Тип документа","Количество","Цена розничная","Реализовано (Пр)","Скидка, %","кВВ, %","Склад","Обоснование оплаты","Дата заказа","Дата продажи","Дата операции","Штрихкод","Розничная с уч. скидки","Кол-во доставок","Кол-во возвратов","Доставка, руб","Тип коробов","Итог. продукт. скидка, %","Промокод, %","СПП, %","Базовый кВВ без НДС, %","Итоговый кВВ без НДС, %","Снижение кВВ (рейтинг), %","Снижение кВВ (акция), %","Вознаграждение с продаж","К перечислению продавцу","Возмещение ПВЗ","Эквайринг","Эквайринг, %","Тип платежа эквайринга","Банк-эквайер","Вознаграждение ВВ","НДС ВВ","Офис доставки","ID офиса","ID партнёра","Партнёр","ИНН партнёра","№ декларации","Тип логистики/штрафа","ID стикера","Страна продажи","Платная доставка","Штрафы","Корректировка ВВ","Возмещение логистики","Организатор перевозки","Хранение","Удержания","Платная приёмка","ID сборочного","Код маркировки","SRID","Тип отчёта","B2B","ID короба приёмки","Софинансирование","Скидка Wibes, %","Баллы (удержано)","Компенсация скидки"
+    ]
+
+    # Первую неделю грузим до ответа: если WB недоступен или токен не подходит,
+    # пользователь получит код ошибки, а не пустой файл с кодом 200
+    try:
+        first_rows = fetch_finance_report(token, segments[0][0], segments[0][1]) if segments else []
     except requests.HTTPError as http_err:
         return (f"Ошибка API: {http_err.response.status_code}", 502)
     except Exception as exc:
         return (f"Ошибка: {exc}", 500)
 
+    def export_rows(first_rows):
+        # Остальные недели грузятся прямо во время отдачи файла: в памяти одна неделя,
+        # а не весь период и не книга целиком (раньше — xlwt в памяти, .xls до 65536 строк)
+        for n, (seg_from, seg_to, _closed) in enumerate(segments, 1):
+            if n == 1:
+                rows, first_rows = first_rows, None
+            else:
+                time.sleep(FINANCE_WEEK_FETCH_PAUSE_S)
+                try:
+                    rows = fetch_finance_report(token, seg_from, seg_to)
+                except Exception as exc:
+                    # Заголовки уже отправлены: обрываем поток, чтобы вместо файла без целых недель
+                    # у пользователя была ошибка загрузки
+                    logging.error(f"Выгрузка фин. отчёта: ошибка загрузки {seg_from} - {seg_to}: {exc}")
+                    raise
+            for r in rows:
+                values = []
+                for key in cols:
+                    val = r.get(key)
+                    if isinstance(val, (dict, list)):
+                        try:
+                            val = json.dumps(val, ensure_ascii=False)
+                        except Exception:
+                            val = str(val)
+                    values.append(val)
+                yield values
+
+    filename = f"finance_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+    return _xlsx_stream_response(iter_xlsx(export_rows(first_rows), header=headers_ru, sheet_title="finance"), filename)
+
 @app.route("/fbs", methods=["GET", "POST"]) 
 @login_required
 def fbs_page():
@@ -13069,20 +12627,27 @@ def api_product_analytics(nm_id: int):
         return jsonify({"error": "bad_dates"}), 400
 
     try:
+        # Заказы только этого товара: для дней из кэша — по индексу by_nm дневной свёртки,
+        # без нормализации и перебора заказов остальных товаров
+        from utils.cache import (
+            get_orders_with_period_cache as get_orders_with_period_cache_indexed,
+            update_period_cache_with_data,
+        )
         if force_refresh:
             raw_orders = fetch_orders_range(token, req_from, req_to)
             orders = to_rows(raw_orders, req_from, req_to)
-            _update_period_cache_with_data(token, req_from, req_to, orders)
+            update_period_cache_with_data(token, req_from, req_to, orders)
             cache_info = {"used_cache_days": 0, "fetched_days": len(list(_daterange_inclusive(req_from, req_to)))}
+            # Фильтрация по nm_id - сначала собираем ВСЕ заказы по товару
+            all_product_orders = []
+            for r in orders:
+                nmv = r.get("Артикул WB") or r.get("nmId") or r.get("nmID")
+                if str(nmv) == str(nm_id):
+                    all_product_orders.append(r)
         else:
-            orders, cache_info = get_orders_with_period_cache(token, req_from, req_to)
-
-        # Фильтрация по nm_id - сначала собираем ВСЕ заказы по товару
-        all_product_orders = []
-        for r in orders:
-            nmv = r.get("Артикул WB") or r.get("nmId") or r.get("nmID")
-            if str(nmv) == str(nm_id):
-                all_product_orders.append(r)
+            all_product_orders, cache_info = get_orders_with_period_cache_indexed(
+                token, req_from, req_to, nm_id=nm_id
+            )
 
         # Разделяем на активные и отмененные
         total_orders = len(all_product_orders)
@@ -13116,27 +12681,25 @@ def api_product_analytics(nm_id: int):
         # Текущие остатки по складам для этого товара
         # Собираем все возможные штрихкоды (SKU) для данного nm_id из кэша карточек
         product_barcodes: set[str] = set()
+        prod_cached = load_products_cache() or {}
         try:
-            prod_cached_full = load_products_cache() or {}
-            for it in (prod_cached_full.get("items") or []):
-                nmv = it.get("nm_id") or it.get("nmId") or it.get("nmID")
-                if str(nmv) == str(nm_id):
-                    if it.get("barcode"):
-                        product_barcodes.add(str(it.get("barcode")))
-                    bars = it.get("barcodes") or []
-                    if isinstance(bars, list):
-                        for b in bars:
-                            if b:
-                                product_barcodes.add(str(b))
-                    sizes = it.get("sizes") or []
-                    if isinstance(sizes, list):
-                        for s in sizes:
-                            bl = s.get("skus") or s.get("barcodes")
-                            if isinstance(bl, list):
-                                for b in bl:
-                                    if b:
-                                        product_barcodes.add(str(b))
-                    break
+            it = find_product_item(prod_cached, nm_id)
+            if it is not None:
+                if it.get("barcode"):
+                    product_barcodes.add(str(it.get("barcode")))
+                bars = it.get("barcodes") or []
+                if isinstance(bars, list):
+                    for b in bars:
+                        if b:
+                            product_barcodes.add(str(b))
+                sizes = it.get("sizes") or []
+                if isinstance(sizes, list):
+                    for s in sizes:
+                        bl = s.get("skus") or s.get("barcodes")
+                        if isinstance(bl, list):
+                            for b in bl:
+                                if b:
+                                    product_barcodes.add(str(b))
         except Exception:
             pass
 
@@ -13144,7 +12707,7 @@ def api_product_analytics(nm_id: int):
         stock_by_warehouse: dict[str, int] = {}
         try:
             stocks_cached = load_stocks_cache() or {}
-            for stock_item in (stocks_cached.get("items") or []):
+            for stock_item in stock_items_for_barcodes(stocks_cached, product_barcodes):
                 bc = str(stock_item.get("barcode") or "")
                 if not bc or (product_barcodes and bc not in product_barcodes):
                     continue
@@ -13227,15 +12790,12 @@ def api_product_analytics(nm_id: int):
         supplier_article = None
         barcode = None
         try:
-            prod_cached = load_products_cache() or {}
-            for it in (prod_cached.get("items") or []):
-                nmv = it.get("nm_id") or it.get("nmId") or it.get("nmID")
-                if str(nmv) == str(nm_id):
-                    photo = it.get("photo") or it.get("img")
-                    product_name = it.get("name") or it.get("title") or it.get("subject") or "Без названия"
-                    supplier_article = it.get("supplier_article") or it.get("vendorCode") or it.get("vendor_code")
-                    barcode = it.get("barcode")
-                    break
+            it = find_product_item(prod_cached, nm_id)
+            if it is not None:
+                photo = it.get("photo") or it.get("img")
+                product_name = it.get("name") or it.get("title") or it.get("subject") or "Без названия"
+                supplier_article = it.get("supplier_article") or it.get("vendorCode") or it.get("vendor_code")
+                barcode = it.get("barcode")
         except Exception:
             photo = None
             product_name = None
@@ -14503,12 +14063,7 @@ def admin_users_delete(user_id: int):
         return redirect(url_for("admin_users"))
     try:
         if delete_user_with_related(user_id):
-            try:
-                cache_path = _cache_path_for_user_id(user_id)
-                if os.path.isfile(cache_path):
-                    os.remove(cache_path)
-            except Exception:
-                pass
+            remove_user_cache(user_id)
             flash("Пользователь удалён")
         else:
             flash("Пользователь не найден")
@@ -15287,6 +14842,8 @@ def api_prices_save():
         
         # Сохраняем изменения в базе данных
         db.session.commit()
+        from utils.order_feed import mark_purchase_prices_changed
+        mark_purchase_prices_changed(current_user.id)
         
         return jsonify({
             "success": True,
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""Бенчмарк: разбор дат/времени WB прежними парсерами и utils.datetime_parse.
+
+Запуск из корня проекта:
+    python benchmarks/bench_datetime_parse.py            # 1M значений
+    python benchmarks/bench_datetime_parse.py 200000     # свой размер
+
+Значения синтетические, как в отчётах WB: отметки времени заказов (секунды, повторы
+внутри страницы), lastChangeDate с Z и дробной частью, даты YYYY-MM-DD и DD.MM.YYYY.
+Прежние реализации скопированы ниже как эталон: результаты сверяются поштучно.
+"""
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import datetime_parse as fast  # noqa: E402
+
+
+# --- прежние реализации (эталон) ---
+
+def legacy_parse_date(date_str):
+    try:
+        return datetime.strptime(date_str, "%Y-%m-%d")
+    except ValueError:
+        try:
+            return datetime.strptime(date_str, "%d.%m.%Y")
+        except ValueError:
+            raise ValueError(f"Unable to parse date '{date_str}'. Expected formats: YYYY-MM-DD or DD.MM.YYYY")
+
+
+def legacy_parse_wb_datetime(value):
+    if not value:
+        return None
+    s = str(value)
+    try:
+        s_norm = s.replace("Z", "+00:00")
+        return datetime.fromisoformat(s_norm[:26] + s_norm[26:])
+    except Exception:
+        try:
+            return datetime.strptime(s[:19], "%Y-%m-%dT%H:%M:%S")
+        except Exception:
+            return None
+
+
+def legacy_parse_wb_dt(value):
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None) if value.tzinfo else value
+    s = str(value).strip()
+    if not s or s.startswith("0001-01-01"):
+        return None
+    core = s.replace("Z", "")
+    if "+" in core[10:]:
+        core = core[: core.rfind("+", 10)]
+    core = core.strip()
+    for fmt, n in (
+        ("%Y-%m-%dT%H:%M:%S", 19),
+        ("%Y-%m-%d %H:%M:%S", 19),
+        ("%d.%m.%Y %H:%M:%S", 19),
+        ("%Y-%m-%d", 10),
+        ("%d.%m.%Y", 10),
+    ):
+        try:
+            return datetime.strptime(core[:n], fmt)
+        except Exception:
+            continue
+    try:
+        return datetime.fromisoformat(s.replace("Z", "+00:00")).replace(tzinfo=None)
+    except Exception:
+        return None
+
+
+def make_values(n, seed=1):
+    rnd = random.Random(seed)
+    dates, stamps, mixed = [], [], []
+    # ~3000 уникальных отметок на страницу: одинаковые lastChangeDate у пачек строк
+    pool = [
+        f"2026-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}T{rnd.randint(0, 23):02d}:"
+        f"{rnd.randint(0, 59):02d}:{rnd.randint(0, 59):02d}"
+        for _ in range(3000)
+    ]
+    for _ in range(n):
+        day = f"2026-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}"
+        dates.append(day if rnd.random() < 0.8 else f"{day[8:10]}.{day[5:7]}.{day[:4]}")
+        stamp = rnd.choice(pool)
+        stamps.append(stamp if rnd.random() < 0.7 else f"{stamp}.{rnd.randint(0, 999999):06d}Z")
+        r = rnd.random()
+        if r < 0.5:
+            mixed.append(stamp)
+        elif r < 0.7:
+            mixed.append(f"{stamp}+03:00")
+        elif r < 0.85:
+            mixed.append(stamp.replace("T", " "))
+        elif r < 0.95:
+            mixed.append(day)
+        else:
+            mixed.append("0001-01-01T00:00:00")
+    return dates, stamps, mixed
+
+
+def timed(fn, values):
+    t = time.perf_counter()
+    out = [fn(v) for v in values]
+    return time.perf_counter() - t, out
+
+
+def main(n):
+    dates, stamps, mixed = make_values(n)
+    cases = (
+        ("parse_date", legacy_parse_date, fast.parse_date, dates),
+        ("parse_wb_datetime", legacy_parse_wb_datetime, fast.parse_wb_datetime, stamps),
+        ("_parse_wb_dt (лента)", legacy_parse_wb_dt, fast.parse_wb_naive_datetime, mixed),
+    )
+    for name, old, new, values in cases:
+        t_old, expected = timed(old, values)
+        t_new, got = timed(new, values)
+        print(
+            f"{name:>22}: {len(values)} значений | было {t_old:6.2f} s | стало {t_new:6.2f} s "
+            f"({t_old / t_new:5.1f}x) | совпадает: {expected == got}"
+        )
+    # Сортировка страницы по lastChangeDate, как в fetch_orders_range (WB отдаёт без Z)
+    page = [{"lastChangeDate": s} for s in stamps if not s.endswith("Z")]
+    t = time.perf_counter()
+    sorted(page, key=lambda x: legacy_parse_wb_datetime(x.get("lastChangeDate")) or datetime.min)
+    t_old = time.perf_counter() - t
+    t = time.perf_counter()
+    sorted(page, key=lambda x: fast.parse_wb_datetime(x.get("lastChangeDate")) or datetime.min)
+    t_new = time.perf_counter() - t
+    print(f"{'sort по lastChangeDate':>22}: было {t_old:6.2f} s | стало {t_new:6.2f} s ({t_old / t_new:5.1f}x)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
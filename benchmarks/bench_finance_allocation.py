@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""Бенчмарк: разнесение продвижения и «суммы с услугами» по товарам.
+
+Запуск из корня проекта:
+    python benchmarks/bench_finance_allocation.py              # 20k и 50k товаров
+    python benchmarks/bench_finance_allocation.py 100000       # свой размер
+
+Товары — как после _apply_product_expense_columns: сумма, логистика, хранение, приёмка,
+продажи (часть без продаж, часть с отрицательной суммой). Часть nmId встречается в
+нескольких строках товаров (разные баркоды), часть строк затрат продвижения — без
+товара или без nmId. Эталон — utils/finance_dashboard.py из git (benchmarks/git_baseline.py, поштучный цикл);
+товары и строки разнесения сверяются целиком, в том числе на случаях без весов.
+"""
+import copy
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from git_baseline import legacy_finance_dashboard  # noqa: E402
+from utils import finance_dashboard as fast  # noqa: E402
+
+legacy = legacy_finance_dashboard()
+
+
+def make_products(n, seed=1):
+    rnd = random.Random(seed)
+    products = []
+    for j in range(n):
+        # ~10% nmId с двумя-тремя баркодами
+        nm = 100000000 + (j if rnd.random() > 0.1 else max(0, j - rnd.randint(1, 2)))
+        sold = rnd.random() > 0.25
+        products.append({
+            "nm_id": nm if rnd.random() > 0.01 else None,
+            "barcode": str(2040000000000 + j),
+            "sa_name": f"ART-{j}",
+            "name": f"Товар {j}",
+            "sales_qty": rnd.randint(1, 40) if sold else 0,
+            "for_pay": round(rnd.uniform(-500, 90000), 2) if sold else rnd.choice([0.0, None]),
+            "logistics": round(rnd.uniform(0, 3000), 2),
+            "storage": round(rnd.uniform(0, 800), 2),
+            "acceptance": rnd.choice([0.0, round(rnd.uniform(0, 200), 2)]),
+        })
+    spend = [
+        {"nm_id": 100000000 + j, "sum": round(rnd.uniform(-50, 20000), 2), "vendor_code": f"ART-{j}"}
+        for j in rnd.sample(range(n + n // 20), n // 5)
+    ]
+    spend.append({"nm_id": "", "sum": 100.0})
+    return products, spend
+
+
+def run(module, products, spend, promotion_total, payment):
+    t = time.perf_counter()
+    products, breakdown, advert_sum = module._apply_promotion_allocation(
+        products, promotion_total=promotion_total, promotion_spend=spend
+    )
+    products_total = round(sum(module._f(p.get("for_pay")) for p in products), 2)
+    products = module._apply_services_allocation(products, payment, products_total=products_total)
+    return time.perf_counter() - t, (products, breakdown, advert_sum)
+
+
+def check(products, spend, promotion_total, payment):
+    _, expected = run(legacy, copy.deepcopy(products), copy.deepcopy(spend), promotion_total, payment)
+    _, got = run(fast, copy.deepcopy(products), copy.deepcopy(spend), promotion_total, payment)
+    return expected == got
+
+
+def main(sizes):
+    for n in sizes:
+        products, spend = make_products(n)
+        promotion_total = -round(sum(max(0.0, r["sum"]) for r in spend) * 0.97, 2)
+        payment = round(sum(p["for_pay"] or 0.0 for p in products) * 0.62, 2)
+        t_old, expected = run(legacy, copy.deepcopy(products), copy.deepcopy(spend), promotion_total, payment)
+        t_new, got = run(fast, copy.deepcopy(products), copy.deepcopy(spend), promotion_total, payment)
+        print(
+            f"{n:>7} товаров, {len(spend)} строк продвижения | было {t_old * 1000:7.1f} ms | "
+            f"стало {t_new * 1000:7.1f} ms ({t_old / t_new:4.1f}x) | совпадает: {expected == got}"
+        )
+
+    # Крайние случаи: нет весов, нет продаж, один товар, нулевая сумма продвижения
+    products, spend = make_products(200, seed=2)
+    for p in products:
+        p["for_pay"] = 0.0
+    cases = {
+        "без весов": (products, spend, -1234.56, -777.77),
+        "без продаж": ([dict(p, sales_qty=0) for p in products], spend, -10.0, 0.0),
+        "один товар": (products[:1], spend[:1], -99.99, 10.01),
+        "без продвижения": (products, spend, 0.0, 500.0),
+    }
+    for title, args in cases.items():
+        print(f"{title:>16}: совпадает: {check(*args)}")
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or [20000, 50000])
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""Бенчмарк: память строк фин. отчёта списком словарей и в FinanceColumns.
+
+Запуск из корня проекта:
+    python benchmarks/bench_finance_columnar.py            # 500k строк
+    python benchmarks/bench_finance_columnar.py 200000     # свой размер
+
+Строки — как reportDetailByPeriod: синтетика bench_finance_dashboard плюс остальные
+поля ответа WB (~85 ключей, у каждой строки свои rrd_id, srid, shk_id). Каждый замер —
+в отдельном процессе (RSS не возвращается системе после free): ответ читается
+страницами по WB_PAGE_ROWS строк (json.loads, как fetch_finance_report), страница
+либо дописывается в список, либо раскладывается в FinanceColumns и удаляется.
+Показывается прирост RSS относительно состояния до загрузки (сюда попадает и память
+последней прочитанной страницы, которую аллокатор не вернул системе). Для колонок
+отдельно — объём живых объектов по tracemalloc (отдельный прогон: tracemalloc замедляет
+загрузку, а на списке словарей сам съедает больше памяти, чем строки).
+Отдельно сверяется compute_finance_dashboard по списку и по колонкам.
+"""
+import gc
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+WB_PAGE_ROWS = 100000
+
+OFFICES = ["Коледино", "Электросталь", "Казань", "Подольск", "Тула", "Краснодар"]
+
+
+def make_rows(n, seed=1):
+    """Строки make_report, дополненные остальными полями ответа WB."""
+    from bench_finance_dashboard import make_report
+
+    raw, catalog, paid_storage, promotion_spend = make_report(n, seed)
+    for i, r in enumerate(raw):
+        day = f"2026-{1 + i % 3:02d}-{1 + i % 28:02d}"
+        office = OFFICES[i % len(OFFICES)]
+        r.update({
+            "realizationreport_id": 300000000 + i // 50000,
+            "date_from": "2026-01-01",
+            "date_to": "2026-03-31",
+            "create_dt": "2026-04-07",
+            "currency_name": "руб",
+            "suppliercontract_code": None,
+            "rrd_id": 4000000000 + i,
+            "gi_id": 20000000 + i % 700,
+            "dlv_prc": 1.65,
+            "fix_tariff_date_from": "",
+            "fix_tariff_date_to": "",
+            "retail_price": r["retail_price_withdisc_rub"],
+            "sale_percent": 30,
+            "commission_percent": 24.5,
+            "office_name": office,
+            "order_dt": f"{day}T10:{i % 60:02d}:00",
+            "sale_dt": f"{day}T18:{i % 60:02d}:00",
+            "rr_dt": day,
+            "shk_id": 17000000000 + i,
+            "return_amount": 0,
+            "gi_box_type_name": "Монопаллета" if i % 5 == 0 else "Короб",
+            "product_discount_for_report": 30,
+            "supplier_promo": 0,
+            "ppvz_spp_prc": 25,
+            "ppvz_kvw_prc_base": 24.5,
+            "ppvz_kvw_prc": 21.3,
+            "sup_rating_prc_up": 0,
+            "is_kgvp_v2": 0,
+            "ppvz_sales_commission": round(r["retail_amount"] * 0.2, 2),
+            "ppvz_reward": 0,
+            "payment_processing": "Комиссия за организацию платежа" if r["quantity"] else "",
+            "acquiring_bank": "Тинькофф" if r["quantity"] else "",
+            "ppvz_vw": round(r["retail_amount"] * 0.18, 2),
+            "ppvz_vw_nds": round(r["retail_amount"] * 0.036, 2),
+            "ppvz_office_name": f"ПВЗ {office}",
+            "ppvz_office_id": 100000 + i % 900,
+            "ppvz_supplier_id": 0,
+            "ppvz_supplier_name": "",
+            "ppvz_inn": "",
+            "declaration_number": "",
+            "sticker_id": str(30000000000 + i),
+            "site_country": "Россия",
+            "srv_dbs": False,
+            "rebill_logistic_cost": 0,
+            "rebill_logistic_org": "",
+            "assembly_id": 0,
+            "kiz": "",
+            "srid": f"{i}.{i % 7}e{i % 10}f4c1a2b3c4d5e6f7a8b9.0.0",
+            "report_type": 1,
+            "is_legal_entity": False,
+            "trbx_id": "",
+            "installment_cofinancing_amount": 0,
+            "wibes_wb_discount_percent": 0,
+            "cashback_amount": 0,
+            "cashback_discount": 0,
+            "cashback_commission_change": 0,
+            "order_uid": f"{i}_{i % 13}",
+            "payment_schedule": 0,
+            "delivery_method": "FBW",
+            "seller_promo_id": 0,
+            "seller_promo_discount": 0,
+            "loyalty_id": 0,
+            "loyalty_discount": 0,
+            "uuid_promocode": "",
+            "sale_price_promocode_discount_prc": 0,
+        })
+    return raw, catalog, paid_storage, promotion_spend
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def measure(mode, traced, paths):
+    import tracemalloc
+
+    from utils.finance_columnar import FinanceColumns
+
+    gc.collect()
+    if traced:
+        tracemalloc.start()
+    before = rss_bytes()
+    t = time.perf_counter()
+    rows = FinanceColumns() if mode == "columns" else []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            page = json.load(f)
+        rows.extend(page)
+        del page
+    elapsed = time.perf_counter() - t
+    gc.collect()
+    live, peak = tracemalloc.get_traced_memory() if traced else (0, 0)
+    print(json.dumps({
+        "rss": rss_bytes() - before,
+        "live": live,
+        "peak": peak,
+        "rows": len(rows),
+        "seconds": elapsed,
+    }))
+
+
+def run(mode, paths, traced=False):
+    args = [sys.executable, os.path.abspath(__file__), "--measure", mode, "1" if traced else "0", *paths]
+    out = subprocess.check_output(args)
+    return json.loads(out.decode().strip().splitlines()[-1])
+
+
+def _mb(value):
+    return f"{value / 1024 / 1024:7.1f} MB"
+
+
+def main(n):
+    import shutil
+    import tempfile
+
+    from bench_finance_dashboard import make_report
+    from utils.finance_columnar import FinanceColumns
+    from utils.finance_dashboard import compute_finance_dashboard
+
+    raw = make_rows(n)[0]
+    print(f"Строк: {len(raw)}, ключей в строке: {len(raw[0])}")
+    tmp_dir = tempfile.mkdtemp(prefix="bench-finance-columnar-")
+    try:
+        paths = []
+        for i in range(0, len(raw), WB_PAGE_ROWS):
+            path = os.path.join(tmp_dir, f"page_{i // WB_PAGE_ROWS}.json")
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(raw[i:i + WB_PAGE_ROWS], f, ensure_ascii=False)
+            paths.append(path)
+        del raw
+        plain = run("dicts", paths)
+        columns = run("columns", paths)
+        traced = run("columns", paths, traced=True)
+        print(f"список словарей: RSS {_mb(plain['rss'])} ({plain['seconds']:5.2f} s)")
+        print(
+            f" FinanceColumns: RSS {_mb(columns['rss'])} ({columns['seconds']:5.2f} s) | "
+            f"живые объекты {_mb(traced['live'])}, пик {_mb(traced['peak'])} | "
+            f"RSS меньше в {plain['rss'] / max(columns['rss'], 1):.1f} раза"
+        )
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    # Расчёт по списку и по колонкам (строки после JSON, как из WB)
+    raw, catalog, paid_storage, promotion_spend = make_report(n)
+    raw = json.loads(json.dumps(raw, ensure_ascii=False))
+    cols = FinanceColumns.from_rows(raw)
+    print(f"FinanceColumns.nbytes(): {_mb(cols.nbytes())}")
+    kwargs = dict(products_catalog=catalog, paid_storage=paid_storage, promotion_spend=promotion_spend)
+    t = time.perf_counter()
+    expected = compute_finance_dashboard(raw, "2026-01-01", "2026-03-31", **kwargs)
+    t_list = time.perf_counter() - t
+    t = time.perf_counter()
+    got = compute_finance_dashboard(cols, "2026-01-01", "2026-03-31", **kwargs)
+    t_cols = time.perf_counter() - t
+    print(
+        f"compute_finance_dashboard: список {t_list:6.2f} s | колонки {t_cols:6.2f} s | "
+        f"совпадает: {expected == got}"
+    )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 4 and sys.argv[1] == "--measure":
+        measure(sys.argv[2], sys.argv[3] == "1", sys.argv[4:])
+    else:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 500000)
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""Бенчмарк: compute_finance_dashboard (один проход по raw) против прежнего расчёта.
+
+Запуск из корня проекта:
+    python benchmarks/bench_finance_dashboard.py                  # 200k строк
+    python benchmarks/bench_finance_dashboard.py 500000           # свой размер
+    python benchmarks/bench_finance_dashboard.py report.json      # записанный отчёт
+
+report.json — строки reportDetailByPeriod (список или {"raw": [...], "paid_storage": [...],
+"promotion_spend": [...], "products_catalog": [...]}), например сохранённые из
+fetch_finance_report. Без файла строки синтетические: продажи, возвраты, логистика,
+удержания (в т.ч. «WB Продвижение»), штрафы, компенсации, строки без баркода.
+Эталон — utils/finance_dashboard.py из git до расчёта в один проход (benchmarks/git_baseline.py);
+результаты сверяются целиком.
+Отдельно — тот же период, собранный слиянием 13 недельных агрегатов (build_finance_partial).
+"""
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from git_baseline import legacy_finance_dashboard  # noqa: E402
+from utils import finance_dashboard as fast  # noqa: E402
+
+# (supplier_oper_name, doc_type_name, вес)
+OPERS = [
+    ("Продажа", "Продажа", 40),
+    ("Логистика", "", 30),
+    ("Возврат", "Возврат", 5),
+    ("Коррекция продаж", "Продажа", 1),
+    ("Коррекция продаж", "Возврат", 1),
+    ("Сторно продаж", "Возврат", 1),
+    ("Удержание", "", 4),
+    ("Штраф", "", 1),
+    ("Доплаты", "", 1),
+    ("Хранение", "", 2),
+    ("Платная приёмка", "", 1),
+    ("Компенсация брака", "Продажа", 1),
+    ("Компенсация ущерба", "Продажа", 1),
+    ("Услуга платная доставка", "Продажа", 1),
+    ("Корректировка эквайринга", "Продажа", 1),
+]
+
+
+def make_report(n, seed=1, products=3000):
+    rnd = random.Random(seed)
+    opers = [o for o in OPERS for _ in range(o[2])]
+    catalog = []
+    for j in range(products):
+        nm = 100000000 + j
+        catalog.append({
+            "nm_id": nm,
+            "barcode": str(2040000000000 + j),
+            "supplier_article": f"ART-{j}",
+            "name": f"Товар {j}",
+        })
+    raw = []
+    for _ in range(n):
+        oper, doc, _w = rnd.choice(opers)
+        j = rnd.randrange(products)
+        qty = 1 if oper in ("Продажа", "Возврат", "Коррекция продаж", "Сторно продаж") else 0
+        price = round(rnd.uniform(300, 5000), 2)
+        bonus = ""
+        if oper == "Удержание":
+            bonus = rnd.choice(["Оказание услуг «WB Продвижение»", "Прочие удержания", "Услуга «Джем»"])
+        # ~3% строк без баркода (продажи по nmId/артикулу), ~1% без идентификации
+        r = rnd.random()
+        barcode = "" if r < 0.04 else str(2040000000000 + j)
+        nm_id = None if r < 0.01 else 100000000 + j
+        sa_name = "" if r < 0.01 else f"ART-{j}"
+        raw.append({
+            "supplier_oper_name": oper,
+            "doc_type_name": doc,
+            "bonus_type_name": bonus,
+            "nm_id": nm_id,
+            "sa_name": sa_name,
+            "barcode": barcode,
+            "brand_name": f"Бренд {j % 40}",
+            "subject_name": f"Предмет {j % 90}",
+            "ts_name": rnd.choice(["42", "44", "46", "0"]),
+            "quantity": qty,
+            "delivery_amount": 1 if oper == "Логистика" and rnd.random() < 0.7 else 0,
+            "retail_price_withdisc_rub": price if qty else 0,
+            "retail_amount": round(price * 0.8, 2) if qty else 0,
+            "ppvz_for_pay": round(price * rnd.uniform(0.6, 0.8), 2) if qty or "омпенсац" in oper or "эквайр" in oper or "доставка" in oper else 0,
+            "delivery_rub": round(rnd.uniform(30, 250), 2) if oper == "Логистика" else 0,
+            "storage_fee": round(rnd.uniform(1, 500), 2) if oper == "Хранение" else 0,
+            "acceptance": round(rnd.uniform(10, 300), 2) if oper == "Платная приёмка" else 0,
+            "deduction": round(rnd.uniform(10, 3000), 2) if oper == "Удержание" else 0,
+            "penalty": round(rnd.uniform(100, 1000), 2) if oper == "Штраф" else 0,
+            "additional_payment": round(rnd.uniform(10, 500), 2) if oper == "Доплаты" else 0,
+            "acquiring_percent": 1.5 if qty else 0,
+            "acquiring_fee": round(price * 0.015, 2) if qty else 0,
+        })
+    paid_storage = [
+        {
+            "barcode": str(2040000000000 + j) if j < products else "",
+            "nmId": 100000000 + j,
+            "vendorCode": f"ART-{j}",
+            "warehousePrice": round(rnd.uniform(0.01, 20), 4),
+            "barcodesCount": rnd.randint(1, 50),
+        }
+        for j in rnd.sample(range(products + 200), min(products, 2000))
+        for _ in range(3)
+    ]
+    promotion_spend = [
+        {"nm_id": 100000000 + j, "sum": round(rnd.uniform(100, 20000), 2)}
+        for j in rnd.sample(range(products), min(products, 300))
+    ]
+    return raw, catalog, paid_storage, promotion_spend
+
+
+def load_recorded(path):
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        return data, [], [], []
+    return (
+        data.get("raw") or [],
+        data.get("products_catalog") or [],
+        data.get("paid_storage") or [],
+        data.get("promotion_spend") or [],
+    )
+
+
+def diff_values(a, b, path="", out=None):
+    """Список расхождений (путь, было, стало) между двумя JSON-подобными значениями."""
+    out = [] if out is None else out
+    if isinstance(a, dict) and isinstance(b, dict):
+        for k in sorted(set(a) | set(b), key=str):
+            diff_values(a.get(k), b.get(k), f"{path}.{k}", out)
+    elif isinstance(a, list) and isinstance(b, list) and len(a) == len(b):
+        for i, (x, y) in enumerate(zip(a, b)):
+            diff_values(x, y, f"{path}[{i}]", out)
+    elif a != b:
+        out.append((path, a, b))
+    return out
+
+
+def run(module, raw, catalog, paid_storage, promotion_spend):
+    t = time.perf_counter()
+    result = module.compute_finance_dashboard(
+        raw,
+        "2026-01-01",
+        "2026-03-31",
+        products_catalog=catalog,
+        paid_storage=paid_storage,
+        promotion_spend=promotion_spend,
+    )
+    return time.perf_counter() - t, result
+
+
+def main(source):
+    if isinstance(source, str):
+        raw, catalog, paid_storage, promotion_spend = load_recorded(source)
+    else:
+        raw, catalog, paid_storage, promotion_spend = make_report(source)
+    t_old, expected = run(legacy_finance_dashboard(), raw, catalog, paid_storage, promotion_spend)
+    t_new, got = run(fast, raw, catalog, paid_storage, promotion_spend)
+    diffs = diff_values(expected, got)
+    print(
+        f"compute_finance_dashboard: {len(raw)} строк, {len(got['products'])} товаров | "
+        f"было {t_old:6.2f} s | стало {t_new:6.2f} s ({t_old / t_new:4.1f}x) | "
+        f"совпадает: {not diffs}"
+    )
+    for path, a, b in diffs[:20]:
+        print(f"  {path}: было {a!r}, стало {b!r}")
+
+    # Квартал из 13 недельных агрегатов (как utils.finance_partials): слияние + разнесение
+    step = max(1, -(-len(raw) // 13))
+    weeks = [fast.build_finance_partial(raw[i:i + step]) for i in range(0, len(raw), step)]
+    t = time.perf_counter()
+    merged = fast.finance_dashboard_from_partial(
+        fast.merge_finance_partials(weeks),
+        "2026-01-01",
+        "2026-03-31",
+        products_catalog=catalog,
+        paid_storage=paid_storage,
+        promotion_spend=promotion_spend,
+    )
+    t_merge = time.perf_counter() - t
+    print(
+        f"{'из недельных агрегатов':>25}: {len(weeks)} недель | {t_merge:6.2f} s "
+        f"({t_new / t_merge:4.1f}x к расчёту по строкам) | совпадает: {merged == got}"
+    )
+
+
+if __name__ == "__main__":
+    arg = sys.argv[1] if len(sys.argv) > 1 else "200000"
+    main(int(arg) if arg.isdigit() else arg)
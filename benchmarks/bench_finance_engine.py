@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""Бенчмарк: /report/finance и расшифровка из одного прохода (utils.finance_engine).
+
+Запуск из корня проекта:
+    python benchmarks/bench_finance_engine.py              # 200k строк
+    python benchmarks/bench_finance_engine.py 500000       # свой размер
+
+Было: пользователь открывает обе страницы — _process_finance_data (эталон из git,
+benchmarks/git_baseline.py, два прохода) и compute_finance_dashboard по тем же строкам.
+Стало: один build_finance_partial, из агрегата — finance_dashboard_from_partial и
+finance_report_from_partial; вторая страница берёт сохранённый агрегат (отдельно — время
+ответа по готовому агрегату). Строки — синтетика bench_finance_dashboard плюс компенсации
+брака / подмены по продаже и возврату. Расшифровка сверяется целиком, итоги /report/finance —
+с точностью до копейки (другой порядок суммирования), вместо строк — их количество.
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from git_baseline import legacy_process_finance_data  # noqa: E402
+from bench_finance_dashboard import diff_values, make_report  # noqa: E402
+from utils import finance_dashboard as fast  # noqa: E402
+from utils.finance_engine import finance_report_from_partial  # noqa: E402
+
+DATE_FROM = "2026-01-01"
+DATE_TO = "2026-03-31"
+TAX_RATE = 6.0
+
+COMPENSATION_OPERS = [
+    "Добровольная компенсация при возврате",
+    "Частичная компенсация брака",
+    "Компенсация подмененного товара",
+    "Компенсация потерянного товара",
+    "Добровольная компенсация брака",
+    "Компенсация брака до возврата товара",
+    "Добровольная компенсация подмены товара",
+    "Компенсация утилизации товара",
+]
+
+
+def make_rows(n, seed=1):
+    raw, catalog, paid_storage, promotion_spend = make_report(n, seed=seed)
+    rnd = random.Random(seed)
+    for r in rnd.sample(raw, max(1, n // 50)):
+        r["supplier_oper_name"] = rnd.choice(COMPENSATION_OPERS)
+        r["doc_type_name"] = rnd.choice(["Продажа", "Возврат"])
+        r["ppvz_for_pay"] = round(rnd.uniform(50, 3000), 2)
+    return raw, catalog, paid_storage, promotion_spend
+
+
+def counts(raw):
+    buyouts = sum(1 for r in raw if str(r.get("supplier_oper_name") or "").strip().lower() in fast.BUYOUT_OPERS)
+    returns = sum(1 for r in raw if str(r.get("supplier_oper_name") or "").strip().lower() in fast.RETURN_OPERS)
+    return {"rows_count": len(raw), "buyouts_rows": buyouts, "returns_rows": returns}
+
+
+def main(n):
+    raw, catalog, paid_storage, promotion_spend = make_rows(n)
+    process_finance_data = legacy_process_finance_data()
+    extras = dict(products_catalog=catalog, paid_storage=paid_storage, promotion_spend=promotion_spend)
+
+    t = time.perf_counter()
+    report_old = process_finance_data(raw, DATE_FROM, DATE_TO, TAX_RATE)
+    dashboard_old = fast.compute_finance_dashboard(raw, DATE_FROM, DATE_TO, **extras)
+    t_old = time.perf_counter() - t
+
+    t = time.perf_counter()
+    partial = fast.build_finance_partial(raw)
+    dashboard_new = fast.finance_dashboard_from_partial(partial, DATE_FROM, DATE_TO, **extras)
+    report_new = finance_report_from_partial(partial, DATE_FROM, DATE_TO, tax_rate=TAX_RATE)
+    t_new = time.perf_counter() - t
+
+    t = time.perf_counter()
+    finance_report_from_partial(partial, DATE_FROM, DATE_TO, tax_rate=TAX_RATE)
+    t_hit = time.perf_counter() - t
+
+    expected = dict(report_old, **counts(raw))
+    expected.pop("rows")
+    report_diffs = [
+        (path, a, b)
+        for path, a, b in diff_values(expected, report_new)
+        if not (isinstance(a, float) and isinstance(b, float) and abs(a - b) <= 0.011)
+    ]
+    dashboard_diffs = diff_values(dashboard_old, dashboard_new)
+    print(
+        f"{len(raw)} строк | обе страницы: было {t_old:6.2f} s | стало {t_new:6.2f} s "
+        f"({t_old / t_new:4.1f}x) | /report/finance по готовому агрегату {t_hit * 1000:.2f} ms"
+    )
+    print(f"  /report/finance совпадает: {not report_diffs} | расшифровка совпадает: {not dashboard_diffs}")
+    for path, a, b in (report_diffs + dashboard_diffs)[:20]:
+        print(f"  {path}: было {a!r}, стало {b!r}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Бенчмарк: загрузка недель фин. отчёта с расчётом в пуле процессов (utils.finance_parallel).
+
+Запуск из корня проекта:
+    python benchmarks/bench_finance_weeks_parallel.py                 # 13 недель по 60k строк
+    python benchmarks/bench_finance_weeks_parallel.py 26 100000       # недель, строк в неделе
+    python benchmarks/bench_finance_weeks_parallel.py 13 60000 2,4,8  # число процессов
+
+collect_finance_partial за закрытый квартал без сохранённых недель: fetch_rows отдаёт
+синтетические строки bench_finance_dashboard после задержки FETCH_LATENCY_S (ответ WB
+и пауза между неделями). 1 процесс — все недели считаются в потоке запроса; N — крупные
+недели уходят в пул, пока качается следующая. Агрегаты сверяются целиком.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+FETCH_LATENCY_S = float(os.getenv("BENCH_FETCH_LATENCY_S", "2.0"))
+
+
+def _run(weeks_rows, first_monday, workers):
+    from utils import cache_layout, finance_parallel, finance_partials
+
+    cache_layout.USERS_CACHE_DIR = tempfile.mkdtemp(prefix="bench_finance_weeks_")
+    cache_layout._migrated.clear()
+    finance_partials.FINANCE_WEEK_FETCH_PAUSE_S = 0
+    finance_parallel.FINANCE_PARALLEL_WORKERS = workers
+    by_week = {(first_monday + timedelta(days=7 * i)).isoformat(): rows for i, rows in enumerate(weeks_rows)}
+
+    def fetch_rows(seg_from, _seg_to):
+        time.sleep(FETCH_LATENCY_S)
+        return by_week[seg_from]
+
+    date_to = first_monday + timedelta(days=7 * len(weeks_rows) - 1)
+    t = time.perf_counter()
+    partial = finance_partials.collect_finance_partial(1, first_monday.isoformat(), date_to.isoformat(), fetch_rows)
+    elapsed = time.perf_counter() - t
+    shutil.rmtree(cache_layout.USERS_CACHE_DIR, ignore_errors=True)
+    return elapsed, partial
+
+
+def main():
+    from bench_finance_dashboard import make_report
+    from utils.finance_columnar import FinanceColumns
+
+    weeks = int(sys.argv[1]) if len(sys.argv) > 1 else 13
+    rows_per_week = int(sys.argv[2]) if len(sys.argv) > 2 else 60000
+    worker_counts = [int(w) for w in sys.argv[3].split(",")] if len(sys.argv) > 3 else [2, 4, 8]
+
+    # Закрытые недели: последняя — за месяц до сегодня
+    today = date.today()
+    last_monday = today - timedelta(days=today.weekday() + 35)
+    first_monday = last_monday - timedelta(days=7 * (weeks - 1))
+    weeks_rows = [FinanceColumns(make_report(rows_per_week, seed=i + 1)[0]) for i in range(weeks)]
+    print(
+        f"{weeks} недель x {rows_per_week} строк, задержка загрузки недели {FETCH_LATENCY_S} с, "
+        f"ядер: {os.cpu_count()}"
+    )
+
+    base_s, base = _run(weeks_rows, first_monday, 1)
+    print(f"1 процесс: {base_s:.2f} с (из них загрузка {weeks * FETCH_LATENCY_S:.1f} с)")
+    for workers in worker_counts:
+        elapsed, partial = _run(weeks_rows, first_monday, workers)
+        same = partial == base
+        print(f"{workers} процесса(ов): {elapsed:.2f} с, x{base_s / elapsed:.2f}, агрегаты совпадают: {same}")
+        if not same:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""Бенчмарк: агрегаты заказов dict-путём и колоночным (NumPy) бэкендом.
+
+Запуск из корня проекта:
+    python benchmarks/bench_orders_columnar.py            # 100k и 1M строк
+    python benchmarks/bench_orders_columnar.py 250000     # свои размеры
+
+Строки синтетические, в формате to_rows. Для колонок отдельно показано время
+раскладки (один раз на снимок) и время самих группировок (на каждый запрос).
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils.orders_processing as op  # noqa: E402
+from utils.orders_columnar import OrdersColumns, columnar_available  # noqa: E402
+
+# Без файлов кэша: фото и остатки не участвуют в замере
+op.load_products_cache = lambda: {}
+op.load_stocks_cache = lambda: None
+
+WAREHOUSES = ["Коледино", "Электросталь", "Казань", "Подольск", "Тула", "Краснодар", "Новосибирск", ""]
+
+
+def make_rows(n, seed=1):
+    rnd = random.Random(seed)
+    rows = []
+    for i in range(n):
+        nm = rnd.randint(100000, 100000 + 2000)
+        rows.append({
+            "Дата": f"2026-{rnd.randint(4, 9):02d}-{rnd.randint(1, 28):02d}",
+            "Склад отгрузки": rnd.choice(WAREHOUSES),
+            "Артикул продавца": f"ART-{nm % 1500}",
+            "Артикул WB": nm,
+            "Баркод": str(2000000000000 + nm),
+            "Цена со скидкой продавца": round(rnd.uniform(100, 5000), 2),
+            "is_cancelled": rnd.random() < 0.12,
+        })
+    return rows
+
+
+def timed(fn, repeat=3):
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        result = fn()
+        dt = time.perf_counter() - t
+        best = dt if best is None else min(best, dt)
+    return best, result
+
+
+def dict_path(rows):
+    daily = op.aggregate_daily_counts_and_revenue(rows)
+    wh = op.aggregate_by_warehouse_orders_only(rows)
+    top = op.aggregate_top_products(rows, limit=15)
+    top_wh = op.aggregate_top_products_orders(rows, "Казань", limit=50)
+    return daily, wh, top, top_wh
+
+
+def columnar_path(cols):
+    daily = cols.daily_series()
+    wh = cols.warehouse_summary()
+    top = cols.top_products(limit=15)
+    top_wh = cols.top_products_orders("Казань", limit=50)
+    cols.product_warehouse_matrix()
+    return daily, wh, top, top_wh
+
+
+def main(sizes):
+    if not columnar_available():
+        print("numpy не установлен — колоночный бэкенд недоступен")
+        return
+    for n in sizes:
+        rows = make_rows(n)
+        repeat = 3 if n <= 200000 else 1
+        t_dict, expected = timed(lambda: dict_path(rows), repeat)
+        t_encode, cols = timed(lambda: OrdersColumns.from_rows(rows), 1)
+        t_cols, got = timed(lambda: columnar_path(cols), repeat)
+        same = (
+            dict(expected[0][0]) == dict(got[0][0])
+            and dict(expected[0][1]) == dict(got[0][1])
+            and expected[1] == got[1]
+            and expected[2] == got[2]
+            and expected[3] == got[3]
+        )
+        print(
+            f"{n:>9} строк: dict {t_dict * 1000:8.1f} ms | колонки: раскладка {t_encode * 1000:8.1f} ms, "
+            f"агрегаты {t_cols * 1000:7.1f} ms ({t_dict / t_cols:5.1f}x) | "
+            f"память колонок {cols.nbytes() / 1024 / 1024:.1f} MB | совпадает: {same}"
+        )
+
+
+if __name__ == "__main__":
+    main([int(x) for x in sys.argv[1:]] or [100000, 1000000])
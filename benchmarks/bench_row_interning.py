@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""Бенчмарк: память строк заказов с общим пулом значений (utils.interning) и без него.
+
+Запуск из корня проекта:
+    python benchmarks/bench_row_interning.py            # 500k строк
+    python benchmarks/bench_row_interning.py 200000     # свой размер
+
+Каждый замер — в отдельном процессе (RSS не возвращается системе после free):
+- to_rows: ответ WB страницами по WB_PAGE_ROWS строк (как fetch_orders_range):
+  json.loads страницы -> to_rows, страница удаляется до загрузки следующей;
+- cache: строки кэша заказов по дням (как orders_period), день за днём:
+  json.loads дня -> нормализованные копии строк.
+Показывается прирост RSS процесса относительно состояния до загрузки.
+"""
+import gc
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+WAREHOUSES = ["Коледино", "Электросталь", "Казань", "Подольск", "Тула", "Краснодар", "Новосибирск", "Екатеринбург - Перспективный 12"]
+REGIONS = [
+    ("Россия", "Центральный федеральный округ", "Московская область"),
+    ("Россия", "Приволжский федеральный округ", "Республика Татарстан"),
+    ("Россия", "Южный федеральный округ", "Краснодарский край"),
+    ("Россия", "Сибирский федеральный округ", "Новосибирская область"),
+    ("Беларусь", "Минская область", "Минск"),
+]
+SUBJECTS = [("Одежда", "Платья", "Бренд один"), ("Обувь", "Кроссовки", "Бренд два"), ("Дом", "Пледы", "Бренд три")]
+
+
+def make_raw(n, seed=1):
+    rnd = random.Random(seed)
+    raw = []
+    for i in range(n):
+        nm = rnd.randint(100000000, 100000000 + 1500)
+        country, okrug, region = rnd.choice(REGIONS)
+        category, subject, brand = rnd.choice(SUBJECTS)
+        day = f"2026-{rnd.randint(4, 9):02d}-{rnd.randint(1, 28):02d}"
+        raw.append({
+            "date": f"{day}T{rnd.randint(0, 23):02d}:{rnd.randint(0, 59):02d}:{rnd.randint(0, 59):02d}",
+            "lastChangeDate": f"{day}T23:59:59",
+            "warehouseName": rnd.choice(WAREHOUSES),
+            "warehouseType": "Склад WB",
+            "countryName": country,
+            "oblastOkrugName": okrug,
+            "regionName": region,
+            "supplierArticle": f"ART-{nm % 1200}",
+            "nmId": nm,
+            "barcode": str(2040000000000 + nm),
+            "category": category,
+            "subject": subject,
+            "brand": brand,
+            "techSize": rnd.choice(["42", "44", "46", "48", "0"]),
+            "incomeID": rnd.randint(20000000, 20000300),
+            "isSupply": False,
+            "isRealization": True,
+            "totalPrice": rnd.randint(1000, 9000),
+            "discountPercent": rnd.randint(10, 60),
+            "spp": rnd.randint(0, 30),
+            "finishedPrice": round(rnd.uniform(300, 5000), 2),
+            "priceWithDisc": round(rnd.uniform(300, 5000), 2),
+            "isCancel": rnd.random() < 0.1,
+            "cancelDate": "0001-01-01T00:00:00",
+            "sticker": str(rnd.randint(10 ** 10, 10 ** 11)),
+            "gNumber": str(rnd.randint(10 ** 18, 10 ** 19)),
+            "srid": f"{i}.0.{rnd.randint(0, 9)}",
+        })
+    return raw
+
+
+WB_PAGE_ROWS = 80000
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def measure(mode, scenario, paths):
+    import utils.interning as interning
+    import utils.orders_processing as op
+
+    if mode == "plain":
+        op.intern_rows = lambda rows, *args, **kwargs: rows
+    gc.collect()
+    before = rss_bytes()
+    t = time.perf_counter()
+    rows = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            chunk = json.load(f)
+        if scenario == "to_rows":
+            rows.extend(op.to_rows(chunk, "2026-01-01", "2026-12-31"))
+        else:
+            # Как _normalize_order_row_cached в utils.cache.get_orders_with_period_cache
+            day_rows = [dict(r) for r in chunk]
+            if mode == "interned":
+                interning.intern_rows(day_rows)
+            rows.extend(day_rows)
+        del chunk
+    elapsed = time.perf_counter() - t
+    gc.collect()
+    print(json.dumps({"rss": rss_bytes() - before, "rows": len(rows), "seconds": elapsed}))
+
+
+def run(mode, scenario, paths):
+    out = subprocess.check_output([sys.executable, os.path.abspath(__file__), "--measure", mode, scenario, *paths])
+    return json.loads(out.decode().strip().splitlines()[-1])
+
+
+def _dump_chunks(tmp_dir, prefix, chunks):
+    paths = []
+    for i, chunk in enumerate(chunks):
+        path = os.path.join(tmp_dir, f"{prefix}_{i}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(chunk, f, ensure_ascii=False)
+        paths.append(path)
+    return paths
+
+
+def main(n):
+    import shutil
+    import tempfile
+    from collections import defaultdict
+
+    import utils.orders_processing as op
+
+    raw = make_raw(n)
+    rows = op.to_rows(raw, "2026-01-01", "2026-12-31")
+    by_day = defaultdict(list)
+    for r in rows:
+        by_day[r["Дата"]].append(r)
+    tmp_dir = tempfile.mkdtemp(prefix="bench-interning-")
+    try:
+        pages = _dump_chunks(tmp_dir, "page", [raw[i:i + WB_PAGE_ROWS] for i in range(0, len(raw), WB_PAGE_ROWS)])
+        days = _dump_chunks(tmp_dir, "day", [by_day[d] for d in sorted(by_day)])
+        del raw, rows, by_day
+        for scenario, paths in (("to_rows", pages), ("cache", days)):
+            plain = run("plain", scenario, paths)
+            interned = run("interned", scenario, paths)
+            saved = 1 - interned["rss"] / plain["rss"] if plain["rss"] else 0.0
+            print(
+                f"{scenario:>8}, {plain['rows']} строк: RSS без пула {plain['rss'] / 1024 / 1024:7.1f} MB "
+                f"({plain['seconds']:.2f} s) | с пулом {interned['rss'] / 1024 / 1024:7.1f} MB "
+                f"({interned['seconds']:.2f} s) | экономия {saved * 100:4.1f}%"
+            )
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 5 and sys.argv[1] == "--measure":
+        measure(sys.argv[2], sys.argv[3], sys.argv[4:])
+    else:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 500000)
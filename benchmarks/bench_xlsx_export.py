@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""Бенчмарк: выгрузка в Excel — openpyxl Workbook в памяти против потоковой utils.xlsx_stream.
+
+Запуск из корня проекта:
+    python benchmarks/bench_xlsx_export.py              # 1M строк «Расшифровки по товарам»
+    python benchmarks/bench_xlsx_export.py 300000       # свой размер
+
+Строки — как в api_finance_breakdown_products_export (11 колонок: баркод, товар, числа,
+пустые ячейки). Было: ws.append всех строк в Workbook, затем wb.save(BytesIO) и отдача
+целиком. Стало: iter_xlsx отдаёт куски по мере записи. Каждый вариант — в отдельном
+процессе: время, рост пика RSS относительно процесса до выгрузки, размер файла,
+время до первого куска.
+Содержимое книг сверяется через openpyxl на первых 20000 строках. Ещё один прогон —
+широкие строки фин. отчёта (77 колонок, как /report/finance/export) только потоково:
+прежний xlwt (.xls) больше 65536 строк не пишет вовсе.
+"""
+import io
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.xlsx_stream import iter_xlsx  # noqa: E402
+
+HEADER = [
+    "Баркод",
+    "Товар",
+    "Кол-во",
+    "Цена",
+    "Сумма",
+    "Логистика",
+    "Хранение",
+    "Платная приёмка",
+    "Продвижение",
+    "Цена с услугами",
+    "Сумма с услугами",
+]
+WIDE_COLUMNS = 77
+CHECK_ROWS = 20000
+
+
+def product_rows(n, seed=1):
+    rnd = random.Random(seed)
+    for j in range(n):
+        qty = rnd.randint(0, 40)
+        amount = round(rnd.uniform(-500, 90000), 2)
+        svc = round(amount * 0.8, 2) if rnd.random() > 0.1 else None
+        yield [
+            str(2040000000000 + j),
+            f"Товар {j} «Бренд {j % 40}» & Ко",
+            qty,
+            round(amount / qty, 2) if qty else "",
+            amount,
+            round(rnd.uniform(0, 3000), 2),
+            round(rnd.uniform(0, 800), 2),
+            0.0,
+            round(rnd.uniform(0, 5000), 2),
+            round(svc / qty, 2) if svc is not None and qty else "",
+            svc if svc is not None else "",
+        ]
+
+
+def wide_rows(n, seed=1):
+    rnd = random.Random(seed)
+    for j in range(n):
+        row = []
+        for c in range(WIDE_COLUMNS):
+            kind = c % 4
+            if kind == 0:
+                row.append(round(rnd.uniform(0, 10000), 2))
+            elif kind == 1:
+                row.append(rnd.choice(["Продажа", "Логистика", "Возврат", ""]))
+            elif kind == 2:
+                row.append(j)
+            else:
+                row.append(None)
+        yield row
+
+
+def write_openpyxl(rows):
+    from openpyxl import Workbook
+
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "По товарам"
+    ws.append(HEADER)
+    for row in rows:
+        ws.append(row)
+    bio = io.BytesIO()
+    wb.save(bio)
+    return [bio.getvalue()]
+
+
+def write_stream(rows, header=HEADER, sheet_title="По товарам"):
+    return iter_xlsx(rows, header=header, sheet_title=sheet_title)
+
+
+def _maxrss_mb():
+    # Linux: ru_maxrss в КБ
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def child(variant, n):
+    """Один прогон в отдельном процессе: чанки отдаются «в сеть» (отбрасываются)."""
+    base = _maxrss_mb()
+    t = time.perf_counter()
+    if variant == "openpyxl":
+        chunks = write_openpyxl(product_rows(n))
+    elif variant == "stream":
+        chunks = write_stream(product_rows(n))
+    else:
+        chunks = write_stream(wide_rows(n), header=[f"col{c}" for c in range(WIDE_COLUMNS)], sheet_title="finance")
+    size = 0
+    first = None
+    count = 0
+    for chunk in chunks:
+        if first is None:
+            first = time.perf_counter() - t
+        size += len(chunk)
+        count += 1
+    print(json.dumps({
+        "time": time.perf_counter() - t,
+        "first": first,
+        "chunks": count,
+        "size": size,
+        "rss": _maxrss_mb() - base,
+    }))
+
+
+def run_child(variant, n):
+    out = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", variant, str(n)],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def check():
+    from openpyxl import load_workbook
+
+    old = load_workbook(io.BytesIO(b"".join(write_openpyxl(product_rows(CHECK_ROWS)))), read_only=True)
+    new = load_workbook(io.BytesIO(b"".join(write_stream(product_rows(CHECK_ROWS)))), read_only=True)
+    # Пустая строка openpyxl и пустая ячейка потоковой записи читаются одинаково — None
+    return (
+        old.sheetnames == new.sheetnames
+        and list(old.active.iter_rows(values_only=True)) == list(new.active.iter_rows(values_only=True))
+    )
+
+
+def main(n):
+    print(f"Содержимое совпадает ({CHECK_ROWS} строк): {check()}")
+    for title, variant in (("openpyxl в памяти", "openpyxl"), ("потоково", "stream")):
+        r = run_child(variant, n)
+        print(
+            f"{title:>18}: {n} строк | {r['time']:6.1f} s | пик RSS +{r['rss']:7.1f} MB | "
+            f"файл {r['size'] / 1e6:6.1f} MB | первый кусок через {r['first']:6.2f} s ({r['chunks']} кусков)"
+        )
+    wide_n = max(1, n // 5)
+    r = run_child("wide", wide_n)
+    print(
+        f"{'фин. отчёт, 77 кол.':>18}: {wide_n} строк | {r['time']:6.1f} s | пик RSS +{r['rss']:7.1f} MB | "
+        f"файл {r['size'] / 1e6:6.1f} MB | первый кусок через {r['first']:6.2f} s ({r['chunks']} кусков)"
+    )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        child(sys.argv[2], int(sys.argv[3]))
+    else:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""Эталоны для бенчмарков: код до оптимизации, загружаемый из git при запуске."""
+import ast
+import os
+import subprocess
+import types
+from typing import Any, Callable, Dict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Ревизии до сводки фин. отчёта в один проход и до единого расчёта /report/finance
+FINANCE_DASHBOARD_REV = "daa57c7^"
+FINANCE_REPORT_REV = "c665629^"
+
+
+def git_source(rev: str, path: str) -> str:
+    """Текст файла path в ревизии rev (нужен git и история репозитория)."""
+    try:
+        return subprocess.run(
+            ["git", "show", f"{rev}:{path}"], cwd=ROOT, check=True, capture_output=True, text=True
+        ).stdout
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise RuntimeError(f"Не удалось взять {path} из ревизии {rev}: {e}") from e
+
+
+def load_module(rev: str, path: str, name: str) -> types.ModuleType:
+    """Модуль path из ревизии rev — отдельно от текущего utils, под именем name."""
+    filename = f"{rev}:{path}"
+    module = types.ModuleType(name)
+    module.__file__ = filename
+    exec(compile(git_source(rev, path), filename, "exec"), module.__dict__)
+    return module
+
+
+def load_function(rev: str, path: str, func_name: str, namespace: Dict[str, Any]) -> Callable:
+    """Функция верхнего уровня func_name из path в ревизии rev.
+
+    Остальной модуль не выполняется (app.py целиком тянет Flask, БД и фоновые потоки),
+    поэтому глобальные имена функции передаются в namespace.
+    """
+    filename = f"{rev}:{path}"
+    for node in ast.parse(git_source(rev, path)).body:
+        if isinstance(node, ast.FunctionDef) and node.name == func_name:
+            scope = dict(namespace)
+            exec(compile(ast.Module(body=[node], type_ignores=[]), filename, "exec"), scope)
+            return scope[func_name]
+    raise RuntimeError(f"В {filename} нет функции {func_name}")
+
+
+def legacy_finance_dashboard() -> types.ModuleType:
+    """utils/finance_dashboard.py до расчёта в один проход (три прохода по raw)."""
+    return load_module(FINANCE_DASHBOARD_REV, "utils/finance_dashboard.py", "legacy_finance_dashboard")
+
+
+def legacy_process_finance_data() -> Callable:
+    """_process_finance_data из app.py до utils.finance_engine: (raw, req_from, req_to, tax_rate)."""
+    from datetime import datetime
+    from typing import List
+
+    from utils.finance_columnar import FinanceColumns
+
+    class _User:
+        tax_rate = None
+
+    class _UserQuery:
+        @staticmethod
+        def get(_user_id):
+            return _User
+
+    _User.query = _UserQuery
+    func = load_function(
+        FINANCE_REPORT_REV,
+        "app.py",
+        "_process_finance_data",
+        {"Any": Any, "Dict": Dict, "List": List, "FinanceColumns": FinanceColumns, "User": _User, "datetime": datetime},
+    )
+
+    def process_finance_data(raw, req_from, req_to, tax_rate=None):
+        # Ставку налога прежний код читал из User по user_id
+        _User.tax_rate = tax_rate
+        return func(raw, req_from, req_to, 1 if tax_rate is not None else None)
+
+    return process_finance_data
@@ -1,12 +1,11 @@
 # -*- coding: utf-8 -*-
 """Blueprint для админки"""
-import os
 from functools import wraps
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_required, current_user
 from models import User, db, delete_user_with_related
 from datetime import datetime
-from utils.cache import _cache_path_for_user_id
+from utils.cache_layout import remove_user_cache
 from utils.wb_token import wb_api_key_expiry_summary
 
 admin_bp = Blueprint('admin', __name__)
@@ -141,12 +140,7 @@ def admin_users_delete(user_id: int):
         return redirect(url_for("admin.admin_users"))
     try:
         if delete_user_with_related(user_id):
-            try:
-                cache_path = _cache_path_for_user_id(user_id)
-                if os.path.isfile(cache_path):
-                    os.remove(cache_path)
-            except Exception:
-                pass
+            remove_user_cache(user_id)
             flash("Пользователь удалён")
         else:
             flash("Пользователь не найден")
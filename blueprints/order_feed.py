@@ -1,14 +1,21 @@
 # -*- coding: utf-8 -*-
 """Лента заказов — список заказов с детальной модалкой."""
-import time
+import base64
+import json
+import threading
+from collections import OrderedDict
 from datetime import datetime
 from typing import Optional, Tuple
 
-from flask import Blueprint, jsonify, render_template, request
+from flask import Blueprint, Response, jsonify, render_template, request
 from flask_login import current_user, login_required
 
 from utils.cache import get_orders_with_period_cache
+from utils.constants import ORDER_FEED_CACHE_MAX_BYTES, ORDER_FEED_CACHE_TTL_SECONDS
 from utils.helpers import parse_date
+from utils.feed_search import FeedSearchIndex, feed_search_text
+from utils.finance_srid_index import finance_srid_index_exists
+from utils.memory_cache import MemoryBoundedCache, estimate_size
 from utils.order_feed import (
     STATUS_LABELS,
     ORDERS_LOOKUP_BEFORE_SALE_DAYS,
@@ -17,9 +24,11 @@ from utils.order_feed import (
     collect_orders_from_period_cache,
     collect_sales_from_period_cache,
     default_date_range,
+    enrich_feed_finance,
     extend_iso_date,
+    feed_data_version,
+    feed_sort_key,
     iso_date_in_range,
-    load_finance_srid_index,
     update_finance_srid_index_from_api,
     update_sales_period_cache_from_api,
 )
@@ -27,9 +36,18 @@ from utils.wb_token import effective_wb_api_token
 
 order_feed_bp = Blueprint("order_feed", __name__)
 
-# Короткий кэш готовой ленты для пакетной подгрузки offset/limit
-_FEED_LIST_CACHE: dict[str, dict] = {}
-_FEED_LIST_TTL_SEC = 120
+# Двухуровневый кэш ленты:
+# 1) базовая лента — все заказы окна, уже обогащённые build_feed_items (суммы фин. отчёта
+#    добавляются позже, только для отдаваемых элементов — enrich_feed_finance), по ключу
+#    (user, окно заказов, окно продаж, версия данных); ограничена по памяти (LRU);
+# 2) представления — отфильтрованные списки ссылок на элементы базовой ленты по
+#    (период выкупов, статус, схема, q); на одну базовую ленту не больше _FEED_VIEWS_PER_BASE.
+# Смена фильтра или поиска не пересобирает ленту; пересборка — только при смене версии данных.
+_FEED_BASE_CACHE = MemoryBoundedCache(
+    ORDER_FEED_CACHE_MAX_BYTES, ORDER_FEED_CACHE_TTL_SECONDS, max_entries=64
+)
+_FEED_VIEWS_PER_BASE = 16
+_FEED_VIEWS_LOCK = threading.Lock()
 
 
 def _parse_optional_range(from_key: str, to_key: str) -> Optional[Tuple[str, str]]:
@@ -47,29 +65,6 @@ def _parse_optional_range(from_key: str, to_key: str) -> Optional[Tuple[str, str
     return date_from, date_to
 
 
-def _feed_cache_key(
-    user_id: int,
-    date_from: str,
-    date_to: str,
-    sale_from: str,
-    sale_to: str,
-    status: str,
-    scheme: str,
-    q: str,
-) -> str:
-    return f"{user_id}|{date_from}|{date_to}|{sale_from}|{sale_to}|{status}|{scheme}|{q}"
-
-
-def _get_cached_feed(key: str):
-    entry = _FEED_LIST_CACHE.get(key)
-    if not entry:
-        return None
-    if (time.time() - entry.get("ts", 0)) > _FEED_LIST_TTL_SEC:
-        _FEED_LIST_CACHE.pop(key, None)
-        return None
-    return entry
-
-
 def _resolve_windows(
     order_range: Optional[Tuple[str, str]],
     sale_range: Optional[Tuple[str, str]],
@@ -124,22 +119,50 @@ def _apply_feed_filters(
     if scheme_filter in ("FBW", "FBS"):
         items = [it for it in items if it.get("scheme") == scheme_filter]
     if q:
-        def _match(it: dict) -> bool:
-            hay = " ".join(
-                str(x or "")
-                for x in (
-                    it.get("gnumber"),
-                    it.get("srid"),
-                    it.get("article"),
-                    it.get("name"),
-                    it.get("barcode"),
-                    it.get("nm_id"),
-                    it.get("sticker"),
-                )
-            ).lower()
-            return q in hay
-
-        items = [it for it in items if _match(it)]
+        items = [it for it in items if q in feed_search_text(it)]
+    return items
+
+
+def _build_feed_search_index(items: list) -> Optional[FeedSearchIndex]:
+    """Поисковый индекс базовой ленты — строится вместе с ней, так что и первый поиск идёт по индексу.
+
+    При ошибке — None: по этой ленте ищем перебором, а индекс заново строится
+    со следующей версией данных (новой базовой лентой).
+    """
+    try:
+        return FeedSearchIndex(items)
+    except Exception as e:
+        print(f"Ошибка построения поискового индекса ленты: {e}")
+        return None
+
+
+def _feed_view(
+    base: dict,
+    sale_range: Optional[Tuple[str, str]],
+    status_filter: str,
+    scheme_filter: str,
+    q: str,
+) -> list:
+    """Отфильтрованное представление базовой ленты (кэшируется внутри базовой записи)."""
+    view_key = (sale_range, status_filter, scheme_filter, q)
+    with _FEED_VIEWS_LOCK:
+        views: OrderedDict = base["views"]
+        hit = views.get(view_key)
+        if hit is not None:
+            views.move_to_end(view_key)
+            return hit
+    source = base["items"]
+    index = base.get("search_index") if q else None
+    if index is not None:
+        # Сначала поиск по индексу (кандидаты в исходном порядке), затем остальные фильтры
+        source = [source[i] for i in index.search(q)]
+        q = ""
+    items = _apply_feed_filters(source, sale_range, status_filter, scheme_filter, q)
+    with _FEED_VIEWS_LOCK:
+        views = base["views"]
+        views[view_key] = items
+        while len(views) > _FEED_VIEWS_PER_BASE:
+            views.popitem(last=False)
     return items
 
 
@@ -171,17 +194,12 @@ def _load_feed_list(
 
     user_id = current_user.id
     token = effective_wb_api_token(current_user)
-    cache_key = _feed_cache_key(
-        user_id, date_from, date_to, sale_from, sale_to, status_filter, scheme_filter, q
-    )
-
-    if refresh:
-        _FEED_LIST_CACHE.pop(cache_key, None)
+    base_key = (user_id, orders_from, orders_to, sales_from, sales_to)
 
-    cached = None if refresh else _get_cached_feed(cache_key)
+    cached = None if refresh else _FEED_BASE_CACHE.get(base_key + (feed_data_version(user_id),))
     if cached:
         return (
-            cached["items"],
+            _feed_view(cached, sale_range, status_filter, scheme_filter, q),
             cached.get("cache_meta") or {},
             cached.get("has_sales", False),
             cached.get("has_finance", False),
@@ -223,24 +241,35 @@ def _load_feed_list(
         )
 
     sales = collect_sales_from_period_cache(user_id, sales_from, sales_to)
-    finance_idx = load_finance_srid_index(user_id)
-    items = build_feed_items(user_id, orders, sales, record_history=True)
-    items = _apply_feed_filters(items, sale_range, status_filter, scheme_filter, q)
-
-    has_sales = bool(sales)
-    has_finance = bool(finance_idx)
-    _FEED_LIST_CACHE[cache_key] = {
-        "ts": time.time(),
-        "items": items,
+    has_finance = finance_srid_index_exists(user_id)
+    base_items = build_feed_items(user_id, orders, sales, record_history=True)
+    search_index = _build_feed_search_index(base_items)
+    # Версия — после сборки: build_feed_items сам дописывает журнал истории статусов,
+    # и версия до сборки сразу устарела бы, а лента пересобиралась бы на каждом запросе
+    version = feed_data_version(user_id)
+
+    cache_key = base_key + (version,)
+    base = {
+        "cache_key": cache_key,
+        "items": base_items,
         "cache_meta": cache_meta,
-        "has_sales": has_sales,
+        "has_sales": bool(sales),
         "has_finance": has_finance,
+        "views": OrderedDict(),
+        "search_index": search_index,
     }
+    size = _estimate_feed_size(base_items)
+    if search_index is not None:
+        size += search_index.estimated_bytes()
+    # Ленты этого окна по старым версиям данных больше не понадобятся
+    _FEED_BASE_CACHE.drop_where(lambda k: k[:5] == base_key)
+    _FEED_BASE_CACHE.put(cache_key, base, size=size)
+    items = _feed_view(base, sale_range, status_filter, scheme_filter, q)
     return (
         items,
         cache_meta,
-        has_sales,
-        has_finance,
+        base["has_sales"],
+        base["has_finance"],
         refreshed,
         date_from,
         date_to,
@@ -249,17 +278,84 @@ def _load_feed_list(
     )
 
 
+def _estimate_feed_size(items: list) -> int:
+    # Элементы + запас на представления (списки ссылок по 8 байт)
+    return estimate_size(items) + len(items) * 8 * _FEED_VIEWS_PER_BASE
+
+
+# Размер пачки строк в NDJSON-потоке ленты
+_FEED_STREAM_CHUNK = 500
+
+
+def encode_feed_cursor(items: list, pos: int) -> str:
+    """Непрозрачный курсор ленты: позиция сразу после items[pos] в порядке feed_sort_key по убыванию.
+
+    Кроме ключа хранит, сколько элементов с таким же ключом уже отдано, — курсор
+    однозначен и для строк с совпадающими датой, srid и номером заказа.
+    """
+    key = feed_sort_key(items[pos])
+    seen = 1
+    while pos - seen >= 0 and feed_sort_key(items[pos - seen]) == key:
+        seen += 1
+    dt, srid, gnumber = key
+    raw = json.dumps([dt.isoformat(), srid, gnumber, seen], ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_feed_cursor(cursor: str) -> Tuple[Tuple[datetime, str, str], int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        dt_s, srid, gnumber, seen = json.loads(raw.decode("utf-8"))
+        return (datetime.fromisoformat(dt_s), str(srid), str(gnumber)), max(0, int(seen))
+    except Exception:
+        raise ValueError("Некорректный cursor")
+
+
+def _feed_cursor_index(items: list, cursor: Tuple[Tuple[datetime, str, str], int]) -> int:
+    """Индекс первого элемента после курсора (бинарный поиск: лента отсортирована по убыванию ключа)."""
+    key, seen = cursor
+
+    def _first(pred) -> int:
+        lo, hi = 0, len(items)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if pred(feed_sort_key(items[mid])):
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    # Элементы с ключом курсора идут подряд: пропускаем из них уже отданные
+    group_start = _first(lambda k: k <= key)
+    group_end = _first(lambda k: k < key)
+    return min(group_start + seen, group_end)
+
+
+def _stream_feed_items(user_id: int, items: list, start: int):
+    for i in range(start, len(items), _FEED_STREAM_CHUNK):
+        yield "".join(
+            json.dumps(it, ensure_ascii=False, default=str) + "\n"
+            for it in enrich_feed_finance(user_id, items[i : i + _FEED_STREAM_CHUNK])
+        )
+
+
 @order_feed_bp.route("/api/order-feed", methods=["GET"])
 @login_required
 def api_order_feed():
-    """Список заказов за период из кэша статистики (+ продажи для статусов)."""
+    """Список заказов за период из кэша статистики (+ продажи для статусов).
+
+    Страницы — по cursor (next_cursor из предыдущего ответа) или по offset.
+    format=ndjson — все элементы, начиная с cursor/offset, потоком по строке JSON.
+    """
     refresh = request.args.get("refresh") in ("1", "true", "yes")
     limit = request.args.get("limit", type=int) or 100
     offset = request.args.get("offset", type=int) or 0
     limit = max(1, min(limit, 500))
     offset = max(0, offset)
+    cursor = (request.args.get("cursor") or "").strip()
 
     try:
+        cursor_pos = decode_feed_cursor(cursor) if cursor else None
         (
             items,
             cache_meta,
@@ -275,13 +371,24 @@ def api_order_feed():
         return jsonify({"error": str(e)}), 400
 
     total = len(items)
-    page = items[offset : offset + limit]
+    start = _feed_cursor_index(items, cursor_pos) if cursor_pos is not None else min(offset, total)
+
+    if (request.args.get("format") or "").lower() == "ndjson":
+        return Response(
+            _stream_feed_items(current_user.id, items, start),
+            mimetype="application/x-ndjson",
+            headers={"X-Feed-Total": str(total), "X-Feed-Offset": str(start)},
+        )
+
+    page = items[start : start + limit]
+    next_cursor = encode_feed_cursor(items, start + len(page) - 1) if page and start + len(page) < total else None
 
     return jsonify({
-        "items": page,
+        "items": enrich_feed_finance(current_user.id, page),
         "total": total,
-        "offset": offset,
+        "offset": start,
         "limit": limit,
+        "next_cursor": next_cursor,
         "date_from": date_from,
         "date_to": date_to,
         "sale_from": sale_from,
@@ -309,6 +416,7 @@ def api_order_feed_export():
         items, _, _, _, _, date_from, date_to, sale_from, sale_to = _load_feed_list(
             refresh=False
         )
+        items = enrich_feed_finance(current_user.id, items)
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
     except Exception as e:
@@ -427,4 +535,4 @@ def api_order_feed_detail(order_id: str):
     if not found:
         return jsonify({"error": "Заказ не найден", "order_id": needle}), 404
 
-    return jsonify({"item": found})
+    return jsonify({"item": enrich_feed_finance(user_id, [found])[0]})
@@ -21,10 +21,12 @@ from utils.cache import (
 )
 from utils.orders_processing import (
     to_rows, aggregate_daily_counts_and_revenue,
-    aggregate_by_warehouse_orders_only, aggregate_top_products,
     aggregate_cancelled_products,
-    aggregate_top_products_orders, aggregate_top_products_sales
+    aggregate_top_products_orders, aggregate_top_products_sales,
+    build_orders_day_rollup, merge_orders_day_rollups, aggregates_from_orders_rollup,
+    aggregate_orders, top_products_orders_from_rollup,
 )
+from utils.orders_columnar import orders_columns_for
 from utils.progress import ORDERS_PROGRESS, set_orders_progress, clear_orders_progress
 from utils.wb_token import effective_wb_api_token, token_for_wb_request
 
@@ -76,6 +78,8 @@ def index():
     # Если GET — пробуем показать последние результаты из кэша
     top_mode = "orders"
     cache_info = None
+    # Итоги дашборда из дневных свёрток (POST); None — считаем по строкам заказов
+    dashboard = None
     if request.method == "GET":
         cached = load_last_results()
         # Use cache only if it belongs to this user (by user_id) and user has token
@@ -133,36 +137,38 @@ def index():
                     # Принудительное обновление - загружаем все данные через API, игнорируя кэш
                     raw_orders = fetch_orders_range(token, date_from, date_to)
                     orders = to_rows(raw_orders, date_from, date_to)
-                    total_orders = len(orders)
-                    total_active_orders = len([o for o in orders if not o.get("is_cancelled", False)])
-                    total_cancelled_orders = len([o for o in orders if o.get("is_cancelled", False)])
-                    total_revenue = round(sum(float(o.get("Цена со скидкой продавца") or 0) for o in orders if not o.get("is_cancelled", False)), 2)
                     # Обновляем кэш принудительно
                     update_period_cache_with_data(token, date_from, date_to, orders)
+                    rollup = build_orders_day_rollup(orders)
                 else:
-                    # Обычное обновление - используем кэш по дням
+                    # Обычное обновление - используем кэш по дням и их готовые свёртки
                     orders, _meta = get_orders_with_period_cache(
-                        token, date_from, date_to
+                        token, date_from, date_to, with_rollups=True
                     )
-                    total_orders = len(orders)
-                    total_active_orders = len([o for o in orders if not o.get("is_cancelled", False)])
-                    total_cancelled_orders = len([o for o in orders if o.get("is_cancelled", False)])
-                    total_revenue = round(sum(float(o.get("Цена со скидкой продавца") or 0) for o in orders if not o.get("is_cancelled", False)), 2)
+                    rollup = merge_orders_day_rollups(_meta.pop("day_rollups", None) or [])
                     cache_info = _meta
 
+                dashboard = aggregates_from_orders_rollup(rollup, limit=15)
+                total_orders = dashboard["total_orders"]
+                total_active_orders = dashboard["total_active_orders"]
+                total_cancelled_orders = dashboard["total_cancelled_orders"]
+                total_revenue = dashboard["total_revenue"]
+
                 # Aggregates for charts
-                o_counts_map, o_rev_map, o_cancelled_counts_map = aggregate_daily_counts_and_revenue(orders)
+                o_counts_map = dashboard["count_by_day"]
+                o_rev_map = dashboard["revenue_by_day"]
+                o_cancelled_counts_map = dashboard["cancelled_count_by_day"]
                 daily_labels = sorted(o_counts_map.keys())
                 daily_orders_counts = [o_counts_map.get(d, 0) for d in daily_labels]
                 daily_orders_cancelled_counts = [o_cancelled_counts_map.get(d, 0) for d in daily_labels]
                 daily_orders_revenue = [round(o_rev_map.get(d, 0.0), 2) for d in daily_labels]
 
                 # Warehouses combined summary
-                warehouse_summary_dual = aggregate_by_warehouse_orders_only(orders)
+                warehouse_summary_dual = dashboard["warehouse_summary_dual"]
 
                 # Top products (by orders)
                 top_mode = "orders"
-                top_products = aggregate_top_products(orders, limit=15)
+                top_products = dashboard["top_products"]
 
                 # Сохраняем токен в профиле пользователя при наличии
                 if current_user.is_authenticated and token:
@@ -218,7 +224,7 @@ def index():
                 updated_at = datetime.now().strftime("%d.%m.%Y %H:%M:%S")
                 date_from_fmt = format_dmy(date_from)
                 date_to_fmt = format_dmy(date_to)
-                cancelled_products_snapshot = aggregate_cancelled_products(orders)
+                cancelled_products_snapshot = dashboard["cancelled_products"]
                 save_last_results({
                     "date_from": date_from,
                     "date_to": date_to,
@@ -243,11 +249,23 @@ def index():
                 error = f"Ошибка: {exc}"
 
     # Build warehouses list and filtered ORDERS TOP from current orders
-    warehouses = sorted({(r.get("Склад отгрузки") or "Не указан") for r in orders})
-    top_products_orders_filtered = aggregate_top_products_orders(
-        orders, selected_warehouse or None, limit=50
-    )
-    cancelled_products = aggregate_cancelled_products(orders)
+    if dashboard is not None:
+        warehouses = dashboard["warehouses"]
+        cancelled_products = dashboard["cancelled_products"]
+        if selected_warehouse:
+            top_products_orders_filtered = aggregate_orders(
+                orders, ("top_products_orders",), warehouse=selected_warehouse
+            )["top_products_orders"]
+        else:
+            top_products_orders_filtered = top_products_orders_from_rollup(rollup, limit=50)
+    else:
+        # Снимок из кэша: склады, отменённые и ТОП заказов — одним проходом
+        fused = aggregate_orders(
+            orders, ("dashboard", "top_products_orders"), warehouse=selected_warehouse or None
+        )
+        warehouses = fused["warehouses"]
+        cancelled_products = fused["cancelled_products"]
+        top_products_orders_filtered = fused["top_products_orders"]
 
     return render_template(
         "index.html",
@@ -313,35 +331,36 @@ def api_orders_refresh():
             # Принудительное обновление - загружаем все данные через API, игнорируя кэш
             raw_orders = fetch_orders_range(token, date_from, date_to)
             orders = to_rows(raw_orders, date_from, date_to)
-            total_orders = len(orders)
-            total_active_orders = len([o for o in orders if not o.get("is_cancelled", False)])
-            total_cancelled_orders = len([o for o in orders if o.get("is_cancelled", False)])
-            total_revenue = round(sum(float(o.get("Цена со скидкой продавца") or 0) for o in orders if not o.get("is_cancelled", False)), 2)
             # Обновляем кэш принудительно
             update_period_cache_with_data(token, date_from, date_to, orders)
             meta = {"used_cache_days": 0, "fetched_days": len(_daterange_inclusive(date_from, date_to))}
+            rollup = build_orders_day_rollup(orders)
         else:
-            # Обычное обновление - используем кэш по дням
+            # Обычное обновление - используем кэш по дням и их готовые свёртки
             orders, meta = get_orders_with_period_cache(
-                token, date_from, date_to
+                token, date_from, date_to, with_rollups=True
             )
-            total_orders = len(orders)
-            total_active_orders = len([o for o in orders if not o.get("is_cancelled", False)])
-            total_cancelled_orders = len([o for o in orders if o.get("is_cancelled", False)])
-            total_revenue = round(sum(float(o.get("Цена со скидкой продавца") or 0) for o in orders if not o.get("is_cancelled", False)), 2)
+            rollup = merge_orders_day_rollups(meta.pop("day_rollups", None) or [])
+        dashboard = aggregates_from_orders_rollup(rollup, limit=15)
+        total_orders = dashboard["total_orders"]
+        total_active_orders = dashboard["total_active_orders"]
+        total_cancelled_orders = dashboard["total_cancelled_orders"]
+        total_revenue = dashboard["total_revenue"]
         # Aggregates
-        o_counts_map, o_rev_map, o_cancelled_counts_map = aggregate_daily_counts_and_revenue(orders)
+        o_counts_map = dashboard["count_by_day"]
+        o_rev_map = dashboard["revenue_by_day"]
+        o_cancelled_counts_map = dashboard["cancelled_count_by_day"]
         daily_labels = sorted(o_counts_map.keys())
         daily_orders_counts = [o_counts_map.get(d, 0) for d in daily_labels]
         daily_orders_cancelled_counts = [o_cancelled_counts_map.get(d, 0) for d in daily_labels]
         daily_orders_revenue = [round(o_rev_map.get(d, 0.0), 2) for d in daily_labels]
         # Warehouses and TOPs
-        warehouse_summary_dual = aggregate_by_warehouse_orders_only(orders)
-        top_products = aggregate_top_products(orders, limit=15)
+        warehouse_summary_dual = dashboard["warehouse_summary_dual"]
+        top_products = dashboard["top_products"]
         top_mode = "orders"
-        warehouses = sorted({(r.get("Склад отгрузки") or "Не указан") for r in orders})
-        top_products_orders_filtered = aggregate_top_products_orders(orders, None, limit=50)
-        cancelled_products = aggregate_cancelled_products(orders)
+        warehouses = dashboard["warehouses"]
+        top_products_orders_filtered = top_products_orders_from_rollup(rollup, limit=50)
+        cancelled_products = dashboard["cancelled_products"]
         updated_at = datetime.now().strftime("%d.%m.%Y %H:%M:%S")
         # Save last results snapshot
         save_last_results({
@@ -506,7 +525,15 @@ def api_top_products_orders():
     if not cached or not (current_user.is_authenticated and cached.get("_user_id") == current_user.id):
         return jsonify({"items": [], "total_qty": 0, "total_sum": 0})
     orders = cached.get("orders", [])
-    items = aggregate_top_products_orders(orders, warehouse, limit=50)
+    # Переключение склада на больших периодах — по колонкам снимка (numpy), иначе проход по строкам
+    cols = orders_columns_for(
+        ("top_products_orders", current_user.id, cached.get("updated_at"), cached.get("date_from"), cached.get("date_to")),
+        orders,
+    )
+    if cols is not None:
+        items = cols.top_products_orders(warehouse, limit=50)
+    else:
+        items = aggregate_top_products_orders(orders, warehouse, limit=50)
     
     # Рассчитываем общие суммы для выбранного склада
     total_qty = 0
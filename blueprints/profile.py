@@ -4,9 +4,10 @@ from typing import Any
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_required, current_user
 from models import db
-from utils.constants import MOSCOW_TZ, CACHE_DIR
+from utils.constants import MOSCOW_TZ
 from utils.wb_token import effective_wb_api_token
 from utils.cache import load_orders_cache_meta, is_orders_cache_fresh
+from utils.cache_layout import user_cache_path
 from datetime import datetime
 import os
 import jwt
@@ -56,7 +57,7 @@ def decode_token_info(token: str) -> dict[str, Any] | None:
 
 
 def _get_light_supplies_cache_info(user_id: int) -> dict[str, Any] | None:
-    path = os.path.join(CACHE_DIR, f"fbw_supplies_detailed_user_{user_id}.json")
+    path = user_cache_path(user_id, "fbw_supplies_detailed")
     if not os.path.isfile(path):
         return None
     try:
@@ -79,7 +80,7 @@ def _get_light_orders_cache_info(user_id: int) -> dict[str, Any] | None:
     - fallback для last_updated: mtime файла периодического кэша orders_period_user_<id>.json
     """
     meta = load_orders_cache_meta(user_id)
-    period_path = os.path.join(CACHE_DIR, f"orders_period_user_{user_id}.json")
+    period_path = user_cache_path(user_id, "orders_period")
     period_mtime_iso = None
     try:
         if os.path.isfile(period_path):
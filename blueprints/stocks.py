@@ -8,7 +8,7 @@ from datetime import datetime
 from typing import Any, Dict, List
 
 import requests
-from flask import Blueprint, jsonify, redirect, render_template, send_file, url_for
+from flask import Blueprint, Response, jsonify, redirect, render_template, request, send_file, url_for
 from flask_login import current_user, login_required
 from openpyxl import Workbook
 
@@ -21,7 +21,8 @@ from utils.cache import (
     save_stocks_cache_for_user,
 )
 from utils.constants import STOCKS_AUTO_REFRESH_INTERVAL_S, STOCKS_CACHE_STALE_S
-from utils.helpers import enrich_stocks_from_products, normalize_stocks, stock_row_product_key
+from utils.helpers import enrich_stocks_from_products, normalize_stocks
+from utils.stocks_view import build_stocks_view, stocks_view_for_user
 from utils.wb_token import effective_wb_api_token
 
 logger = logging.getLogger(__name__)
@@ -52,15 +53,6 @@ def _normalize_and_enrich_stocks(
     return enrich_stocks_from_products(items, products)
 
 
-def _enrich_stocks_items_for_user(items: List[Dict[str, Any]], user_id: int) -> List[Dict[str, Any]]:
-    """Повторно подтягивает названия/артикулы из кэша товаров (для уже сохранённых остатков)."""
-    try:
-        products = (load_products_cache_for_user(user_id) or {}).get("items") or []
-    except Exception:
-        products = []
-    return enrich_stocks_from_products(items, products)
-
-
 def _stocks_cache_is_stale(cached: Dict[str, Any] | None) -> bool:
     if not cached or not cached.get("updated_at"):
         return True
@@ -116,7 +108,7 @@ def stocks_page():
         try:
             cached = load_stocks_cache()
             if cached and cached.get("_user_id") == current_user.id:
-                items = _enrich_stocks_items_for_user(cached.get("items", []), current_user.id)
+                items = cached.get("items", [])
                 # Показ из кэша; устаревший кэш обновляем в фоне
                 _maybe_start_stocks_bg_refresh(current_user.id, token, cached)
             else:
@@ -134,153 +126,25 @@ def stocks_page():
         except Exception as exc:
             error = f"Ошибка: {exc}"
 
-    # Общие итоги
-    total_qty_all = sum(int(it.get("qty", 0) or 0) for it in items)
-    total_in_transit_all = sum(int(it.get("in_transit", 0) or 0) for it in items)
-
-    # Агрегация по товарам
-    prod_map: Dict[tuple, Dict[str, Any]] = {}
-    for it in items:
-        key = stock_row_product_key(it)
-        rec = prod_map.get(key)
-        if not rec:
-            rec = {
-                "vendor_code": it.get("vendor_code") or "",
-                "barcode": it.get("barcode") or "",
-                "nm_id": it.get("nm_id"),
-                "name": it.get("name") or "",
-                "total_qty": 0,
-                "total_in_transit": 0,
-                "warehouses": [],
-            }
-            prod_map[key] = rec
-        rec["total_qty"] += int(it.get("qty", 0) or 0)
-        rec["total_in_transit"] += int(it.get("in_transit", 0) or 0)
-        if not rec.get("vendor_code") and it.get("vendor_code"):
-            rec["vendor_code"] = it.get("vendor_code")
-        if not rec.get("name") and it.get("name"):
-            rec["name"] = it.get("name")
-        if not rec.get("barcode") and it.get("barcode"):
-            rec["barcode"] = it.get("barcode")
-        if rec.get("nm_id") is None and it.get("nm_id") is not None:
-            rec["nm_id"] = it.get("nm_id")
-        rec["warehouses"].append(
-            {
-                "warehouse": it.get("warehouse"),
-                "qty": int(it.get("qty", 0) or 0),
-                "in_transit": int(it.get("in_transit", 0) or 0),
-            }
-        )
-
-    from collections import defaultdict as _dd
-
-    for rec in prod_map.values():
-        qty_acc = _dd(int)
-        transit_acc = _dd(int)
-        for w in rec["warehouses"]:
-            name = w.get("warehouse") or ""
-            qty_acc[name] += int(w.get("qty", 0) or 0)
-            transit_acc[name] += int(w.get("in_transit", 0) or 0)
-        wh_list = [
-            {"warehouse": name, "qty": qty, "in_transit": transit_acc.get(name, 0)}
-            for name, qty in qty_acc.items()
-            if qty > 0 or transit_acc.get(name, 0) > 0
-        ]
-        wh_list.sort(key=lambda x: (-x["qty"], x["warehouse"]))
-        rec["warehouses"] = wh_list
-
-    # Подтягиваем фото товаров из кэша товаров
-    try:
-        nm_to_photo: Dict[Any, Any] = {}
-        prod_cached = load_products_cache() or {}
-        for it_p in (prod_cached.get("items") or []):
-            nmv = it_p.get("nm_id") or it_p.get("nmId") or it_p.get("nmID")
-            if nmv is None:
-                continue
-            photo = it_p.get("photo") or it_p.get("img")
-            if photo:
-                nm_to_photo[int(nmv)] = photo
-        for rec in prod_map.values():
-            nm = rec.get("nm_id")
-            if nm is not None:
-                try:
-                    rec["photo"] = nm_to_photo.get(int(nm))
-                except Exception:
-                    rec["photo"] = nm_to_photo.get(nm)
-    except Exception:
-        pass
-
-    products_agg = sorted(
-        prod_map.values(), key=lambda x: (-x["total_qty"], x["vendor_code"] or x.get("name") or "")
-    )
-
-    # Агрегация по складам
-    wh_map: Dict[str, Dict[str, Any]] = {}
-    for it in items:
-        w = it.get("warehouse") or ""
-        rec = wh_map.get(w)
-        if not rec:
-            rec = {
-                "warehouse": w,
-                "total_qty": 0,
-                "total_in_transit": 0,
-                "products": [],
-            }
-            wh_map[w] = rec
-        qty_i = int(it.get("qty", 0) or 0)
-        in_transit_i = int(it.get("in_transit", 0) or 0)
-        rec["total_qty"] += qty_i
-        rec["total_in_transit"] += in_transit_i
-        rec["products"].append(
-            {
-                "vendor_code": it.get("vendor_code"),
-                "barcode": it.get("barcode"),
-                "nm_id": it.get("nm_id"),
-                "name": it.get("name") or "",
-                "qty": qty_i,
-                "in_transit": in_transit_i,
-            }
-        )
-
-    for rec in wh_map.values():
-        rec["products"].sort(key=lambda x: (-x["qty"], x["vendor_code"] or x.get("name") or ""))
-
-    try:
-        nm_to_photo: Dict[Any, Any] = {}
-        prod_cached = load_products_cache() or {}
-        for it_p in (prod_cached.get("items") or []):
-            nmv = it_p.get("nm_id") or it_p.get("nmId") or it_p.get("nmID")
-            if nmv is None:
-                continue
-            photo = it_p.get("photo") or it_p.get("img")
-            if photo:
-                nm_to_photo[int(nmv)] = photo
-        for rec in wh_map.values():
-            for p in rec["products"]:
-                nm = p.get("nm_id")
-                if nm is not None:
-                    try:
-                        p["photo"] = nm_to_photo.get(int(nm))
-                    except Exception:
-                        p["photo"] = nm_to_photo.get(nm)
-    except Exception:
-        pass
-
-    warehouses_agg = sorted(
-        wh_map.values(), key=lambda x: (-x["total_qty"], x["warehouse"] or "")
-    )
-
-    cached = load_stocks_cache() or {}
-    updated_at = cached.get("updated_at") if cached.get("_user_id") == current_user.id else None
+    # Агрегаты по товарам и складам — из снимка, собранного при сохранении остатков
+    view = stocks_view_for_user(current_user.id) if items else None
+    if view is not None:
+        data = view["data"]
+    else:
+        try:
+            products = (load_products_cache() or {}).get("items") or []
+        except Exception:
+            products = []
+        data = build_stocks_view([dict(it) for it in items], products)
 
     return render_template(
         "stocks.html",
         error=error,
-        total_qty_all=total_qty_all,
-        total_in_transit_all=total_in_transit_all,
-        updated_at=updated_at,
-        products_agg=products_agg,
-        warehouses_agg=warehouses_agg,
+        total_qty_all=data["total_qty_all"],
+        total_in_transit_all=data["total_in_transit_all"],
+        updated_at=data.get("updated_at"),
+        products_agg=data["products"],
+        warehouses_agg=data["warehouses"],
         stocks_auto_refresh_ms=int(float(STOCKS_AUTO_REFRESH_INTERVAL_S or 1800) * 1000),
     )
 
@@ -373,140 +237,20 @@ def api_stocks_update_time():
 @stocks_bp.route("/api/stocks/data", methods=["GET"])
 @login_required
 def api_stocks_data():
-    cached = load_stocks_cache()
-    if not cached or not (current_user.is_authenticated and cached.get("_user_id") == current_user.id):
+    """Агрегаты остатков из готового снимка (utils.stocks_view) с поддержкой ETag."""
+    view = stocks_view_for_user(current_user.id)
+    if view is None:
         return jsonify({"products": [], "warehouses": [], "total_qty_all": 0, "updated_at": None})
 
-    items = _enrich_stocks_items_for_user(cached.get("items", []), current_user.id)
-    total_qty_all = sum(int((it.get("qty") or 0)) for it in items)
-    total_in_transit_all = sum(int((it.get("in_transit") or 0)) for it in items)
-
-    from collections import defaultdict as _dd
-
-    prod_map: Dict[tuple, Dict[str, Any]] = {}
-    for it in items:
-        key = stock_row_product_key(it)
-        rec = prod_map.get(key)
-        if not rec:
-            rec = {
-                "vendor_code": it.get("vendor_code") or "",
-                "barcode": it.get("barcode") or "",
-                "nm_id": it.get("nm_id"),
-                "name": it.get("name") or "",
-                "total_qty": 0,
-                "total_in_transit": 0,
-                "warehouses": [],
-            }
-            prod_map[key] = rec
-        qty_i = int(it.get("qty", 0) or 0)
-        rec["total_qty"] += qty_i
-        rec["total_in_transit"] += int(it.get("in_transit", 0) or 0)
-        if not rec.get("vendor_code") and it.get("vendor_code"):
-            rec["vendor_code"] = it.get("vendor_code")
-        if not rec.get("name") and it.get("name"):
-            rec["name"] = it.get("name")
-        if not rec.get("barcode") and it.get("barcode"):
-            rec["barcode"] = it.get("barcode")
-        if rec.get("nm_id") is None and it.get("nm_id") is not None:
-            rec["nm_id"] = it.get("nm_id")
-        rec["warehouses"].append({
-            "warehouse": it.get("warehouse"),
-            "qty": qty_i,
-            "in_transit": int(it.get("in_transit", 0) or 0),
-        })
-
-    products_agg = []
-    for rec in prod_map.values():
-        qty_acc = _dd(int)
-        transit_acc = _dd(int)
-        for w in rec["warehouses"]:
-            name = w.get("warehouse") or ""
-            qty_acc[name] += int(w.get("qty", 0) or 0)
-            transit_acc[name] += int(w.get("in_transit", 0) or 0)
-        rec["total_in_transit"] = sum(transit_acc.values())
-        rec["warehouses"] = [
-            {"warehouse": name, "qty": qty, "in_transit": transit_acc.get(name, 0)}
-            for name, qty in qty_acc.items()
-            if qty > 0 or transit_acc.get(name, 0) > 0
-        ]
-        rec["warehouses"].sort(key=lambda x: (-x["qty"], x["warehouse"]))
-        products_agg.append(rec)
-
-    try:
-        nm_to_photo: Dict[Any, Any] = {}
-        prod_cached = load_products_cache() or {}
-        for it_p in (prod_cached.get("items") or []):
-            nmv = it_p.get("nm_id") or it_p.get("nmId") or it_p.get("nmID")
-            if nmv is None:
-                continue
-            photo = it_p.get("photo") or it_p.get("img")
-            if photo:
-                nm_to_photo[int(nmv)] = photo
-        for rec in products_agg:
-            nm = rec.get("nm_id")
-            if nm is not None:
-                try:
-                    rec["photo"] = nm_to_photo.get(int(nm))
-                except Exception:
-                    rec["photo"] = nm_to_photo.get(nm)
-    except Exception:
-        pass
-    products_agg.sort(key=lambda x: (-x["total_qty"], x["vendor_code"] or x.get("name") or ""))
-
-    wh_map: Dict[str, Dict[str, Any]] = {}
-    for it in items:
-        w = it.get("warehouse") or ""
-        rec = wh_map.get(w)
-        if not rec:
-            rec = {"warehouse": w, "total_qty": 0, "total_in_transit": 0, "products": []}
-            wh_map[w] = rec
-        qty_i = int(it.get("qty", 0) or 0)
-        in_transit_i = int(it.get("in_transit", 0) or 0)
-        rec["total_qty"] += qty_i
-        rec["total_in_transit"] += in_transit_i
-        rec["products"].append({
-            "vendor_code": it.get("vendor_code"),
-            "nm_id": it.get("nm_id"),
-            "barcode": it.get("barcode"),
-            "name": it.get("name") or "",
-            "qty": qty_i,
-            "in_transit": in_transit_i,
-        })
-    for rec in wh_map.values():
-        rec["products"].sort(key=lambda x: (-x["qty"], x["vendor_code"] or x.get("name") or ""))
-
-    try:
-        nm_to_photo: Dict[Any, Any] = {}
-        prod_cached = load_products_cache() or {}
-        for it_p in (prod_cached.get("items") or []):
-            nmv = it_p.get("nm_id") or it_p.get("nmId") or it_p.get("nmID")
-            if nmv is None:
-                continue
-            photo = it_p.get("photo") or it_p.get("img")
-            if photo:
-                nm_to_photo[int(nmv)] = photo
-        for rec in wh_map.values():
-            for p in rec["products"]:
-                nm = p.get("nm_id")
-                if nm is not None:
-                    try:
-                        p["photo"] = nm_to_photo.get(int(nm))
-                    except Exception:
-                        p["photo"] = nm_to_photo.get(nm)
-    except Exception:
-        pass
-
-    warehouses_agg = sorted(
-        wh_map.values(), key=lambda x: (-x["total_qty"], x["warehouse"] or "")
-    )
-
-    return jsonify({
-        "products": products_agg,
-        "warehouses": warehouses_agg,
-        "total_qty_all": total_qty_all,
-        "total_in_transit_all": total_in_transit_all,
-        "updated_at": cached.get("updated_at"),
-    })
+    etag = view.get("etag")
+    if etag and request.if_none_match.contains(etag):
+        resp = Response(status=304)
+    else:
+        resp = jsonify(view["data"])
+    if etag:
+        resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
 
 
 @stocks_bp.route("/stocks/export", methods=["POST"])
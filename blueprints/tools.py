@@ -437,6 +437,8 @@ def api_prices_save():
                 continue
         
         db.session.commit()
+        from utils.order_feed import mark_purchase_prices_changed
+        mark_purchase_prices_changed(current_user.id)
         
         # Проверяем, что цены действительно сохранились
         verify_count = PurchasePrice.query.filter_by(user_id=current_user.id).count()
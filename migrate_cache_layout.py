@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Скрипт для переноса кэша из плоской раскладки cache/*_user_<id>.json
+в папки пользователей cache/users/<id>/<тип>.json и построения индекса функций.
+Запускайте при остановленном приложении. Повторный запуск безопасен.
+
+    python migrate_cache_layout.py            # перенос
+    python migrate_cache_layout.py --dry-run  # только показать, что будет перенесено
+"""
+import sys
+
+from utils.cache_layout import USERS_CACHE_DIR, migrate_flat_cache_layout
+
+
+def migrate(dry_run: bool = False) -> bool:
+    """Переносит файлы кэша и печатает итог"""
+    try:
+        result = migrate_flat_cache_layout(dry_run=dry_run)
+    except Exception as e:
+        print(f"✗ Ошибка при миграции кэша: {e}")
+        return False
+    for name in result["moved"]:
+        print(f"{'→ будет перенесён' if dry_run else '✓ перенесён'}: {name}")
+    for name in result["skipped"]:
+        print(f"⚠ пропущен (в папке пользователя уже есть новая версия): {name}")
+    print(f"Перенесено: {len(result['moved'])}, пропущено: {len(result['skipped'])}")
+    for feature, user_ids in (result.get("features") or {}).items():
+        print(f"Функция {feature}: {len(user_ids)} пользователей")
+    return True
+
+
+if __name__ == "__main__":
+    dry_run = "--dry-run" in sys.argv[1:]
+    print("Миграция кэша: раскладка по папкам пользователей")
+    print(f"Папка: {USERS_CACHE_DIR}")
+    print("-" * 50)
+
+    if migrate(dry_run=dry_run):
+        print("-" * 50)
+        print("Миграция завершена успешно!")
+        sys.exit(0)
+    else:
+        print("-" * 50)
+        print("Миграция завершилась с ошибками")
+        sys.exit(1)
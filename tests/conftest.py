@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+# Корень проекта — в sys.path, как в benchmarks/: тесты импортируют utils.* при запуске `pytest` из любой папки
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""aggregate_orders (один проход) против прежних aggregate_* и _normalize_and_group_orders.
+
+Прежний _normalize_and_group_orders из app.py (два прохода по заказам) перенесён сюда
+как эталон — в app.py он теперь делегирует aggregate_orders.
+"""
+import random
+from collections import defaultdict
+from typing import Any, Dict, List
+
+import pytest
+
+from utils import orders_processing
+from utils.orders_processing import (
+    aggregate_by_warehouse_orders_only,
+    aggregate_cancelled_products,
+    aggregate_daily_counts_and_revenue,
+    aggregate_orders,
+    aggregate_top_products,
+    aggregate_top_products_orders,
+)
+
+PRODUCTS_CACHE = {
+    "items": [
+        {"nm_id": 1001, "photo": "https://img/1001.jpg"},
+        {"nm_id": 1002, "photo": "https://img/1002.jpg"},
+        {"nmID": 1003, "img": "https://img/1003.jpg"},
+    ]
+}
+
+
+@pytest.fixture(autouse=True)
+def _no_user_caches(monkeypatch):
+    # Фото — из фиксированного кэша товаров, остатков нет (без Flask-контекста пользователя)
+    monkeypatch.setattr(orders_processing, "load_products_cache", lambda: PRODUCTS_CACHE)
+    monkeypatch.setattr(orders_processing, "load_stocks_cache", lambda: None)
+
+
+def legacy_normalize_and_group_orders(orders: List[Dict[str, Any]]) -> tuple:
+    counts_total: Dict[str, int] = defaultdict(int)
+    by_wh: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    revenue_total: Dict[str, float] = defaultdict(float)
+    by_wh_sum: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+    nm_by_product: Dict[str, Any] = {}
+    barcode_by_product: Dict[str, Any] = {}
+    supplier_article_by_product: Dict[str, Any] = {}
+    barcode_to_nm: Dict[str, Any] = {}
+    supplier_article_to_nm: Dict[str, Any] = {}
+
+    def _row_barcode(row):
+        return row.get("_barcode") or row.get("Баркод") or row.get("barcode")
+
+    def _row_nm_id(row):
+        return row.get("_nm_id") or row.get("Артикул WB") or row.get("nmId") or row.get("nmID")
+
+    def _row_supplier_article(row):
+        return row.get("_supplier_article") or row.get("Артикул продавца") or row.get("supplierArticle")
+
+    def _row_warehouse(row):
+        return str(row.get("_warehouse") or row.get("Склад отгрузки") or row.get("warehouseName") or "Не указан")
+
+    def _row_price(row):
+        raw = row.get("_price")
+        if raw is None:
+            raw = row.get("Цена со скидкой продавца")
+        if raw is None:
+            raw = row.get("priceWithDisc")
+        try:
+            return float(raw or 0)
+        except (TypeError, ValueError):
+            return 0.0
+
+    for r in orders or []:
+        if r.get("is_cancelled", False):
+            continue
+        barcode = _row_barcode(r)
+        nmv = _row_nm_id(r)
+        supplier_article = _row_supplier_article(r)
+        if nmv:
+            if barcode:
+                barcode_to_nm[barcode] = nmv
+            if supplier_article:
+                supplier_article_to_nm[supplier_article] = nmv
+
+    for r in orders or []:
+        if r.get("is_cancelled", False):
+            continue
+        barcode = _row_barcode(r)
+        nmv = _row_nm_id(r)
+        supplier_article = _row_supplier_article(r)
+        if not nmv:
+            if barcode and barcode in barcode_to_nm:
+                nmv = barcode_to_nm[barcode]
+            elif supplier_article and supplier_article in supplier_article_to_nm:
+                nmv = supplier_article_to_nm[supplier_article]
+        if nmv:
+            prod_key = f"NM_{nmv}"
+        elif barcode:
+            prod_key = f"BARCODE_{barcode}"
+        elif supplier_article:
+            prod_key = str(supplier_article)
+        else:
+            prod_key = "Не указан"
+        wh = _row_warehouse(r)
+        counts_total[prod_key] += 1
+        by_wh[prod_key][wh] += 1
+        price = _row_price(r)
+        revenue_total[prod_key] += price
+        by_wh_sum[prod_key][wh] += price
+        if nmv:
+            nm_by_product[prod_key] = nmv
+        if barcode:
+            barcode_by_product[prod_key] = barcode
+        if supplier_article:
+            supplier_article_by_product[prod_key] = supplier_article
+
+    return (counts_total, by_wh, revenue_total, by_wh_sum, nm_by_product, barcode_by_product, supplier_article_by_product)
+
+
+def _plain(value):
+    """defaultdict -> dict рекурсивно, чтобы сравнивать и ключи, и порядок не учитывать."""
+    if isinstance(value, dict):
+        return {k: _plain(v) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return tuple(_plain(v) for v in value)
+    return value
+
+
+def _order(day, nm, barcode, article, warehouse, price, cancelled=False):
+    return {
+        "Дата": day,
+        "Артикул WB": nm,
+        "Баркод": barcode,
+        "Артикул продавца": article,
+        "Склад отгрузки": warehouse,
+        "Цена со скидкой продавца": price,
+        "is_cancelled": cancelled,
+    }
+
+
+def representative_orders() -> List[Dict[str, Any]]:
+    return [
+        _order("2026-10-01", 1001, "b1", "ART-1", "Коледино", 1500.0),
+        _order("2026-10-01", 1001, "b1", "ART-1", "Казань", 1490.5),
+        _order("2026-10-01", 1002, "b2", "ART-2", "Коледино", 800),
+        # отмены: в выручку, склады и ТОП не идут, но считаются по дням и в отменённых товарах
+        _order("2026-10-01", 1002, "b2", "ART-2", "Казань", 800, cancelled=True),
+        _order("2026-10-02", 1003, "b3", "", "Электросталь", "990.90", cancelled=True),
+        # пустая и отсутствующая дата
+        _order("", 1001, "b1", "ART-1", "Коледино", 1500.0),
+        _order(None, 1002, "b2", "ART-2", None, 810),
+        # нет Артикула WB: в матрице связывается по баркоду / артикулу продавца
+        _order("2026-10-02", None, "b1", "ART-1", "Казань", 1480),
+        _order("2026-10-02", "", "b9", "ART-2", "Подольск", 700),
+        _order("2026-10-02", None, "b-new", "ART-NEW", "Подольск", 300),
+        _order("2026-10-03", None, None, None, "", None),
+        # некорректная цена и товар без склада
+        _order("2026-10-03", 1003, "b3", "ART-3", "", "n/a"),
+        _order("2026-10-03", 1003, "b3a", "ART-3", "Электросталь", 1200.0),
+        _order("2026-10-03", 1003, "b3a", "ART-3", "Электросталь", 1200.0, cancelled=True),
+    ]
+
+
+def random_orders(n: int, seed: int) -> List[Dict[str, Any]]:
+    rnd = random.Random(seed)
+    warehouses = ["Коледино", "Казань", "Подольск", "Электросталь", "", None]
+    days = [f"2026-09-{d:02d}" for d in range(1, 31)] + ["", None]
+    rows = []
+    for _ in range(n):
+        j = rnd.randint(0, 60)
+        row = _order(
+            rnd.choice(days),
+            rnd.choice([1000 + j, 1000 + j, None, ""]),
+            rnd.choice([f"b{j}", f"b{j}", None]),
+            rnd.choice([f"ART-{j}", f"ART-{j}", None]),
+            rnd.choice(warehouses),
+            rnd.choice([round(rnd.uniform(100, 5000), 2), 0, None, "bad", str(rnd.randint(1, 900))]),
+            cancelled=rnd.random() < 0.15,
+        )
+        if rnd.random() < 0.05:
+            del row["is_cancelled"]
+        rows.append(row)
+    return rows
+
+
+ORDER_SETS = {
+    "representative": representative_orders,
+    "random": lambda: random_orders(3000, seed=7),
+    "all_cancelled": lambda: [dict(r, is_cancelled=True) for r in representative_orders()],
+    "empty": lambda: [],
+}
+
+
+@pytest.fixture(params=sorted(ORDER_SETS))
+def orders(request):
+    return ORDER_SETS[request.param]()
+
+
+def test_dashboard_matches_legacy_aggregates(orders):
+    fused = aggregate_orders(orders, ("dashboard",), limit=15)
+
+    count_by_day, revenue_by_day, cancelled_count_by_day = aggregate_daily_counts_and_revenue(orders)
+    total_orders = sum(count_by_day.values())
+    total_cancelled = sum(cancelled_count_by_day.values())
+    assert dict(fused["count_by_day"]) == dict(count_by_day)
+    assert dict(fused["revenue_by_day"]) == dict(revenue_by_day)
+    assert dict(fused["cancelled_count_by_day"]) == dict(cancelled_count_by_day)
+    assert fused["total_orders"] == total_orders
+    assert fused["total_cancelled_orders"] == total_cancelled
+    assert fused["total_active_orders"] == total_orders - total_cancelled
+    assert fused["total_revenue"] == round(sum(revenue_by_day.values()), 2)
+    assert fused["warehouse_summary_dual"] == aggregate_by_warehouse_orders_only(orders)
+    assert fused["top_products"] == aggregate_top_products(orders, limit=15)
+    assert fused["cancelled_products"] == aggregate_cancelled_products(orders)
+    assert fused["warehouses"] == sorted({(r.get("Склад отгрузки") or "Не указан") for r in orders})
+
+
+@pytest.mark.parametrize("warehouse", [None, "Коледино", "Не указан", "Нет такого"])
+def test_top_products_orders_matches_legacy(orders, warehouse):
+    fused = aggregate_orders(orders, ("top_products_orders",), warehouse=warehouse, orders_limit=50)
+    assert fused["top_products_orders"] == aggregate_top_products_orders(orders, warehouse, limit=50)
+
+
+def test_product_matrix_matches_legacy_grouping(orders):
+    fused = aggregate_orders(orders, ("product_matrix",))
+    assert _plain(fused["product_matrix"]) == _plain(legacy_normalize_and_group_orders(orders))
+
+
+def test_product_matrix_links_rows_without_nm_id():
+    matrix = aggregate_orders(representative_orders(), ("product_matrix",))["product_matrix"]
+    counts_total, by_wh = matrix[0], matrix[1]
+    # строка без Артикула WB с баркодом b1 попала к товару 1001; с незнакомым баркодом — отдельно
+    assert counts_total["NM_1001"] == 4
+    assert dict(by_wh["NM_1001"]) == {"Коледино": 2, "Казань": 2}
+    assert counts_total["BARCODE_b-new"] == 1
+    assert counts_total["Не указан"] == 1
+
+
+def test_all_outputs_in_one_call_match_separate_calls(orders):
+    fused = aggregate_orders(orders, warehouse="Казань")
+    assert fused["top_products_orders"] == aggregate_orders(
+        orders, ("top_products_orders",), warehouse="Казань"
+    )["top_products_orders"]
+    assert _plain(fused["product_matrix"]) == _plain(aggregate_orders(orders, ("product_matrix",))["product_matrix"])
+    dashboard = aggregate_orders(orders, ("dashboard",))
+    for key in dashboard:
+        assert _plain(fused[key]) == _plain(dashboard[key])
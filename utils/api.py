@@ -24,6 +24,7 @@ from utils.constants import (
     SUPPLIES_API_MIN_INTERVAL_S, DISCOUNTS_PRICES_API_URL,
     COMMISSION_API_URL, DIMENSIONS_API_URL, WAREHOUSES_API_URL
 )
+from utils.finance_columnar import FinanceColumns
 from utils.helpers import parse_date, parse_wb_datetime, _parse_iso_datetime, to_moscow, _fmt_dt_moscow, _fbw_status_from_id
 
 logger = logging.getLogger(__name__)
@@ -343,14 +344,25 @@ def _split_date_range(date_from: str, date_to: str, days_per_chunk: int = 7) ->
     return intervals
 
 
-def fetch_finance_report(token: str, date_from: str, date_to: str, limit: int = 100000, progress_callback=None) -> List[Dict[str, Any]]:
-    """Получает финансовый отчет с разбивкой по интервалам"""
+def fetch_finance_report(
+    token: str,
+    date_from: str,
+    date_to: str,
+    limit: int = 100000,
+    progress_callback=None,
+    columnar: bool = False,
+) -> List[Dict[str, Any]] | FinanceColumns:
+    """Получает финансовый отчет с разбивкой по интервалам.
+
+    columnar=True — строки каждого интервала сразу складываются в FinanceColumns
+    (только нужные финансам колонки), словари держатся в памяти по одному интервалу.
+    """
     headers = {"Authorization": f"Bearer {token}"}
     
     # Разбиваем период на интервалы по 7 дней
     intervals = _split_date_range(date_from, date_to, days_per_chunk=7)
     total_intervals = len(intervals)
-    all_rows: List[Dict[str, Any]] = []
+    all_rows: List[Dict[str, Any]] | FinanceColumns = FinanceColumns() if columnar else []
     
     logging.info(f"Начинаем загрузку финансового отчета за период {date_from} - {date_to}, интервалов: {total_intervals}")
     failed_intervals: List[str] = []
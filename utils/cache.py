@@ -1,7 +1,12 @@
 # -*- coding: utf-8 -*-
 """Функции кэширования"""
 import os
+import re
 import json
+import time
+import shutil
+import hashlib
+import tempfile
 from typing import Dict, Any
 from flask import session
 from flask_login import current_user
@@ -12,35 +17,144 @@ from utils.constants import (
     ORDERS_TODAY_CACHE_TTL_SECONDS,
 )
 from utils.helpers import _get_session_id
+from utils.cache_manager import record_cache_access
+from utils.cache_layout import user_cache_path
+from utils.interning import STOCK_CATEGORICAL_FIELDS, intern_row, intern_rows
 from datetime import datetime, timedelta
 
 
+def atomic_write_json(path: str, payload: Any, *, indent: int | None = None) -> None:
+    """Атомарно записывает JSON: временный файл в той же папке + os.replace.
+
+    Читатель видит либо старую, либо новую версию файла целиком, даже если запись
+    прервалась или параллельно пишет другой поток/процесс. Исключения пробрасываются —
+    вызывающие save_* сами решают, глотать ли ошибку.
+    """
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", suffix=".json", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, indent=indent)
+        os.replace(tmp_path, path)
+        record_cache_access(path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
 def _cache_path_for_user() -> str:
     """Путь к кэшу заказов для текущего пользователя"""
     if current_user.is_authenticated:
-        return os.path.join(CACHE_DIR, f"orders_user_{current_user.id}.json")
+        return user_cache_path(current_user.id, "orders")
     return os.path.join(CACHE_DIR, f"orders_{_get_session_id()}.json")
 
 
 def _cache_path_for_user_id(user_id: int) -> str:
     """Путь к кэшу заказов для конкретного пользователя"""
-    return os.path.join(CACHE_DIR, f"orders_user_{user_id}.json")
+    return user_cache_path(user_id, "orders")
+
+
+# Вторичные индексы кэшей товаров и остатков (по nm_id / баркоду).
+# Строятся при сохранении и лежат в том же файле под ключом "_index": {"n": len(items), ...},
+# где n — число строк, по которым индекс построен. Если items переписали без индекса
+# (старый файл или чужой код), n не совпадёт и чтение откатится на полный перебор.
+
+def _item_nm_key(item: Dict[str, Any]) -> str | None:
+    nmv = item.get("nm_id") or item.get("nmId") or item.get("nmID")
+    return str(nmv) if nmv else None
+
+
+def with_products_index(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Добавляет к кэшу товаров индекс {"by_nm": {nm_id: позиция первой карточки}}."""
+    items = payload.get("items")
+    if not isinstance(items, list):
+        return payload
+    by_nm: Dict[str, int] = {}
+    for pos, it in enumerate(items):
+        if isinstance(it, dict):
+            key = _item_nm_key(it)
+            if key is not None and key not in by_nm:
+                by_nm[key] = pos
+    payload["_index"] = {"n": len(items), "by_nm": by_nm}
+    return payload
+
+
+def with_stocks_index(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Добавляет к кэшу остатков индекс {"by_barcode": {баркод: [позиции]}, "by_nm": {nm_id: [позиции]}}."""
+    items = payload.get("items")
+    if not isinstance(items, list):
+        return payload
+    by_barcode: Dict[str, list[int]] = {}
+    by_nm: Dict[str, list[int]] = {}
+    for pos, it in enumerate(items):
+        if not isinstance(it, dict):
+            continue
+        bc = str(it.get("barcode") or "")
+        if bc:
+            by_barcode.setdefault(bc, []).append(pos)
+        key = _item_nm_key(it)
+        if key is not None:
+            by_nm.setdefault(key, []).append(pos)
+    payload["_index"] = {"n": len(items), "by_barcode": by_barcode, "by_nm": by_nm}
+    return payload
+
+
+def _cache_index(cached: Dict[str, Any] | None, field: str) -> Dict[str, Any] | None:
+    """Индекс field из кэша, если он построен по текущему списку items."""
+    if not isinstance(cached, dict):
+        return None
+    index = cached.get("_index")
+    items = cached.get("items")
+    if not isinstance(index, dict) or not isinstance(items, list) or index.get("n") != len(items):
+        return None
+    by_key = index.get(field)
+    return by_key if isinstance(by_key, dict) else None
+
+
+def find_product_item(cached: Dict[str, Any] | None, nm_id: Any) -> Dict[str, Any] | None:
+    """Первая карточка товара с данным nm_id из кэша товаров (по индексу, иначе перебором)."""
+    items = (cached or {}).get("items") or []
+    key = str(nm_id)
+    by_nm = _cache_index(cached, "by_nm")
+    if by_nm is not None:
+        pos = by_nm.get(key)
+        return items[pos] if pos is not None else None
+    for it in items:
+        if isinstance(it, dict) and _item_nm_key(it) == key:
+            return it
+    return None
+
+
+def stock_items_for_barcodes(cached: Dict[str, Any] | None, barcodes: set[str]) -> list[Dict[str, Any]]:
+    """Строки остатков по набору баркодов (в порядке файла); пустой набор — все строки."""
+    items = (cached or {}).get("items") or []
+    if not barcodes:
+        return list(items)
+    by_barcode = _cache_index(cached, "by_barcode")
+    if by_barcode is not None:
+        positions = sorted(p for bc in barcodes for p in (by_barcode.get(bc) or []))
+        return [items[p] for p in positions]
+    return [it for it in items if str(it.get("barcode") or "") in barcodes]
 
 
 # Products cache helpers (per user)
 def _products_cache_path_for_user() -> str:
     """Путь к кэшу товаров для текущего пользователя"""
     if current_user.is_authenticated:
-        return os.path.join(CACHE_DIR, f"products_user_{current_user.id}.json")
+        return user_cache_path(current_user.id, "products")
     return os.path.join(CACHE_DIR, "products_anon.json")
 
 
 def load_products_cache_for_user(user_id: int) -> Dict[str, Any] | None:
     """Загружает кэш товаров для конкретного пользователя (фоновые задачи без request)."""
-    path = os.path.join(CACHE_DIR, f"products_user_{user_id}.json")
+    path = user_cache_path(user_id, "products")
     if not os.path.isfile(path):
         return None
     try:
+        record_cache_access(path)
         with open(path, "r", encoding="utf-8") as f:
             return json.load(f)
     except Exception:
@@ -53,6 +167,7 @@ def load_products_cache() -> Dict[str, Any] | None:
     if not os.path.isfile(path):
         return None
     try:
+        record_cache_access(path)
         with open(path, "r", encoding="utf-8") as f:
             return json.load(f)
     except Exception:
@@ -66,8 +181,7 @@ def save_products_cache(payload: Dict[str, Any]) -> None:
         enriched = dict(payload)
         if current_user.is_authenticated:
             enriched["_user_id"] = current_user.id
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(enriched, f, ensure_ascii=False)
+        atomic_write_json(path, with_products_index(enriched))
     except Exception:
         pass
 
@@ -83,6 +197,7 @@ def load_articles_cache() -> Dict[str, Any] | None:
     """Загружает кэш артикулов для текущего пользователя"""
     path = _articles_cache_path_for_user()
     try:
+        record_cache_access(path)
         with open(path, "r", encoding="utf-8") as f:
             return json.load(f)
     except FileNotFoundError:
@@ -98,17 +213,22 @@ def save_articles_cache(payload: Dict[str, Any]) -> None:
         enriched = dict(payload)
         if current_user.is_authenticated:
             enriched["_user_id"] = current_user.id
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(enriched, f, ensure_ascii=False)
+        atomic_write_json(path, enriched)
     except Exception:
         pass
 
 
 # Stocks cache helpers (per user)
+def _intern_stock_items(cached: Any) -> None:
+    """Склады, артикулы и баркоды строк остатков — общими объектами (см. utils.interning)."""
+    if isinstance(cached, dict) and isinstance(cached.get("items"), list):
+        intern_rows(cached["items"], STOCK_CATEGORICAL_FIELDS)
+
+
 def _stocks_cache_path_for_user() -> str:
     """Путь к кэшу остатков для текущего пользователя"""
     if current_user.is_authenticated:
-        return os.path.join(CACHE_DIR, f"stocks_user_{current_user.id}.json")
+        return user_cache_path(current_user.id, "stocks")
     return os.path.join(CACHE_DIR, "stocks_anon.json")
 
 
@@ -118,8 +238,11 @@ def load_stocks_cache() -> Dict[str, Any] | None:
     if not os.path.isfile(path):
         return None
     try:
+        record_cache_access(path)
         with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
+            cached = json.load(f)
+        _intern_stock_items(cached)
+        return cached
     except Exception:
         return None
 
@@ -131,19 +254,24 @@ def save_stocks_cache(payload: Dict[str, Any]) -> None:
         enriched = dict(payload)
         if current_user.is_authenticated:
             enriched["_user_id"] = current_user.id
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(enriched, f, ensure_ascii=False)
+        atomic_write_json(path, with_stocks_index(enriched))
+        if current_user.is_authenticated:
+            from utils.stocks_view import save_stocks_view_for_user
+            save_stocks_view_for_user(current_user.id, enriched)
     except Exception:
         pass
 
 
 def load_stocks_cache_for_user(user_id: int) -> Dict[str, Any] | None:
     """Загружает кэш остатков для конкретного пользователя"""
-    path = os.path.join(CACHE_DIR, f"stocks_user_{user_id}.json")
+    path = user_cache_path(user_id, "stocks")
     try:
         if os.path.isfile(path):
+            record_cache_access(path)
             with open(path, "r", encoding="utf-8") as f:
-                return json.load(f)
+                cached = json.load(f)
+            _intern_stock_items(cached)
+            return cached
     except Exception:
         pass
     return None
@@ -151,19 +279,21 @@ def load_stocks_cache_for_user(user_id: int) -> Dict[str, Any] | None:
 
 def save_stocks_cache_for_user(user_id: int, payload: Dict[str, Any]) -> None:
     """Сохраняет кэш остатков для конкретного пользователя"""
-    path = os.path.join(CACHE_DIR, f"stocks_user_{user_id}.json")
+    path = user_cache_path(user_id, "stocks")
     try:
         enriched = dict(payload)
         enriched["_user_id"] = user_id
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(enriched, f, ensure_ascii=False)
+        atomic_write_json(path, with_stocks_index(enriched))
+        # Готовые агрегаты для /stocks и /api/stocks/data (см. utils.stocks_view)
+        from utils.stocks_view import save_stocks_view_for_user
+        save_stocks_view_for_user(user_id, enriched)
     except Exception:
         pass
 
 
 def clear_stocks_cache_for_user(user_id: int) -> None:
     """Очищает кэш остатков для конкретного пользователя"""
-    path = os.path.join(CACHE_DIR, f"stocks_user_{user_id}.json")
+    path = user_cache_path(user_id, "stocks")
     try:
         if os.path.exists(path):
             os.remove(path)
@@ -176,7 +306,7 @@ def clear_stocks_cache_for_user(user_id: int) -> None:
 def _fbs_supplies_cache_path_for_user() -> str:
     """Путь к кэшу поставок FBS для текущего пользователя"""
     if current_user.is_authenticated:
-        return os.path.join(CACHE_DIR, f"fbs_supplies_user_{current_user.id}.json")
+        return user_cache_path(current_user.id, "fbs_supplies")
     return os.path.join(CACHE_DIR, "fbs_supplies_anon.json")
 
 
@@ -186,6 +316,7 @@ def load_fbs_supplies_cache() -> Dict[str, Any] | None:
     if not os.path.isfile(path):
         return None
     try:
+        record_cache_access(path)
         with open(path, "r", encoding="utf-8") as f:
             return json.load(f)
     except Exception:
@@ -199,8 +330,7 @@ def save_fbs_supplies_cache(payload: Dict[str, Any]) -> None:
         enriched = dict(payload)
         if current_user.is_authenticated:
             enriched["_user_id"] = current_user.id
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(enriched, f, ensure_ascii=False)
+        atomic_write_json(path, enriched)
     except Exception:
         pass
 
@@ -209,7 +339,7 @@ def save_fbs_supplies_cache(payload: Dict[str, Any]) -> None:
 def _fbw_supplies_cache_path_for_user() -> str:
     """Путь к кэшу поставок FBW для текущего пользователя"""
     if current_user.is_authenticated:
-        return os.path.join(CACHE_DIR, f"fbw_supplies_user_{current_user.id}.json")
+        return user_cache_path(current_user.id, "fbw_supplies")
     return os.path.join(CACHE_DIR, "fbw_supplies_anon.json")
 
 
@@ -219,6 +349,7 @@ def load_fbw_supplies_cache() -> Dict[str, Any] | None:
     if not os.path.isfile(path):
         return None
     try:
+        record_cache_access(path)
         with open(path, "r", encoding="utf-8") as f:
             return json.load(f)
     except Exception:
@@ -232,8 +363,7 @@ def save_fbw_supplies_cache(payload: Dict[str, Any]) -> None:
         enriched = dict(payload)
         if current_user.is_authenticated:
             enriched["_user_id"] = current_user.id
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(enriched, f, ensure_ascii=False)
+        atomic_write_json(path, enriched)
     except Exception:
         pass
 
@@ -242,11 +372,11 @@ def save_fbw_supplies_cache(payload: Dict[str, Any]) -> None:
 def _fbw_supplies_detailed_cache_path_for_user(user_id: int | None = None) -> str:
     """Путь к детальному кэшу поставок FBW"""
     if user_id is not None:
-        return os.path.join(CACHE_DIR, f"fbw_supplies_detailed_user_{user_id}.json")
+        return user_cache_path(user_id, "fbw_supplies_detailed")
     # fallback без current_user в фоновых задачах
     try:
         if current_user and getattr(current_user, "is_authenticated", False):
-            return os.path.join(CACHE_DIR, f"fbw_supplies_detailed_user_{current_user.id}.json")
+            return user_cache_path(current_user.id, "fbw_supplies_detailed")
     except Exception:
         pass
     return os.path.join(CACHE_DIR, "fbw_supplies_detailed_anon.json")
@@ -268,6 +398,7 @@ def load_fbw_supplies_detailed_cache(user_id: int | None = None) -> Dict[str, An
         pass
     
     try:
+        record_cache_access(path)
         with open(path, "r", encoding="utf-8") as f:
             return json.load(f)
     except Exception as e:
@@ -284,8 +415,7 @@ def save_fbw_supplies_detailed_cache(payload: Dict[str, Any], user_id: int = Non
             enriched["_user_id"] = user_id
         elif current_user.is_authenticated:
             enriched["_user_id"] = current_user.id
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(enriched, f, ensure_ascii=False, indent=2)
+        atomic_write_json(path, enriched, indent=2)
     except Exception:
         pass
 
@@ -312,9 +442,9 @@ def is_supplies_cache_fresh() -> bool:
 def _orders_cache_meta_path_for_user(user_id: int = None) -> str:
     """Путь к метаданным кэша заказов"""
     if user_id:
-        return os.path.join(CACHE_DIR, f"orders_warm_meta_user_{user_id}.json")
+        return user_cache_path(user_id, "orders_warm_meta")
     elif current_user.is_authenticated:
-        return os.path.join(CACHE_DIR, f"orders_warm_meta_user_{current_user.id}.json")
+        return user_cache_path(current_user.id, "orders_warm_meta")
     return os.path.join(CACHE_DIR, "orders_warm_meta_anon.json")
 
 
@@ -334,6 +464,7 @@ def load_orders_cache_meta(user_id: int = None) -> Dict[str, Any] | None:
         pass
     
     try:
+        record_cache_access(path)
         with open(path, "r", encoding="utf-8") as f:
             return json.load(f)
     except Exception as e:
@@ -350,8 +481,7 @@ def save_orders_cache_meta(payload: Dict[str, Any], user_id: int = None) -> None
             enriched["_user_id"] = user_id
         elif current_user.is_authenticated:
             enriched["_user_id"] = current_user.id
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(enriched, f, ensure_ascii=False, indent=2)
+        atomic_write_json(path, enriched, indent=2)
     except Exception:
         pass
 
@@ -375,9 +505,9 @@ def is_orders_cache_fresh(user_id: int = None) -> bool:
 def _orders_period_cache_path_for_user(user_id: int = None) -> str:
     """Путь к периодическому кэшу заказов"""
     if user_id:
-        return os.path.join(CACHE_DIR, f"orders_period_user_{user_id}.json")
+        return user_cache_path(user_id, "orders_period")
     elif current_user.is_authenticated:
-        return os.path.join(CACHE_DIR, f"orders_period_user_{current_user.id}.json")
+        return user_cache_path(current_user.id, "orders_period")
     return os.path.join(CACHE_DIR, f"orders_period_{_get_session_id()}.json")
 
 
@@ -389,6 +519,7 @@ def load_orders_period_cache(user_id: int = None) -> Dict[str, Any] | None:
         print("Файл кэша не найден")
         return None
     try:
+        record_cache_access(path)
         with open(path, "r", encoding="utf-8") as f:
             data = json.load(f)
             days_count = len(data.get('days', {}))
@@ -410,8 +541,7 @@ def save_orders_period_cache(payload: Dict[str, Any], user_id: int = None) -> No
             enriched["_user_id"] = current_user.id
         print(f"Сохраняем кэш в файл: {path}")
         print(f"Количество дней для сохранения: {len(enriched.get('days', {}))}")
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(enriched, f, ensure_ascii=False)
+        atomic_write_json(path, enriched)
         print("Кэш успешно сохранен")
     except Exception as e:
         print(f"Ошибка сохранения кэша: {e}")
@@ -421,7 +551,7 @@ def save_orders_period_cache(payload: Dict[str, Any], user_id: int = None) -> No
 def _fbs_tasks_cache_path_for_user() -> str:
     """Путь к кэшу задач FBS для текущего пользователя"""
     if current_user.is_authenticated:
-        return os.path.join(CACHE_DIR, f"fbs_tasks_user_{current_user.id}.json")
+        return user_cache_path(current_user.id, "fbs_tasks")
     return os.path.join(CACHE_DIR, "fbs_tasks_anon.json")
 
 
@@ -431,6 +561,7 @@ def load_fbs_tasks_cache() -> Dict[str, Any] | None:
     if not os.path.isfile(path):
         return None
     try:
+        record_cache_access(path)
         with open(path, "r", encoding="utf-8") as f:
             return json.load(f)
     except Exception:
@@ -439,12 +570,13 @@ def load_fbs_tasks_cache() -> Dict[str, Any] | None:
 
 def load_fbs_tasks_cache_by_user_id(user_id: int) -> Dict[str, Any] | None:
     """Load FBS tasks cache by user ID (for background threads)"""
-    path = os.path.join(CACHE_DIR, f"fbs_tasks_user_{user_id}.json")
+    path = user_cache_path(user_id, "fbs_tasks")
     print(f"Loading FBS tasks cache from: {path}")
     if not os.path.isfile(path):
         print(f"FBS tasks cache file not found: {path}")
         return None
     try:
+        record_cache_access(path)
         with open(path, "r", encoding="utf-8") as f:
             data = json.load(f)
             print(f"FBS tasks cache loaded successfully, {len(data.get('rows', []))} tasks found")
@@ -461,53 +593,130 @@ def save_fbs_tasks_cache(payload: Dict[str, Any]) -> None:
         enriched = dict(payload)
         if current_user.is_authenticated:
             enriched["_user_id"] = current_user.id
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(enriched, f, ensure_ascii=False)
+        atomic_write_json(path, enriched)
     except Exception:
         pass
 
 
+def _last_results_dir_for_user() -> str:
+    """Папка last_results текущего пользователя (снимки save_last_results)."""
+    if current_user.is_authenticated:
+        return user_cache_path(current_user.id, "last_results", is_dir=True)
+    return os.path.join(CACHE_DIR, f"last_results_{_get_session_id()}")
+
+
+def _last_results_dir_for_user_id(user_id: int) -> str:
+    """Папка секций last_results для конкретного пользователя"""
+    return user_cache_path(user_id, "last_results", is_dir=True)
+
+
+_SECTION_NAME_RE = re.compile(r"^[A-Za-z0-9_\-]+$")
+# Снимок одного сохранения: snapshot-<хэш набора ключей>.json
+_SNAPSHOT_PREFIX = "snapshot-"
+
+
+def _last_results_section_path(sections_dir: str, key: str) -> str | None:
+    """Файл секции прежней раскладки (один ключ = один файл); None — если ключ нельзя безопасно превратить в имя файла."""
+    if not isinstance(key, str) or not _SECTION_NAME_RE.match(key):
+        return None
+    return os.path.join(sections_dir, f"{key}.json")
+
+
+def _last_results_snapshot_path(sections_dir: str, keys) -> str:
+    """Файл снимка для набора ключей: одна и та же страница всегда пишет в один и тот же файл."""
+    digest = hashlib.sha1("\n".join(sorted(str(k) for k in keys)).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(sections_dir, f"{_SNAPSHOT_PREFIX}{digest}.json")
+
+
 def load_last_results() -> Dict[str, Any] | None:
-    """Загружает последние результаты из кэша"""
-    path = _cache_path_for_user()
-    if not os.path.isfile(path):
+    """Загружает последние результаты из кэша.
+
+    Базой служит старый единый файл orders_user_*.json (если ещё не перенесён первым
+    save_last_results), поверх него — секции прежней раскладки (<ключ>.json), поверх них —
+    снимки save_last_results (snapshot-*.json) от старых к новым. Ключи одного снимка
+    всегда из одного сохранения. Старый файл в лимит размера не входит.
+    """
+    legacy_path = _cache_path_for_user()
+    sections_dir = _last_results_dir_for_user()
+
+    section_files: list[tuple[str, str]] = []
+    snapshot_files: list[str] = []
+    try:
+        if os.path.isdir(sections_dir):
+            for name in os.listdir(sections_dir):
+                if not name.endswith(".json") or name.startswith("."):
+                    continue
+                if name.startswith(_SNAPSHOT_PREFIX):
+                    snapshot_files.append(os.path.join(sections_dir, name))
+                else:
+                    section_files.append((name[: -len(".json")], os.path.join(sections_dir, name)))
+    except Exception:
+        section_files = []
+        snapshot_files = []
+    has_legacy = os.path.isfile(legacy_path)
+    if not has_legacy and not section_files and not snapshot_files:
         return None
-    
-    # Проверяем размер файла (снимок заказов может быть большим — см. LAST_RESULTS_CACHE_MAX_BYTES)
+
+    # Проверяем суммарный размер (снимок заказов может быть большим — см. LAST_RESULTS_CACHE_MAX_BYTES)
     try:
-        file_size = os.path.getsize(path)
-        if file_size > LAST_RESULTS_CACHE_MAX_BYTES:
+        total_size = 0
+        for _, section_path in section_files:
+            total_size += os.path.getsize(section_path)
+        for snapshot_path in snapshot_files:
+            total_size += os.path.getsize(snapshot_path)
+        if total_size > LAST_RESULTS_CACHE_MAX_BYTES:
             lim_mb = LAST_RESULTS_CACHE_MAX_BYTES / (1024 * 1024)
             print(
-                f"Файл last_results слишком большой ({file_size / 1024 / 1024:.1f} MB, лимит {lim_mb:.0f} MB), "
+                f"Файл last_results слишком большой ({total_size / 1024 / 1024:.1f} MB, лимит {lim_mb:.0f} MB), "
                 f"пропускаем загрузку (см. FUCKBERRY_LAST_RESULTS_MAX_MB)"
             )
             return None
     except Exception:
         pass
-    
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception as e:
-        print(f"Ошибка загрузки кэша: {e}")
-        return None
+
+    result: Dict[str, Any] = {}
+    if has_legacy:
+        try:
+            record_cache_access(legacy_path)
+            with open(legacy_path, "r", encoding="utf-8") as f:
+                legacy = json.load(f)
+            if isinstance(legacy, dict):
+                result.update(legacy)
+        except Exception as e:
+            print(f"Ошибка загрузки кэша: {e}")
+    for key, section_path in section_files:
+        try:
+            record_cache_access(section_path)
+            with open(section_path, "r", encoding="utf-8") as f:
+                result[key] = json.load(f)
+        except Exception as e:
+            print(f"Ошибка загрузки секции кэша {key}: {e}")
+    snapshots: list[tuple[int, Dict[str, Any]]] = []
+    for snapshot_path in snapshot_files:
+        try:
+            record_cache_access(snapshot_path)
+            with open(snapshot_path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            if isinstance(snapshot, dict) and isinstance(snapshot.get("data"), dict):
+                snapshots.append((int(snapshot.get("saved_at") or 0), snapshot["data"]))
+        except Exception as e:
+            print(f"Ошибка загрузки снимка кэша {os.path.basename(snapshot_path)}: {e}")
+    for _, data in sorted(snapshots, key=lambda item: item[0]):
+        result.update(data)
+    if isinstance(result.get("orders"), list):
+        intern_rows(result["orders"])
+    return result or None
 
 
 def save_last_results(payload: Dict[str, Any]) -> None:
     """
-    Сохраняет результаты в кэш, объединяя с существующими данными.
-    Это позволяет сохранять данные для разных страниц (заказы, финансовый отчет) без перезаписи друг друга.
+    Сохраняет результаты в кэш: всё, что передано одним вызовом, пишется атомарно одним
+    снимком (заказы и посчитанные по ним агрегаты не могут оказаться из разных сохранений).
+    Снимки с другим набором ключей (данные других страниц) не читаются и не перезаписываются.
     """
-    path = _cache_path_for_user()
-    try:
-        # Загружаем существующий кэш, если он есть
-        existing_cache = load_last_results() or {}
-        
-        # Объединяем существующий кэш с новыми данными (новые данные имеют приоритет)
-        enriched = dict(existing_cache)
-        enriched.update(payload)
-        
+    sections_dir = _last_results_dir_for_user()
+    try:
+        enriched = dict(payload)
         try:
             if current_user.is_authenticated:
                 enriched["_user_id"] = current_user.id
@@ -515,10 +724,56 @@ def save_last_results(payload: Dict[str, Any]) -> None:
         except Exception:
             # If current_user unavailable outside request context, ignore
             pass
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(enriched, f, ensure_ascii=False)
-    except Exception:
-        pass
+        os.makedirs(sections_dir, exist_ok=True)
+        atomic_write_json(
+            _last_results_snapshot_path(sections_dir, enriched.keys()),
+            {"saved_at": time.time_ns(), "data": enriched},
+        )
+        _migrate_legacy_last_results(sections_dir, enriched.keys())
+        # Секции прежней раскладки с этими ключами больше не нужны (снимок новее их)
+        for key in enriched:
+            section_path = _last_results_section_path(sections_dir, key)
+            if section_path is not None and os.path.isfile(section_path):
+                try:
+                    os.remove(section_path)
+                except OSError:
+                    pass
+    except Exception as e:
+        print(f"Ошибка сохранения last_results: {e}")
+
+
+def _migrate_legacy_last_results(sections_dir: str, saved_keys) -> None:
+    """Переносит старый единый файл в снимок (ключи, не перезаписанные сохранением) и удаляет его."""
+    legacy_path = _cache_path_for_user()
+    if not os.path.isfile(legacy_path):
+        return
+    try:
+        legacy_mtime_ns = os.stat(legacy_path).st_mtime_ns
+        with open(legacy_path, "r", encoding="utf-8") as f:
+            legacy = json.load(f)
+        rest = {k: v for k, v in legacy.items() if k not in saved_keys} if isinstance(legacy, dict) else {}
+        if rest:
+            # Снимок старше только что сохранённого — при загрузке его ключи не перекроют новые
+            atomic_write_json(
+                _last_results_snapshot_path(sections_dir, rest.keys()),
+                {"saved_at": legacy_mtime_ns, "data": rest},
+            )
+        os.remove(legacy_path)
+    except Exception as e:
+        print(f"Ошибка переноса старого last_results {legacy_path}: {e}")
+
+
+def clear_last_results_for_user(user_id: int) -> None:
+    """Удаляет last_results пользователя: старый единый файл и папку секций."""
+    try:
+        legacy_path = _cache_path_for_user_id(user_id)
+        if os.path.isfile(legacy_path):
+            os.remove(legacy_path)
+        sections_dir = _last_results_dir_for_user_id(user_id)
+        if os.path.isdir(sections_dir):
+            shutil.rmtree(sections_dir, ignore_errors=True)
+    except Exception as e:
+        print(f"Error clearing last_results for user {user_id}: {e}")
 
 
 # --- Orders cache processing functions ---
@@ -565,10 +820,19 @@ def get_orders_with_period_cache(
     date_to: str,
     *,
     bypass_today_ttl: bool = False,
+    with_rollups: bool = False,
+    nm_id: Any = None,
+    barcode: Any = None,
 ) -> tuple[list[dict[str, Any]], dict[str, Any]]:
     """Возвращает (orders, cache_meta). Использует кэш по дням и загружает только отсутствующие дни.
 
     bypass_today_ttl: если True — день «сегодня» всегда тянется с WB (игнор TTL свежести).
+    with_rollups: если True — в cache_meta["day_rollups"] дневные свёртки возвращённых дней
+    (в порядке строк orders), чтобы дашборд считал итоги без прохода по заказам.
+    nm_id: если задан — только заказы этого товара (Артикул WB). Для дней из кэша строки
+    берутся по индексу by_nm свёртки дня, остальные строки дня не нормализуются.
+    barcode: то же по баркоду (индекс by_barcode); вместе с nm_id — строки, подходящие под оба.
+    Свёртки в day_rollups при этом остаются свёртками всего дня.
     """
     from collections import defaultdict
     from utils.api import fetch_orders_range
@@ -661,10 +925,10 @@ def get_orders_with_period_cache(
             )
             normalized["is_cancelled"] = cancel_raw is True or str(cancel_raw).lower() in ("true", "1", "истина")
 
-        return normalized
+        return intern_row(normalized)
 
-    def _cached_orders(entry: Dict[str, Any]) -> list[dict[str, Any]]:
-        """Извлекает список заказов из записи кэша дня"""
+    def _raw_cached_orders(entry: Dict[str, Any]) -> list[dict[str, Any]]:
+        """Сырые строки заказов записи кэша дня (позиции by_nm свёртки — по этому списку)"""
         if not isinstance(entry, dict):
             return []
         val = (
@@ -675,11 +939,55 @@ def get_orders_with_period_cache(
         )
         if not isinstance(val, list):
             return []
-        return [_normalize_order_row_cached(v) for v in val if isinstance(v, dict)]
+        return [v for v in val if isinstance(v, dict)]
+
+    def _cached_orders(entry: Dict[str, Any]) -> list[dict[str, Any]]:
+        """Извлекает список заказов из записи кэша дня"""
+        return [_normalize_order_row_cached(v) for v in _raw_cached_orders(entry)]
+
+    nm_key = str(nm_id) if nm_id is not None else None
+    bc_key = str(barcode) if barcode is not None else None
+    selective = nm_key is not None or bc_key is not None
+
+    def _is_selected(row: Dict[str, Any]) -> bool:
+        if nm_key is not None and str(row.get("Артикул WB") or row.get("nmId") or row.get("nmID")) != nm_key:
+            return False
+        return bc_key is None or str(row.get("Баркод") or "") == bc_key
+
+    def _selected_positions(rollup: Dict[str, Any]) -> list[int]:
+        """Позиции строк дня по индексам свёртки (в порядке строк дня)."""
+        positions = None
+        if nm_key is not None:
+            positions = (rollup.get("by_nm") or {}).get(nm_key) or []
+        if bc_key is not None:
+            bc_positions = (rollup.get("by_barcode") or {}).get(bc_key) or []
+            positions = bc_positions if positions is None else sorted(set(positions) & set(bc_positions))
+        return positions or []
+
+    collected_rollups: list[dict[str, Any]] = []
+    rollups_backfilled = 0
     for day in requested_days:
         entry = days_map.get(day)
         if entry and day not in days_to_fetch:
-            collected_orders.extend(_cached_orders(entry))
+            rollup = _period_day_entry_rollup(entry)
+            if rollup is None:
+                # Запись из старого формата кэша — считаем свёртку один раз и сохраняем
+                day_orders = _cached_orders(entry)
+                rollup = _attach_period_day_rollup(entry, day_orders)
+                rollups_backfilled += 1
+                if selective:
+                    day_orders = [r for r in day_orders if _is_selected(r)]
+            elif selective:
+                raw_rows = _raw_cached_orders(entry)
+                day_orders = [
+                    _normalize_order_row_cached(raw_rows[pos])
+                    for pos in _selected_positions(rollup)
+                    if pos < len(raw_rows)
+                ]
+            else:
+                day_orders = _cached_orders(entry)
+            collected_orders.extend(day_orders)
+            collected_rollups.append(rollup)
 
     # Fetch missing days in one period request and split per day
     total_days = len(days_to_fetch)
@@ -712,6 +1020,10 @@ def get_orders_with_period_cache(
                     "orders": fetched_orders,
                     "updated_at": datetime.now(MOSCOW_TZ).strftime("%d.%m.%Y %H:%M:%S"),
                 }
+                # Свёртку пересчитываем только для дней, которые реально перезагрузили
+                collected_rollups.append(_attach_period_day_rollup(days_map[day], fetched_orders))
+                if selective:
+                    fetched_orders = [r for r in fetched_orders if _is_selected(r)]
                 collected_orders.extend(fetched_orders)
                 done_days += 1
                 if current_user and current_user.is_authenticated:
@@ -720,8 +1032,8 @@ def get_orders_with_period_cache(
             print(f"Ошибка единой загрузки заказов: {e}")
 
     # Persist cache file if any changes were made
-    if days_to_fetch:
-        print(f"Сохраняем кэш для дней: {days_to_fetch}")
+    if days_to_fetch or rollups_backfilled:
+        print(f"Сохраняем кэш для дней: {days_to_fetch} (досчитано свёрток: {rollups_backfilled})")
         cache["days"] = days_map
         save_orders_period_cache(cache)
         print(f"Кэш сохранен. Всего дней в кэше: {len(days_map)}")
@@ -732,9 +1044,35 @@ def get_orders_with_period_cache(
         clear_orders_progress(current_user.id, key=progress_key)
 
     meta = {"used_cache_days": len(requested_days) - len(days_to_fetch), "fetched_days": len(days_to_fetch)}
+    if with_rollups:
+        meta["day_rollups"] = collected_rollups
     return collected_orders, meta
 
 
+def _period_day_entry_rollup(entry: Dict[str, Any]) -> Dict[str, Any] | None:
+    """Свёртка записи дня, если она актуальна (та же версия и тот же updated_at, что у заказов)."""
+    from utils.orders_processing import ORDERS_DAY_ROLLUP_VERSION
+
+    rollup = entry.get("rollup") if isinstance(entry, dict) else None
+    if not isinstance(rollup, dict):
+        return None
+    if rollup.get("v") != ORDERS_DAY_ROLLUP_VERSION:
+        return None
+    if rollup.get("updated_at") != entry.get("updated_at"):
+        return None
+    return rollup
+
+
+def _attach_period_day_rollup(entry: Dict[str, Any], orders: list[dict[str, Any]]) -> Dict[str, Any]:
+    """Считает свёртку дня по его заказам и кладёт в запись кэша."""
+    from utils.orders_processing import build_orders_day_rollup
+
+    rollup = build_orders_day_rollup(orders)
+    rollup["updated_at"] = entry.get("updated_at")
+    entry["rollup"] = rollup
+    return rollup
+
+
 def update_period_cache_with_data(
     token: str,
     date_from: str,
@@ -766,6 +1104,7 @@ def update_period_cache_with_data(
             "orders": orders_by_day.get(day, []),
             "updated_at": datetime.now(MOSCOW_TZ).strftime("%d.%m.%Y %H:%M:%S"),
         }
+        _attach_period_day_rollup(days_map[day], days_map[day]["orders"])
     
     # Сохраняем обновленный кэш
     cache["days"] = days_map
@@ -808,6 +1147,7 @@ def load_dbs_active_ids() -> Dict[str, Any]:
     _ensure_dbs_cache_dir()
     path = os.path.join(CACHE_DIR, "dbs_active_ids.json")
     try:
+        record_cache_access(path)
         with open(path, "r", encoding="utf-8") as f:
             return json.load(f)
     except Exception:
@@ -819,8 +1159,7 @@ def save_dbs_active_ids(data: Dict[str, Any]) -> None:
     _ensure_dbs_cache_dir()
     path = os.path.join(CACHE_DIR, "dbs_active_ids.json")
     try:
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False)
+        atomic_write_json(path, data)
     except Exception:
         pass
 
@@ -846,6 +1185,7 @@ def load_dbs_known_orders() -> Dict[str, Any]:
     _ensure_dbs_cache_dir()
     path = os.path.join(CACHE_DIR, "dbs_known_orders.json")
     try:
+        record_cache_access(path)
         with open(path, "r", encoding="utf-8") as f:
             return json.load(f)
     except Exception:
@@ -857,8 +1197,7 @@ def save_dbs_known_orders(data: Dict[str, Any]) -> None:
     _ensure_dbs_cache_dir()
     path = os.path.join(CACHE_DIR, "dbs_known_orders.json")
     try:
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False)
+        atomic_write_json(path, data)
     except Exception:
         pass
 
@@ -887,7 +1226,7 @@ def add_dbs_known_orders(orders: list[dict[str, Any]]) -> None:
 def _fbs_stock_cache_path_for_user() -> str:
     """Путь к кэшу остатков FBS для текущего пользователя"""
     if current_user.is_authenticated:
-        return os.path.join(CACHE_DIR, f"fbs_stock_user_{current_user.id}.json")
+        return user_cache_path(current_user.id, "fbs_stock")
     return os.path.join(CACHE_DIR, f"fbs_stock_{_get_session_id()}.json")
 
 
@@ -897,6 +1236,7 @@ def load_fbs_stock_cache() -> Dict[str, Any] | None:
     if not os.path.isfile(path):
         return None
     try:
+        record_cache_access(path)
         with open(path, "r", encoding="utf-8") as f:
             return json.load(f)
     except Exception:
@@ -910,8 +1250,7 @@ def save_fbs_stock_cache(payload: Dict[str, Any]) -> None:
         enriched = dict(payload)
         if current_user.is_authenticated:
             enriched["_user_id"] = current_user.id
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(enriched, f, ensure_ascii=False)
+        atomic_write_json(path, enriched)
     except Exception:
         pass
 
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""Раскладка CACHE_DIR по пользователям: cache/users/<id>/<тип>.json и индекс фоновых функций."""
+import json
+import os
+import re
+import shutil
+import threading
+from typing import Any, Dict, List
+
+from utils.constants import CACHE_DIR
+
+USERS_CACHE_DIR = os.path.join(CACHE_DIR, "users")
+FEATURE_INDEX_PATH = os.path.join(USERS_CACHE_DIR, "features.json")
+
+# Фоновые функции, по которым ведётся индекс пользователей
+FEATURE_AUTO_UPDATE = "auto_update"
+
+# Тип кэша -> шаблон старого плоского имени в CACHE_DIR
+_LEGACY_NAMES: Dict[str, str] = {
+    "orders": "orders_user_{id}.json",
+    "last_results": "last_results_user_{id}",
+    "products": "products_user_{id}.json",
+    "stocks": "stocks_user_{id}.json",
+    "fbs_supplies": "fbs_supplies_user_{id}.json",
+    "fbw_supplies": "fbw_supplies_user_{id}.json",
+    "fbw_supplies_detailed": "fbw_supplies_detailed_user_{id}.json",
+    "orders_warm_meta": "orders_warm_meta_user_{id}.json",
+    "orders_period": "orders_period_user_{id}.json",
+    "fbs_tasks": "fbs_tasks_user_{id}.json",
+    "fbs_stock": "fbs_stock_user_{id}.json",
+    "seller_info": "seller_info_user_{id}.json",
+    "sales_period": "sales_period_user_{id}.json",
+    "finance_srid": "finance_srid_user_{id}.json",
+    "order_status_history": "order_status_history_user_{id}.json",
+    "auto_update_settings": "auto_update_settings_user_{id}.json",
+    "fbs_notifications": "fbs_notifications_user_{id}.json",
+    "dbs_notifications": "dbs_notifications_user_{id}.json",
+    "margin_settings": "margin_settings_{id}.json",
+}
+
+# Обратное соответствие: regex старого имени -> тип кэша
+_LEGACY_PATTERNS = [
+    (re.compile("^" + re.escape(tpl).replace(r"\{id\}", r"(\d+)") + "$"), cache_type)
+    for cache_type, tpl in _LEGACY_NAMES.items()
+]
+
+_layout_lock = threading.Lock()
+# (user_id, тип), для которых уже проверен перенос старого файла
+_migrated: set[tuple[int, str]] = set()
+
+_features_lock = threading.Lock()
+_features: Dict[str, set[int]] | None = None
+_features_mtime: float | None = None
+
+
+def user_cache_dir(user_id: int) -> str:
+    """Папка кэша пользователя (создаётся при необходимости)."""
+    path = os.path.join(USERS_CACHE_DIR, str(int(user_id)))
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _migrate_legacy_entry(user_id: int, cache_type: str, new_path: str) -> bool:
+    """Переносит старый плоский файл/папку на новое место, если нового ещё нет."""
+    tpl = _LEGACY_NAMES.get(cache_type)
+    if not tpl:
+        return False
+    legacy_path = os.path.join(CACHE_DIR, tpl.format(id=int(user_id)))
+    if not os.path.exists(legacy_path):
+        return False
+    if os.path.exists(new_path):
+        # Новая версия уже есть — старый файл устарел
+        print(f"Кэш {cache_type} пользователя {user_id}: старый файл {legacy_path} оставлен (есть новый)")
+        return False
+    try:
+        os.replace(legacy_path, new_path)
+        return True
+    except Exception as e:
+        print(f"Не удалось перенести кэш {legacy_path}: {e}")
+        return False
+
+
+def user_cache_path(user_id: int, cache_type: str, *, is_dir: bool = False) -> str:
+    """Путь к кэшу типа cache_type пользователя user_id: users/<id>/<тип>.json.
+
+    is_dir=True — для кэшей-папок (секции last_results). При первом обращении в процессе
+    подхватывает старый плоский файл, если он остался.
+    """
+    uid = int(user_id)
+    name = cache_type if is_dir else f"{cache_type}.json"
+    path = os.path.join(USERS_CACHE_DIR, str(uid), name)
+    key = (uid, cache_type)
+    if key not in _migrated:
+        with _layout_lock:
+            if key not in _migrated:
+                user_cache_dir(uid)
+                _migrate_legacy_entry(uid, cache_type, path)
+                _migrated.add(key)
+    return path
+
+
+def list_cache_user_ids() -> List[int]:
+    """ID пользователей, у которых есть папка кэша (одно чтение users/, без обхода файлов)."""
+    try:
+        return sorted(int(name) for name in os.listdir(USERS_CACHE_DIR) if name.isdigit())
+    except FileNotFoundError:
+        return []
+
+
+def remove_user_cache(user_id: int) -> None:
+    """Удаляет весь кэш пользователя (папку + старые плоские файлы) и его записи в индексе функций."""
+    uid = int(user_id)
+    try:
+        shutil.rmtree(os.path.join(USERS_CACHE_DIR, str(uid)), ignore_errors=True)
+        for cache_type, tpl in _LEGACY_NAMES.items():
+            legacy_path = os.path.join(CACHE_DIR, tpl.format(id=uid))
+            if os.path.isdir(legacy_path):
+                shutil.rmtree(legacy_path, ignore_errors=True)
+            elif os.path.exists(legacy_path):
+                os.remove(legacy_path)
+    except Exception as e:
+        print(f"Ошибка удаления кэша пользователя {uid}: {e}")
+    with _layout_lock:
+        for key in [k for k in _migrated if k[0] == uid]:
+            _migrated.discard(key)
+    with _features_lock:
+        features = _load_features_locked()
+        changed = False
+        for users in features.values():
+            if uid in users:
+                users.discard(uid)
+                changed = True
+        if changed:
+            _save_features_locked(features)
+
+
+# --- Индекс фоновых функций ---
+
+def _load_features_locked() -> Dict[str, set[int]]:
+    global _features, _features_mtime
+    try:
+        mtime = os.path.getmtime(FEATURE_INDEX_PATH)
+    except OSError:
+        mtime = None
+    if _features is not None and mtime == _features_mtime:
+        return _features
+    loaded: Dict[str, set[int]] = {}
+    if mtime is not None:
+        try:
+            with open(FEATURE_INDEX_PATH, "r", encoding="utf-8") as f:
+                data = json.load(f) or {}
+            for feature, ids in (data.get("features") or {}).items():
+                loaded[str(feature)] = {int(x) for x in ids or []}
+        except Exception as e:
+            print(f"Ошибка чтения индекса функций кэша: {e}")
+    _features = loaded
+    _features_mtime = mtime
+    return loaded
+
+
+def _save_features_locked(features: Dict[str, set[int]]) -> None:
+    global _features_mtime
+    from utils.cache import atomic_write_json
+
+    os.makedirs(USERS_CACHE_DIR, exist_ok=True)
+    payload = {"features": {k: sorted(v) for k, v in features.items()}}
+    try:
+        atomic_write_json(FEATURE_INDEX_PATH, payload)
+        _features_mtime = os.path.getmtime(FEATURE_INDEX_PATH)
+    except Exception as e:
+        print(f"Ошибка сохранения индекса функций кэша: {e}")
+
+
+def feature_index_exists() -> bool:
+    return os.path.isfile(FEATURE_INDEX_PATH)
+
+
+def set_user_feature(user_id: int, feature: str, enabled: bool) -> None:
+    """Отмечает в индексе, что у пользователя включена/выключена фоновая функция."""
+    uid = int(user_id)
+    if not feature_index_exists():
+        # Первая запись — сначала собираем индекс по всем пользователям, иначе в нём будет только этот
+        rebuild_feature_index()
+    with _features_lock:
+        features = _load_features_locked()
+        users = features.setdefault(feature, set())
+        if enabled == (uid in users) and feature_index_exists():
+            return
+        if enabled:
+            users.add(uid)
+        else:
+            users.discard(uid)
+        _save_features_locked(features)
+
+
+def users_with_feature(feature: str) -> List[int]:
+    """ID пользователей с включённой функцией — без обхода CACHE_DIR."""
+    with _features_lock:
+        return sorted(_load_features_locked().get(feature, set()))
+
+
+def auto_update_enabled(settings: Dict[str, Any]) -> bool:
+    """Включено ли автообновление остатков в настройках (старый и новый формат)."""
+    if not isinstance(settings, dict):
+        return False
+    global_settings = settings.get("global", settings)
+    return bool((global_settings or {}).get("enabled"))
+
+
+def rebuild_feature_index() -> Dict[str, List[int]]:
+    """Пересобирает индекс функций по настройкам в папках пользователей (разовый обход)."""
+    features: Dict[str, set[int]] = {FEATURE_AUTO_UPDATE: set()}
+    # Настройки, ещё лежащие в старой плоской раскладке, сначала переносим
+    try:
+        for name in os.listdir(CACHE_DIR):
+            parsed = parse_legacy_cache_name(name)
+            if parsed and parsed[0] == "auto_update_settings":
+                user_cache_path(parsed[1], "auto_update_settings")
+    except FileNotFoundError:
+        pass
+    for uid in list_cache_user_ids():
+        path = os.path.join(USERS_CACHE_DIR, str(uid), "auto_update_settings.json")
+        if not os.path.isfile(path):
+            continue
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                if auto_update_enabled(json.load(f)):
+                    features[FEATURE_AUTO_UPDATE].add(uid)
+        except Exception as e:
+            print(f"Ошибка чтения настроек автообновления пользователя {uid}: {e}")
+    with _features_lock:
+        _save_features_locked(features)
+        global _features
+        _features = features
+    return {k: sorted(v) for k, v in features.items()}
+
+
+# --- Разовая миграция плоской раскладки ---
+
+def parse_legacy_cache_name(name: str) -> tuple[str, int] | None:
+    """(тип кэша, user_id) для старого плоского имени или None."""
+    for pattern, cache_type in _LEGACY_PATTERNS:
+        m = pattern.match(name)
+        if m:
+            return cache_type, int(m.group(1))
+    return None
+
+
+def migrate_flat_cache_layout(dry_run: bool = False) -> Dict[str, Any]:
+    """Переносит все пользовательские файлы из корня CACHE_DIR в users/<id>/ и строит индекс функций."""
+    moved: List[str] = []
+    skipped: List[str] = []
+    try:
+        names = sorted(os.listdir(CACHE_DIR))
+    except FileNotFoundError:
+        names = []
+    for name in names:
+        parsed = parse_legacy_cache_name(name)
+        if not parsed:
+            continue
+        cache_type, uid = parsed
+        is_dir = cache_type == "last_results"
+        new_path = os.path.join(USERS_CACHE_DIR, str(uid), cache_type if is_dir else f"{cache_type}.json")
+        if os.path.exists(new_path):
+            skipped.append(name)
+            continue
+        if dry_run:
+            moved.append(name)
+            continue
+        with _layout_lock:
+            _migrated.discard((uid, cache_type))
+        # user_cache_path сам переносит старый файл при первом обращении
+        user_cache_path(uid, cache_type, is_dir=is_dir)
+        if os.path.exists(os.path.join(CACHE_DIR, name)):
+            skipped.append(name)
+        else:
+            moved.append(name)
+    features = {} if dry_run else rebuild_feature_index()
+    return {"moved": moved, "skipped": skipped, "features": features}
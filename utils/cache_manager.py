@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+"""Учёт размера CACHE_DIR и вытеснение холодных кэшей по квоте (LRU)."""
+import os
+import re
+import shutil
+import threading
+import time
+from typing import Any, Dict, List
+
+from utils.constants import CACHE_DIR, CACHE_QUOTA_BYTES
+
+# Файл с временем последнего обращения к кэшам (относительный путь -> unix ts)
+_ACCESS_INDEX_NAME = "cache_access_index.json"
+# Как часто сбрасывать индекс обращений на диск (сек)
+_ACCESS_FLUSH_INTERVAL_S = 60.0
+# Сколько переиспользовать обход CACHE_DIR для сводки использования (страница профиля
+# опрашивает её каждые 5 с, а обход — stat каждого файла кэша), сек
+_USAGE_SCAN_TTL_S = 60.0
+# Служебные файлы самого учёта кэша: в индекс обращений и LRU не попадают
+_BOOKKEEPING_KEYS = {_ACCESS_INDEX_NAME, os.path.join("users", "features.json")}
+
+# (regex по имени файла/папки в CACHE_DIR, тип кэша, можно ли вытеснять)
+# Вытесняются только кэши, которые пересобираются из WB API. Настройки, состояние
+# уведомлений и наблюдаемая история статусов не восстанавливаются — их не трогаем.
+_CACHE_TYPES: list[tuple[re.Pattern, str, bool]] = [
+    (re.compile(r"^last_results_user_(\d+)$"), "last_results", True),
+    (re.compile(r"^orders_user_(\d+)\.json$"), "last_results", True),
+    (re.compile(r"^orders_period_user_(\d+)\.json$"), "orders_period", True),
+    (re.compile(r"^orders_warm_meta_user_(\d+)\.json$"), "orders_warm_meta", True),
+    (re.compile(r"^sales_period_user_(\d+)\.json$"), "sales_period", True),
+    (re.compile(r"^finance_srid_user_(\d+)\.json$"), "finance_srid", True),
+    (re.compile(r"^products_user_(\d+)\.json$"), "products", True),
+    (re.compile(r"^stocks_user_(\d+)\.json$"), "stocks", True),
+    (re.compile(r"^fbs_tasks_user_(\d+)\.json$"), "fbs_tasks", True),
+    (re.compile(r"^fbs_stock_user_(\d+)\.json$"), "fbs_stock", True),
+    (re.compile(r"^fbs_supplies_user_(\d+)\.json$"), "fbs_supplies", True),
+    (re.compile(r"^fbw_supplies_user_(\d+)\.json$"), "fbw_supplies", True),
+    (re.compile(r"^fbw_supplies_detailed_user_(\d+)\.json$"), "fbw_supplies_detailed", True),
+    (re.compile(r"^seller_info_user_(\d+)\.json$"), "seller_info", True),
+    (re.compile(r"^margin_settings_(\d+)\.json$"), "margin_settings", False),
+    (re.compile(r"^auto_update_settings_user_(\d+)\.json$"), "auto_update_settings", False),
+    (re.compile(r"^fbs_notifications_user_(\d+)\.json$"), "fbs_notifications", False),
+    (re.compile(r"^dbs_notifications_user_(\d+)\.json$"), "dbs_notifications", False),
+    (re.compile(r"^order_status_history_user_(\d+)\.json$"), "order_status_history", False),
+]
+
+# Типы в раскладке users/<id>/<тип>.json, которые можно вытеснять (пересобираются из WB API)
+_EVICTABLE_USER_TYPES = {
+    cache_type for _pattern, cache_type, evictable in _CACHE_TYPES if evictable
+} | {"orders", "stocks_view", "finance_partials", "report_results", "finance_srid_db"}
+
+_access_lock = threading.Lock()
+_access_times: Dict[str, float] = {}
+_access_loaded = False
+_access_dirty = False
+_access_flushed_at = 0.0
+_quota_lock = threading.Lock()
+# Последний обход CACHE_DIR: (время, записи)
+_usage_scan: tuple[float, List[Dict[str, Any]]] | None = None
+_usage_scan_lock = threading.Lock()
+
+
+def classify_cache_entry(name: str) -> tuple[str, int | None, bool]:
+    """Возвращает (тип кэша, user_id, можно ли вытеснять) по имени файла/папки в CACHE_DIR."""
+    for pattern, cache_type, evictable in _CACHE_TYPES:
+        m = pattern.match(name)
+        if m:
+            try:
+                user_id = int(m.group(1))
+            except (IndexError, TypeError, ValueError):
+                user_id = None
+            return cache_type, user_id, evictable
+    # Анонимные / общие файлы и всё неизвестное — не вытесняем
+    return "other", None, False
+
+
+def _rel_key(path: str) -> str:
+    try:
+        return os.path.relpath(os.path.abspath(path), CACHE_DIR)
+    except ValueError:
+        return path
+
+
+def _load_access_index() -> None:
+    global _access_loaded
+    if _access_loaded:
+        return
+    _access_loaded = True
+    path = os.path.join(CACHE_DIR, _ACCESS_INDEX_NAME)
+    try:
+        import json
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        for key, ts in (data.get("files") or {}).items():
+            if key in _BOOKKEEPING_KEYS:
+                continue
+            try:
+                _access_times[str(key)] = max(float(ts), _access_times.get(str(key), 0.0))
+            except (TypeError, ValueError):
+                continue
+    except Exception:
+        pass
+
+
+def flush_access_index(force: bool = False) -> None:
+    """Сбрасывает индекс обращений на диск (не чаще _ACCESS_FLUSH_INTERVAL_S без force)."""
+    global _access_dirty, _access_flushed_at
+    now = time.time()
+    with _access_lock:
+        if not _access_dirty:
+            return
+        if not force and (now - _access_flushed_at) < _ACCESS_FLUSH_INTERVAL_S:
+            return
+        snapshot = dict(_access_times)
+        _access_dirty = False
+        _access_flushed_at = now
+    try:
+        from utils.cache import atomic_write_json
+        atomic_write_json(os.path.join(CACHE_DIR, _ACCESS_INDEX_NAME), {"files": snapshot})
+    except Exception as e:
+        print(f"Ошибка сохранения индекса обращений к кэшу: {e}")
+
+
+def record_cache_access(path: str) -> None:
+    """Отмечает чтение/запись файла кэша (для LRU). Дёшево: только словарь в памяти."""
+    global _access_dirty
+    if not path:
+        return
+    key = _rel_key(path)
+    if key.startswith(".."):
+        return
+    # Учитываем на уровне записи CACHE_DIR: users/<id>/<тип> или файл/папка в корне.
+    # Секции last_results — на уровне папки, вытесняется она целиком
+    parts = key.split(os.sep)
+    top = os.sep.join(parts[:3]) if parts[0] == "users" else parts[0]
+    if top in _BOOKKEEPING_KEYS:
+        return
+    with _access_lock:
+        _load_access_index()
+        _access_times[top] = time.time()
+        _access_dirty = True
+    flush_access_index()
+
+
+def _entry_size(path: str) -> int:
+    if os.path.isdir(path):
+        total = 0
+        for root, _dirs, files in os.walk(path):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    continue
+        return total
+    return os.path.getsize(path)
+
+
+def scan_cache_dir() -> List[Dict[str, Any]]:
+    """Список записей CACHE_DIR с размером, временем последнего обращения и типом."""
+    with _access_lock:
+        _load_access_index()
+        access = dict(_access_times)
+    entries: List[Dict[str, Any]] = []
+    try:
+        names = os.listdir(CACHE_DIR)
+    except Exception:
+        return entries
+    for name in names:
+        if name.startswith(".") or name in _BOOKKEEPING_KEYS:
+            continue
+        if name == "users":
+            entries.extend(_scan_users_dir(access))
+            continue
+        path = os.path.join(CACHE_DIR, name)
+        try:
+            size = _entry_size(path)
+            mtime = os.path.getmtime(path)
+        except OSError:
+            continue
+        cache_type, user_id, evictable = classify_cache_entry(name)
+        entries.append({
+            "name": name,
+            "path": path,
+            "type": cache_type,
+            "user_id": user_id,
+            "size": size,
+            "last_access": max(mtime, access.get(name, 0.0)),
+            "evictable": evictable,
+        })
+    return entries
+
+
+def _scan_users_dir(access: Dict[str, float]) -> List[Dict[str, Any]]:
+    """Записи раскладки users/<id>/<тип>.json (см. utils.cache_layout)."""
+    entries: List[Dict[str, Any]] = []
+    users_dir = os.path.join(CACHE_DIR, "users")
+    try:
+        user_dirs = [d for d in os.listdir(users_dir) if d.isdigit()]
+    except FileNotFoundError:
+        return entries
+    for uid in user_dirs:
+        user_dir = os.path.join(users_dir, uid)
+        try:
+            names = os.listdir(user_dir)
+        except OSError:
+            continue
+        for name in names:
+            if name.startswith("."):
+                continue
+            path = os.path.join(user_dir, name)
+            try:
+                size = _entry_size(path)
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue
+            cache_type = name[:-5] if name.endswith(".json") else name
+            key = os.path.join("users", uid, name)
+            entries.append({
+                "name": key,
+                "path": path,
+                "type": cache_type,
+                "user_id": int(uid),
+                "size": size,
+                "last_access": max(mtime, access.get(key, 0.0)),
+                "evictable": cache_type in _EVICTABLE_USER_TYPES,
+            })
+    return entries
+
+
+def _remove_entry(entry: Dict[str, Any]) -> bool:
+    path = entry["path"]
+    try:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"Не удалось удалить кэш {entry['name']}: {e}")
+        return False
+    with _access_lock:
+        _access_times.pop(entry["name"], None)
+    return True
+
+
+def enforce_cache_quota(quota_bytes: int | None = None) -> Dict[str, Any]:
+    """Вытесняет самые холодные пересобираемые кэши, пока CACHE_DIR не уложится в квоту.
+
+    quota_bytes <= 0 — квота отключена. Возвращает статистику прогона.
+    """
+    global _access_dirty
+    quota = CACHE_QUOTA_BYTES if quota_bytes is None else int(quota_bytes)
+    if quota <= 0:
+        return {"quota_bytes": 0, "evicted": [], "freed_bytes": 0}
+    if not _quota_lock.acquire(blocking=False):
+        return {"quota_bytes": quota, "evicted": [], "freed_bytes": 0, "skipped": "busy"}
+    try:
+        entries = scan_cache_dir()
+        _store_usage_scan(entries)
+        total = sum(e["size"] for e in entries)
+        evicted: List[str] = []
+        freed = 0
+        if total > quota:
+            candidates = sorted((e for e in entries if e["evictable"]), key=lambda e: e["last_access"])
+            for entry in candidates:
+                if total <= quota:
+                    break
+                if _remove_entry(entry):
+                    total -= entry["size"]
+                    freed += entry["size"]
+                    evicted.append(entry["name"])
+            if evicted:
+                gone = set(evicted)
+                _store_usage_scan([e for e in entries if e["name"] not in gone])
+                with _access_lock:
+                    _access_dirty = True
+                flush_access_index(force=True)
+                print(
+                    f"Квота кэша {quota / 1024 / 1024:.0f} MB: вытеснено {len(evicted)} файлов, "
+                    f"освобождено {freed / 1024 / 1024:.1f} MB"
+                )
+        return {
+            "quota_bytes": quota,
+            "total_bytes": total,
+            "evicted": evicted,
+            "freed_bytes": freed,
+        }
+    finally:
+        _quota_lock.release()
+
+
+def _store_usage_scan(entries: List[Dict[str, Any]]) -> None:
+    global _usage_scan
+    with _usage_scan_lock:
+        _usage_scan = (time.time(), entries)
+
+
+def _cached_usage_scan() -> List[Dict[str, Any]]:
+    """Обход CACHE_DIR не старше _USAGE_SCAN_TTL_S (последний прогон квоты тоже годится)."""
+    with _usage_scan_lock:
+        if _usage_scan is not None and time.time() - _usage_scan[0] < _USAGE_SCAN_TTL_S:
+            return _usage_scan[1]
+    entries = scan_cache_dir()
+    _store_usage_scan(entries)
+    return entries
+
+
+def cache_usage_summary(user_id: int | None = None) -> Dict[str, Any]:
+    """Использование CACHE_DIR: всего, по типам кэша и по пользователям.
+
+    Если передан user_id — дополнительно детализация по файлам этого пользователя.
+    Размеры — по обходу не старше _USAGE_SCAN_TTL_S: частый опрос не обходит каталог заново.
+    """
+    entries = _cached_usage_scan()
+    by_type: Dict[str, Dict[str, Any]] = {}
+    by_user: Dict[str, int] = {}
+    total = 0
+    for e in entries:
+        total += e["size"]
+        bucket = by_type.setdefault(e["type"], {"bytes": 0, "files": 0, "evictable": e["evictable"]})
+        bucket["bytes"] += e["size"]
+        bucket["files"] += 1
+        if e["user_id"] is not None:
+            key = str(e["user_id"])
+            by_user[key] = by_user.get(key, 0) + e["size"]
+    summary: Dict[str, Any] = {
+        "total_bytes": total,
+        "quota_bytes": CACHE_QUOTA_BYTES,
+        "by_type": by_type,
+        "by_user": by_user,
+    }
+    if user_id is not None:
+        user_types: Dict[str, Dict[str, Any]] = {}
+        for e in entries:
+            if e["user_id"] != user_id:
+                continue
+            item = user_types.setdefault(e["type"], {"bytes": 0, "last_access": 0.0, "evictable": e["evictable"]})
+            item["bytes"] += e["size"]
+            item["last_access"] = max(item["last_access"], e["last_access"])
+        summary["user"] = {
+            "user_id": user_id,
+            "total_bytes": by_user.get(str(user_id), 0),
+            "by_type": user_types,
+        }
+    return summary
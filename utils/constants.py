@@ -102,12 +102,20 @@ CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "cache")
 if not os.path.isdir(CACHE_DIR):
     os.makedirs(CACHE_DIR, exist_ok=True)
 
-# Макс. размер last_results (orders_user_*.json) при json.load, МиБ. Длинные периоды = крупный JSON.
+# Макс. суммарный размер last_results (last_results_user_*/ + старый orders_user_*.json) при json.load, МиБ.
+# Длинные периоды = крупный JSON.
 # Переменная окружения: FUCKBERRY_LAST_RESULTS_MAX_MB
 LAST_RESULTS_CACHE_MAX_BYTES = (
     int(os.getenv("FUCKBERRY_LAST_RESULTS_MAX_MB", "80")) * 1024 * 1024
 )
 
+# Квота на весь CACHE_DIR, МиБ (0 — без ограничения). При превышении вытесняются
+# самые давно не использованные пересобираемые кэши; настройки не трогаются.
+# Переменная окружения: FUCKBERRY_CACHE_QUOTA_MB
+CACHE_QUOTA_BYTES = int(os.getenv("FUCKBERRY_CACHE_QUOTA_MB", "2048")) * 1024 * 1024
+# Как часто проверять квоту в фоновом мониторинге, сек
+CACHE_QUOTA_CHECK_INTERVAL_S = int(os.getenv("FUCKBERRY_CACHE_QUOTA_CHECK_S", "600"))
+
 # Пагинация WB supplier/orders (lastChangeDate). Для короткого окна, заканчивающегося «сегодня»,
 # условие выхода по дате часто не наступает в течение дня → без лимита возможны сотни страниц и минуты ожидания.
 WB_ORDERS_FETCH_MAX_PAGES = int(os.getenv("WB_ORDERS_FETCH_MAX_PAGES", "2000"))
@@ -118,6 +126,50 @@ WB_ORDERS_PAGE_SLEEP_INTRADAY_S = float(os.getenv("WB_ORDERS_PAGE_SLEEP_INTRADAY
 # Не дёргать WB для «сегодня», если срез дня в period-cache обновлялся недавно (сек). 0 = всегда обновлять.
 ORDERS_TODAY_CACHE_TTL_SECONDS = int(os.getenv("ORDERS_TODAY_CACHE_TTL_SECONDS", "180"))
 
+# Журнал наблюдаемых статусов ленты заказов: сжатие журнала после стольких записей
+# и срок хранения истории по srid без новых наблюдений (дней).
+ORDER_STATUS_HISTORY_COMPACT_LINES = int(os.getenv("ORDER_STATUS_HISTORY_COMPACT_LINES", "5000"))
+ORDER_STATUS_HISTORY_RETENTION_DAYS = int(os.getenv("ORDER_STATUS_HISTORY_RETENTION_DAYS", "180"))
+# Кэш готовой (обогащённой) ленты заказов в памяти процесса: общий лимит, МиБ, и TTL, сек.
+# Лента пересобирается раньше TTL, если изменились кэши заказов/продаж/финансов/товаров.
+ORDER_FEED_CACHE_MAX_BYTES = int(os.getenv("ORDER_FEED_CACHE_MAX_MB", "256")) * 1024 * 1024
+ORDER_FEED_CACHE_TTL_SECONDS = int(os.getenv("ORDER_FEED_CACHE_TTL_SECONDS", "600"))
+# Сколько готовых элементов ленты (по srid) держать в памяти на пользователя для инкрементальной пересборки
+ORDER_FEED_MATERIALIZED_MAX_ITEMS = int(os.getenv("ORDER_FEED_MATERIALIZED_MAX_ITEMS", "300000"))
+# Колоночный (NumPy) бэкенд агрегатов заказов: с какого числа строк включать и лимит кэша колонок, МиБ
+ORDERS_COLUMNAR_MIN_ROWS = int(os.getenv("ORDERS_COLUMNAR_MIN_ROWS", "20000"))
+ORDERS_COLUMNAR_CACHE_MAX_BYTES = int(os.getenv("ORDERS_COLUMNAR_CACHE_MAX_MB", "128")) * 1024 * 1024
+
+# Размер LRU разобранных дат/времени (utils.datetime_parse): строк-ключей на каждый формат
+DATETIME_PARSE_CACHE_SIZE = int(os.getenv("DATETIME_PARSE_CACHE_SIZE", "65536"))
+
+# Недельные агрегаты фин. отчёта (utils.finance_partials): неделя Пн–Вс считается закрытой
+# и сохраняется на диск через столько дней после воскресенья (WB публикует отчёт в понедельник).
+# Пауза между загрузками недель из WB, сек (как между интервалами в fetch_finance_report).
+FINANCE_WEEK_CLOSED_AFTER_DAYS = int(os.getenv("FINANCE_WEEK_CLOSED_AFTER_DAYS", "2"))
+FINANCE_WEEK_FETCH_PAUSE_S = float(os.getenv("FINANCE_WEEK_FETCH_PAUSE_S", "2.0"))
+
+# Расчёт загруженных недель фин. отчёта в пуле процессов (utils.finance_parallel): с какого
+# числа строк недели включается и сколько процессов (0 — по числу ядер; 1 — без пула).
+FINANCE_PARALLEL_MIN_ROWS = int(os.getenv("FINANCE_PARALLEL_MIN_ROWS", "20000"))
+FINANCE_PARALLEL_WORKERS = int(os.getenv("FINANCE_PARALLEL_WORKERS", "0"))
+
+# Результаты фин. отчётов на диске (utils.report_results): сколько хранить, сек (периоды
+# с незакрытыми неделями — недолго, WB ещё дописывает отчёт), и лимиты на пользователя —
+# число периодов и общий размер, МиБ (самые старые удаляются первыми).
+REPORT_RESULT_TTL_SECONDS = int(os.getenv("REPORT_RESULT_TTL_SECONDS", "10800"))
+REPORT_RESULT_OPEN_TTL_SECONDS = int(os.getenv("REPORT_RESULT_OPEN_TTL_SECONDS", "300"))
+REPORT_RESULTS_MAX_PER_USER = int(os.getenv("REPORT_RESULTS_MAX_PER_USER", "12"))
+REPORT_RESULTS_MAX_BYTES_PER_USER = int(os.getenv("REPORT_RESULTS_MAX_MB_PER_USER", "256")) * 1024 * 1024
+
+# Фоновый предрасчёт расшифровки фин. отчёта (utils.finance_precompute): включён ли, в какой
+# час по Москве запускать (раз в сутки, вне пиковых часов), пауза между пользователями, сек,
+# и сколько хранить готовые результаты закрытых периодов, сек (данные за них уже не меняются).
+FINANCE_PRECOMPUTE_AUTO = os.getenv("FINANCE_PRECOMPUTE_AUTO", "1") == "1"
+FINANCE_PRECOMPUTE_HOUR = int(os.getenv("FINANCE_PRECOMPUTE_HOUR", "4"))
+FINANCE_PRECOMPUTE_USER_PAUSE_S = float(os.getenv("FINANCE_PRECOMPUTE_USER_PAUSE_S", "5.0"))
+FINANCE_PRECOMPUTE_RESULT_TTL_S = int(os.getenv("FINANCE_PRECOMPUTE_RESULT_TTL_S", str(8 * 24 * 3600)))
+
 # Управление автопостроением кэша поставок
 SUPPLIES_CACHE_AUTO = os.getenv("SUPPLIES_CACHE_AUTO", "0") == "1"
 
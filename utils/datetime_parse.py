@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""Быстрый разбор дат/времени WB (общий для parse_date, parse_wb_datetime и др.)."""
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Optional
+
+from utils.constants import DATETIME_PARSE_CACHE_SIZE
+
+# формат -> (длина строки, срезы полей Y, m, d[, H, M, S], (позиция, разделитель))
+FIXED_FORMATS = {
+    "%Y-%m-%d": (10, ((0, 4), (5, 7), (8, 10)), ((4, "-"), (7, "-"))),
+    "%d.%m.%Y": (10, ((6, 10), (3, 5), (0, 2)), ((2, "."), (5, "."))),
+    "%Y-%m-%dT%H:%M:%S": (
+        19,
+        ((0, 4), (5, 7), (8, 10), (11, 13), (14, 16), (17, 19)),
+        ((4, "-"), (7, "-"), (10, "T"), (13, ":"), (16, ":")),
+    ),
+    "%Y-%m-%d %H:%M:%S": (
+        19,
+        ((0, 4), (5, 7), (8, 10), (11, 13), (14, 16), (17, 19)),
+        ((4, "-"), (7, "-"), (10, " "), (13, ":"), (16, ":")),
+    ),
+    "%d.%m.%Y %H:%M:%S": (
+        19,
+        ((6, 10), (3, 5), (0, 2), (11, 13), (14, 16), (17, 19)),
+        ((2, "."), (5, "."), (10, " "), (13, ":"), (16, ":")),
+    ),
+}
+
+
+def _parse_layout(text: str, layout: tuple) -> Optional[datetime]:
+    """datetime по строгой раскладке или None, если строка ей не соответствует."""
+    length, fields, seps = layout
+    if len(text) != length or not text.isascii():
+        return None
+    for pos, ch in seps:
+        if text[pos] != ch:
+            return None
+    parts = []
+    for start, end in fields:
+        part = text[start:end]
+        if not part.isdigit():
+            return None
+        parts.append(int(part))
+    # Несуществующая дата (31.02) — ValueError, как и у strptime
+    return datetime(*parts)
+
+
+def strptime_fixed(text: Any, fmt: str) -> datetime:
+    """datetime.strptime(text, fmt) с быстрым путём для FIXED_FORMATS.
+
+    Строгая раскладка (ASCII-цифры с ведущими нулями) собирается срезами и int(),
+    остальное (без ведущих нулей, лишние символы) уходит в strptime.
+    """
+    layout = FIXED_FORMATS.get(fmt)
+    if layout is not None and text.__class__ is str:
+        dt = _parse_layout(text, layout)
+        if dt is not None:
+            return dt
+    return datetime.strptime(text, fmt)
+
+
+# Даты дня и одинаковые отметки времени повторяются в отчётах тысячи раз. Результаты —
+# неизменяемые datetime, поэтому отдавать один объект из кэша безопасно.
+@lru_cache(maxsize=DATETIME_PARSE_CACHE_SIZE)
+def _parse_date_str(date_str: str) -> datetime:
+    try:
+        return strptime_fixed(date_str, "%Y-%m-%d")
+    except ValueError:
+        try:
+            return strptime_fixed(date_str, "%d.%m.%Y")
+        except ValueError:
+            raise ValueError(f"Unable to parse date '{date_str}'. Expected formats: YYYY-MM-DD or DD.MM.YYYY")
+
+
+def parse_date(date_str: str) -> datetime:
+    """Дата в формате YYYY-MM-DD или DD.MM.YYYY (ValueError, если ни один не подошёл)."""
+    if date_str.__class__ is not str:
+        return _parse_date_str.__wrapped__(date_str)
+    return _parse_date_str(date_str)
+
+
+@lru_cache(maxsize=DATETIME_PARSE_CACHE_SIZE)
+def _parse_wb_datetime_str(s: str) -> datetime | None:
+    try:
+        # Z -> +00:00 для fromisoformat (он и есть быстрый путь — реализован на C)
+        return datetime.fromisoformat(s.replace("Z", "+00:00"))
+    except Exception:
+        try:
+            return strptime_fixed(s[:19], "%Y-%m-%dT%H:%M:%S")
+        except Exception:
+            return None
+
+
+def parse_wb_datetime(value: Any) -> datetime | None:
+    """Дата/время из ответов WB (ISO, с Z или смещением); при неудаче — первые 19 символов."""
+    if not value:
+        return None
+    return _parse_wb_datetime_str(str(value))
+
+
+@lru_cache(maxsize=DATETIME_PARSE_CACHE_SIZE)
+def _parse_iso_datetime_str(value: str) -> datetime | None:
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except Exception:
+        try:
+            return datetime.strptime(value, "%Y-%m-%dT%H:%M:%S%z")
+        except Exception:
+            try:
+                return strptime_fixed(value, "%Y-%m-%dT%H:%M:%S")
+            except Exception:
+                return None
+
+
+def parse_iso_datetime(value: Any) -> datetime | None:
+    """ISO datetime (с поддержкой Z); None для пустых и неразборчивых значений."""
+    if not value or value.__class__ is not str:
+        return None
+    return _parse_iso_datetime_str(value)
+
+
+# Форматы parse_wb_naive_datetime в порядке попыток: (формат, сколько символов брать)
+_NAIVE_FORMATS = (
+    ("%Y-%m-%dT%H:%M:%S", 19),
+    ("%Y-%m-%d %H:%M:%S", 19),
+    ("%d.%m.%Y %H:%M:%S", 19),
+    ("%Y-%m-%d", 10),
+    ("%d.%m.%Y", 10),
+)
+
+
+@lru_cache(maxsize=DATETIME_PARSE_CACHE_SIZE)
+def _parse_wb_naive_str(s: str) -> Optional[datetime]:
+    if not s or s.startswith("0001-01-01"):
+        return None
+    # Убираем таймзону для единообразия
+    core = s.replace("Z", "")
+    if "+" in core[10:]:
+        core = core[: core.rfind("+", 10)]
+    core = core.strip()
+    for fmt, n in _NAIVE_FORMATS:
+        try:
+            return strptime_fixed(core[:n], fmt)
+        except Exception:
+            continue
+    try:
+        return datetime.fromisoformat(s.replace("Z", "+00:00")).replace(tzinfo=None)
+    except Exception:
+        return None
+
+
+def parse_wb_naive_datetime(value: Any) -> Optional[datetime]:
+    """Дата/время WB без таймзоны (смещение отбрасывается); 0001-01-01 и пустое — None."""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None) if value.tzinfo else value
+    return _parse_wb_naive_str(str(value).strip())
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""Поисковый индекс ленты заказов (триграммы) для свободного поиска q."""
+from array import array
+from typing import Any, Dict, List
+
+# Поля элемента ленты, по которым ищет строка поиска
+FEED_SEARCH_FIELDS = ("gnumber", "srid", "article", "name", "barcode", "nm_id", "sticker")
+
+_NGRAM = 3
+
+
+def feed_search_text(item: Dict[str, Any]) -> str:
+    """Строка, в которой ищется q (в нижнем регистре)."""
+    return " ".join(str(item.get(f) or "") for f in FEED_SEARCH_FIELDS).lower()
+
+
+class FeedSearchIndex:
+    """Триграммный индекс по элементам ленты.
+
+    Для каждой триграммы хранится возрастающий список номеров элементов (array('I')).
+    Поиск подстроки q (len >= 3): берём самый короткий список среди триграмм q и проверяем
+    `q in text` только у этих кандидатов — результат совпадает с полным перебором, порядок
+    элементов сохраняется. Префиксный поиск — частный случай подстроки. Для q короче
+    триграммы — перебор заранее подготовленных строк (без сборки их на каждый запрос).
+    """
+
+    __slots__ = ("texts", "postings")
+
+    def __init__(self, items: List[Dict[str, Any]]) -> None:
+        self.texts: List[str] = [feed_search_text(it) for it in items]
+        postings: Dict[str, array] = {}
+        for idx, text in enumerate(self.texts):
+            grams = {text[i : i + _NGRAM] for i in range(len(text) - _NGRAM + 1)}
+            for gram in grams:
+                bucket = postings.get(gram)
+                if bucket is None:
+                    bucket = postings[gram] = array("I")
+                bucket.append(idx)
+        self.postings = postings
+
+    def search(self, q: str) -> List[int]:
+        """Номера элементов (по возрастанию), в строке поиска которых есть q."""
+        q = (q or "").lower()
+        texts = self.texts
+        if not q:
+            return list(range(len(texts)))
+        if len(q) < _NGRAM:
+            return [i for i, text in enumerate(texts) if q in text]
+        smallest = None
+        for i in range(len(q) - _NGRAM + 1):
+            bucket = self.postings.get(q[i : i + _NGRAM])
+            if bucket is None:
+                return []
+            if smallest is None or len(bucket) < len(smallest):
+                smallest = bucket
+        return [i for i in smallest if q in texts[i]]
+
+    def estimated_bytes(self) -> int:
+        """Оценка памяти индекса (для учёта в кэше ленты)."""
+        text_bytes = sum(len(t) for t in self.texts) + 56 * len(self.texts)
+        posting_bytes = sum(64 + 4 * len(b) for b in self.postings.values()) + 80 * len(self.postings)
+        return text_bytes + posting_bytes
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""Колоночное хранение строк фин. отчёта WB (reportDetailByPeriod)."""
+from array import array
+from itertools import islice
+from math import isnan
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+# Денежные/процентные поля: float(v or 0), None и отсутствие ключа — NaN
+FINANCE_FLOAT_COLUMNS = (
+    "retail_price",
+    "retail_price_withdisc_rub",
+    "retail_amount",
+    "ppvz_for_pay",
+    "ppvz_vw",
+    "delivery_amount",
+    "delivery_rub",
+    "storage_fee",
+    "acceptance",
+    "deduction",
+    "penalty",
+    "additional_payment",
+    "acquiring_percent",
+    "acquiring_fee",
+)
+# Целые поля: int(v or 0)
+FINANCE_INT_COLUMNS = (
+    "quantity",
+    "rrd_id",
+)
+# Значения как есть (строки, nm_id), словарное кодирование
+FINANCE_VALUE_COLUMNS = (
+    "supplier_oper_name",
+    "doc_type_name",
+    "bonus_type_name",
+    "nm_id",
+    "sa_name",
+    "barcode",
+    "brand_name",
+    "subject_name",
+    "ts_name",
+    "rr_dt",
+)
+# Значения как есть без кодирования (уникальны почти у каждой строки)
+FINANCE_PLAIN_COLUMNS = (
+    "srid",
+)
+FINANCE_COLUMNS = FINANCE_FLOAT_COLUMNS + FINANCE_INT_COLUMNS + FINANCE_VALUE_COLUMNS + FINANCE_PLAIN_COLUMNS
+
+_NAN = float("nan")
+# Сколько строк раскодируется за раз при итерации
+_ITER_CHUNK = 4096
+
+
+def _to_float(v: Any) -> float:
+    if v is None:
+        return _NAN
+    try:
+        return float(v or 0.0)
+    except Exception:
+        return 0.0
+
+
+def _to_int(v: Any) -> int:
+    try:
+        return int(v or 0)
+    except Exception:
+        try:
+            return int(float(v or 0))
+        except Exception:
+            return 0
+
+
+class _ValueColumn:
+    """Словарное кодирование: значение -> код по порядку первого появления."""
+
+    __slots__ = ("codes", "labels", "index")
+
+    def __init__(self) -> None:
+        # Код 0 — None (ключа нет в строке)
+        self.codes = array("I")
+        self.labels: List[Any] = [None]
+        self.index: Dict[Any, int] = {}
+
+    def append(self, value: Any) -> None:
+        if value is None:
+            self.codes.append(0)
+            return
+        try:
+            c = self.index.get(value)
+        except TypeError:  # dict/list в поле — храним как есть, без кодирования
+            c = None
+            self.labels.append(value)
+            self.codes.append(len(self.labels) - 1)
+            return
+        if c is None:
+            c = self.index[value] = len(self.labels)
+            self.labels.append(value)
+        self.codes.append(c)
+
+    def values(self, start: int, stop: int) -> List[Any]:
+        labels = self.labels
+        return [labels[c] for c in self.codes[start:stop]]
+
+
+class FinanceColumns:
+    """Строки фин. отчёта по колонкам FINANCE_COLUMNS на модуле array (без numpy).
+
+    NaN денежной колонки при чтении снова None: _retail_with_disc отличает «нет поля»
+    от нуля. Строки добавляются порциями (extend по интервалу загрузки), итерация отдаёт
+    обычные словари — build_finance_partial и индекс srid принимают FinanceColumns
+    вместо списка строк без изменений.
+    """
+
+    __slots__ = ("n", "floats", "ints", "values", "plain")
+
+    def __init__(self, rows: Optional[Iterable[Dict[str, Any]]] = None) -> None:
+        self.n = 0
+        self.floats: Dict[str, array] = {name: array("d") for name in FINANCE_FLOAT_COLUMNS}
+        self.ints: Dict[str, array] = {name: array("q") for name in FINANCE_INT_COLUMNS}
+        self.values: Dict[str, _ValueColumn] = {name: _ValueColumn() for name in FINANCE_VALUE_COLUMNS}
+        self.plain: Dict[str, List[Any]] = {name: [] for name in FINANCE_PLAIN_COLUMNS}
+        if rows:
+            self.extend(rows)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Dict[str, Any]]) -> "FinanceColumns":
+        if isinstance(rows, cls):
+            return rows
+        return cls(rows)
+
+    def extend(self, rows: Iterable[Dict[str, Any]]) -> None:
+        """Дописывает строки (словари WB); лишние ключи отбрасываются."""
+        floats = [(name, self.floats[name].append) for name in FINANCE_FLOAT_COLUMNS]
+        ints = [(name, self.ints[name].append) for name in FINANCE_INT_COLUMNS]
+        values = [(name, self.values[name].append) for name in FINANCE_VALUE_COLUMNS]
+        values += [(name, self.plain[name].append) for name in FINANCE_PLAIN_COLUMNS]
+        n = 0
+        for r in rows:
+            get = r.get
+            for name, add in floats:
+                add(_to_float(get(name)))
+            for name, add in ints:
+                add(_to_int(get(name)))
+            for name, add in values:
+                add(get(name))
+            n += 1
+        self.n += n
+
+    def __len__(self) -> int:
+        return self.n
+
+    def column(self, name: str) -> List[Any]:
+        """Колонка целиком в виде значений строк (NaN денежных полей -> None)."""
+        return self._decode(name, 0, self.n)
+
+    def _decode(self, name: str, start: int, stop: int) -> List[Any]:
+        if name in self.values:
+            return self.values[name].values(start, stop)
+        if name in self.plain:
+            return self.plain[name][start:stop]
+        if name in self.ints:
+            return self.ints[name][start:stop].tolist()
+        return [None if isnan(v) else v for v in self.floats[name][start:stop]]
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        names = FINANCE_COLUMNS
+        for start in range(0, self.n, _ITER_CHUNK):
+            stop = min(start + _ITER_CHUNK, self.n)
+            cols = [self._decode(name, start, stop) for name in names]
+            for values in zip(*cols):
+                yield dict(zip(names, values))
+
+    def to_dicts(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Строки словарями по сохранённым колонкам (для JSON-ответа)."""
+        it = iter(self)
+        return list(islice(it, limit) if limit is not None else it)
+
+    def nbytes(self) -> int:
+        """Приблизительный объём: массивы + словари значений (~80 байт на значение)."""
+        size = sum(a.itemsize * len(a) for a in self.floats.values())
+        size += sum(a.itemsize * len(a) for a in self.ints.values())
+        for col in self.values.values():
+            size += col.codes.itemsize * len(col.codes) + len(col.labels) * 80
+        for values in self.plain.values():
+            size += len(values) * 80
+        return size
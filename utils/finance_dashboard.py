@@ -2,9 +2,19 @@
 """Расчёт сводки финансового отчёта по логике листа DASHBOARD из «Расшифровка WB»."""
 from __future__ import annotations
 
+from array import array
 from datetime import datetime
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, Iterable, List
 
+from utils.finance_columnar import FinanceColumns
+
+try:
+    import numpy as np
+except ImportError:  # numpy не входит в requirements — разнесение считается на списках
+    np = None
+
+# Версия формата build_finance_partial (сохранённые недельные агрегаты другой версии пересчитываются)
+FINANCE_PARTIAL_VERSION = 2
 
 BUYOUT_OPERS = {
     "продажа",
@@ -18,6 +28,10 @@ RETURN_OPERS = {
     "корректный возврат",
 }
 
+# Операции «к перечислению» по продажам / возвратам (+ «коррекция продаж» по типу документа)
+K_SALE_OPERS = {"продажа", "сторно возвратов", "корректная продажа"}
+K_RETURN_OPERS = {"возврат", "сторно продаж", "корректный возврат"}
+
 DEFECT_OPERS = {
     "компенсация брака",
     "оплата брака",
@@ -35,6 +49,25 @@ DAMAGE_OPERS = {
 }
 
 
+# Суммы страницы /report/finance (utils.finance_engine), которых нет в сводке DASHBOARD:
+# компенсация брака (X1..X8) и ущерба (U1..U14) — знак по типу документа (продажа, возврат)
+REPORT_DEFECT_OPERS = {
+    "добровольная компенсация при возврате": (1, -1),
+    "частичная компенсация брака": (1, -1),
+    "компенсация подмененного товара": (1, -1),
+    "компенсация потерянного товара": (1, -1),
+}
+REPORT_DAMAGE_OPERS = {
+    "частичная компенсация брака": (1, -1),
+    "добровольная компенсация брака": (1, -1),
+    "компенсация брака до возврата товара": (1, -1),
+    "добровольная компенсация подмены товара": (1, 1),
+    "компенсация подмененного товара": (-1, -1),
+    "добровольная компенсация утилизации товара": (1, -1),
+    "компенсация утилизации товара": (1, -1),
+}
+
+
 def _norm(v: Any) -> str:
     return str(v or "").strip().lower()
 
@@ -73,7 +106,11 @@ def _retail_with_disc(row: Dict[str, Any]) -> float:
     return _f(row.get("retail_price"))
 
 
-def _detail_key(row: Dict[str, Any], *, include_oper: bool = True) -> Tuple[str, ...]:
+# Разделитель полей в строковых ключах детализаций и затрат (агрегаты сохраняются в JSON)
+_KEY_SEP = "\x1f"
+
+
+def _detail_key(row: Dict[str, Any], *, include_oper: bool = True) -> str:
     parts = [
         str(row.get("nm_id") or ""),
         str(row.get("sa_name") or "").strip(),
@@ -86,19 +123,25 @@ def _detail_key(row: Dict[str, Any], *, include_oper: bool = True) -> Tuple[str,
         parts.append(str(row.get("supplier_oper_name") or "").strip())
         parts.append(str(row.get("doc_type_name") or "").strip())
         parts.append(str(row.get("bonus_type_name") or "").strip())
-    return tuple(parts)
+    return _KEY_SEP.join(parts)
 
 
 def _add_detail(
-    bucket: Dict[Tuple[str, ...], Dict[str, Any]],
+    bucket: Dict[str, Dict[str, Any]],
     row: Dict[str, Any],
     amount: float,
+    key: str | None = None,
     *,
     include_oper: bool = True,
-) -> None:
+) -> str | None:
+    """
+    Добавляет сумму строки в детализацию (без округления — округляет _finalize_details).
+    Возвращает ключ строки, чтобы не собирать его заново для следующей детализации.
+    """
     if abs(amount) < 1e-9:
-        return
-    key = _detail_key(row, include_oper=include_oper)
+        return key
+    if key is None:
+        key = _detail_key(row, include_oper=include_oper)
     item = bucket.get(key)
     if item is None:
         bucket[key] = {
@@ -112,15 +155,20 @@ def _add_detail(
             "doc_type": str(row.get("doc_type_name") or "").strip() if include_oper else "",
             "bonus_type": str(row.get("bonus_type_name") or "").strip() if include_oper else "",
             "qty": _i(row.get("quantity")),
-            "amount": round(amount, 2),
+            "amount": amount,
         }
     else:
         item["qty"] += _i(row.get("quantity"))
-        item["amount"] = round(_f(item["amount"]) + amount, 2)
+        item["amount"] += amount
+    return key
 
 
-def _finalize_details(bucket: Dict[Tuple[str, ...], Dict[str, Any]]) -> List[Dict[str, Any]]:
-    items = [v for v in bucket.values() if abs(_f(v.get("amount"))) >= 0.01]
+def _finalize_details(bucket: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    items = []
+    for v in bucket.values():
+        amount = round(_f(v.get("amount")), 2)
+        if abs(amount) >= 0.01:
+            items.append(dict(v, amount=amount))
     items.sort(key=lambda x: abs(_f(x.get("amount"))), reverse=True)
     return items
 
@@ -170,64 +218,60 @@ def _row_in_products_breakdown(row: Dict[str, Any], *, is_return_row: bool) -> b
     return _product_group_key(row) is not None
 
 
-def _build_products_breakdown(raw: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    """
-    Сводка по товарам без возвратов:
-    — с баркодом (как раньше);
-    — без баркода, но с nm_id / артикулом продавца (продажи и др. операции).
-    """
-    bucket: Dict[str, Dict[str, Any]] = {}
-    for r in raw:
-        oper = _norm(r.get("supplier_oper_name"))
-        doc = r.get("doc_type_name")
-        is_return_row = oper in RETURN_OPERS or _is_return_doc(doc)
-        key = _product_group_key(r)
-        if key is None or is_return_row:
-            continue
-
-        barcode = str(r.get("barcode") or "").strip()
-        pay = _f(r.get("ppvz_for_pay"))
-        sales_qty = _i(r.get("quantity")) if oper in BUYOUT_OPERS else 0
-
-        item = bucket.get(key)
-        if item is None:
-            bucket[key] = {
-                "barcode": barcode,
-                "name": _product_title(r),
-                "nm_id": r.get("nm_id") or "",
-                "sa_name": str(r.get("sa_name") or "").strip(),
-                "sales_qty": sales_qty,
-                "for_pay": round(pay, 2),
-            }
-        else:
-            item["for_pay"] = round(_f(item["for_pay"]) + pay, 2)
-            item["sales_qty"] = _i(item.get("sales_qty")) + sales_qty
-            if not item.get("barcode") and barcode:
-                item["barcode"] = barcode
-            if item["name"] in ("", "—"):
-                item["name"] = _product_title(r)
-            if not item.get("nm_id") and r.get("nm_id"):
-                item["nm_id"] = r.get("nm_id")
-            if not item.get("sa_name") and r.get("sa_name"):
-                item["sa_name"] = str(r.get("sa_name") or "").strip()
-
-    items = list(bucket.values())
+def _add_product_row(
+    bucket: Dict[str, Dict[str, Any]],
+    row: Dict[str, Any],
+    key: str,
+    *,
+    pay: float,
+    sales_qty: int,
+    barcode: str,
+) -> None:
+    """Строка отчёта в сводку по товарам (for_pay без округления — см. _finalize_products)."""
+    item = bucket.get(key)
+    if item is None:
+        bucket[key] = {
+            "barcode": barcode,
+            "name": _product_title(row),
+            "nm_id": row.get("nm_id") or "",
+            "sa_name": str(row.get("sa_name") or "").strip(),
+            "sales_qty": sales_qty,
+            "for_pay": pay,
+        }
+    else:
+        item["for_pay"] += pay
+        item["sales_qty"] = _i(item.get("sales_qty")) + sales_qty
+        if not item.get("barcode") and barcode:
+            item["barcode"] = barcode
+        if item["name"] in ("", "—"):
+            item["name"] = _product_title(row)
+        if not item.get("nm_id") and row.get("nm_id"):
+            item["nm_id"] = row.get("nm_id")
+        if not item.get("sa_name") and row.get("sa_name"):
+            item["sa_name"] = str(row.get("sa_name") or "").strip()
+
+
+def _finalize_products(bucket: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Сводка по товарам без возвратов, отсортированная по |Сумма|."""
+    items = []
+    for v in bucket.values():
+        item = dict(v)
+        item["for_pay"] = round(_f(item.get("for_pay")), 2)
+        items.append(item)
     items.sort(key=lambda x: (-abs(_f(x.get("for_pay"))), str(x.get("barcode") or ""), str(x.get("sa_name") or "")))
     return items
 
 
-def _enrich_products_from_catalog(
-    products: List[Dict[str, Any]],
-    catalog: List[Dict[str, Any]] | None,
-) -> List[Dict[str, Any]]:
-    """Подставляет баркод/название из кэша товаров (/products) по баркоду, nm_id или артикулу."""
-    if not products or not catalog:
-        return products
-
+def _index_catalog(catalog: List[Dict[str, Any]] | None) -> tuple[
+    Dict[str, Dict[str, Any]],
+    Dict[int, Dict[str, Any]],
+    Dict[str, Dict[str, Any]],
+]:
+    """Индексы кэша товаров (/products) по баркоду, nm_id и артикулу — строятся один раз на расчёт."""
     by_barcode: Dict[str, Dict[str, Any]] = {}
     by_nm: Dict[int, Dict[str, Any]] = {}
     by_sa: Dict[str, Dict[str, Any]] = {}
-    for p in catalog:
+    for p in catalog or []:
         if not isinstance(p, dict):
             continue
         bc = str(p.get("barcode") or "").strip()
@@ -242,7 +286,20 @@ def _enrich_products_from_catalog(
         sa = str(p.get("supplier_article") or p.get("vendor_code") or p.get("sa_name") or "").strip().lower()
         if sa:
             by_sa[sa] = p
+    return by_barcode, by_nm, by_sa
+
 
+def _enrich_products_from_catalog(
+    products: List[Dict[str, Any]],
+    catalog: List[Dict[str, Any]] | None,
+    *,
+    catalog_index: tuple | None = None,
+) -> List[Dict[str, Any]]:
+    """Подставляет баркод/название из кэша товаров (/products) по баркоду, nm_id или артикулу."""
+    if not products or not catalog:
+        return products
+
+    by_barcode, by_nm, by_sa = catalog_index or _index_catalog(catalog)
     def _needs_name(item: Dict[str, Any]) -> bool:
         name = str(item.get("name") or "").strip()
         if not name or name in ("—", "-"):
@@ -418,9 +475,20 @@ def _build_paid_storage_by_product(paid_storage: List[Dict[str, Any]] | None) ->
     return _finalize_details(bucket)
 
 
+def _cost_key(row: Dict[str, Any]) -> str | None:
+    """Поля строки, по которым _match_product_for_cost ищет товар: баркод, nm_id, артикул."""
+    bc = str(row.get("barcode") or "").strip()
+    nm = row.get("nm_id")
+    nm = "" if nm is None else str(nm)
+    sa = str(row.get("sa_name") or "").strip().lower()
+    if not bc and not nm and not sa:
+        return None
+    return _KEY_SEP.join((bc, nm, sa))
+
+
 def _apply_product_expense_columns(
     products: List[Dict[str, Any]],
-    raw: List[Dict[str, Any]],
+    row_costs: Dict[str, List[float]],
     *,
     acceptance_total: float,
     paid_storage: List[Dict[str, Any]] | None = None,
@@ -431,6 +499,9 @@ def _apply_product_expense_columns(
     — Платная приёмка: сумма acceptance по фактическим строкам товара;
     — Хранение: сумма warehousePrice из отчёта «Платное хранение» по товару.
       Товары только из хранения (без строк финотчёта) добавляются отдельными строками.
+
+    row_costs — суммы [delivery_rub, acceptance] строк отчёта по _cost_key, собранные
+    за тот же проход, что и итоги: товар подбирается один раз на ключ, а не на строку.
     """
     if not products and not paid_storage:
         return products
@@ -442,18 +513,16 @@ def _apply_product_expense_columns(
         p["promotion"] = 0.0
 
     by_barcode, by_nm, by_sa = _index_products_for_costs(products)
-    for r in raw:
-        if not isinstance(r, dict):
-            continue
-        prod = _match_product_for_cost(r, by_barcode, by_nm, by_sa)
+    for cost_key, (delivery_rub, acceptance_val) in row_costs.items():
+        bc, nm, sa = cost_key.split(_KEY_SEP)
+        prod = _match_product_for_cost({"barcode": bc, "nm_id": nm, "sa_name": sa}, by_barcode, by_nm, by_sa)
         if not prod:
             continue
-        delivery_rub = _f(r.get("delivery_rub"))
-        acceptance_val = _f(r.get("acceptance"))
-        if abs(delivery_rub) >= 1e-9:
-            prod["logistics"] = round(_f(prod["logistics"]) + delivery_rub, 2)
-        if abs(acceptance_val) >= 1e-9:
-            prod["acceptance"] = round(_f(prod["acceptance"]) + acceptance_val, 2)
+        prod["logistics"] += delivery_rub
+        prod["acceptance"] += acceptance_val
+    for p in products:
+        p["logistics"] = round(p["logistics"], 2)
+        p["acceptance"] = round(p["acceptance"], 2)
 
     # В сверке приёмка показывается как abs(total)
     if acceptance_total < 0:
@@ -549,6 +618,71 @@ def _promotion_total_from_details(other_details: List[Dict[str, Any]]) -> float:
     return round(total, 2)
 
 
+# Округление до копеек массивом (numpy): с какой длины включать; значения дальше
+# _ROUND2_MAX_CENTS копеек от нуля и ближе _ROUND2_HALF_MARGIN к половине копейки
+# округляются round() поштучно — там ошибка x * 100 могла бы изменить результат.
+_ROUND2_NUMPY_MIN = 64
+_ROUND2_MAX_CENTS = 1e11
+_ROUND2_HALF_MARGIN = 1e-3
+
+
+def _round2_many(values: List[float] | array) -> List[float]:
+    """
+    [round(v, 2) for v in values] — с numpy векторно, с тем же результатом до бита:
+    rint(v * 100) / 100 — ближайшее к v число с двумя знаками, как и у round().
+    """
+    if np is None or len(values) < _ROUND2_NUMPY_MIN:
+        return [round(v, 2) for v in values]
+    x = np.asarray(values, dtype=np.float64)
+    with np.errstate(invalid="ignore"):
+        y = x * 100.0
+        out = (np.rint(y) / 100.0).tolist()
+        unsure = (np.abs(np.abs(y - np.trunc(y)) - 0.5) < _ROUND2_HALF_MARGIN) | ~(np.abs(y) < _ROUND2_MAX_CENTS)
+    for i in np.flatnonzero(unsure).tolist():
+        out[i] = round(float(x[i]), 2)
+    return out
+
+
+def _cents(v: float) -> int:
+    return int(round(v * 100))
+
+
+def _cents_sum(values: List[float]) -> int:
+    """Σ округлённых до копеек значений в целых копейках (ValueError на nan/inf)."""
+    if np is None or len(values) < _ROUND2_NUMPY_MIN:
+        return sum(map(_cents, values))
+    y = np.asarray(values, dtype=np.float64) * 100.0
+    if not np.isfinite(y).all():
+        raise ValueError("non-finite value")
+    return int(np.rint(y).astype(np.int64).sum())
+
+
+def _product_columns(products: List[Dict[str, Any]], fields: Iterable[str]) -> Dict[str, array]:
+    """Матрица товаров для разнесения: по колонке array('d') на поле (значения как у _f)."""
+    cols: Dict[str, array] = {}
+    for name in fields:
+        # Ненулевой float берётся как есть (_f вернул бы его же), остальное — через _f
+        values = [p.get(name) for p in products]
+        cols[name] = array("d", [v if type(v) is float and v else _f(v) for v in values])
+    return cols
+
+
+def _allocate_remainder_to_last(total: float, parts: List[float]) -> List[float]:
+    """
+    parts — округлённые доли всех позиций, кроме последней; последней достаётся остаток
+    total − Σ parts. Сумма долей считается в целых копейках: результат тот же, что у
+    накопления round(накоплено + доля, 2) по одной доле, и не зависит от порядка сложения.
+    """
+    try:
+        allocated = _cents_sum(parts) / 100
+    except (ValueError, OverflowError):  # nan/inf в долях — накопление как раньше
+        allocated = 0.0
+        for part in parts:
+            allocated = round(allocated + part, 2)
+    parts.append(round(total - allocated, 2))
+    return parts
+
+
 def _apply_promotion_allocation(
     products: List[Dict[str, Any]],
     *,
@@ -560,69 +694,85 @@ def _apply_promotion_allocation(
     пропорционально затратам из /adv/v3/fullstats.
     Возвращает (products, breakdown_rows, advert_api_sum).
     """
-    for p in products:
-        p["promotion"] = 0.0
-
-    spend_rows = [r for r in (promotion_spend or []) if isinstance(r, dict) and _f(r.get("sum")) > 0]
-    advert_api_sum = round(sum(_f(r.get("sum")) for r in spend_rows), 2)
+    spend_rows: List[Dict[str, Any]] = []
+    weights: List[float] = []
+    for r in promotion_spend or []:
+        if isinstance(r, dict):
+            weight = _f(r.get("sum"))
+            if weight > 0:
+                spend_rows.append(r)
+                weights.append(weight)
+    advert_api_sum = round(sum(weights), 2)
     target = round(_f(promotion_total), 2)
-    if not spend_rows or abs(target) < 1e-9:
+    weight_total = advert_api_sum
+    if not spend_rows or abs(target) < 1e-9 or abs(weight_total) < 1e-9:
+        for p in products:
+            p["promotion"] = 0.0
         return products, [], advert_api_sum
 
-    by_nm: Dict[int, List[Dict[str, Any]]] = {}
-    for p in products:
+    # nmId строк затрат; строки без числового nmId пропускаются и в доли не входят
+    nms: List[int | None] = []
+    for row in spend_rows:
+        try:
+            nms.append(int(row.get("nm_id")))
+        except Exception:
+            nms.append(None)
+
+    wanted = {nm for nm in nms if nm is not None}
+    by_nm: Dict[int, List[int]] = {}
+    for idx, p in enumerate(products):
+        p["promotion"] = 0.0
         nm = p.get("nm_id")
         if nm is None or nm == "":
             continue
         try:
-            nmi = int(nm)
+            nmi = nm if type(nm) is int else int(nm)
         except Exception:
             continue
-        by_nm.setdefault(nmi, []).append(p)
+        if nmi in wanted:
+            by_nm.setdefault(nmi, []).append(idx)
 
-    weight_total = round(sum(_f(r.get("sum")) for r in spend_rows), 2)
-    if abs(weight_total) < 1e-9:
-        return products, [], advert_api_sum
-
-    allocated = 0.0
+    # Доли строк затрат: все, кроме последней, — пропорционально весу, последней — остаток
     last_idx = len(spend_rows) - 1
-    breakdown: List[Dict[str, Any]] = []
+    amounts = _round2_many([
+        target * weights[i] / weight_total
+        for i in range(last_idx)
+        if nms[i] is not None
+    ])
+    if nms[last_idx] is not None:
+        amounts = _allocate_remainder_to_last(target, amounts)
 
-    for i, row in enumerate(spend_rows):
-        try:
-            nmi = int(row.get("nm_id"))
-        except Exception:
+    # Продвижение товаров копится в копейках (товар может встретиться в нескольких строках)
+    promo_cents = array("q", bytes(8 * len(products)))
+    touched: set = set()
+    breakdown: List[Dict[str, Any]] = []
+    amount_iter = iter(amounts)
+    for row, nmi, weight in zip(spend_rows, nms, weights):
+        if nmi is None:
             continue
-        weight = _f(row.get("sum"))
-        if i == last_idx:
-            amt = round(target - allocated, 2)
-        else:
-            amt = round(target * weight / weight_total, 2)
-            allocated = round(allocated + amt, 2)
-
+        amt = next(amount_iter)
         matched = by_nm.get(nmi) or []
         if matched:
+            first = products[matched[0]]
             if len(matched) == 1:
-                matched[0]["promotion"] = round(_f(matched[0].get("promotion")) + amt, 2)
-                barcode = str(matched[0].get("barcode") or "").strip()
-                sa_name = str(matched[0].get("sa_name") or "").strip()
-                name = str(matched[0].get("name") or "").strip()
+                parts = [amt]
+                barcode = str(first.get("barcode") or "").strip()
+                sa_name = str(first.get("sa_name") or "").strip()
+                name = str(first.get("name") or "").strip()
             else:
-                pay_base = sum(_f(p.get("for_pay")) for p in matched)
-                sub_alloc = 0.0
-                for j, p in enumerate(matched):
-                    if j == len(matched) - 1:
-                        part = round(amt - sub_alloc, 2)
-                    elif abs(pay_base) >= 1e-9:
-                        part = round(amt * _f(p.get("for_pay")) / pay_base, 2)
-                        sub_alloc = round(sub_alloc + part, 2)
-                    else:
-                        part = round(amt / len(matched), 2)
-                        sub_alloc = round(sub_alloc + part, 2)
-                    p["promotion"] = round(_f(p.get("promotion")) + part, 2)
-                barcode = str(matched[0].get("barcode") or "").strip()
-                sa_name = str(matched[0].get("sa_name") or row.get("vendor_code") or "").strip()
-                name = str(matched[0].get("name") or row.get("name") or "").strip()
+                pays = [_f(products[j].get("for_pay")) for j in matched]
+                pay_base = sum(pays)
+                if abs(pay_base) >= 1e-9:
+                    parts = _round2_many([amt * pay / pay_base for pay in pays[:-1]])
+                else:
+                    parts = [round(amt / len(matched), 2)] * (len(matched) - 1)
+                parts = _allocate_remainder_to_last(amt, parts)
+                barcode = str(first.get("barcode") or "").strip()
+                sa_name = str(first.get("sa_name") or row.get("vendor_code") or "").strip()
+                name = str(first.get("name") or row.get("name") or "").strip()
+            for j, part in zip(matched, parts):
+                promo_cents[j] += _cents(part)
+                touched.add(j)
         else:
             barcode = str(row.get("barcode") or "").strip()
             sa_name = str(row.get("vendor_code") or "").strip()
@@ -643,6 +793,9 @@ def _apply_promotion_allocation(
             "advert_sum": round(weight, 2),
         })
 
+    for j in touched:
+        products[j]["promotion"] = promo_cents[j] / 100
+
     breakdown.sort(key=lambda x: abs(_f(x.get("amount"))), reverse=True)
     return products, breakdown, advert_api_sum
 
@@ -669,49 +822,38 @@ def _apply_services_allocation(
 
     Σ «Сумма с услугами» по проданным = Оплата на РС.
     Цена с услугами = Сумма с услугами / Кол-во.
+    Колонки товаров читаются один раз (_product_columns), дальше — проходы по массивам
+    с округлением до копеек целым массивом (_round2_many).
     """
     if not products:
         return products
 
     target = round(_f(payment_to_account), 2)
-    sold: List[Dict[str, Any]] = []
-    unsold: List[Dict[str, Any]] = []
-    for p in products:
-        if _i(p.get("sales_qty")) > 0:
-            sold.append(p)
-        else:
-            unsold.append(p)
-            p["for_pay_with_services"] = None
-            p["price_with_services"] = None
+    qty = [_i(p.get("sales_qty")) for p in products]
+    sold = [i for i, q in enumerate(qty) if q > 0]
+    unsold = [i for i, q in enumerate(qty) if q <= 0]
+    for i in unsold:
+        products[i]["for_pay_with_services"] = None
+        products[i]["price_with_services"] = None
 
     if not sold:
         return products
 
-    def _costs(p: Dict[str, Any]) -> float:
-        return (
-            _f(p.get("logistics"))
-            + _f(p.get("storage"))
-            + _f(p.get("acceptance"))
-            + _f(p.get("promotion"))
+    cols = _product_columns(products, ("for_pay", "logistics", "storage", "acceptance", "promotion"))
+    for_pay = cols["for_pay"]
+    costs = [
+        logistics + storage + acceptance + promotion
+        for logistics, storage, acceptance, promotion in zip(
+            cols["logistics"], cols["storage"], cols["acceptance"], cols["promotion"]
         )
-
-    def _base(p: Dict[str, Any]) -> float:
-        return round(_f(p.get("for_pay")) - _costs(p), 2)
-
-    bases: List[float] = []
-    weights: List[float] = []
-    for p in sold:
-        pay = _f(p.get("for_pay"))
-        bases.append(_base(p))
-        weights.append(pay if pay > 0 else 0.0)
+    ]
+    bases = _round2_many([pay - cost for pay, cost in zip(for_pay, costs)])
 
     # Затраты / base непроданных (обычно for_pay=0 → base = −затраты)
-    unsold_services_sum = round(sum(_base(p) for p in unsold), 2)
+    unsold_services_sum = round(sum(bases[i] for i in unsold), 2)
 
-    allocated_total = round(sum(_costs(p) for p in products), 2)
-    pt = round(_f(products_total), 2) if products_total is not None else round(
-        sum(_f(p.get("for_pay")) for p in products), 2
-    )
+    allocated_total = round(sum(costs), 2)
+    pt = round(_f(products_total), 2) if products_total is not None else round(sum(for_pay), 2)
     # Как в подвале сверки: разница = Итого Сумма (gap) − Итого Разнесено
     recon_gap = round(pt - target, 2)
     allocation_residual = round(recon_gap - allocated_total, 2)
@@ -721,43 +863,24 @@ def _apply_services_allocation(
     # Эквивалентно: target - sum(bases), при for_pay непроданных ≈ 0
     gap = round(-to_distribute, 2)
 
+    weights = [for_pay[i] if for_pay[i] > 0 else 0.0 for i in sold]
     weight_total = round(sum(weights), 2)
-    allocated_adj = 0.0
-    last_idx = len(sold) - 1
-    for i, p in enumerate(sold):
-        if i == last_idx:
-            adj = round(gap - allocated_adj, 2)
-        elif weight_total > 1e-9:
-            adj = round(gap * (weights[i] / weight_total), 2)
-            allocated_adj = round(allocated_adj + adj, 2)
-        else:
-            n = len(sold)
-            adj = round(gap / n, 2)
-            allocated_adj = round(allocated_adj + adj, 2)
-        amt = round(bases[i] + adj, 2)
+    if weight_total > 1e-9:
+        parts = _round2_many([gap * (w / weight_total) for w in weights[:-1]])
+    else:
+        parts = [round(gap / len(sold), 2)] * (len(sold) - 1)
+    adjustments = _allocate_remainder_to_last(gap, parts)
+
+    amounts = _round2_many([bases[i] + adj for i, adj in zip(sold, adjustments)])
+    prices = _round2_many([amt / qty[i] for i, amt in zip(sold, amounts)])
+    for i, amt, price in zip(sold, amounts, prices):
+        p = products[i]
         p["for_pay_with_services"] = amt
-        qty = _i(p.get("sales_qty"))
-        p["price_with_services"] = round(amt / qty, 2) if qty else None
+        p["price_with_services"] = price
 
     return products
 
 
-def _is_ksale_oper(oper: str, doc: Any) -> bool:
-    if oper in ("продажа", "сторно возвратов", "корректная продажа"):
-        return True
-    if oper == "коррекция продаж" and _is_sale_doc(doc):
-        return True
-    return False
-
-
-def _is_kreturn_oper(oper: str, doc: Any) -> bool:
-    if oper in ("возврат", "сторно продаж", "корректный возврат"):
-        return True
-    if oper == "коррекция продаж" and _is_return_doc(doc):
-        return True
-    return False
-
-
 def _build_payment_vs_products_reconciliation(
     *,
     products_total: float,
@@ -847,25 +970,14 @@ def _build_payment_vs_products_reconciliation(
     }
 
 
-def compute_finance_dashboard(
-    raw: List[Dict[str, Any]],
-    date_from: str,
-    date_to: str,
-    products_catalog: List[Dict[str, Any]] | None = None,
-    user_id: int | None = None,
-    paid_storage: List[Dict[str, Any]] | None = None,
-    promotion_spend: List[Dict[str, Any]] | None = None,
-) -> Dict[str, Any]:
+def build_finance_partial(raw: List[Dict[str, Any]] | FinanceColumns) -> Dict[str, Any]:
     """
-    Считает метрики как на DASHBOARD:
-    выручка / выкупы / возвраты / WB реализовал / удержания / компенсации / оплата на РС.
+    Один проход по строкам фин. отчёта: суммы, детализации, сводка по товарам и затраты
+    по _cost_key без округления. Частичные агрегаты складываются merge_finance_partials
+    (например, по неделям), итог считает finance_dashboard_from_partial, а итоги
+    страницы /report/finance (суммы report_*) — utils.finance_engine.
+    raw — список строк WB или FinanceColumns с теми же значениями.
     """
-    if products_catalog is None and user_id is not None:
-        try:
-            from utils.cache import load_products_cache_for_user
-            products_catalog = (load_products_cache_for_user(user_id) or {}).get("items") or []
-        except Exception:
-            products_catalog = []
     buyouts_rub = 0.0
     returns_rub = 0.0
     buyouts_qty = 0
@@ -893,18 +1005,35 @@ def compute_finance_dashboard(
     # Компенсация ущерба (G20)
     damage = 0.0
 
-    defect_details: Dict[Tuple[str, ...], Dict[str, Any]] = {}
-    damage_details: Dict[Tuple[str, ...], Dict[str, Any]] = {}
-    penalty_details: Dict[Tuple[str, ...], Dict[str, Any]] = {}
-    additional_details: Dict[Tuple[str, ...], Dict[str, Any]] = {}
-    return_details: Dict[Tuple[str, ...], Dict[str, Any]] = {}
-    logistics_details: Dict[Tuple[str, ...], Dict[str, Any]] = {}
-    other_details: Dict[Tuple[str, ...], Dict[str, Any]] = {}
-    acceptance_details: Dict[Tuple[str, ...], Dict[str, Any]] = {}
-    returns_for_pay_details: Dict[Tuple[str, ...], Dict[str, Any]] = {}
-    paid_delivery_details: Dict[Tuple[str, ...], Dict[str, Any]] = {}
-    e3_details: Dict[Tuple[str, ...], Dict[str, Any]] = {}
-    products_vs_ksale_details: Dict[Tuple[str, ...], Dict[str, Any]] = {}
+    # Итоги /report/finance: по всем строкам и по своим наборам операций
+    report_qty = 0
+    report_retail_amount = 0.0
+    report_for_pay = 0.0
+    report_ppvz_vw = 0.0
+    report_buyouts = 0.0
+    report_returns = 0.0
+    report_buyout_rows = 0
+    report_return_rows = 0
+    report_paid_delivery = 0.0
+    report_defect = 0.0
+    report_damage = 0.0
+
+    defect_details: Dict[str, Dict[str, Any]] = {}
+    damage_details: Dict[str, Dict[str, Any]] = {}
+    penalty_details: Dict[str, Dict[str, Any]] = {}
+    additional_details: Dict[str, Dict[str, Any]] = {}
+    return_details: Dict[str, Dict[str, Any]] = {}
+    logistics_details: Dict[str, Dict[str, Any]] = {}
+    other_details: Dict[str, Dict[str, Any]] = {}
+    acceptance_details: Dict[str, Dict[str, Any]] = {}
+    returns_for_pay_details: Dict[str, Dict[str, Any]] = {}
+    paid_delivery_details: Dict[str, Dict[str, Any]] = {}
+    e3_details: Dict[str, Dict[str, Any]] = {}
+    products_vs_ksale_details: Dict[str, Dict[str, Any]] = {}
+
+    # Сводка по товарам и суммы затрат по _cost_key — в том же проходе по raw
+    products_bucket: Dict[str, Dict[str, Any]] = {}
+    row_costs: Dict[str, List[float]] = {}
 
     for r in raw:
         oper = _norm(r.get("supplier_oper_name"))
@@ -914,6 +1043,12 @@ def compute_finance_dashboard(
         retail_t = _retail_with_disc(r)
         retail_p = _f(r.get("retail_amount"))
         barcode = str(r.get("barcode") or "").strip()
+        doc_n = _norm(doc)
+        # То же, что _is_sale_doc / _is_return_doc, без повторной нормализации
+        is_sale_doc = "продаж" in doc_n
+        is_return_doc = "возврат" in doc_n
+        # Ключ детализации собирается при первой записи строки в любую из детализаций
+        key = None
 
         delivery_rub = _f(r.get("delivery_rub"))
         storage_fee = _f(r.get("storage_fee"))
@@ -927,93 +1062,319 @@ def compute_finance_dashboard(
         other_deductions += deduction_val
 
         if abs(delivery_rub) >= 1e-9:
-            _add_detail(logistics_details, r, delivery_rub)
+            key = _add_detail(logistics_details, r, delivery_rub, key)
         if abs(acceptance_val) >= 1e-9:
-            _add_detail(acceptance_details, r, acceptance_val)
+            key = _add_detail(acceptance_details, r, acceptance_val, key)
         if abs(deduction_val) >= 1e-9:
-            _add_detail(other_details, r, deduction_val)
+            key = _add_detail(other_details, r, deduction_val, key)
+        if abs(delivery_rub) >= 1e-9 or abs(acceptance_val) >= 1e-9:
+            cost_key = _cost_key(r)
+            if cost_key is not None:
+                costs = row_costs.get(cost_key)
+                if costs is None:
+                    row_costs[cost_key] = [delivery_rub, acceptance_val]
+                else:
+                    costs[0] += delivery_rub
+                    costs[1] += acceptance_val
 
         penalty_val = _f(r.get("penalty"))
         additional_val = _f(r.get("additional_payment"))
         penalties += penalty_val
         additional_payment += additional_val
         if abs(penalty_val) >= 1e-9:
-            _add_detail(penalty_details, r, penalty_val)
+            key = _add_detail(penalty_details, r, penalty_val, key)
         if abs(additional_val) >= 1e-9:
-            _add_detail(additional_details, r, additional_val)
+            key = _add_detail(additional_details, r, additional_val, key)
+
+        report_qty += qty
+        report_retail_amount += retail_p
+        report_for_pay += pay
+        report_ppvz_vw += _f(r.get("ppvz_vw"))
+        if "логистик" in oper and pay > 0:
+            report_paid_delivery += pay
+        signs = REPORT_DEFECT_OPERS.get(oper)
+        if signs is not None:
+            if is_sale_doc:
+                report_defect += signs[0] * pay
+            if is_return_doc:
+                report_defect += signs[1] * pay
+        signs = REPORT_DAMAGE_OPERS.get(oper)
+        if signs is not None:
+            if is_sale_doc:
+                report_damage += signs[0] * pay
+            if is_return_doc:
+                report_damage += signs[1] * pay
 
         # Выкупы / возвраты (руб по T, шт по N)
         if oper in BUYOUT_OPERS:
+            report_buyouts += _f(r.get("retail_price"))
+            report_buyout_rows += 1
             # «коррекция продаж» учитываем только с типом документа Продажа для qty/руб как в Excel SUMIFS без фильтра J
             # (в Excel для T/N на выкупах фильтр только по K, без J)
             buyouts_rub += retail_t
             buyouts_qty += qty
             wb_plus += retail_p
         if oper in RETURN_OPERS:
+            report_returns += _f(r.get("retail_price"))
+            report_return_rows += 1
             returns_rub += retail_t
             returns_qty += qty
             wb_minus += retail_p
-            _add_detail(return_details, r, retail_t)
+            key = _add_detail(return_details, r, retail_t, key)
 
         # Эквайринг: sale +fee, return -fee при percent > 0
         acq_pct = _f(r.get("acquiring_percent"))
         afee = _f(r.get("acquiring_fee"))
         if acq_pct > 0:
-            if _is_sale_doc(doc):
+            if is_sale_doc:
                 acquiring += afee
-            elif _is_return_doc(doc):
+            elif is_return_doc:
                 acquiring -= afee
 
         if "коррект" in oper and "эквайр" in oper:
             e3_acquiring_corr += pay
-            _add_detail(e3_details, r, pay)
+            key = _add_detail(e3_details, r, pay, key)
 
         if oper == "услуга платная доставка":
             paid_delivery += pay
-            _add_detail(paid_delivery_details, r, pay)
+            key = _add_detail(paid_delivery_details, r, pay, key)
 
         # Комиссия: суммы к перечислению по операциям
-        is_ksale = _is_ksale_oper(oper, doc)
-        is_kreturn = _is_kreturn_oper(oper, doc)
+        is_ksale = oper in K_SALE_OPERS or (oper == "коррекция продаж" and is_sale_doc)
+        is_kreturn = oper in K_RETURN_OPERS or (oper == "коррекция продаж" and is_return_doc)
         if is_ksale:
             k_sale += pay
         if is_kreturn:
             k_return += pay
-            _add_detail(returns_for_pay_details, r, pay)
+            key = _add_detail(returns_for_pay_details, r, pay, key)
+
+        # Сводка по товарам (без возвратов)
+        is_return_row = oper in RETURN_OPERS or is_return_doc
+        product_key = None if is_return_row else _product_group_key(r)
+        in_products = product_key is not None
+        if in_products:
+            _add_product_row(
+                products_bucket,
+                r,
+                product_key,
+                pay=pay,
+                sales_qty=qty if oper in BUYOUT_OPERS else 0,
+                barcode=barcode,
+            )
 
         # Сумма по товарам − k_sale:
         # + операции в товарной сводке, не входящие в k_sale
         # − продажи k_sale, которые не попали в товарную сводку
-        is_return_row = oper in RETURN_OPERS or _is_return_doc(doc)
-        in_products = _row_in_products_breakdown(r, is_return_row=is_return_row)
         if in_products and not is_ksale and abs(pay) >= 1e-9:
-            _add_detail(products_vs_ksale_details, r, pay)
+            key = _add_detail(products_vs_ksale_details, r, pay, key)
         if is_ksale and not in_products and abs(pay) >= 1e-9:
-            _add_detail(products_vs_ksale_details, r, -pay)
+            key = _add_detail(products_vs_ksale_details, r, -pay, key)
 
         # Компенсация брака (упрощённо по наборам Excel G18)
         if oper in DEFECT_OPERS:
-            if _is_sale_doc(doc):
+            if is_sale_doc:
                 defect += pay
-                _add_detail(defect_details, r, pay)
-            elif _is_return_doc(doc):
+                key = _add_detail(defect_details, r, pay, key)
+            elif is_return_doc:
                 defect -= pay
-                _add_detail(defect_details, r, -pay)
+                key = _add_detail(defect_details, r, -pay, key)
 
         # Компенсация ущерба (G20)
         if oper in DAMAGE_OPERS:
-            if _is_sale_doc(doc):
+            if is_sale_doc:
                 damage += pay
-                _add_detail(damage_details, r, pay)
-            elif _is_return_doc(doc):
+                key = _add_detail(damage_details, r, pay, key)
+            elif is_return_doc:
                 damage -= pay
-                _add_detail(damage_details, r, -pay)
+                key = _add_detail(damage_details, r, -pay, key)
+
+    return {
+        "v": FINANCE_PARTIAL_VERSION,
+        "rows": len(raw),
+        "sums": {
+            "buyouts_rub": buyouts_rub,
+            "returns_rub": returns_rub,
+            "buyouts_qty": buyouts_qty,
+            "returns_qty": returns_qty,
+            "wb_plus": wb_plus,
+            "wb_minus": wb_minus,
+            "delivery_count": delivery_count,
+            "logistics": logistics,
+            "storage": storage,
+            "acceptance": acceptance,
+            "other_deductions": other_deductions,
+            "penalties": penalties,
+            "additional_payment": additional_payment,
+            "acquiring": acquiring,
+            "paid_delivery": paid_delivery,
+            "e3_acquiring_corr": e3_acquiring_corr,
+            "k_sale": k_sale,
+            "k_return": k_return,
+            "defect": defect,
+            "damage": damage,
+            "report_qty": report_qty,
+            "report_retail_amount": report_retail_amount,
+            "report_for_pay": report_for_pay,
+            "report_ppvz_vw": report_ppvz_vw,
+            "report_buyouts": report_buyouts,
+            "report_returns": report_returns,
+            "report_buyout_rows": report_buyout_rows,
+            "report_return_rows": report_return_rows,
+            "report_paid_delivery": report_paid_delivery,
+            "report_defect": report_defect,
+            "report_damage": report_damage,
+        },
+        "details": {
+            "defect": defect_details,
+            "damage": damage_details,
+            "penalties": penalty_details,
+            "additional": additional_details,
+            "returns": return_details,
+            "logistics": logistics_details,
+            "other": other_details,
+            "acceptance": acceptance_details,
+            "returns_for_pay": returns_for_pay_details,
+            "paid_delivery": paid_delivery_details,
+            "e3": e3_details,
+            "products_vs_ksale": products_vs_ksale_details,
+        },
+        "products": products_bucket,
+        "costs": row_costs,
+    }
+
+
+def _merge_detail_item(item: Dict[str, Any], other: Dict[str, Any]) -> None:
+    item["qty"] += _i(other.get("qty"))
+    item["amount"] += _f(other.get("amount"))
+
+
+def _merge_product_item(item: Dict[str, Any], other: Dict[str, Any]) -> None:
+    """Как _add_product_row для уже собранной строки: суммы складываются, пустые поля дополняются."""
+    item["for_pay"] += _f(other.get("for_pay"))
+    item["sales_qty"] = _i(item.get("sales_qty")) + _i(other.get("sales_qty"))
+    if not item.get("barcode") and other.get("barcode"):
+        item["barcode"] = other["barcode"]
+    if item["name"] in ("", "—"):
+        item["name"] = other.get("name")
+    if not item.get("nm_id") and other.get("nm_id"):
+        item["nm_id"] = other["nm_id"]
+    if not item.get("sa_name") and other.get("sa_name"):
+        item["sa_name"] = other["sa_name"]
+
+
+def merge_finance_partials(partials: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Складывает частичные агрегаты build_finance_partial в один.
+
+    Порядок важен так же, как порядок строк в одном проходе: первое вхождение товара или
+    строки детализации задаёт её поля (название, артикул), поэтому недели передаются
+    по возрастанию дат. Входные агрегаты не изменяются.
+    """
+    merged: Dict[str, Any] = {
+        "v": FINANCE_PARTIAL_VERSION,
+        "rows": 0,
+        "sums": {},
+        "details": {},
+        "products": {},
+        "costs": {},
+    }
+    sums = merged["sums"]
+    details = merged["details"]
+    products = merged["products"]
+    costs = merged["costs"]
+    for part in partials:
+        merged["rows"] += _i(part.get("rows"))
+        for name, value in (part.get("sums") or {}).items():
+            sums[name] = sums.get(name, 0) + value
+        for name, bucket in (part.get("details") or {}).items():
+            target = details.setdefault(name, {})
+            for key, item in bucket.items():
+                have = target.get(key)
+                if have is None:
+                    target[key] = dict(item)
+                else:
+                    _merge_detail_item(have, item)
+        for key, item in (part.get("products") or {}).items():
+            have = products.get(key)
+            if have is None:
+                products[key] = dict(item)
+            else:
+                _merge_product_item(have, item)
+        for key, (delivery_rub, acceptance_val) in (part.get("costs") or {}).items():
+            have = costs.get(key)
+            if have is None:
+                costs[key] = [delivery_rub, acceptance_val]
+            else:
+                have[0] += delivery_rub
+                have[1] += acceptance_val
+    return merged
+
+
+def finance_dashboard_from_partial(
+    partial: Dict[str, Any],
+    date_from: str,
+    date_to: str,
+    products_catalog: List[Dict[str, Any]] | None = None,
+    user_id: int | None = None,
+    paid_storage: List[Dict[str, Any]] | None = None,
+    promotion_spend: List[Dict[str, Any]] | None = None,
+) -> Dict[str, Any]:
+    """
+    Считает метрики как на DASHBOARD по агрегату build_finance_partial / merge_finance_partials:
+    выручка / выкупы / возвраты / WB реализовал / удержания / компенсации / оплата на РС.
+    Разнесение хранения, продвижения и услуг по товарам — здесь, уже после слияния периодов.
+    """
+    if products_catalog is None and user_id is not None:
+        try:
+            from utils.cache import load_products_cache_for_user
+            products_catalog = (load_products_cache_for_user(user_id) or {}).get("items") or []
+        except Exception:
+            products_catalog = []
+
+    sums = partial.get("sums") or {}
+    buyouts_rub = _f(sums.get("buyouts_rub"))
+    returns_rub = _f(sums.get("returns_rub"))
+    buyouts_qty = _i(sums.get("buyouts_qty"))
+    returns_qty = _i(sums.get("returns_qty"))
+    wb_plus = _f(sums.get("wb_plus"))
+    wb_minus = _f(sums.get("wb_minus"))
+    delivery_count = _f(sums.get("delivery_count"))
+    logistics = _f(sums.get("logistics"))
+    storage = _f(sums.get("storage"))
+    acceptance = _f(sums.get("acceptance"))
+    other_deductions = _f(sums.get("other_deductions"))
+    penalties = _f(sums.get("penalties"))
+    additional_payment = _f(sums.get("additional_payment"))
+    acquiring = _f(sums.get("acquiring"))
+    paid_delivery = _f(sums.get("paid_delivery"))
+    e3_acquiring_corr = _f(sums.get("e3_acquiring_corr"))
+    k_sale = _f(sums.get("k_sale"))
+    k_return = _f(sums.get("k_return"))
+    defect = _f(sums.get("defect"))
+    damage = _f(sums.get("damage"))
+
+    details = partial.get("details") or {}
+    defect_details = details.get("defect") or {}
+    damage_details = details.get("damage") or {}
+    penalty_details = details.get("penalties") or {}
+    additional_details = details.get("additional") or {}
+    return_details = details.get("returns") or {}
+    logistics_details = details.get("logistics") or {}
+    other_details = details.get("other") or {}
+    acceptance_details = details.get("acceptance") or {}
+    returns_for_pay_details = details.get("returns_for_pay") or {}
+    paid_delivery_details = details.get("paid_delivery") or {}
+    e3_details = details.get("e3") or {}
+    products_vs_ksale_details = details.get("products_vs_ksale") or {}
+    products_bucket = partial.get("products") or {}
+    row_costs = partial.get("costs") or {}
+    rows_count = _i(partial.get("rows"))
 
     revenue_rub = buyouts_rub - returns_rub
     revenue_qty = buyouts_qty - returns_qty
     wb_realized = wb_plus - wb_minus
 
-    # Комиссия B18 (без e3 внутри — e3 добавим в оплату на РС, как в рабочем _process_finance_data)
+    # Комиссия B18 (без e3 внутри — e3 добавим в оплату на РС, как в finance_report_from_partial)
     commission = revenue_rub - k_sale + k_return - acquiring
 
     # Удержания WB (только удержания, без компенсаций/возвратов)
@@ -1042,16 +1403,17 @@ def compute_finance_dashboard(
     storage_by_product = _build_paid_storage_by_product(paid_storage)
     paid_storage_total = round(sum(_f(x.get("amount")) for x in storage_by_product), 2)
 
-    products = _build_products_breakdown(raw)
-    products = _enrich_products_from_catalog(products, products_catalog)
+    catalog_index = _index_catalog(products_catalog) if products_catalog else None
+    products = _finalize_products(products_bucket)
+    products = _enrich_products_from_catalog(products, products_catalog, catalog_index=catalog_index)
     products = _apply_product_expense_columns(
         products,
-        raw,
+        row_costs,
         acceptance_total=acceptance,
         paid_storage=paid_storage,
     )
     # Дообогащаем имена/баркоды у строк «только хранение»
-    products = _enrich_products_from_catalog(products, products_catalog)
+    products = _enrich_products_from_catalog(products, products_catalog, catalog_index=catalog_index)
     other_details_final = _finalize_details(other_details)
     promotion_total = _promotion_total_from_details(other_details_final)
     products, promotion_by_product, advert_api_sum = _apply_promotion_allocation(
@@ -1107,7 +1469,7 @@ def compute_finance_dashboard(
 
     return {
         "success": True,
-        "rows_count": len(raw),
+        "rows_count": rows_count,
         "date_from": date_from,
         "date_to": date_to,
         "date_from_fmt": date_from_fmt,
@@ -1194,3 +1556,27 @@ def compute_finance_dashboard(
             "payment_to_account": round(payment_to_account, 2),
         },
     }
+
+
+def compute_finance_dashboard(
+    raw: List[Dict[str, Any]] | FinanceColumns,
+    date_from: str,
+    date_to: str,
+    products_catalog: List[Dict[str, Any]] | None = None,
+    user_id: int | None = None,
+    paid_storage: List[Dict[str, Any]] | None = None,
+    promotion_spend: List[Dict[str, Any]] | None = None,
+) -> Dict[str, Any]:
+    """
+    Считает метрики как на DASHBOARD:
+    выручка / выкупы / возвраты / WB реализовал / удержания / компенсации / оплата на РС.
+    """
+    return finance_dashboard_from_partial(
+        build_finance_partial(raw),
+        date_from,
+        date_to,
+        products_catalog=products_catalog,
+        user_id=user_id,
+        paid_storage=paid_storage,
+        promotion_spend=promotion_spend,
+    )
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""Единый расчёт фин. отчёта для /report/finance и /report/finance-breakdown из одного агрегата периода."""
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+from utils.finance_dashboard import FINANCE_PARTIAL_VERSION, _f, _i
+from utils.finance_partials import collect_finance_partial, finance_period_closed
+
+REPORT_KIND_FINANCE_PARTIAL = "finance_partial"
+
+
+def finance_report_from_partial(
+    partial: Dict[str, Any],
+    date_from: str,
+    date_to: str,
+    *,
+    tax_rate: Optional[float] = None,
+) -> Dict[str, Any]:
+    """
+    Ответ /api/report/finance по агрегату периода: итоги, налог от «WB реализовал».
+    Вместо самих строк — их число и количество строк выкупов / возвратов (для счётчиков страницы).
+    """
+    s = partial.get("sums") or {}
+
+    total_buyouts = _f(s.get("report_buyouts"))
+    total_returns = _f(s.get("report_returns"))
+    total_acquiring = _f(s.get("acquiring"))
+    total_logistics = _f(s.get("logistics"))
+    total_storage = _f(s.get("storage"))
+    total_acceptance = _f(s.get("acceptance"))
+    total_penalties = _f(s.get("penalties"))
+    total_additional_payment = _f(s.get("additional_payment"))
+    total_other_deductions = _f(s.get("other_deductions")) + total_additional_payment
+    total_paid_delivery = _f(s.get("report_paid_delivery"))
+    defect_comp = _f(s.get("report_defect"))
+    damage_comp = _f(s.get("report_damage"))
+
+    revenue_calc = total_buyouts - total_returns
+    total_wb_realized = _f(s.get("wb_plus")) - _f(s.get("wb_minus"))
+    commission_total = revenue_calc - _f(s.get("k_sale")) + _f(s.get("k_return")) - total_acquiring
+    total_deductions = (
+        commission_total
+        + total_acquiring
+        + total_logistics
+        + total_storage
+        + total_other_deductions
+        + total_acceptance
+        - defect_comp
+        - damage_comp
+        - total_paid_delivery
+        + total_penalties
+        + total_additional_payment
+    )
+    total_for_transfer = revenue_calc - total_deductions + _f(s.get("e3_acquiring_corr"))
+    tax_amount = (total_wb_realized * tax_rate) / 100.0 if tax_rate is not None else 0.0
+
+    return {
+        "rows_count": _i(partial.get("rows")),
+        "buyouts_rows": _i(s.get("report_buyout_rows")),
+        "returns_rows": _i(s.get("report_return_rows")),
+        "total_qty": _i(s.get("report_qty")),
+        "total_sum": round(_f(s.get("report_retail_amount")), 2),
+        "total_logistics": round(total_logistics, 2),
+        "total_storage": round(total_storage, 2),
+        "total_acceptance": round(total_acceptance, 2),
+        "total_for_pay": round(_f(s.get("report_for_pay")), 2),
+        "total_buyouts": round(total_buyouts, 2),
+        "total_returns": round(total_returns, 2),
+        "revenue": round(revenue_calc, 2),
+        "total_wb_realized": round(total_wb_realized, 2),
+        "total_commission": round(commission_total, 2),
+        "total_acquiring": round(total_acquiring, 2),
+        "total_commission_wb": round(_f(s.get("report_ppvz_vw")), 2),
+        "total_other_deductions": round(total_other_deductions, 2),
+        "total_penalties": round(total_penalties, 2),
+        "total_defect_compensation": round(defect_comp, 2),
+        "total_damage_compensation": round(damage_comp, 2),
+        "total_paid_delivery": round(total_paid_delivery, 2),
+        "total_additional_payment": round(total_additional_payment, 2),
+        "total_deductions": round(total_deductions, 2),
+        "total_for_transfer": round(total_for_transfer, 2),
+        "tax_amount": round(tax_amount, 2),
+        "tax_rate": tax_rate,
+        "date_from_fmt": datetime.strptime(date_from, "%Y-%m-%d").strftime("%d.%m.%Y"),
+        "date_to_fmt": datetime.strptime(date_to, "%Y-%m-%d").strftime("%d.%m.%Y"),
+    }
+
+
+def load_or_collect_finance_partial(
+    user_id: int,
+    date_from: str,
+    date_to: str,
+    fetch_rows: Callable[[str, str], Any],
+    *,
+    progress_callback=None,
+    refresh: bool = False,
+) -> Dict[str, Any]:
+    """
+    Агрегат фин. отчёта за период: сохранённый другой страницей (или прошлым запросом),
+    иначе collect_finance_partial (закрытые недели с диска, остальное из WB) с сохранением.
+    Сохраняется только агрегат, все отрезки которого загрузились; период с открытыми
+    неделями — на REPORT_RESULT_OPEN_TTL_SECONDS. refresh=True — всегда собирать заново.
+    """
+    from utils.constants import REPORT_RESULT_OPEN_TTL_SECONDS
+    from utils.report_results import load_report_result, save_report_result
+
+    version = str(FINANCE_PARTIAL_VERSION)
+    if not refresh:
+        cached = load_report_result(user_id, REPORT_KIND_FINANCE_PARTIAL, date_from, date_to, version)
+        if cached is not None:
+            print(f"Агрегат фин. отчёта {date_from} - {date_to}, пользователь {user_id}: из кэша")
+            return cached
+    partial = collect_finance_partial(
+        user_id,
+        date_from,
+        date_to,
+        fetch_rows,
+        progress_callback=progress_callback,
+    )
+    if partial.get("failed_segments"):
+        return partial
+    ttl_s = None if finance_period_closed(date_to) else REPORT_RESULT_OPEN_TTL_SECONDS
+    save_report_result(user_id, REPORT_KIND_FINANCE_PARTIAL, date_from, date_to, version, partial, ttl_s=ttl_s)
+    return partial
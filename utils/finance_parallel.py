@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""Расчёт недельных агрегатов фин. отчёта в пуле процессов, пока загружаются следующие недели."""
+import logging
+import multiprocessing
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from utils.constants import FINANCE_PARALLEL_MIN_ROWS, FINANCE_PARALLEL_WORKERS
+from utils.finance_dashboard import build_finance_partial
+
+logger = logging.getLogger(__name__)
+
+
+def finance_parallel_workers() -> int:
+    """Число процессов пула: FINANCE_PARALLEL_WORKERS или число ядер."""
+    if FINANCE_PARALLEL_WORKERS > 0:
+        return FINANCE_PARALLEL_WORKERS
+    return os.cpu_count() or 1
+
+
+def _build_week_partial(rows: Any, after: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    partial = build_finance_partial(rows)
+    if after is not None:
+        after(partial)
+    return partial
+
+
+class FinanceWeekPool:
+    """
+    build_finance_partial для загруженных недель. Неделя от FINANCE_PARALLEL_MIN_ROWS строк
+    уходит в процесс пула, и следующая неделя качается из WB, пока эта считается; мелкие
+    недели считаются сразу. after(агрегат) выполняется там же, где считалась неделя — так
+    и запись агрегата на диск уходит из потока запроса. Пул (spawn: fork из многопоточного
+    веб-процесса небезопасен) создаётся при первой крупной неделе. В ожидании держится
+    не больше недель, чем процессов; если процесс не справился, неделя пересчитывается
+    в текущем процессе.
+    """
+
+    def __init__(self, workers: Optional[int] = None, min_rows: Optional[int] = None) -> None:
+        self.workers = workers or finance_parallel_workers()
+        self.min_rows = FINANCE_PARALLEL_MIN_ROWS if min_rows is None else min_rows
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pending: "OrderedDict[Hashable, Tuple[Any, Any, Any]]" = OrderedDict()
+        self._ready: List[Tuple[Hashable, Dict[str, Any]]] = []
+
+    def __enter__(self) -> "FinanceWeekPool":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def submit(self, key: Hashable, rows: Any, after: Optional[Callable[[Dict[str, Any]], None]] = None) -> None:
+        """Ставит в расчёт строки недели key; результат — в completed(). after должен сериализоваться pickle."""
+        if self.workers > 1 and len(rows) >= self.min_rows:
+            try:
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                    )
+                self._pending[key] = (self._pool.submit(_build_week_partial, rows, after), rows, after)
+                while len(self._pending) > self.workers:
+                    self._collect(next(iter(self._pending)))
+                return
+            except Exception as e:
+                logger.warning(f"Пул расчёта фин. отчёта недоступен ({e}), считаем в текущем процессе")
+        self._ready.append((key, _build_week_partial(rows, after)))
+
+    def _collect(self, key: Hashable) -> None:
+        future, rows, after = self._pending.pop(key)
+        try:
+            partial = future.result()
+        except Exception as e:
+            logger.warning(f"Расчёт недели {key} в пуле не удался ({e}), считаем в текущем процессе")
+            partial = _build_week_partial(rows, after)
+        self._ready.append((key, partial))
+
+    def completed(self, wait: bool = False) -> List[Tuple[Hashable, Dict[str, Any]]]:
+        """Посчитанные недели (key, агрегат); wait=True — дождаться всех поставленных."""
+        for key in list(self._pending):
+            if wait or self._pending[key][0].done():
+                self._collect(key)
+        ready, self._ready = self._ready, []
+        return ready
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+        self._pending.clear()
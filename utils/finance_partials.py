@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""Недельные агрегаты фин. отчёта WB: users/<id>/finance_partials/<понедельник>.json."""
+import functools
+import json
+import os
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from utils.cache_layout import user_cache_path
+from utils.cache_manager import record_cache_access
+from utils.constants import FINANCE_WEEK_CLOSED_AFTER_DAYS, FINANCE_WEEK_FETCH_PAUSE_S
+from utils.finance_dashboard import FINANCE_PARTIAL_VERSION, build_finance_partial, merge_finance_partials
+from utils.finance_parallel import FinanceWeekPool
+from utils.finance_srid_index import record_finance_week_srids
+
+
+def plan_finance_segments(
+    date_from: str,
+    date_to: str,
+    today: Optional[date] = None,
+) -> List[Tuple[str, str, bool]]:
+    """
+    Разбивает период на отрезки по возрастанию дат: (с, по, закрытая неделя целиком).
+    Закрытая неделя Пн–Вс в WB больше не меняется — её можно брать из сохранённого
+    агрегата, остальные отрезки (края периода, текущая неделя) загружаются из WB.
+    """
+    start = datetime.strptime(date_from, "%Y-%m-%d").date()
+    end = datetime.strptime(date_to, "%Y-%m-%d").date()
+    today = today or date.today()
+    segments: List[Tuple[str, str, bool]] = []
+    cursor = start
+    while cursor <= end:
+        monday = cursor - timedelta(days=cursor.weekday())
+        sunday = monday + timedelta(days=6)
+        seg_end = min(sunday, end)
+        full_week = cursor == monday and seg_end == sunday
+        closed = full_week and (today - sunday).days >= FINANCE_WEEK_CLOSED_AFTER_DAYS
+        seg = (cursor.strftime("%Y-%m-%d"), seg_end.strftime("%Y-%m-%d"), closed)
+        # Соседние открытые отрезки склеиваем — один запрос к WB вместо нескольких
+        if not closed and segments and not segments[-1][2]:
+            segments[-1] = (segments[-1][0], seg[1], False)
+        else:
+            segments.append(seg)
+        cursor = seg_end + timedelta(days=1)
+    return segments
+
+
+def finance_period_closed(date_to: str, today: Optional[date] = None) -> bool:
+    """Закрыта ли неделя, в которую попадает конец периода, — итоги за период больше не изменятся."""
+    end = datetime.strptime(date_to, "%Y-%m-%d").date()
+    sunday = end + timedelta(days=6 - end.weekday())
+    return ((today or date.today()) - sunday).days >= FINANCE_WEEK_CLOSED_AFTER_DAYS
+
+
+def _week_partial_path(user_id: int, week_from: str) -> str:
+    return os.path.join(user_cache_path(user_id, "finance_partials", is_dir=True), f"{week_from}.json")
+
+
+def load_finance_week_partial(user_id: int, week_from: str) -> Optional[Dict[str, Any]]:
+    """Сохранённый агрегат недели, начинающейся week_from, или None (нет файла / другая версия)."""
+    path = _week_partial_path(user_id, week_from)
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        partial = data.get("partial")
+        if data.get("v") != FINANCE_PARTIAL_VERSION or not isinstance(partial, dict):
+            return None
+        record_cache_access(path)
+        return partial
+    except Exception as e:
+        print(f"Ошибка чтения недельного агрегата фин. отчёта {path}: {e}")
+        return None
+
+
+def save_finance_week_partial(user_id: int, week_from: str, week_to: str, partial: Dict[str, Any]) -> None:
+    write_finance_week_partial(_week_partial_path(user_id, week_from), week_from, week_to, partial)
+
+
+def write_finance_week_partial(path: str, week_from: str, week_to: str, partial: Dict[str, Any]) -> None:
+    """Запись агрегата недели по готовому пути — в т.ч. из процесса пула (FinanceWeekPool)."""
+    from utils.cache import atomic_write_json
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        atomic_write_json(path, {
+            "v": FINANCE_PARTIAL_VERSION,
+            "date_from": week_from,
+            "date_to": week_to,
+            "saved_at": datetime.now().isoformat(timespec="seconds"),
+            "partial": partial,
+        })
+    except Exception as e:
+        print(f"Ошибка сохранения недельного агрегата фин. отчёта {path}: {e}")
+
+
+def collect_finance_partial(
+    user_id: int,
+    date_from: str,
+    date_to: str,
+    fetch_rows: Callable[[str, str], List[Dict[str, Any]]],
+    progress_callback=None,
+) -> Dict[str, Any]:
+    """
+    Агрегат build_finance_partial за период: закрытые недели — из сохранённых файлов
+    (недостающие загружаются через fetch_rows(с, по) и сохраняются), остальное — из WB.
+    fetch_rows при ошибке загрузки поднимает исключение: такой отрезок считается пустым
+    и не сохраняется, а пустой успешный ответ за закрытую неделю сохраняется как есть.
+    Крупные недели считаются в пуле процессов (FinanceWeekPool), пока качается следующая.
+    progress_callback(current, total, period) вызывается перед каждой загрузкой из WB.
+
+    В агрегате: failed_segments — отрезки («с - по»), которые не удалось загрузить,
+    empty_segments — загруженные из WB в этом вызове без единой строки. Разнесение
+    хранения/продвижения/услуг — после слияния (finance_dashboard_from_partial).
+    """
+    segments = plan_finance_segments(date_from, date_to)
+    partials: List[Optional[Dict[str, Any]]] = []
+    to_fetch: List[int] = []
+    failed: List[str] = []
+    for idx, (seg_from, _seg_to, closed) in enumerate(segments):
+        partial = load_finance_week_partial(user_id, seg_from) if closed else None
+        partials.append(partial)
+        if partial is None:
+            to_fetch.append(idx)
+
+    print(
+        f"Фин. отчёт {date_from} - {date_to}, пользователь {user_id}: отрезков {len(segments)}, "
+        f"из сохранённых недель {len(segments) - len(to_fetch)}, загрузка из WB {len(to_fetch)}"
+    )
+    fetched: List[int] = []
+
+    def _store(done) -> None:
+        for idx, partial in done:
+            if segments[idx][2]:
+                # Запись из процесса пула не попадает в индекс доступа веб-процесса
+                record_cache_access(_week_partial_path(user_id, segments[idx][0]))
+            partials[idx] = partial
+            fetched.append(idx)
+
+    with FinanceWeekPool() as pool:
+        for n, idx in enumerate(to_fetch, 1):
+            seg_from, seg_to, closed = segments[idx]
+            if progress_callback:
+                progress_callback(n, len(to_fetch), f"{seg_from} - {seg_to}")
+            if n > 1:
+                time.sleep(FINANCE_WEEK_FETCH_PAUSE_S)
+            try:
+                rows = fetch_rows(seg_from, seg_to)
+            except Exception as e:
+                print(f"Фин. отчёт {seg_from} - {seg_to}, пользователь {user_id}: ошибка загрузки: {e}")
+                partials[idx] = build_finance_partial([])
+                failed.append(f"{seg_from} - {seg_to}")
+                continue
+            if rows is None:
+                rows = []
+            # Закрытая неделя (и без строк — иначе её качали бы из WB при каждом запросе)
+            # сохраняется там же, где считается
+            save = (
+                functools.partial(write_finance_week_partial, _week_partial_path(user_id, seg_from), seg_from, seg_to)
+                if closed else None
+            )
+            pool.submit(idx, rows, save)
+            if closed:
+                # Те же строки — в индекс srid ленты заказов, чтобы она не качала неделю заново
+                record_finance_week_srids(user_id, seg_from, seg_to, rows)
+            del rows
+            _store(pool.completed())
+        _store(pool.completed(wait=True))
+    merged = merge_finance_partials(partials)
+    merged["failed_segments"] = failed
+    merged["empty_segments"] = [
+        f"{segments[idx][0]} - {segments[idx][1]}" for idx in sorted(fetched) if not partials[idx]["rows"]
+    ]
+    return merged
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""Фоновый предрасчёт расшифровки фин. отчёта (/report/finance-breakdown) за прошлую неделю и месяц."""
+import json
+import os
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from utils.cache_layout import user_cache_path
+from utils.constants import FINANCE_PRECOMPUTE_RESULT_TTL_S, FINANCE_WEEK_CLOSED_AFTER_DAYS
+
+
+def last_closed_finance_week(today: Optional[date] = None) -> Tuple[str, str]:
+    """(понедельник, воскресенье) последней закрытой недели — как в plan_finance_segments."""
+    today = today or date.today()
+    sunday = today - timedelta(days=today.weekday() + 1)
+    if (today - sunday).days < FINANCE_WEEK_CLOSED_AFTER_DAYS:
+        sunday -= timedelta(days=7)
+    monday = sunday - timedelta(days=6)
+    return monday.strftime("%Y-%m-%d"), sunday.strftime("%Y-%m-%d")
+
+
+def finance_warm_ranges(today: Optional[date] = None) -> List[Tuple[str, str]]:
+    """
+    Периоды для предрасчёта: последняя закрытая неделя и прошлый календарный месяц —
+    месяц, только если его последняя неделя уже закрыта (иначе итоги ещё изменятся).
+    """
+    today = today or date.today()
+    week_from, week_to = last_closed_finance_week(today)
+    ranges = [(week_from, week_to)]
+    month_to = today.replace(day=1) - timedelta(days=1)
+    month_from = month_to.replace(day=1)
+    month_sunday = month_to + timedelta(days=6 - month_to.weekday())
+    if month_sunday.strftime("%Y-%m-%d") <= week_to:
+        ranges.append((month_from.strftime("%Y-%m-%d"), month_to.strftime("%Y-%m-%d")))
+    return ranges
+
+
+# Отметка о последней обработанной неделе
+def _state_path(user_id: int) -> str:
+    return user_cache_path(user_id, "finance_precompute")
+
+
+def _load_state(user_id: int) -> Dict[str, Any]:
+    try:
+        with open(_state_path(user_id), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print(f"Ошибка чтения отметки предрасчёта фин. отчёта пользователя {user_id}: {e}")
+        return {}
+
+
+def finance_precompute_due(user_id: int, today: Optional[date] = None) -> bool:
+    """Появилась ли у пользователя закрытая неделя, которую фоновая задача ещё не обработала."""
+    week_from, _ = last_closed_finance_week(today)
+    return _load_state(user_id).get("week") != week_from
+
+
+def _mark_precomputed(user_id: int, week_from: str, ranges: List[str]) -> None:
+    from utils.cache import atomic_write_json
+
+    try:
+        path = _state_path(user_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        atomic_write_json(path, {
+            "week": week_from,
+            "ranges": ranges,
+            "updated_at": datetime.now().isoformat(timespec="seconds"),
+        })
+    except Exception as e:
+        print(f"Ошибка сохранения отметки предрасчёта фин. отчёта пользователя {user_id}: {e}")
+
+
+def precompute_finance_breakdown(
+    user_id: int,
+    compute: Callable[[str, str], Dict[str, Any]],
+    version: str,
+    is_complete: Callable[[Dict[str, Any]], bool],
+    today: Optional[date] = None,
+) -> Dict[str, Any]:
+    """
+    Считает compute(с, по) за периоды finance_warm_ranges, которых ещё нет в report_results
+    с версией version, и сохраняет полные (is_complete) результаты на FINANCE_PRECOMPUTE_RESULT_TTL_S.
+    Неделя отмечается обработанной, только если все периоды посчитаны — иначе задача
+    повторит их на следующем запуске.
+    """
+    from utils.report_results import REPORT_KIND_BREAKDOWN, load_report_result, save_report_result
+
+    week_from, _ = last_closed_finance_week(today)
+    ranges = finance_warm_ranges(today)
+    computed: List[str] = []
+    cached = 0
+    failed = 0
+    for date_from, date_to in ranges:
+        if load_report_result(user_id, REPORT_KIND_BREAKDOWN, date_from, date_to, version) is not None:
+            cached += 1
+            continue
+        t = time.perf_counter()
+        result = compute(date_from, date_to)
+        if not is_complete(result):
+            failed += 1
+            continue
+        save_report_result(
+            user_id,
+            REPORT_KIND_BREAKDOWN,
+            date_from,
+            date_to,
+            version,
+            result,
+            ttl_s=FINANCE_PRECOMPUTE_RESULT_TTL_S,
+            precomputed=True,
+        )
+        computed.append(f"{date_from}_{date_to}")
+        print(
+            f"Предрасчёт фин. отчёта {date_from} - {date_to}, пользователь {user_id}: "
+            f"{time.perf_counter() - t:.1f} с"
+        )
+    if not failed:
+        _mark_precomputed(user_id, week_from, [f"{f}_{t}" for f, t in ranges])
+    return {"week": week_from, "computed": computed, "cached": cached, "failed": failed}
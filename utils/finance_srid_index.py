@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""Индекс фин. отчёта по srid (эквайринг / к перечислению) в SQLite: users/<id>/finance_srid_db/."""
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from utils.cache_layout import user_cache_path
+from utils.cache_manager import record_cache_access
+from utils.constants import FINANCE_WEEK_FETCH_PAUSE_S
+
+# Сколько srid в одном запросе IN (...) — ниже лимита переменных старых SQLite (999)
+_LOOKUP_BATCH = 500
+
+# Суммы по (srid, неделя), ключ недели — дата её понедельника; по неделям суммируются при чтении
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS srid_week (
+    srid TEXT NOT NULL,
+    week TEXT NOT NULL,
+    acquiring REAL NOT NULL DEFAULT 0,
+    ppvz_for_pay REAL NOT NULL DEFAULT 0,
+    sale_acquiring REAL,
+    sale_ppvz_for_pay REAL,
+    acquiring_percent REAL,
+    PRIMARY KEY (srid, week)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS srid_week_by_week ON srid_week (week);
+CREATE TABLE IF NOT EXISTS weeks (
+    week TEXT PRIMARY KEY,
+    date_to TEXT NOT NULL,
+    closed INTEGER NOT NULL,
+    rows INTEGER NOT NULL,
+    updated_at TEXT NOT NULL
+);
+"""
+
+# Схема создаётся один раз на файл в процессе
+_schema_lock = threading.Lock()
+_schema_ready: set = set()
+
+
+def finance_srid_db_path(user_id: int) -> str:
+    return os.path.join(user_cache_path(user_id, "finance_srid_db", is_dir=True), "index.sqlite3")
+
+
+def _connect(user_id: int) -> sqlite3.Connection:
+    path = finance_srid_db_path(user_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Файл мог быть удалён вытеснением кэша — тогда схему создаём заново
+    fresh = path not in _schema_ready or not os.path.isfile(path)
+    conn = sqlite3.connect(path, timeout=30)
+    if fresh:
+        with _schema_lock:
+            conn.executescript(_SCHEMA)
+            _schema_ready.add(path)
+            # Старый JSON-индекс больше не читается — освобождаем место
+            legacy = user_cache_path(user_id, "finance_srid")
+            try:
+                os.remove(legacy)
+            except OSError:
+                pass
+    record_cache_access(path)
+    return conn
+
+
+def _week_monday(date_str: str) -> str:
+    day = datetime.strptime(date_str, "%Y-%m-%d").date()
+    return (day - timedelta(days=day.weekday())).strftime("%Y-%m-%d")
+
+
+def _f(v: Any) -> float:
+    try:
+        return float(v or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _group_rows_by_srid(rows: Iterable[Dict[str, Any]]) -> Dict[str, List[Any]]:
+    """srid -> [acquiring, ppvz_for_pay, sale_acquiring, sale_ppvz_for_pay, acquiring_percent]."""
+    by_srid: Dict[str, List[Any]] = {}
+    for row in rows:
+        srid = str(row.get("srid") or "").strip()
+        if not srid:
+            continue
+        fee = _f(row.get("acquiring_fee"))
+        pay = _f(row.get("ppvz_for_pay"))
+        bucket = by_srid.get(srid)
+        if bucket is None:
+            bucket = by_srid[srid] = [0.0, 0.0, None, None, None]
+        bucket[0] += fee
+        bucket[1] += pay
+        if fee and not bucket[4]:
+            bucket[4] = _f(row.get("acquiring_percent")) or None
+        oper = str(row.get("supplier_oper_name") or "").lower()
+        doc = str(row.get("doc_type_name") or "").lower()
+        # Для «К перечислению» в ЛК по продаже важны суммы операции Продажа
+        if ("продажа" in oper or "продажа" in doc) and pay:
+            bucket[2] = (bucket[2] or 0.0) + fee
+            bucket[3] = (bucket[3] or 0.0) + pay
+    return by_srid
+
+
+def upsert_finance_srid_rows(
+    user_id: int,
+    week_from: str,
+    date_to: str,
+    rows: Iterable[Dict[str, Any]],
+    *,
+    closed: bool,
+) -> int:
+    """
+    Записывает суммы по srid строк отрезка [week_from, date_to] (week_from — понедельник).
+    Строки отрезка заменяются целиком: записи с ключами недель внутри отрезка удаляются,
+    записи недели week_from обновляются upsert'ом. Возвращает число srid.
+    """
+    by_srid = _group_rows_by_srid(rows)
+    conn = _connect(user_id)
+    try:
+        with conn:
+            # Записи старых отрезков внутри этого (открытая неделя могла быть загружена вместе
+            # со следующей) и srid, пропавшие из недели, удаляем; остальные обновляем upsert'ом
+            conn.execute("DELETE FROM srid_week WHERE week > ? AND week <= ?", (week_from, date_to))
+            stale = [
+                (srid, week_from)
+                for (srid,) in conn.execute("SELECT srid FROM srid_week WHERE week = ?", (week_from,))
+                if srid not in by_srid
+            ]
+            conn.executemany("DELETE FROM srid_week WHERE srid = ? AND week = ?", stale)
+            conn.executemany(
+                """
+                INSERT INTO srid_week (srid, week, acquiring, ppvz_for_pay, sale_acquiring, sale_ppvz_for_pay, acquiring_percent)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (srid, week) DO UPDATE SET
+                    acquiring = excluded.acquiring,
+                    ppvz_for_pay = excluded.ppvz_for_pay,
+                    sale_acquiring = excluded.sale_acquiring,
+                    sale_ppvz_for_pay = excluded.sale_ppvz_for_pay,
+                    acquiring_percent = excluded.acquiring_percent
+                """,
+                ((srid, week_from, *values) for srid, values in by_srid.items()),
+            )
+            conn.execute("DELETE FROM weeks WHERE week > ? AND week <= ?", (week_from, date_to))
+            conn.execute(
+                "INSERT OR REPLACE INTO weeks (week, date_to, closed, rows, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (week_from, date_to, int(closed), len(by_srid), datetime.now().isoformat(timespec="seconds")),
+            )
+    finally:
+        conn.close()
+    return len(by_srid)
+
+
+def loaded_finance_weeks(user_id: int) -> Dict[str, Tuple[str, bool]]:
+    """Понедельник -> (по какую дату загружен отрезок, закрыта ли неделя)."""
+    conn = _connect(user_id)
+    try:
+        return {week: (date_to, bool(closed)) for week, date_to, closed in conn.execute(
+            "SELECT week, date_to, closed FROM weeks"
+        )}
+    finally:
+        conn.close()
+
+
+def finance_srid_index_exists(user_id: int) -> bool:
+    if not os.path.isfile(finance_srid_db_path(user_id)):
+        return False
+    conn = _connect(user_id)
+    try:
+        return conn.execute("SELECT 1 FROM srid_week LIMIT 1").fetchone() is not None
+    finally:
+        conn.close()
+
+
+def lookup_finance_srids(user_id: int, srids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """srid -> {acquiring, ppvz_for_pay, acquiring_percent} только для переданных srid."""
+    wanted = sorted({s for s in srids if s})
+    if not wanted or not os.path.isfile(finance_srid_db_path(user_id)):
+        return {}
+    out: Dict[str, Dict[str, Any]] = {}
+    conn = _connect(user_id)
+    try:
+        for i in range(0, len(wanted), _LOOKUP_BATCH):
+            batch = wanted[i:i + _LOOKUP_BATCH]
+            cur = conn.execute(
+                f"""
+                SELECT srid, SUM(acquiring), SUM(ppvz_for_pay), SUM(sale_acquiring),
+                       SUM(sale_ppvz_for_pay), MAX(acquiring_percent)
+                FROM srid_week WHERE srid IN ({",".join("?" * len(batch))})
+                GROUP BY srid
+                """,
+                batch,
+            )
+            for srid, acquiring, for_pay, sale_acquiring, sale_for_pay, percent in cur:
+                # По продаже в ЛК показываются суммы операции Продажа (SUM по NULL — NULL)
+                if sale_for_pay is not None:
+                    for_pay = sale_for_pay
+                if sale_acquiring is not None:
+                    acquiring = sale_acquiring
+                out[srid] = {
+                    "acquiring": round(acquiring or 0.0, 2),
+                    "ppvz_for_pay": round(for_pay or 0.0, 2),
+                    "acquiring_percent": percent,
+                }
+    finally:
+        conn.close()
+    return out
+
+
+def update_finance_srid_index(
+    user_id: int,
+    date_from: str,
+    date_to: str,
+    fetch_rows,
+) -> Dict[str, Any]:
+    """
+    Дозагружает индекс за период: отрезки с понедельника недели date_from по date_to;
+    закрытые недели, уже записанные в индекс, пропускаются. fetch_rows(с, по) — строки WB.
+    """
+    from utils.finance_partials import plan_finance_segments
+
+    segments = plan_finance_segments(_week_monday(date_from), date_to)
+    loaded = loaded_finance_weeks(user_id)
+    to_fetch = [
+        (seg_from, seg_to, closed)
+        for seg_from, seg_to, closed in segments
+        if not (closed and loaded.get(seg_from, ("", False))[1])
+    ]
+    print(
+        f"Индекс srid фин. отчёта {date_from} - {date_to}, пользователь {user_id}: "
+        f"отрезков {len(segments)}, загрузка из WB {len(to_fetch)}"
+    )
+    srids = 0
+    for n, (seg_from, seg_to, closed) in enumerate(to_fetch, 1):
+        if n > 1:
+            time.sleep(FINANCE_WEEK_FETCH_PAUSE_S)
+        rows = fetch_rows(seg_from, seg_to) or []
+        # Пустой ответ по закрытой неделе не запоминаем: fetch_finance_report отдаёт [] и при ошибке
+        srids += upsert_finance_srid_rows(user_id, seg_from, seg_to, rows, closed=closed and len(rows) > 0)
+    return {"segments": len(segments), "fetched": len(to_fetch), "srids": srids}
+
+
+def record_finance_week_srids(
+    user_id: int,
+    week_from: str,
+    week_to: str,
+    rows: Optional[Iterable[Dict[str, Any]]],
+) -> None:
+    """Строки закрытой недели, загруженные для недельного агрегата, — сразу и в индекс srid.
+
+    Пустая неделя тоже отмечается загруженной: лента заказов не будет качать её заново.
+    """
+    if rows is None:
+        return
+    try:
+        upsert_finance_srid_rows(user_id, week_from, week_to, rows, closed=True)
+    except Exception as e:
+        print(f"Ошибка записи индекса srid за неделю {week_from} пользователя {user_id}: {e}")
@@ -9,6 +9,12 @@ from typing import Any, List, Dict
 from flask import session
 from flask_login import current_user
 from utils.constants import MOSCOW_TZ, APP_VERSION
+from utils.datetime_parse import (
+    parse_date as _fast_parse_date,
+    parse_iso_datetime as _fast_parse_iso_datetime,
+    parse_wb_datetime as _fast_parse_wb_datetime,
+)
+from utils.interning import STOCK_CATEGORICAL_FIELDS, intern_rows
 
 
 def to_moscow(dt: datetime | None) -> datetime | None:
@@ -51,52 +57,17 @@ def format_dmy(date_str: str) -> str:
 
 def parse_date(date_str: str) -> datetime:
     """Парсит дату в формате YYYY-MM-DD или DD.MM.YYYY"""
-    try:
-        # Try YYYY-MM-DD format first
-        return datetime.strptime(date_str, "%Y-%m-%d")
-    except ValueError:
-        try:
-            # Try DD.MM.YYYY format
-            return datetime.strptime(date_str, "%d.%m.%Y")
-        except ValueError:
-            raise ValueError(f"Unable to parse date '{date_str}'. Expected formats: YYYY-MM-DD or DD.MM.YYYY")
+    return _fast_parse_date(date_str)
 
 
 def parse_wb_datetime(value: str) -> datetime | None:
     """Парсит datetime из формата Wildberries"""
-    if not value:
-        return None
-    s = str(value)
-    # Trim subseconds if present to 6 digits max for fromisoformat
-    try:
-        # Normalize Z to +00:00
-        s_norm = s.replace("Z", "+00:00")
-        dt = datetime.fromisoformat(s_norm[:26] + s_norm[26:])  # be forgiving on microseconds length
-        return dt
-    except Exception:
-        try:
-            return datetime.strptime(s[:19], "%Y-%m-%dT%H:%M:%S")
-        except Exception:
-            return None
+    return _fast_parse_wb_datetime(value)
 
 
 def _parse_iso_datetime(value: str | None) -> datetime | None:
     """Парсит ISO datetime"""
-    if not value:
-        return None
-    try:
-        # Support trailing 'Z'
-        s = value.replace("Z", "+00:00")
-        return datetime.fromisoformat(s)
-    except Exception:
-        try:
-            # Fallback common formats
-            return datetime.strptime(value, "%Y-%m-%dT%H:%M:%S%z")
-        except Exception:
-            try:
-                return datetime.strptime(value, "%Y-%m-%dT%H:%M:%S")
-            except Exception:
-                return None
+    return _fast_parse_iso_datetime(value)
 
 
 def _fmt_dt_moscow(value: str | None, with_time: bool = True) -> str:
@@ -906,7 +877,7 @@ def normalize_stocks(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
             "warehouse_id": r.get("warehouseId") or r.get("warehouseID"),
             "region": r.get("regionName") or r.get("region"),
         })
-    return items
+    return intern_rows(items, STOCK_CATEGORICAL_FIELDS)
 
 
 def stock_row_product_key(it: Dict[str, Any]) -> tuple:
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""Словарное кодирование повторяющихся значений в строках заказов и остатков."""
+from typing import Any, Dict, Iterable, List
+
+# Поля строки заказа (to_rows) с небольшим числом различных значений
+ORDER_CATEGORICAL_FIELDS = (
+    "Дата",
+    "Склад отгрузки",
+    "Тип склада хранения товаров",
+    "Страна",
+    "Округ",
+    "Регион",
+    "Артикул продавца",
+    "Артикул WB",
+    "Баркод",
+    "Категория",
+    "Предмет",
+    "Бренд",
+    "Размер товара",
+    "Номер поставки",
+    # Служебные поля строк из app.to_rows
+    "_order_date",
+    "_warehouse",
+    "_warehouse_label",
+    "_supplier_article",
+    "_nm_id",
+    "_barcode",
+)
+
+# Поля строки остатков (normalize_stocks)
+STOCK_CATEGORICAL_FIELDS = (
+    "vendor_code",
+    "barcode",
+    "nm_id",
+    "warehouse",
+    "warehouse_id",
+    "region",
+    "name",
+)
+
+# Пул значений: значение -> единственный объект. При переполнении очищается целиком —
+# уже закодированные строки продолжают держать свои объекты, новые получат другие.
+_POOL: Dict[Any, Any] = {}
+_POOL_MAX_ENTRIES = 500000
+
+
+def intern_value(value: Any) -> Any:
+    """Общий объект для str/int значения (остальные типы возвращаются как есть)."""
+    cls = value.__class__
+    if cls is not str and cls is not int:
+        return value
+    pooled = _POOL.get(value)
+    if pooled is None:
+        if len(_POOL) >= _POOL_MAX_ENTRIES:
+            _POOL.clear()
+        pooled = _POOL.setdefault(value, value)
+    return pooled
+
+
+def intern_row(row: Dict[str, Any], fields: Iterable[str] = ORDER_CATEGORICAL_FIELDS) -> Dict[str, Any]:
+    """Подменяет значения полей fields в строке на объекты из пула (на месте)."""
+    if len(_POOL) >= _POOL_MAX_ENTRIES:
+        _POOL.clear()
+    pooled = _POOL.setdefault
+    get = row.get
+    for field in fields:
+        value = get(field)
+        cls = value.__class__
+        if cls is str or cls is int:
+            row[field] = pooled(value, value)
+    return row
+
+
+def intern_rows(rows: List[Any], fields: Iterable[str] = ORDER_CATEGORICAL_FIELDS) -> List[Any]:
+    """intern_row для каждой строки-словаря списка (на месте); возвращает тот же список.
+
+    Цикл развёрнут вручную: вызывается на сотнях тысяч строк, вызов функции на поле заметен.
+    """
+    fields = tuple(fields)
+    if len(_POOL) >= _POOL_MAX_ENTRIES:
+        _POOL.clear()
+    pooled = _POOL.setdefault
+    for row in rows or []:
+        if row.__class__ is not dict:
+            continue
+        get = row.get
+        for field in fields:
+            value = get(field)
+            cls = value.__class__
+            if cls is str or cls is int:
+                row[field] = pooled(value, value)
+    return rows
+
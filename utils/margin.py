@@ -3,20 +3,13 @@
 import os
 import json
 from utils.constants import DEFAULT_MARGIN_SETTINGS, CACHE_DIR
-
-
-def _get_cache_dir() -> str:
-    """Получает директорию для кэша"""
-    cache_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "cache")
-    os.makedirs(cache_dir, exist_ok=True)
-    return cache_dir
+from utils.cache_layout import user_cache_path
 
 
 def load_user_margin_settings(user_id: int) -> dict:
     """Загружает настройки маржи для пользователя"""
     try:
-        cache_dir = _get_cache_dir()
-        path = os.path.join(cache_dir, f"margin_settings_{user_id}.json")
+        path = user_cache_path(user_id, "margin_settings")
         if os.path.exists(path):
             with open(path, "r", encoding="utf-8") as f:
                 data = json.load(f) or {}
@@ -53,8 +46,7 @@ def save_user_margin_settings(user_id: int, settings: dict) -> dict:
             except Exception:
                 normalized[key] = default_val
     try:
-        cache_dir = _get_cache_dir()
-        path = os.path.join(cache_dir, f"margin_settings_{user_id}.json")
+        path = user_cache_path(user_id, "margin_settings")
         with open(path, "w", encoding="utf-8") as f:
             json.dump(normalized, f, ensure_ascii=False)
     except Exception as e:
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""Ограниченный по памяти LRU-кэш в процессе (для готовых лент/отчётов)."""
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+def estimate_size(value: Any, *, sample: int = 64) -> int:
+    """Грубая оценка памяти значения в байтах.
+
+    Для списков берём выборку до sample элементов и масштабируем: считать точно
+    (sys.getsizeof по всему графу) на сотнях тысяч строк дороже самой выборки.
+    Размер JSON ×3 — эмпирический множитель накладных расходов dict/str в CPython.
+    """
+    try:
+        if isinstance(value, (list, tuple)):
+            n = len(value)
+            if n == 0:
+                return 64
+            step = max(1, n // sample)
+            picked = value[::step][:sample]
+            per_item = sum(len(json.dumps(x, ensure_ascii=False, default=str)) for x in picked) / len(picked)
+            return int(per_item * n * 3) + 64
+        return len(json.dumps(value, ensure_ascii=False, default=str)) * 3 + 64
+    except Exception:
+        return 1024
+
+
+class MemoryBoundedCache:
+    """LRU с TTL и лимитом суммарного (оценочного) размера записей.
+
+    Вытеснение — при вставке, самые давно использованные записи первыми; просроченные
+    записи вычищаются тоже при вставке, а не только при повторном чтении того же ключа.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        ttl_seconds: float,
+        *,
+        max_entries: int = 256,
+        sizeof: Callable[[Any], int] = estimate_size,
+    ) -> None:
+        self.max_bytes = int(max_bytes)
+        self.ttl_seconds = float(ttl_seconds)
+        self.max_entries = int(max_entries)
+        self._sizeof = sizeof
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[Hashable, Dict[str, Any]]" = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if self.ttl_seconds > 0 and now - entry["ts"] > self.ttl_seconds:
+                self._drop_locked(key)
+                return None
+            self._data.move_to_end(key)
+            return entry["value"]
+
+    def put(self, key: Hashable, value: Any, size: Optional[int] = None) -> None:
+        nbytes = int(size if size is not None else self._sizeof(value))
+        with self._lock:
+            if key in self._data:
+                self._drop_locked(key)
+            if self.max_bytes > 0 and nbytes > self.max_bytes:
+                # Запись больше всего бюджета — не кэшируем
+                return
+            self._data[key] = {"value": value, "ts": time.time(), "size": nbytes}
+            self._bytes += nbytes
+            self._evict_locked()
+
+    def add_size(self, key: Hashable, delta: int) -> None:
+        """Доучитывает память, выросшую у уже лежащей записи (например, ленивый индекс)."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return
+            entry["size"] += int(delta)
+            self._bytes += int(delta)
+            self._evict_locked()
+
+    def pop(self, key: Hashable) -> None:
+        with self._lock:
+            self._drop_locked(key)
+
+    def drop_where(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Удаляет записи, ключи которых удовлетворяют predicate (например, все ключи пользователя)."""
+        with self._lock:
+            keys = [k for k in self._data if predicate(k)]
+            for k in keys:
+                self._drop_locked(k)
+            return len(keys)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "max_entries": self.max_entries,
+            }
+
+    def _drop_locked(self, key: Hashable) -> None:
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry["size"]
+
+    def _evict_locked(self) -> None:
+        if self.ttl_seconds > 0:
+            cutoff = time.time() - self.ttl_seconds
+            for k in [k for k, e in self._data.items() if e["ts"] < cutoff]:
+                self._drop_locked(k)
+        while self._data and (
+            (self.max_bytes > 0 and self._bytes > self.max_bytes)
+            or len(self._data) > self.max_entries
+        ):
+            oldest = next(iter(self._data))
+            self._drop_locked(oldest)
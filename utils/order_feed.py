@@ -4,12 +4,26 @@ from __future__ import annotations
 
 import json
 import os
+import threading
+from collections import OrderedDict
 from datetime import datetime, timedelta
+from operator import itemgetter
 from typing import Any, Dict, List, Optional, Tuple
 
 from models import PurchasePrice
-from utils.cache import CACHE_DIR, load_orders_period_cache
-from utils.constants import MOSCOW_TZ
+from utils.cache import atomic_write_json, load_orders_period_cache
+from utils.cache_manager import record_cache_access
+from utils.cache_layout import user_cache_path
+from utils.constants import MOSCOW_TZ, ORDER_FEED_MATERIALIZED_MAX_ITEMS
+from utils.datetime_parse import parse_wb_naive_datetime
+from utils.finance_srid_index import finance_srid_db_path, lookup_finance_srids, update_finance_srid_index
+from utils.status_history import (  # noqa: F401 — реэкспорт для старых импортов
+    append_status_events,
+    apply_status_event,
+    load_status_history,
+    save_status_history,
+    status_history_version,
+)
 
 # Статусы ленты
 STATUS_ORDERED = "ordered"
@@ -33,11 +47,40 @@ STATUS_CSS = {
 
 
 def _sales_period_cache_path(user_id: int) -> str:
-    return os.path.join(CACHE_DIR, f"sales_period_user_{user_id}.json")
+    return user_cache_path(user_id, "sales_period")
 
 
-def _status_history_path(user_id: int) -> str:
-    return os.path.join(CACHE_DIR, f"order_status_history_user_{user_id}.json")
+def feed_data_version(user_id: int) -> Tuple[Any, ...]:
+    """Версия данных, из которых собирается лента: (mtime, size) файлов-источников.
+
+    Меняется при любой перезаписи кэша заказов, продаж, финансового индекса, товаров,
+    истории статусов, а также при правке закупочных цен — готовую ленту по старой версии
+    можно выбрасывать без TTL.
+    """
+    version: List[Any] = []
+    paths = [user_cache_path(user_id, cache_type) for cache_type in ("orders_period", "sales_period", "products")]
+    paths.insert(2, finance_srid_db_path(user_id))
+    paths.append(_purchase_prices_path(user_id))
+    for path in paths:
+        try:
+            st = os.stat(path)
+            version.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            version.append(None)
+    version.append(status_history_version(user_id))
+    return tuple(version)
+
+
+def _purchase_prices_path(user_id: int) -> str:
+    return user_cache_path(user_id, "purchase_prices_version")
+
+
+def mark_purchase_prices_changed(user_id: int) -> None:
+    """Отмечает правку закупочных цен (они в БД): меняет подпись, по которой устаревает лента."""
+    try:
+        atomic_write_json(_purchase_prices_path(user_id), {"saved_at": datetime.now(MOSCOW_TZ).isoformat()})
+    except Exception as e:
+        print(f"Ошибка отметки изменения закупочных цен пользователя {user_id}: {e}")
 
 
 def load_sales_period_cache(user_id: int) -> Dict[str, Any]:
@@ -45,6 +88,7 @@ def load_sales_period_cache(user_id: int) -> Dict[str, Any]:
     if not os.path.isfile(path):
         return {"days": {}}
     try:
+        record_cache_access(path)
         with open(path, "r", encoding="utf-8") as f:
             data = json.load(f)
             if not isinstance(data, dict):
@@ -60,61 +104,14 @@ def save_sales_period_cache(user_id: int, payload: Dict[str, Any]) -> None:
     try:
         enriched = dict(payload)
         enriched["_user_id"] = user_id
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(enriched, f, ensure_ascii=False)
-    except Exception:
-        pass
-
-
-def load_status_history(user_id: int) -> Dict[str, List[Dict[str, Any]]]:
-    path = _status_history_path(user_id)
-    if not os.path.isfile(path):
-        return {}
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            return data if isinstance(data, dict) else {}
-    except Exception:
-        return {}
-
-
-def save_status_history(user_id: int, history: Dict[str, List[Dict[str, Any]]]) -> None:
-    path = _status_history_path(user_id)
-    try:
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(history, f, ensure_ascii=False)
+        atomic_write_json(path, enriched)
     except Exception:
         pass
 
 
 def _parse_wb_dt(value: Any) -> Optional[datetime]:
-    if value is None:
-        return None
-    if isinstance(value, datetime):
-        return value.replace(tzinfo=None) if value.tzinfo else value
-    s = str(value).strip()
-    if not s or s.startswith("0001-01-01"):
-        return None
-    # Убираем таймзону для единообразия
-    core = s.replace("Z", "")
-    if "+" in core[10:]:
-        core = core[: core.rfind("+", 10)]
-    core = core.strip()
-    for fmt, n in (
-        ("%Y-%m-%dT%H:%M:%S", 19),
-        ("%Y-%m-%d %H:%M:%S", 19),
-        ("%d.%m.%Y %H:%M:%S", 19),
-        ("%Y-%m-%d", 10),
-        ("%d.%m.%Y", 10),
-    ):
-        try:
-            return datetime.strptime(core[:n], fmt)
-        except Exception:
-            continue
-    try:
-        return datetime.fromisoformat(s.replace("Z", "+00:00")).replace(tzinfo=None)
-    except Exception:
-        return None
+    # Без таймзоны, 0001-01-01 — None (см. utils.datetime_parse)
+    return parse_wb_naive_datetime(value)
 
 
 def format_dt_display(value: Any) -> str:
@@ -326,23 +323,23 @@ def record_status_observation(
     srid: str,
     status: str,
     at: Optional[str] = None,
-) -> None:
+) -> Optional[Dict[str, Any]]:
+    """Фиксирует статус srid в истории, если он сменился. Возвращает новое событие или None."""
     if not srid:
-        return
-    now = datetime.now(MOSCOW_TZ).strftime("%Y-%m-%d %H:%M:%S")
-    events = history.setdefault(srid, [])
+        return None
+    events = history.get(srid)
     if events and events[-1].get("status") == status:
-        return
-    events.append({
+        return None
+    now = datetime.now(MOSCOW_TZ).strftime("%Y-%m-%d %H:%M:%S")
+    event = {
         "status": status,
         "label": STATUS_LABELS.get(status, status),
         "at": at or now,
         "source": "observation",
         "seen_at": now,
-    })
-    # ограничиваем хвост
-    if len(events) > 40:
-        history[srid] = events[-40:]
+    }
+    apply_status_event(history, srid, event)
+    return event
 
 
 def _products_index(user_id: int) -> Dict[int, Dict[str, Any]]:
@@ -443,96 +440,24 @@ def normalize_order_row(row: Dict[str, Any]) -> Dict[str, Any]:
     return o
 
 
-def _finance_srid_cache_path(user_id: int) -> str:
-    return os.path.join(CACHE_DIR, f"finance_srid_user_{user_id}.json")
-
-
-def load_finance_srid_index(user_id: int) -> Dict[str, Dict[str, Any]]:
-    """srid -> {acquiring, ppvz_for_pay, ...}"""
-    path = _finance_srid_cache_path(user_id)
-    if not os.path.isfile(path):
-        return {}
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            by_srid = (data or {}).get("by_srid") or {}
-            return by_srid if isinstance(by_srid, dict) else {}
-    except Exception:
-        return {}
-
-
-def save_finance_srid_index(user_id: int, by_srid: Dict[str, Dict[str, Any]]) -> None:
-    path = _finance_srid_cache_path(user_id)
-    try:
-        payload = {
-            "_user_id": user_id,
-            "updated_at": datetime.now(MOSCOW_TZ).strftime("%d.%m.%Y %H:%M:%S"),
-            "by_srid": by_srid,
-        }
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(payload, f, ensure_ascii=False)
-    except Exception:
-        pass
-
-
-def _merge_finance_srid_row(bucket: Dict[str, Any], row: Dict[str, Any]) -> None:
-    try:
-        fee = float(row.get("acquiring_fee") or 0)
-    except (TypeError, ValueError):
-        fee = 0.0
-    try:
-        pay = float(row.get("ppvz_for_pay") or 0)
-    except (TypeError, ValueError):
-        pay = 0.0
-    bucket["acquiring"] = round(float(bucket.get("acquiring") or 0) + fee, 2)
-    bucket["ppvz_for_pay"] = round(float(bucket.get("ppvz_for_pay") or 0) + pay, 2)
-    oper = str(row.get("supplier_oper_name") or "")
-    doc = str(row.get("doc_type_name") or "")
-    if fee and not bucket.get("acquiring_percent"):
-        try:
-            bucket["acquiring_percent"] = float(row.get("acquiring_percent") or 0) or None
-        except (TypeError, ValueError):
-            pass
-    if ("продажа" in oper.lower() or "продажа" in doc.lower()) and pay:
-        bucket["sale_ppvz_for_pay"] = round(float(bucket.get("sale_ppvz_for_pay") or 0) + pay, 2)
-        bucket["sale_acquiring"] = round(float(bucket.get("sale_acquiring") or 0) + fee, 2)
-
-
 def update_finance_srid_index_from_api(
     user_id: int,
     token: str,
     date_from: str,
     date_to: str,
-) -> Dict[str, Dict[str, Any]]:
-    """Тянет фин. отчёт за период и дописывает индекс по srid (эквайринг / к перечислению)."""
+) -> Dict[str, Any]:
+    """
+    Дозагружает индекс srid фин. отчёта (эквайринг / к перечислению) за период:
+    закрытые недели, уже записанные в индекс, из WB не качаются (utils.finance_srid_index).
+    """
     from utils.api import fetch_finance_report
 
-    rows = fetch_finance_report(token, date_from, date_to)
-    existing = load_finance_srid_index(user_id)
-    # Пересобираем только затронутые srid из этого ответа: сначала сгруппируем строки периода,
-    # затем заменим записи этих srid целиком (чтобы не задвоить при повторном refresh).
-    period_srids: Dict[str, Dict[str, Any]] = {}
-    for row in rows:
-        srid = str(row.get("srid") or "").strip()
-        if not srid:
-            continue
-        bucket = period_srids.setdefault(srid, {"acquiring": 0.0, "ppvz_for_pay": 0.0})
-        _merge_finance_srid_row(bucket, row)
-
-    for srid, bucket in period_srids.items():
-        # Для «К перечислению» в ЛК по продаже важны суммы операции Продажа
-        if bucket.get("sale_ppvz_for_pay") is not None:
-            bucket["ppvz_for_pay"] = bucket["sale_ppvz_for_pay"]
-        if bucket.get("sale_acquiring") is not None:
-            bucket["acquiring"] = bucket["sale_acquiring"]
-        existing[srid] = {
-            "acquiring": bucket.get("acquiring") or 0.0,
-            "ppvz_for_pay": bucket.get("ppvz_for_pay") or 0.0,
-            "acquiring_percent": bucket.get("acquiring_percent"),
-        }
-
-    save_finance_srid_index(user_id, existing)
-    return existing
+    return update_finance_srid_index(
+        user_id,
+        date_from,
+        date_to,
+        lambda seg_from, seg_to: fetch_finance_report(token, seg_from, seg_to, columnar=True),
+    )
 
 
 def collect_orders_from_period_cache(
@@ -615,6 +540,209 @@ def update_sales_period_cache_from_api(
     return raw
 
 
+# Материализованные элементы ленты по srid: при пересборке заново считаются только
+# элементы, у которых поменялись входные данные (строка заказа, продажа, финансы,
+# закупочная цена, карточка товара, история статусов).
+# user_id -> {"gen": номер сборки, "entries": {srid: [отпечаток, элемент, ключ сортировки, gen]}}
+_FEED_ITEMS_LOCK = threading.Lock()
+_FEED_ITEMS: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+_FEED_ITEMS_MAX_USERS = 32
+
+
+def _feed_items_state(user_id: int) -> Dict[str, Any]:
+    with _FEED_ITEMS_LOCK:
+        state = _FEED_ITEMS.get(user_id)
+        if state is None:
+            state = _FEED_ITEMS[user_id] = {"gen": 0, "entries": {}}
+            while len(_FEED_ITEMS) > _FEED_ITEMS_MAX_USERS:
+                _FEED_ITEMS.popitem(last=False)
+        else:
+            _FEED_ITEMS.move_to_end(user_id)
+        return state
+
+
+def reset_feed_items(user_id: int) -> None:
+    """Сбрасывает материализованные элементы ленты пользователя (следующая сборка — полная)."""
+    with _FEED_ITEMS_LOCK:
+        _FEED_ITEMS.pop(int(user_id), None)
+
+
+def _prune_feed_items(state: Dict[str, Any]) -> None:
+    entries = state["entries"]
+    if ORDER_FEED_MATERIALIZED_MAX_ITEMS <= 0 or len(entries) <= ORDER_FEED_MATERIALIZED_MAX_ITEMS:
+        return
+    # Выбрасываем элементы, дольше всех не попадавшие в сборки
+    keep = ORDER_FEED_MATERIALIZED_MAX_ITEMS * 3 // 4
+    by_gen = sorted(entries.items(), key=lambda kv: kv[1][3], reverse=True)
+    state["entries"] = dict(by_gen[:keep])
+
+
+def _row_fingerprint(row: Dict[str, Any]) -> int:
+    try:
+        return hash(tuple(row.items()))
+    except TypeError:
+        return hash(json.dumps(row, ensure_ascii=False, sort_keys=True, default=str))
+
+
+def feed_sort_key(item: Dict[str, Any]) -> Tuple[datetime, str, str]:
+    """Ключ порядка ленты (свежие сверху при reverse=True): (дата заказа, srid, номер заказа).
+
+    Номер заказа различает строки без srid; полные совпадения ключа курсор ленты
+    различает по числу уже отданных элементов с этим ключом.
+    """
+    return (
+        _parse_wb_dt(item.get("datetime")) or datetime.min,
+        str(item.get("srid") or ""),
+        str(item.get("gnumber") or ""),
+    )
+
+
+def _sale_money(
+    status: str,
+    for_pay_gross: Optional[float],
+    fin: Optional[Dict[str, Any]],
+    purchase_price: Optional[float],
+) -> Tuple[Optional[float], Optional[float], Optional[float], Optional[float]]:
+    """(эквайринг, к перечислению, маржа, маржа %) продажи; fin — суммы srid из индекса фин. отчёта."""
+    acquiring = None
+    for_pay_net = for_pay_gross
+    if fin:
+        acquiring = format_money(fin.get("acquiring"))
+        if fin.get("ppvz_for_pay") is not None:
+            for_pay_net = format_money(fin.get("ppvz_for_pay"))
+        elif for_pay_gross is not None and acquiring is not None:
+            for_pay_net = round(float(for_pay_gross) - float(acquiring), 2)
+        if acquiring == 0:
+            acquiring = 0.0
+
+    margin_value = None
+    margin_pct = None
+    if (
+        status in (STATUS_SOLD, STATUS_RETURNED)
+        and for_pay_net is not None
+        and purchase_price is not None
+    ):
+        try:
+            margin_value = round(float(for_pay_net) - float(purchase_price), 2)
+            if float(purchase_price) > 0:
+                margin_pct = round(margin_value / float(purchase_price) * 100.0, 1)
+        except (TypeError, ValueError):
+            margin_value = None
+            margin_pct = None
+    return acquiring, for_pay_net, margin_value, margin_pct
+
+
+def _build_feed_item(
+    order: Dict[str, Any],
+    sale_info: Optional[Dict[str, Any]],
+    purchase_price: Optional[float],
+    prod: Optional[Dict[str, Any]],
+    hist: List[Dict[str, Any]],
+) -> Dict[str, Any]:
+    srid = str(order.get("Уникальный ID заказа") or "").strip()
+    gnumber = str(order.get("Номер заказа") or "").strip()
+    nm_raw = order.get("Артикул WB")
+    try:
+        nm_id = int(nm_raw) if nm_raw is not None else None
+    except (TypeError, ValueError):
+        nm_id = None
+
+    barcode = str(order.get("Баркод") or "").strip()
+    name = None
+    photo = None
+    if prod:
+        name = prod.get("name") or prod.get("title")
+        photo = prod.get("photo")
+    if not name:
+        subject = order.get("Предмет") or ""
+        article = order.get("Артикул продавца") or ""
+        name = f"{subject} {article}".strip() or "Без названия"
+
+    status, status_label, status_css = resolve_status(order, sale_info)
+
+    price_seller = format_money(order.get("Цена со скидкой продавца"))
+    price_buyer = format_money(order.get("Цена с учетом всех скидок"))
+
+    created_raw = order.get("ДатаВремя") or order.get("Дата")
+    updated_raw = order.get("Дата и время обновления информации в сервисе")
+
+    timeline = build_timeline(order, sale_info, hist, current_status=status)
+
+    scheme = detect_scheme(order.get("Тип склада хранения товаров"))
+
+    # К перечислению / маржа — только при подтверждённой продаже; суммы из фин. отчёта
+    # (эквайринг, точное «к перечислению») добавляет enrich_feed_finance для страницы ленты
+    for_pay_gross = None
+    if sale_info and status in (STATUS_SOLD, STATUS_RETURNED):
+        for_pay_gross = format_money((sale_info.get("sale") or {}).get("forPay"))
+    acquiring, for_pay_net, margin_value, margin_pct = _sale_money(status, for_pay_gross, None, purchase_price)
+
+    sold_at_dt = sale_info.get("sold_at") if sale_info else None
+
+    return {
+        "id": srid or gnumber,
+        "srid": srid,
+        "gnumber": gnumber,
+        "sticker": order.get("ID стикера"),
+        "datetime": created_raw,
+        "datetime_display": format_dt_display(created_raw),
+        "sold_at": sold_at_dt.strftime("%Y-%m-%d") if sold_at_dt else None,
+        "sold_at_display": format_dt_display(sold_at_dt) if sold_at_dt else None,
+        "updated_at": updated_raw,
+        "updated_at_display": format_dt_display(updated_raw),
+        "status": status,
+        "status_label": status_label,
+        "status_css": status_css,
+        "scheme": scheme,
+        "warehouse": order.get("Склад отгрузки"),
+        "warehouse_type": order.get("Тип склада хранения товаров"),
+        "country": order.get("Страна"),
+        "region": order.get("Регион"),
+        "oblast": order.get("Округ"),
+        "nm_id": nm_id,
+        "article": order.get("Артикул продавца"),
+        "barcode": barcode,
+        "brand": order.get("Бренд"),
+        "subject": order.get("Предмет"),
+        "category": order.get("Категория"),
+        "size": order.get("Размер товара"),
+        "name": name,
+        "photo": photo,
+        "qty": 1,
+        "price": price_seller,
+        "price_buyer": price_buyer,
+        "price_total": format_money(order.get("Цена без скидок")),
+        "discount_seller": order.get("Скидка продавца"),
+        "discount_wb": order.get("Скидка WB"),
+        "purchase_price": purchase_price,
+        "margin": margin_value,
+        "margin_pct": margin_pct,
+        "income_id": order.get("Номер поставки"),
+        "is_cancelled": bool(order.get("is_cancelled")),
+        "cancel_date": order.get("Дата и время отмены заказа"),
+        "cancel_date_display": format_dt_display(order.get("Дата и время отмены заказа")),
+        "timeline": timeline,
+        "sale": {
+            "sold_at": format_dt_display(sale_info["sold_at"]) if sale_info.get("sold_at") else None,
+            "returned_at": format_dt_display(sale_info["returned_at"]) if sale_info.get("returned_at") else None,
+            "for_pay_gross": for_pay_gross,
+            "acquiring": acquiring,
+            "for_pay": for_pay_net,
+        } if sale_info else None,
+    }
+
+
+def _status_at_hint(item: Dict[str, Any], order: Dict[str, Any], sale_info: Optional[Dict[str, Any]]) -> str:
+    status = item["status"]
+    if status == STATUS_CANCELLED:
+        return str(order.get("Дата и время отмены заказа") or "")
+    if status == STATUS_SOLD and sale_info and sale_info.get("sold_at"):
+        return sale_info["sold_at"].isoformat(sep=" ")
+    if status == STATUS_RETURNED and sale_info and sale_info.get("returned_at"):
+        return sale_info["returned_at"].isoformat(sep=" ")
+    return str(item.get("datetime") or "")
+
+
 def build_feed_items(
     user_id: int,
     orders: List[Dict[str, Any]],
@@ -622,159 +750,120 @@ def build_feed_items(
     *,
     record_history: bool = True,
 ) -> List[Dict[str, Any]]:
+    """Элементы ленты по заказам, свежие сверху, без сумм из фин. отчёта (см. enrich_feed_finance).
+
+    Готовые элементы переиспользуются по srid, пока не изменился отпечаток их входных
+    данных, — после дозагрузки пары дней пересчитываются только изменившиеся заказы.
+    """
     products = _products_index(user_id)
     purchases = _purchase_index(user_id)
     sales_idx = index_sales_by_srid(sales or [])
-    finance_idx = load_finance_srid_index(user_id)
-    # Историю всегда читаем для таймлайна; пишем только при record_history=True
+    # Историю всегда читаем для таймлайна; пишем только при record_history=True —
+    # и только новые переходы статусов (дозапись в журнал, а не перезапись файла)
     history = load_status_history(user_id)
+    new_events: List[Tuple[str, Dict[str, Any]]] = []
+
+    state = _feed_items_state(int(user_id))
+    state["gen"] += 1
+    gen = state["gen"]
+    entries: Dict[str, List[Any]] = state["entries"]
 
-    items: List[Dict[str, Any]] = []
+    keyed: List[Tuple[Tuple[datetime, str, str], Dict[str, Any]]] = []
     for raw_order in orders:
-        order = normalize_order_row(raw_order)
-        srid = str(order.get("Уникальный ID заказа") or "").strip()
-        gnumber = str(order.get("Номер заказа") or "").strip()
-        nm_raw = order.get("Артикул WB")
+        if not isinstance(raw_order, dict):
+            raw_order = {}
+        # Ключи — как после normalize_order_row, но без копирования строки
+        srid = str(raw_order.get("Уникальный ID заказа") or raw_order.get("srid") or "").strip()
+        barcode = str(
+            raw_order.get("Баркод") or raw_order.get("barcode") or raw_order.get("_barcode") or ""
+        ).strip()
+        nm_raw = raw_order.get("Артикул WB")
+        if nm_raw is None:
+            nm_raw = raw_order.get("nmId") or raw_order.get("nmID") or raw_order.get("_nm_id")
         try:
-            nm_id = int(nm_raw) if nm_raw is not None else None
+            prod = products.get(int(nm_raw)) if nm_raw is not None else None
         except (TypeError, ValueError):
-            nm_id = None
-
-        barcode = str(order.get("Баркод") or "").strip()
-        prod = products.get(nm_id) if nm_id is not None else None
-        name = None
-        photo = None
-        if prod:
-            name = prod.get("name") or prod.get("title")
-            photo = prod.get("photo")
-        if not name:
-            subject = order.get("Предмет") or ""
-            article = order.get("Артикул продавца") or ""
-            name = f"{subject} {article}".strip() or "Без названия"
-
-        sale_info = sales_idx.get(srid) if srid else None
-        status, status_label, status_css = resolve_status(order, sale_info)
-
+            prod = None
         purchase_price = purchases.get(barcode) if barcode else None
-        price_seller = format_money(order.get("Цена со скидкой продавца"))
-        price_buyer = format_money(order.get("Цена с учетом всех скидок"))
-
-        created_raw = order.get("ДатаВремя") or order.get("Дата")
-        updated_raw = order.get("Дата и время обновления информации в сервисе")
-
+        sale_info = sales_idx.get(srid) if srid else None
         hist = history.get(srid) if srid else []
-        timeline = build_timeline(order, sale_info, hist, current_status=status)
-
-        if record_history and srid:
-            at_hint = None
-            if status == STATUS_CANCELLED:
-                at_hint = str(order.get("Дата и время отмены заказа") or "")
-            elif status == STATUS_SOLD and sale_info and sale_info.get("sold_at"):
-                at_hint = sale_info["sold_at"].isoformat(sep=" ")
-            elif status == STATUS_RETURNED and sale_info and sale_info.get("returned_at"):
-                at_hint = sale_info["returned_at"].isoformat(sep=" ")
-            else:
-                at_hint = str(created_raw or "")
-            record_status_observation(history, srid, status, at_hint)
-
-        scheme = detect_scheme(order.get("Тип склада хранения товаров"))
-
-        # Финансы / к перечислению / маржа — только при подтверждённой продаже
-        for_pay_gross = None
-        acquiring = None
-        for_pay_net = None
-        if sale_info and status in (STATUS_SOLD, STATUS_RETURNED):
-            for_pay_gross = format_money((sale_info.get("sale") or {}).get("forPay"))
-            for_pay_net = for_pay_gross
-            fin = finance_idx.get(srid) if srid else None
-            if fin:
-                acquiring = format_money(fin.get("acquiring"))
-                if fin.get("ppvz_for_pay") is not None:
-                    for_pay_net = format_money(fin.get("ppvz_for_pay"))
-                elif for_pay_gross is not None and acquiring is not None:
-                    for_pay_net = round(float(for_pay_gross) - float(acquiring), 2)
-                if acquiring == 0:
-                    acquiring = 0.0
-
-        margin_value = None
-        margin_pct = None
-        if (
-            status in (STATUS_SOLD, STATUS_RETURNED)
-            and for_pay_net is not None
-            and purchase_price is not None
-        ):
-            try:
-                margin_value = round(float(for_pay_net) - float(purchase_price), 2)
-                if float(purchase_price) > 0:
-                    margin_pct = round(margin_value / float(purchase_price) * 100.0, 1)
-            except (TypeError, ValueError):
-                margin_value = None
-                margin_pct = None
-
-        sold_at_dt = sale_info.get("sold_at") if sale_info else None
-
-        items.append({
-            "id": srid or gnumber,
-            "srid": srid,
-            "gnumber": gnumber,
-            "sticker": order.get("ID стикера"),
-            "datetime": created_raw,
-            "datetime_display": format_dt_display(created_raw),
-            "sold_at": sold_at_dt.strftime("%Y-%m-%d") if sold_at_dt else None,
-            "sold_at_display": format_dt_display(sold_at_dt) if sold_at_dt else None,
-            "updated_at": updated_raw,
-            "updated_at_display": format_dt_display(updated_raw),
-            "status": status,
-            "status_label": status_label,
-            "status_css": status_css,
-            "scheme": scheme,
-            "warehouse": order.get("Склад отгрузки"),
-            "warehouse_type": order.get("Тип склада хранения товаров"),
-            "country": order.get("Страна"),
-            "region": order.get("Регион"),
-            "oblast": order.get("Округ"),
-            "nm_id": nm_id,
-            "article": order.get("Артикул продавца"),
-            "barcode": barcode,
-            "brand": order.get("Бренд"),
-            "subject": order.get("Предмет"),
-            "category": order.get("Категория"),
-            "size": order.get("Размер товара"),
-            "name": name,
-            "photo": photo,
-            "qty": 1,
-            "price": price_seller,
-            "price_buyer": price_buyer,
-            "price_total": format_money(order.get("Цена без скидок")),
-            "discount_seller": order.get("Скидка продавца"),
-            "discount_wb": order.get("Скидка WB"),
-            "purchase_price": purchase_price,
-            "margin": margin_value,
-            "margin_pct": margin_pct,
-            "income_id": order.get("Номер поставки"),
-            "is_cancelled": bool(order.get("is_cancelled")),
-            "cancel_date": order.get("Дата и время отмены заказа"),
-            "cancel_date_display": format_dt_display(order.get("Дата и время отмены заказа")),
-            "timeline": timeline,
-            "sale": {
-                "sold_at": format_dt_display(sale_info["sold_at"]) if sale_info.get("sold_at") else None,
-                "returned_at": format_dt_display(sale_info["returned_at"]) if sale_info.get("returned_at") else None,
-                "for_pay_gross": for_pay_gross,
-                "acquiring": acquiring,
-                "for_pay": for_pay_net,
-            } if sale_info else None,
-        })
-
-    if record_history:
-        save_status_history(user_id, history)
 
-    # Свежие сверху
-    def sort_key(it: Dict[str, Any]):
-        dt = _parse_wb_dt(it.get("datetime")) or datetime.min
-        return dt
+        fingerprint = None
+        entry = None
+        if srid:
+            sale = (sale_info or {}).get("sale") or {}
+            fingerprint = (
+                _row_fingerprint(raw_order),
+                (
+                    sale_info.get("sold_at"),
+                    sale_info.get("returned_at"),
+                    bool(sale_info.get("sale")),
+                    bool(sale_info.get("return")),
+                    sale.get("forPay"),
+                ) if sale_info else None,
+                purchase_price,
+                (prod.get("name") or prod.get("title"), prod.get("photo")) if prod else None,
+                (len(hist), hist[-1].get("status"), hist[-1].get("at")) if hist else None,
+            )
+            entry = entries.get(srid)
+
+        if entry is not None and entry[0] == fingerprint:
+            item = entry[1]
+            entry[3] = gen
+            order = None
+        else:
+            order = normalize_order_row(raw_order)
+            item = _build_feed_item(order, sale_info, purchase_price, prod, hist)
+            entry = [fingerprint, item, feed_sort_key(item), gen]
+            if srid:
+                entries[srid] = entry
 
-    items.sort(key=sort_key, reverse=True)
-    return items
+        if record_history and srid:
+            events = history.get(srid)
+            if not events or events[-1].get("status") != item["status"]:
+                if order is None:
+                    order = normalize_order_row(raw_order)
+                at_hint = _status_at_hint(item, order, sale_info)
+                event = record_status_observation(history, srid, item["status"], at_hint)
+                if event is not None:
+                    new_events.append((srid, event))
+
+        keyed.append((entry[2], item))
+
+    if new_events:
+        append_status_events(user_id, new_events)
+    _prune_feed_items(state)
+
+    # Свежие сверху; ключи посчитаны при материализации, даты при сортировке не разбираются
+    keyed.sort(key=itemgetter(0), reverse=True)
+    return [item for _key, item in keyed]
+
+
+def enrich_feed_finance(user_id: int, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Элементы с суммами из индекса фин. отчёта — srid ищутся только для переданных (страницы ленты).
+
+    Элементы базовой ленты общие для запросов, поэтому изменённые возвращаются копиями.
+    """
+    finance_idx = lookup_finance_srids(user_id, (it.get("srid") for it in items if it.get("sale")))
+    if not finance_idx:
+        return items
+    out: List[Dict[str, Any]] = []
+    for it in items:
+        sale = it.get("sale")
+        fin = finance_idx.get(it.get("srid") or "") if sale else None
+        if not fin or it.get("status") not in (STATUS_SOLD, STATUS_RETURNED):
+            out.append(it)
+            continue
+        acquiring, for_pay, margin_value, margin_pct = _sale_money(
+            it.get("status"), sale.get("for_pay_gross"), fin, it.get("purchase_price")
+        )
+        out.append(dict(
+            it,
+            margin=margin_value,
+            margin_pct=margin_pct,
+            sale=dict(sale, acquiring=acquiring, for_pay=for_pay),
+        ))
+    return out
 
 
 def default_date_range(days: int = 7) -> Tuple[str, str]:
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+"""Колоночное представление заказов периода на NumPy (необязательный бэкенд агрегатов)."""
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from utils.constants import ORDERS_COLUMNAR_CACHE_MAX_BYTES, ORDERS_COLUMNAR_MIN_ROWS
+from utils.memory_cache import MemoryBoundedCache
+
+try:
+    import numpy as np
+except ImportError:  # numpy не входит в requirements — бэкенд просто выключен
+    np = None
+
+# Готовые колонки по ключу вызывающего кода (например, пользователь + время снимка)
+_COLUMNS_CACHE = MemoryBoundedCache(ORDERS_COLUMNAR_CACHE_MAX_BYTES, 1800, max_entries=32)
+
+
+def columnar_available() -> bool:
+    return np is not None
+
+
+class _Encoder:
+    """Словарное кодирование строк: значение -> код по порядку первого появления."""
+
+    __slots__ = ("codes", "labels")
+
+    def __init__(self, empty: bool = False) -> None:
+        # empty=True — код 0 зарезервирован под пустое значение (None)
+        self.codes: Dict[Any, int] = {}
+        self.labels: List[Any] = [None] if empty else []
+
+    def code(self, value: Any) -> int:
+        c = self.codes.get(value)
+        if c is None:
+            c = self.codes[value] = len(self.labels)
+            self.labels.append(value)
+        return c
+
+
+def _day_ordinal(label: Any) -> int:
+    try:
+        return datetime.strptime(str(label)[:10], "%Y-%m-%d").toordinal()
+    except (TypeError, ValueError):
+        return 0
+
+
+class OrdersColumns:
+    """Заказы периода в виде массивов.
+
+    - day — код дня (словарь day_labels), day_ordinals — date.toordinal() по коду дня;
+    - nm_id — Артикул WB (int64, 0 — нет);
+    - price — Цена со скидкой продавца (float64), cancelled — флаг отмены;
+    - warehouse, barcode, supplier_article, product — коды словарей строк (0 у barcode/
+      supplier_article — пусто).
+    Группировки — np.bincount по кодам; суммы накапливаются в порядке строк, как в
+    dict-версии, поэтому результаты совпадают с aggregate_* из utils.orders_processing.
+    """
+
+    __slots__ = (
+        "n",
+        "day",
+        "day_labels",
+        "day_ordinals",
+        "nm_id",
+        "price",
+        "cancelled",
+        "warehouse",
+        "warehouse_labels",
+        "barcode",
+        "barcode_labels",
+        "supplier_article",
+        "supplier_article_labels",
+        "product",
+        "product_labels",
+    )
+
+    @classmethod
+    def from_rows(cls, rows: List[Dict[str, Any]]) -> "OrdersColumns":
+        if np is None:
+            raise RuntimeError("numpy не установлен")
+        days = _Encoder()
+        warehouses = _Encoder()
+        barcodes = _Encoder(empty=True)
+        articles = _Encoder(empty=True)
+        products = _Encoder()
+        n = len(rows)
+        day = np.empty(n, dtype=np.int32)
+        nm_id = np.zeros(n, dtype=np.int64)
+        price = np.zeros(n, dtype=np.float64)
+        cancelled = np.zeros(n, dtype=np.bool_)
+        warehouse = np.empty(n, dtype=np.int32)
+        barcode = np.zeros(n, dtype=np.int32)
+        supplier_article = np.zeros(n, dtype=np.int32)
+        product = np.empty(n, dtype=np.int32)
+        for i, r in enumerate(rows):
+            day[i] = days.code(r.get("Дата"))
+            warehouse[i] = warehouses.code(r.get("Склад отгрузки") or "Не указан")
+            sa = r.get("Артикул продавца")
+            bc = r.get("Баркод")
+            nm = r.get("Артикул WB") or r.get("nmId") or r.get("nmID")
+            product[i] = products.code(str(sa or r.get("Артикул WB") or bc or "Не указан"))
+            if sa:
+                supplier_article[i] = articles.code(sa)
+            if bc:
+                barcode[i] = barcodes.code(bc)
+            if nm:
+                try:
+                    nm_id[i] = int(nm)
+                except (TypeError, ValueError):
+                    pass
+            if r.get("is_cancelled", False):
+                cancelled[i] = True
+            try:
+                price[i] = float(r.get("Цена со скидкой продавца") or 0)
+            except (TypeError, ValueError):
+                pass
+        cols = cls()
+        cols.n = n
+        cols.day = day
+        cols.day_labels = days.labels
+        cols.day_ordinals = np.array([_day_ordinal(d) for d in days.labels], dtype=np.int32)
+        cols.nm_id = nm_id
+        cols.price = price
+        cols.cancelled = cancelled
+        cols.warehouse = warehouse
+        cols.warehouse_labels = warehouses.labels
+        cols.barcode = barcode
+        cols.barcode_labels = barcodes.labels
+        cols.supplier_article = supplier_article
+        cols.supplier_article_labels = articles.labels
+        cols.product = product
+        cols.product_labels = products.labels
+        return cols
+
+    def nbytes(self) -> int:
+        arrays = (self.day, self.nm_id, self.price, self.cancelled, self.warehouse,
+                  self.barcode, self.supplier_article, self.product, self.day_ordinals)
+        labels = len(self.product_labels) + len(self.barcode_labels) + len(self.supplier_article_labels)
+        return int(sum(a.nbytes for a in arrays)) + labels * 120
+
+    # --- группировки ---
+
+    @staticmethod
+    def _first_index(groups: "np.ndarray", size: int) -> "np.ndarray":
+        """Индекс первой строки каждой группы (len(groups) — группы нет). O(n), без сортировки."""
+        first = np.full(size, len(groups), dtype=np.int64)
+        np.minimum.at(first, groups, np.arange(len(groups), dtype=np.int64))
+        return first
+
+    @classmethod
+    def _first_order(cls, groups: "np.ndarray", size: int) -> "np.ndarray":
+        """Коды групп в порядке первого появления (как порядок ключей dict в dict-версии)."""
+        first = cls._first_index(groups, size)
+        present = np.flatnonzero(first < len(groups))
+        return present[np.argsort(first[present], kind="stable")]
+
+    @classmethod
+    def _first_nonzero(cls, groups: "np.ndarray", values: "np.ndarray", size: int) -> "np.ndarray":
+        """Первое ненулевое значение values в каждой группе (в порядке строк)."""
+        out = np.zeros(size, dtype=values.dtype)
+        sel = np.flatnonzero(values != 0)
+        if sel.size:
+            first = cls._first_index(groups[sel], size)
+            present = np.flatnonzero(first < sel.size)
+            out[present] = values[sel[first[present]]]
+        return out
+
+    def daily_series(self) -> Tuple[Dict[str, int], Dict[str, float], Dict[str, int]]:
+        """Как aggregate_daily_counts_and_revenue: (заказы, выручка активных, отмены) по дням."""
+        size = len(self.day_labels)
+        counts = np.bincount(self.day, minlength=size)
+        cancelled = np.bincount(self.day, weights=self.cancelled, minlength=size)
+        active = ~self.cancelled
+        revenue = np.bincount(self.day[active], weights=self.price[active], minlength=size)
+        count_by_day: Dict[str, int] = defaultdict(int)
+        revenue_by_day: Dict[str, float] = defaultdict(float)
+        cancelled_count_by_day: Dict[str, int] = defaultdict(int)
+        for code in self._first_order(self.day, size):
+            count_by_day[self.day_labels[code]] = int(counts[code])
+        for code in self._first_order(self.day[self.cancelled], size):
+            cancelled_count_by_day[self.day_labels[code]] = int(cancelled[code])
+        for code in self._first_order(self.day[active], size):
+            revenue_by_day[self.day_labels[code]] = float(revenue[code])
+        return count_by_day, revenue_by_day, cancelled_count_by_day
+
+    def warehouse_summary(self) -> List[Dict[str, Any]]:
+        """Как aggregate_by_warehouse_orders_only."""
+        counts = np.bincount(self.warehouse[~self.cancelled], minlength=len(self.warehouse_labels))
+        summary = [
+            {"warehouse": w, "orders": int(counts[code])}
+            for w, code in sorted((self.warehouse_labels[c], c) for c in np.flatnonzero(counts))
+        ]
+        summary.sort(key=lambda x: x["orders"], reverse=True)
+        return summary
+
+    def products_map(self, *, cancelled: bool = False, warehouse: Optional[str] = None) -> Dict[str, list]:
+        """{товар: [шт, выручка, nm_id, баркод, артикул продавца]} в порядке первого появления.
+
+        cancelled=True — по отменённым строкам, иначе по активным; warehouse — фильтр по складу.
+        """
+        mask = self.cancelled if cancelled else ~self.cancelled
+        if warehouse:
+            try:
+                wh_code = self.warehouse_labels.index(warehouse)
+            except ValueError:
+                return {}
+            mask = mask & (self.warehouse == wh_code)
+        idx = np.flatnonzero(mask)
+        if not idx.size:
+            return {}
+        size = len(self.product_labels)
+        groups = self.product[idx]
+        qty = np.bincount(groups, minlength=size)
+        revenue = np.bincount(groups, weights=self.price[idx], minlength=size)
+        nm = self._first_nonzero(groups, self.nm_id[idx], size)
+        bc = self._first_nonzero(groups, self.barcode[idx], size)
+        sa = self._first_nonzero(groups, self.supplier_article[idx], size)
+        return {
+            self.product_labels[c]: [
+                int(qty[c]),
+                float(revenue[c]),
+                int(nm[c]) or None,
+                self.barcode_labels[bc[c]],
+                self.supplier_article_labels[sa[c]],
+            ]
+            for c in self._first_order(groups, size)
+        }
+
+    def top_products(self, limit: int = 15) -> List[Dict[str, Any]]:
+        """Как aggregate_top_products."""
+        from utils.orders_processing import _load_nm_to_photo
+
+        nm_to_photo = _load_nm_to_photo()
+        items = [{
+            "product": p,
+            "qty": qty,
+            "nm_id": nm,
+            "barcode": bc,
+            "supplier_article": sa,
+            "sum": round(revenue, 2),
+            "photo": nm_to_photo.get(nm),
+        } for p, (qty, revenue, nm, bc, sa) in self.products_map().items()]
+        items.sort(key=lambda x: x["qty"], reverse=True)
+        return items[:limit]
+
+    def cancelled_products(self) -> List[Dict[str, Any]]:
+        """Как aggregate_cancelled_products."""
+        from utils.orders_processing import _load_nm_to_photo
+
+        nm_to_photo = _load_nm_to_photo()
+        items = [{
+            "product": p,
+            "qty": qty,
+            "nm_id": nm,
+            "barcode": bc,
+            "supplier_article": sa,
+            "sum": 0.0,
+            "photo": nm_to_photo.get(nm),
+        } for p, (qty, _revenue, nm, bc, sa) in self.products_map(cancelled=True).items()]
+        items.sort(key=lambda x: x["qty"], reverse=True)
+        return items
+
+    def top_products_orders(self, warehouse: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+        """Как aggregate_top_products_orders (с фото и остатками)."""
+        from utils.orders_processing import _top_products_orders_items
+
+        return _top_products_orders_items(self.products_map(warehouse=warehouse), warehouse, limit)
+
+    def product_warehouse_matrix(self) -> Tuple["np.ndarray", "np.ndarray"]:
+        """Матрицы товары × склады по активным заказам: (штук, выручка), индексы — коды
+        product_labels и warehouse_labels."""
+        active = ~self.cancelled
+        width = len(self.warehouse_labels)
+        size = len(self.product_labels) * width
+        cell = self.product[active].astype(np.int64) * width + self.warehouse[active]
+        qty = np.bincount(cell, minlength=size).reshape(-1, width)
+        revenue = np.bincount(cell, weights=self.price[active], minlength=size).reshape(-1, width)
+        return qty, revenue
+
+
+def orders_columns_for(key: Hashable, rows: List[Dict[str, Any]]) -> Optional[OrdersColumns]:
+    """Колонки для набора строк (кэшируются по key) или None, если numpy нет или строк мало."""
+    if np is None or len(rows) < ORDERS_COLUMNAR_MIN_ROWS:
+        return None
+    cols = _COLUMNS_CACHE.get(key)
+    if cols is None or cols.n != len(rows):
+        cols = OrdersColumns.from_rows(rows)
+        _COLUMNS_CACHE.put(key, cols, size=cols.nbytes())
+    return cols
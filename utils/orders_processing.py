@@ -4,6 +4,7 @@ from collections import defaultdict
 from typing import List, Dict, Any, Tuple
 from utils.helpers import parse_date, build_stocks_qty_indexes, lookup_stock_qty
 from utils.cache import load_products_cache, load_stocks_cache
+from utils.interning import intern_rows
 
 
 def to_rows(data: List[Dict[str, Any]], start_date: str, end_date: str) -> List[Dict[str, Any]]:
@@ -56,7 +57,8 @@ def to_rows(data: List[Dict[str, Any]], start_date: str, end_date: str) -> List[
             "Уникальный ID заказа": sale.get("srid"),
             "is_cancelled": is_cancelled_bool,  # Добавляем флаг отмены для удобства
         })
-    return rows
+    # Склады, бренды, предметы и т.п. повторяются в каждой строке — держим по одному объекту
+    return intern_rows(rows)
 
 
 def aggregate_daily_counts_and_revenue(rows: List[Dict[str, Any]]):
@@ -230,17 +232,21 @@ def aggregate_top_products_orders(rows: List[Dict[str, Any]], warehouse: str | N
         supplier_article = r.get("Артикул продавца")
         if product not in supplier_article_by_product and supplier_article:
             supplier_article_by_product[product] = supplier_article
+    products = {
+        p: [c, revenue_by_product.get(p, 0.0), nm_by_product.get(p), barcode_by_product.get(p), supplier_article_by_product.get(p)]
+        for p, c in counts.items()
+    }
+    return _top_products_orders_items(products, warehouse, limit)
+
+
+def _top_products_orders_items(
+    products: Dict[str, list],
+    warehouse: str | None,
+    limit: int,
+) -> List[Dict[str, Any]]:
+    """ТОП заказанных товаров с фото и остатками из {товар: [шт, выручка, nm_id, баркод, артикул продавца]}."""
     # Enrich with product photos from cache
-    nm_to_photo: Dict[Any, Any] = {}
-    try:
-        prod_cached = load_products_cache() or {}
-        for it in (prod_cached.get("items") or []):
-            nmv = it.get("nm_id") or it.get("nmId") or it.get("nmID")
-            photo = it.get("photo") or it.get("img")
-            if nmv is not None and nmv not in nm_to_photo:
-                nm_to_photo[nmv] = photo
-    except Exception:
-        nm_to_photo = {}
+    nm_to_photo = _load_nm_to_photo()
 
     # Остатки: barcode и nm_id (новый Analytics API часто без barcode до обогащения)
     stocks_by_barcode: Dict[str, int] = {}
@@ -266,10 +272,7 @@ def aggregate_top_products_orders(rows: List[Dict[str, Any]], warehouse: str | N
         stocks_by_barcode, stocks_by_nm, stocks_by_vendor = {}, {}, {}
 
     items = []
-    for p, c in counts.items():
-        nm_id = nm_by_product.get(p)
-        barcode = barcode_by_product.get(p)
-        supplier_article = supplier_article_by_product.get(p)
+    for p, (c, revenue, nm_id, barcode, supplier_article) in products.items():
         stock_qty = lookup_stock_qty(
             stocks_by_barcode,
             stocks_by_nm,
@@ -284,7 +287,7 @@ def aggregate_top_products_orders(rows: List[Dict[str, Any]], warehouse: str | N
             "nm_id": nm_id,
             "barcode": barcode,
             "supplier_article": supplier_article,
-            "sum": round(revenue_by_product.get(p, 0.0), 2),
+            "sum": round(revenue, 2),
             "photo": nm_to_photo.get(nm_id),
             "stock_qty": stock_qty,
         })
@@ -292,6 +295,420 @@ def aggregate_top_products_orders(rows: List[Dict[str, Any]], warehouse: str | N
     return items[:limit]
 
 
+# --- Дневные свёртки (rollup) для кэша заказов по дням ---
+
+# Версия формата свёртки: при изменении состава полей старые свёртки пересчитываются
+ORDERS_DAY_ROLLUP_VERSION = 3
+
+
+def build_orders_day_rollup(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Свёртка заказов одного дня для дашборда /orders.
+
+    Хранится в записи дня кэша orders_period рядом с самими заказами. Поля:
+    - daily: {Дата: [заказов, отменено, выручка]} (выручка не округлена, только активные);
+    - warehouses: {склад: активных заказов}; warehouses_all — все склады дня, включая отмены;
+    - products: {ключ товара: [шт, выручка, nm_id, баркод, артикул продавца]} (активные);
+    - cancelled_products: {ключ товара: [шт, nm_id, баркод, артикул продавца]};
+    - by_nm: {str(nm_id): [позиции строк дня]} — индекс для выборки заказов одного товара;
+    - by_barcode: {баркод: [позиции строк дня]} — то же по баркоду (размеру).
+    Ключ товара тот же, что в aggregate_top_products.
+    """
+    daily: Dict[str, list] = {}
+    warehouses: Dict[str, int] = defaultdict(int)
+    warehouses_all: set[str] = set()
+    products: Dict[str, list] = {}
+    cancelled_products: Dict[str, list] = {}
+    by_nm: Dict[str, list] = {}
+    by_barcode: Dict[str, list] = {}
+    for pos, r in enumerate(rows):
+        day = r.get("Дата")
+        is_cancelled = r.get("is_cancelled", False)
+        day_bucket = daily.get(day)
+        if day_bucket is None:
+            day_bucket = daily[day] = [0, 0, 0.0]
+        day_bucket[0] += 1
+        warehouse = r.get("Склад отгрузки") or "Не указан"
+        warehouses_all.add(warehouse)
+        product = str(r.get("Артикул продавца") or r.get("Артикул WB") or r.get("Баркод") or "Не указан")
+        nm = r.get("Артикул WB") or r.get("nmId") or r.get("nmID")
+        barcode = r.get("Баркод")
+        supplier_article = r.get("Артикул продавца")
+        if nm:
+            nm_positions = by_nm.get(str(nm))
+            if nm_positions is None:
+                by_nm[str(nm)] = [pos]
+            else:
+                nm_positions.append(pos)
+        if barcode:
+            bc_positions = by_barcode.get(str(barcode))
+            if bc_positions is None:
+                by_barcode[str(barcode)] = [pos]
+            else:
+                bc_positions.append(pos)
+        if is_cancelled:
+            day_bucket[1] += 1
+            item = cancelled_products.get(product)
+            if item is None:
+                cancelled_products[product] = [1, nm or None, barcode or None, supplier_article or None]
+            else:
+                item[0] += 1
+                if not item[1] and nm:
+                    item[1] = nm
+                if not item[2] and barcode:
+                    item[2] = barcode
+                if not item[3] and supplier_article:
+                    item[3] = supplier_article
+            continue
+        try:
+            price = float(r.get("Цена со скидкой продавца") or 0)
+        except (TypeError, ValueError):
+            price = 0.0
+        day_bucket[2] += price
+        warehouses[warehouse] += 1
+        item = products.get(product)
+        if item is None:
+            products[product] = [1, price, nm or None, barcode or None, supplier_article or None]
+        else:
+            item[0] += 1
+            item[1] += price
+            if not item[2] and nm:
+                item[2] = nm
+            if not item[3] and barcode:
+                item[3] = barcode
+            if not item[4] and supplier_article:
+                item[4] = supplier_article
+    return {
+        "v": ORDERS_DAY_ROLLUP_VERSION,
+        "daily": daily,
+        "warehouses": dict(warehouses),
+        "warehouses_all": sorted(warehouses_all),
+        "products": products,
+        "cancelled_products": cancelled_products,
+        "by_nm": by_nm,
+        "by_barcode": by_barcode,
+    }
+
+
+def merge_orders_day_rollups(rollups: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Складывает дневные свёртки в одну (в порядке дней: первое непустое nm_id/баркод побеждает).
+
+    by_nm и by_barcode не сливаются: позиции в них относятся к строкам своего дня.
+    """
+    merged = {
+        "v": ORDERS_DAY_ROLLUP_VERSION,
+        "daily": {},
+        "warehouses": defaultdict(int),
+        "warehouses_all": set(),
+        "products": {},
+        "cancelled_products": {},
+    }
+    for rollup in rollups:
+        if not isinstance(rollup, dict):
+            continue
+        for day, (cnt, cancelled, revenue) in (rollup.get("daily") or {}).items():
+            bucket = merged["daily"].get(day)
+            if bucket is None:
+                merged["daily"][day] = [cnt, cancelled, revenue]
+            else:
+                bucket[0] += cnt
+                bucket[1] += cancelled
+                bucket[2] += revenue
+        for warehouse, cnt in (rollup.get("warehouses") or {}).items():
+            merged["warehouses"][warehouse] += cnt
+        merged["warehouses_all"].update(rollup.get("warehouses_all") or [])
+        for field, qty_fields in (("products", 2), ("cancelled_products", 1)):
+            target = merged[field]
+            for product, item in (rollup.get(field) or {}).items():
+                existing = target.get(product)
+                if existing is None:
+                    target[product] = list(item)
+                    continue
+                for i in range(qty_fields):
+                    existing[i] += item[i]
+                for i in range(qty_fields, len(item)):
+                    if not existing[i] and item[i]:
+                        existing[i] = item[i]
+    merged["warehouses"] = dict(merged["warehouses"])
+    merged["warehouses_all"] = sorted(merged["warehouses_all"])
+    return merged
+
+
+def _load_nm_to_photo() -> Dict[Any, Any]:
+    nm_to_photo: Dict[Any, Any] = {}
+    try:
+        prod_cached = load_products_cache() or {}
+        for it in (prod_cached.get("items") or []):
+            nmv = it.get("nm_id") or it.get("nmId") or it.get("nmID")
+            photo = it.get("photo") or it.get("img")
+            if nmv is not None and nmv not in nm_to_photo:
+                nm_to_photo[nmv] = photo
+    except Exception:
+        nm_to_photo = {}
+    return nm_to_photo
+
+
+def aggregates_from_orders_rollup(rollup: Dict[str, Any], limit: int = 15) -> Dict[str, Any]:
+    """Показатели дашборда /orders из (слитой) свёртки — без прохода по строкам заказов.
+
+    Результат совпадает с aggregate_daily_counts_and_revenue, aggregate_by_warehouse_orders_only,
+    aggregate_top_products и aggregate_cancelled_products по тем же заказам.
+    """
+    count_by_day: Dict[str, int] = defaultdict(int)
+    revenue_by_day: Dict[str, float] = defaultdict(float)
+    cancelled_count_by_day: Dict[str, int] = defaultdict(int)
+    for day, (cnt, cancelled, revenue) in (rollup.get("daily") or {}).items():
+        count_by_day[day] += cnt
+        if cancelled:
+            cancelled_count_by_day[day] += cancelled
+        if cnt - cancelled:
+            revenue_by_day[day] += revenue
+    total_orders = sum(count_by_day.values())
+    total_cancelled = sum(cancelled_count_by_day.values())
+
+    warehouse_summary = [
+        {"warehouse": w, "orders": c}
+        for w, c in sorted((rollup.get("warehouses") or {}).items())
+    ]
+    warehouse_summary.sort(key=lambda x: x["orders"], reverse=True)
+
+    nm_to_photo = _load_nm_to_photo()
+    top_products = [{
+        "product": p,
+        "qty": item[0],
+        "nm_id": item[2],
+        "barcode": item[3],
+        "supplier_article": item[4],
+        "sum": round(item[1], 2),
+        "photo": nm_to_photo.get(item[2]),
+    } for p, item in (rollup.get("products") or {}).items()]
+    top_products.sort(key=lambda x: x["qty"], reverse=True)
+
+    cancelled_products = [{
+        "product": p,
+        "qty": item[0],
+        "nm_id": item[1],
+        "barcode": item[2],
+        "supplier_article": item[3],
+        "sum": 0.0,
+        "photo": nm_to_photo.get(item[1]),
+    } for p, item in (rollup.get("cancelled_products") or {}).items()]
+    cancelled_products.sort(key=lambda x: x["qty"], reverse=True)
+
+    return {
+        "total_orders": total_orders,
+        "total_active_orders": total_orders - total_cancelled,
+        "total_cancelled_orders": total_cancelled,
+        "total_revenue": round(sum(revenue_by_day.values()), 2),
+        "count_by_day": count_by_day,
+        "revenue_by_day": revenue_by_day,
+        "cancelled_count_by_day": cancelled_count_by_day,
+        "warehouse_summary_dual": warehouse_summary,
+        "top_products": top_products[:limit],
+        "cancelled_products": cancelled_products,
+        "warehouses": list(rollup.get("warehouses_all") or []),
+    }
+
+
+# --- Единый проход по заказам для /orders и отчётов ---
+
+ORDERS_AGGREGATE_OUTPUTS = ("dashboard", "top_products_orders", "product_matrix")
+
+
+def _add_product_order(
+    target: Dict[str, list],
+    product: str,
+    price: float,
+    nm: Any,
+    barcode: Any,
+    supplier_article: Any,
+) -> None:
+    item = target.get(product)
+    if item is None:
+        target[product] = [1, price, nm or None, barcode or None, supplier_article or None]
+        return
+    item[0] += 1
+    item[1] += price
+    if not item[2] and nm:
+        item[2] = nm
+    if not item[3] and barcode:
+        item[3] = barcode
+    if not item[4] and supplier_article:
+        item[4] = supplier_article
+
+
+def _group_matrix_rows(
+    matrix_rows: List[tuple],
+    barcode_to_nm: Dict[Any, Any],
+    supplier_article_to_nm: Dict[Any, Any],
+) -> tuple:
+    """Группировка товары × склады по активным строкам (логика _normalize_and_group_orders)."""
+    counts_total: Dict[str, int] = defaultdict(int)
+    by_wh: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    revenue_total: Dict[str, float] = defaultdict(float)
+    by_wh_sum: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+    nm_by_product: Dict[str, Any] = {}
+    barcode_by_product: Dict[str, Any] = {}
+    supplier_article_by_product: Dict[str, Any] = {}
+    for nmv, barcode, supplier_article, wh, price in matrix_rows:
+        # Нет Артикула WB — берём связанный по баркоду или артикулу продавца
+        if not nmv:
+            if barcode and barcode in barcode_to_nm:
+                nmv = barcode_to_nm[barcode]
+            elif supplier_article and supplier_article in supplier_article_to_nm:
+                nmv = supplier_article_to_nm[supplier_article]
+        if nmv:
+            prod_key = f"NM_{nmv}"
+        elif barcode:
+            prod_key = f"BARCODE_{barcode}"
+        elif supplier_article:
+            prod_key = str(supplier_article)
+        else:
+            prod_key = "Не указан"
+        counts_total[prod_key] += 1
+        by_wh[prod_key][wh] += 1
+        revenue_total[prod_key] += price
+        by_wh_sum[prod_key][wh] += price
+        if nmv:
+            nm_by_product[prod_key] = nmv
+        if barcode:
+            barcode_by_product[prod_key] = barcode
+        if supplier_article:
+            # Артикул продавца — последний (актуальный)
+            supplier_article_by_product[prod_key] = supplier_article
+    return (counts_total, by_wh, revenue_total, by_wh_sum, nm_by_product, barcode_by_product, supplier_article_by_product)
+
+
+def top_products_orders_from_rollup(rollup: Dict[str, Any], limit: int = 50) -> List[Dict[str, Any]]:
+    """ТОП заказов без фильтра по складу из (слитой) свёртки — как aggregate_top_products_orders(rows, None)."""
+    return _top_products_orders_items(rollup.get("products") or {}, None, limit)
+
+
+def aggregate_orders(
+    rows: List[Dict[str, Any]],
+    outputs: Tuple[str, ...] = ORDERS_AGGREGATE_OUTPUTS,
+    *,
+    limit: int = 15,
+    warehouse: str | None = None,
+    orders_limit: int = 50,
+) -> Dict[str, Any]:
+    """Агрегаты заказов за один проход по строкам вместо отдельного прохода на каждый показатель.
+
+    outputs — какие группы нужны маршруту (остальные в проходе не считаются):
+    - "dashboard": итоги, ряды по дням, склады, ТОП товаров, отменённые товары и список
+      складов — ключи как у aggregates_from_orders_rollup; заменяет
+      aggregate_daily_counts_and_revenue, aggregate_by_warehouse_orders_only,
+      aggregate_top_products и aggregate_cancelled_products;
+    - "top_products_orders": как aggregate_top_products_orders(rows, warehouse, orders_limit);
+    - "product_matrix": кортеж как _normalize_and_group_orders в app.py (товары × склады).
+    """
+    want = set(outputs)
+    need_dashboard = "dashboard" in want
+    need_orders_top = "top_products_orders" in want
+    need_matrix = "product_matrix" in want
+    # Без фильтра по складу ТОП заказов строится по тому же словарю товаров, что и дашборд
+    need_products = need_dashboard or (need_orders_top and not warehouse)
+    need_wh_products = need_orders_top and bool(warehouse)
+
+    daily: Dict[str, list] = {}
+    warehouses: Dict[str, int] = defaultdict(int)
+    warehouses_all: set[str] = set()
+    products: Dict[str, list] = {}
+    wh_products: Dict[str, list] = {}
+    cancelled_products: Dict[str, list] = {}
+    matrix_rows: List[tuple] = []
+    barcode_to_nm: Dict[Any, Any] = {}
+    supplier_article_to_nm: Dict[Any, Any] = {}
+
+    for r in rows:
+        is_cancelled = r.get("is_cancelled", False)
+        day_bucket = None
+        if need_dashboard:
+            day = r.get("Дата")
+            day_bucket = daily.get(day)
+            if day_bucket is None:
+                day_bucket = daily[day] = [0, 0, 0.0]
+            day_bucket[0] += 1
+            warehouses_all.add(r.get("Склад отгрузки") or "Не указан")
+            if is_cancelled:
+                day_bucket[1] += 1
+        if is_cancelled:
+            if need_dashboard:
+                product = str(r.get("Артикул продавца") or r.get("Артикул WB") or r.get("Баркод") or "Не указан")
+                nm = r.get("Артикул WB") or r.get("nmId") or r.get("nmID")
+                barcode = r.get("Баркод")
+                supplier_article = r.get("Артикул продавца")
+                item = cancelled_products.get(product)
+                if item is None:
+                    cancelled_products[product] = [1, nm or None, barcode or None, supplier_article or None]
+                else:
+                    item[0] += 1
+                    if not item[1] and nm:
+                        item[1] = nm
+                    if not item[2] and barcode:
+                        item[2] = barcode
+                    if not item[3] and supplier_article:
+                        item[3] = supplier_article
+            continue
+
+        if need_matrix:
+            m_barcode = r.get("_barcode") or r.get("Баркод") or r.get("barcode")
+            m_nm = r.get("_nm_id") or r.get("Артикул WB") or r.get("nmId") or r.get("nmID")
+            m_article = r.get("_supplier_article") or r.get("Артикул продавца") or r.get("supplierArticle")
+            m_wh = str(r.get("_warehouse") or r.get("Склад отгрузки") or r.get("warehouseName") or "Не указан")
+            raw_price = r.get("_price")
+            if raw_price is None:
+                raw_price = r.get("Цена со скидкой продавца")
+            if raw_price is None:
+                raw_price = r.get("priceWithDisc")
+            try:
+                m_price = float(raw_price or 0)
+            except (TypeError, ValueError):
+                m_price = 0.0
+            if m_nm:
+                if m_barcode:
+                    barcode_to_nm[m_barcode] = m_nm
+                if m_article:
+                    supplier_article_to_nm[m_article] = m_nm
+            matrix_rows.append((m_nm, m_barcode, m_article, m_wh, m_price))
+
+        if not (need_dashboard or need_products or need_wh_products):
+            continue
+        try:
+            price = float(r.get("Цена со скидкой продавца") or 0)
+        except (TypeError, ValueError):
+            price = 0.0
+        warehouse_name = r.get("Склад отгрузки") or "Не указан"
+        if need_dashboard:
+            day_bucket[2] += price
+            warehouses[warehouse_name] += 1
+        if need_products or (need_wh_products and warehouse_name == warehouse):
+            product = str(r.get("Артикул продавца") or r.get("Артикул WB") or r.get("Баркод") or "Не указан")
+            nm = r.get("Артикул WB") or r.get("nmId") or r.get("nmID")
+            barcode = r.get("Баркод")
+            supplier_article = r.get("Артикул продавца")
+            if need_products:
+                _add_product_order(products, product, price, nm, barcode, supplier_article)
+            if need_wh_products and warehouse_name == warehouse:
+                _add_product_order(wh_products, product, price, nm, barcode, supplier_article)
+
+    result: Dict[str, Any] = {}
+    if need_dashboard:
+        result.update(aggregates_from_orders_rollup({
+            "daily": daily,
+            "warehouses": dict(warehouses),
+            "warehouses_all": sorted(warehouses_all),
+            "products": products,
+            "cancelled_products": cancelled_products,
+        }, limit=limit))
+    if need_orders_top:
+        result["top_products_orders"] = _top_products_orders_items(
+            wh_products if warehouse else products, warehouse, orders_limit
+        )
+    if need_matrix:
+        result["product_matrix"] = _group_matrix_rows(matrix_rows, barcode_to_nm, supplier_article_to_nm)
+    return result
+
+
 def aggregate_top_products_sales(rows: List[Dict[str, Any]], warehouse: str | None = None, limit: int = 50) -> List[Tuple[str, int]]:
     """Агрегирует ТОП товаров по продажам с фильтрацией по складу"""
     counts: Dict[str, int] = defaultdict(int)
@@ -1,12 +1,9 @@
 # -*- coding: utf-8 -*-
 """Управление прогрессом длительных операций"""
-from typing import Any
 
 # Глобальные переменные для хранения прогресса
 ORDERS_PROGRESS: dict[int, dict[str, object]] = {}
-FINANCE_PROGRESS: dict[int, dict[str, object]] = {}
-FINANCE_RESULTS: dict[int, dict[str, Any]] = {}  # Хранит результаты финансового отчета по user_id
-FINANCE_LOADING: dict[int, bool] = {}  # Флаг загрузки финансового отчета
+# Прогресс, флаг загрузки и результаты фин. отчёта — в utils.report_results (общие для воркеров)
 
 
 def set_orders_progress(user_id: int, total: int, done: int, key: str | None = None) -> None:
@@ -40,21 +37,23 @@ def clear_orders_progress(user_id: int, key: str | None = None) -> None:
 def set_finance_progress(user_id: int, current: int, total: int, period: str = "") -> None:
     """Устанавливает прогресс загрузки финансового отчета"""
     try:
-        FINANCE_PROGRESS[user_id] = {"current": current, "total": total, "period": period}
+        from utils.report_results import REPORT_KIND_FINANCE, set_report_job_progress
+        set_report_job_progress(user_id, REPORT_KIND_FINANCE, current, total, period)
     except Exception:
         pass
 
 
 def get_finance_progress(user_id: int) -> dict[str, object]:
     """Получает прогресс загрузки финансового отчета"""
-    return FINANCE_PROGRESS.get(user_id) or {"current": 0, "total": 0, "period": ""}
+    from utils.report_results import REPORT_KIND_FINANCE, get_report_job
+    return dict(get_report_job(user_id, REPORT_KIND_FINANCE)["progress"])
 
 
 def clear_finance_progress(user_id: int) -> None:
     """Очищает прогресс загрузки финансового отчета"""
     try:
-        if user_id in FINANCE_PROGRESS:
-            del FINANCE_PROGRESS[user_id]
+        from utils.report_results import REPORT_KIND_FINANCE, clear_report_job_progress
+        clear_report_job_progress(user_id, REPORT_KIND_FINANCE)
     except Exception:
         pass
 
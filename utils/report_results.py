@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""Результаты фоновых фин. отчётов и состояние загрузки на диске: users/<id>/report_results/."""
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional, Tuple
+
+from utils.cache_layout import user_cache_path
+from utils.cache_manager import record_cache_access
+from utils.constants import (
+    REPORT_RESULT_TTL_SECONDS,
+    REPORT_RESULTS_MAX_BYTES_PER_USER,
+    REPORT_RESULTS_MAX_PER_USER,
+)
+
+REPORT_KIND_FINANCE = "finance"
+REPORT_KIND_BREAKDOWN = "finance_breakdown"
+
+_JOB_SUFFIX = ".job.json"
+
+# expires_at и precomputed записываются в начале файла (до result) — для очистки хватает первых байт
+_EXPIRES_AT_RE = re.compile(rb'"expires_at":\s*([0-9.eE+]+)')
+_PRECOMPUTED_RE = re.compile(rb'"precomputed":\s*true')
+_HEAD_BYTES = 512
+
+# Проверка «не идёт ли уже загрузка» + запись флага в пределах процесса. Между воркерами
+# возможна гонка в миллисекунды — тогда отчёт посчитается дважды, результат один и тот же.
+_job_lock = threading.Lock()
+
+
+def _results_dir(user_id: int) -> str:
+    path = user_cache_path(user_id, "report_results", is_dir=True)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _result_name(kind: str, date_from: str, date_to: str) -> str:
+    return f"{kind}_{date_from}_{date_to}.json"
+
+
+def _read_json(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else None
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Ошибка чтения результата отчёта {path}: {e}")
+        return None
+
+
+def _write_json(path: str, payload: Dict[str, Any]) -> None:
+    from utils.cache import atomic_write_json
+
+    atomic_write_json(path, payload)
+
+
+def load_report_result(
+    user_id: int,
+    kind: str,
+    date_from: str,
+    date_to: str,
+    version: str,
+) -> Optional[Dict[str, Any]]:
+    """Сохранённый результат отчёта за период или None (нет, истёк TTL, другая версия данных).
+
+    version (схема расчёта, налог, кэш товаров и т.п.) задаёт вызывающий код.
+    """
+    path = os.path.join(_results_dir(user_id), _result_name(kind, date_from, date_to))
+    data = _read_json(path)
+    if not data or data.get("v") != version:
+        return None
+    if float(data.get("expires_at") or 0) < time.time():
+        return None
+    record_cache_access(path)
+    return data.get("result")
+
+
+def _stored_head(path: str, mtime: float) -> Tuple[float, bool]:
+    """(срок хранения, заранее посчитан) из начала файла; срок не прочитался — mtime + TTL по умолчанию."""
+    expires_at = mtime + REPORT_RESULT_TTL_SECONDS
+    precomputed = False
+    try:
+        with open(path, "rb") as f:
+            head = f.read(_HEAD_BYTES)
+        m = _EXPIRES_AT_RE.search(head)
+        if m:
+            expires_at = float(m.group(1))
+        precomputed = _PRECOMPUTED_RE.search(head) is not None
+    except (OSError, ValueError):
+        pass
+    return expires_at, precomputed
+
+
+def _prune_results(user_id: int, keep: str) -> None:
+    """
+    Удаляет просроченные результаты и самые старые сверх лимитов (файл keep не трогаем).
+    Заранее посчитанные результаты в лимиты не входят и удаляются только по сроку — их немного
+    (неделя и месяц), и их не должны вытеснять отчёты, открытые днём.
+    """
+    directory = _results_dir(user_id)
+    now = time.time()
+    entries = []
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    for name in names:
+        if not name.endswith(".json") or name.endswith(_JOB_SUFFIX) or name.startswith("."):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, name, path))
+    entries.sort(reverse=True)
+    kept = 0
+    kept_bytes = 0
+    for mtime, size, name, path in entries:
+        expires_at, precomputed = _stored_head(path, mtime)
+        expired = expires_at < now
+        over_limit = not precomputed and (
+            kept >= REPORT_RESULTS_MAX_PER_USER or kept_bytes + size > REPORT_RESULTS_MAX_BYTES_PER_USER
+        )
+        if name != keep and (expired or over_limit):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            continue
+        if not precomputed:
+            kept += 1
+            kept_bytes += size
+
+
+def save_report_result(
+    user_id: int,
+    kind: str,
+    date_from: str,
+    date_to: str,
+    version: str,
+    result: Dict[str, Any],
+    *,
+    ttl_s: Optional[float] = None,
+    precomputed: bool = False,
+) -> None:
+    """
+    Сохраняет результат за период на ttl_s секунд (по умолчанию REPORT_RESULT_TTL_SECONDS).
+    precomputed=True — посчитан заранее (фоновой задачей): не вытесняется лимитами на пользователя.
+    """
+    name = _result_name(kind, date_from, date_to)
+    path = os.path.join(_results_dir(user_id), name)
+    try:
+        _write_json(path, {
+            "v": version,
+            "kind": kind,
+            "date_from": date_from,
+            "date_to": date_to,
+            "created_at": time.time(),
+            "expires_at": time.time() + (ttl_s if ttl_s is not None else REPORT_RESULT_TTL_SECONDS),
+            "precomputed": precomputed,
+            "result": result,
+        })
+        _prune_results(user_id, keep=name)
+    except Exception as e:
+        print(f"Ошибка сохранения результата отчёта {path}: {e}")
+
+
+# --- Состояние загрузки (общее для воркеров) ---
+
+def _job_path(user_id: int, kind: str) -> str:
+    return os.path.join(_results_dir(user_id), f"{kind}{_JOB_SUFFIX}")
+
+
+def get_report_job(user_id: int, kind: str) -> Dict[str, Any]:
+    """Состояние последней загрузки: loading, ready, progress, период."""
+    job = _read_json(_job_path(user_id, kind)) or {}
+    job.setdefault("loading", False)
+    job.setdefault("ready", False)
+    job["progress"] = job.get("progress") or {"current": 0, "total": 0, "period": ""}
+    return job
+
+
+def _save_job(user_id: int, kind: str, job: Dict[str, Any]) -> None:
+    try:
+        _write_json(_job_path(user_id, kind), job)
+    except Exception as e:
+        print(f"Ошибка сохранения состояния загрузки отчёта {kind} пользователя {user_id}: {e}")
+
+
+def start_report_job(
+    user_id: int,
+    kind: str,
+    date_from: str,
+    date_to: str,
+    version: str,
+    stale_after_s: float,
+) -> Optional[str]:
+    """
+    Отмечает начало загрузки и возвращает её id — его нужно передать в finish_report_job.
+    None — уже идёт загрузка, начатая менее stale_after_s назад (в этом или другом воркере);
+    зависшая дольше — перезапускается.
+    """
+    with _job_lock:
+        job = get_report_job(user_id, kind)
+        if job.get("loading"):
+            age = time.time() - float(job.get("started_at") or 0)
+            if age < stale_after_s:
+                return None
+            print(f"Сброс зависшей загрузки отчёта {kind} пользователя {user_id} (возраст {age:.0f} с)")
+        job_id = uuid.uuid4().hex
+        _save_job(user_id, kind, {
+            "job_id": job_id,
+            "loading": True,
+            "ready": False,
+            "started_at": time.time(),
+            "pid": os.getpid(),
+            "date_from": date_from,
+            "date_to": date_to,
+            "version": version,
+            "progress": {"current": 0, "total": 0, "period": ""},
+        })
+        return job_id
+
+
+def set_report_job_progress(user_id: int, kind: str, current: int, total: int, period: str = "") -> None:
+    with _job_lock:
+        job = get_report_job(user_id, kind)
+        job["progress"] = {"current": current, "total": total, "period": period}
+        _save_job(user_id, kind, job)
+
+
+def clear_report_job_progress(user_id: int, kind: str) -> None:
+    with _job_lock:
+        job = get_report_job(user_id, kind)
+        if job.get("progress", {}).get("total") or job.get("progress", {}).get("period"):
+            job["progress"] = {"current": 0, "total": 0, "period": ""}
+            _save_job(user_id, kind, job)
+
+
+def finish_report_job(
+    user_id: int,
+    kind: str,
+    result: Optional[Dict[str, Any]],
+    *,
+    job_id: str,
+    reusable: bool = True,
+    ttl_s: Optional[float] = None,
+) -> None:
+    """
+    Завершает загрузку job_id (из start_report_job). reusable=True — результат сохраняется
+    за период на ttl_s (см. save_report_result) и отдаётся следующим запросам этого периода;
+    False (ошибка) — только ближайшему опросу /result. result=None — загрузка не удалась, отдавать нечего.
+    Если job_id уже не текущая загрузка (зависшую перезапустили, в т.ч. за другой период),
+    завершение игнорируется: период и версия в файле состояния — уже чужие.
+    """
+    with _job_lock:
+        job = get_report_job(user_id, kind)
+        if job.get("job_id") != job_id:
+            print(f"Завершение устаревшей загрузки отчёта {kind} пользователя {user_id} проигнорировано")
+            return
+        job["loading"] = False
+        job["progress"] = {"current": 0, "total": 0, "period": ""}
+        job.pop("result", None)
+        job["ready"] = result is not None
+        if result is not None:
+            if reusable:
+                save_report_result(
+                    user_id,
+                    kind,
+                    job.get("date_from") or "",
+                    job.get("date_to") or "",
+                    job.get("version") or "",
+                    result,
+                    ttl_s=ttl_s,
+                )
+            else:
+                job["result"] = result
+        _save_job(user_id, kind, job)
+
+
+def load_report_job_result(user_id: int, kind: str) -> Optional[Dict[str, Any]]:
+    """Результат последней завершённой загрузки (для /result) или None."""
+    job = get_report_job(user_id, kind)
+    if job.get("loading") or not job.get("ready"):
+        return None
+    if isinstance(job.get("result"), dict):
+        return job["result"]
+    return load_report_result(
+        user_id,
+        kind,
+        job.get("date_from") or "",
+        job.get("date_to") or "",
+        job.get("version") or "",
+    )
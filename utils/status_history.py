@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""История наблюдаемых статусов заказов для ленты: снимок + append-only журнал."""
+from __future__ import annotations
+
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Tuple
+
+from utils.cache import atomic_write_json
+from utils.cache_layout import user_cache_path
+from utils.cache_manager import record_cache_access
+from utils.constants import (
+    MOSCOW_TZ,
+    ORDER_STATUS_HISTORY_COMPACT_LINES,
+    ORDER_STATUS_HISTORY_RETENTION_DAYS,
+)
+
+# Сколько последних событий храним на один srid
+MAX_EVENTS_PER_SRID = 40
+
+_lock = threading.Lock()
+# user_id -> {"by_srid": {...}, "snapshot_sig": ..., "log_offset": int, "log_lines": int}
+_states: Dict[int, Dict[str, Any]] = {}
+
+
+# users/<id>/order_status_history.json — сжатый снимок {srid: [события]}
+def _snapshot_path(user_id: int) -> str:
+    return user_cache_path(user_id, "order_status_history")
+
+
+# Рядом order_status_history.log — новые переходы после снимка, по строке JSON на событие
+def _log_path(user_id: int) -> str:
+    return os.path.splitext(_snapshot_path(user_id))[0] + ".log"
+
+
+def _file_sig(path: str) -> Tuple[int, int] | None:
+    try:
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+    except OSError:
+        return None
+
+
+def status_history_version(user_id: int) -> Tuple[Any, ...]:
+    """(mtime, size) снимка и журнала истории — меняется при каждой дозаписи или сжатии."""
+    uid = int(user_id)
+    return _file_sig(_snapshot_path(uid)), _file_sig(_log_path(uid))
+
+
+def apply_status_event(by_srid: Dict[str, List[Dict[str, Any]]], srid: str, event: Dict[str, Any]) -> bool:
+    """Добавляет событие в историю srid, если статус сменился. True — событие новое.
+
+    Список событий заменяется новым, а не дополняется на месте: копии индекса из
+    load_status_history делят списки с общим индексом и читаются без _lock.
+    """
+    events = by_srid.get(srid)
+    if events and events[-1].get("status") == event.get("status"):
+        return False
+    events = (events or []) + [event]
+    if len(events) > MAX_EVENTS_PER_SRID:
+        events = events[-MAX_EVENTS_PER_SRID:]
+    by_srid[srid] = events
+    return True
+
+
+def _load_snapshot(path: str) -> Dict[str, List[Dict[str, Any]]]:
+    if not os.path.isfile(path):
+        return {}
+    try:
+        record_cache_access(path)
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except Exception:
+        return {}
+
+
+def _replay_log(state: Dict[str, Any], path: str, until: int | None = None) -> None:
+    """Дочитывает журнал с последнего смещения (только целые строки, до until байт)."""
+    try:
+        with open(path, "rb") as f:
+            f.seek(state["log_offset"])
+            chunk = f.read() if until is None else f.read(max(until - state["log_offset"], 0))
+    except OSError:
+        return
+    end = chunk.rfind(b"\n")
+    if end < 0:
+        return
+    by_srid = state["by_srid"]
+    for line in chunk[: end + 1].splitlines():
+        if not line.strip():
+            continue
+        try:
+            rec = json.loads(line)
+            srid = str(rec.get("srid") or "")
+            event = rec.get("event")
+        except Exception:
+            continue
+        if srid and isinstance(event, dict):
+            apply_status_event(by_srid, srid, event)
+        state["log_lines"] += 1
+    state["log_offset"] += end + 1
+
+
+def _compacting_path(user_id: int) -> str:
+    return _log_path(user_id) + ".compacting"
+
+
+def _recover_compacting_locked(user_id: int) -> None:
+    """
+    Журнал, оставшийся от прерванного сжатия (.compacting). Если он новее снимка —
+    его события в снимок не попали: сжатие доводится до конца (снимок + этот журнал).
+    Иначе снимок уже записан, и файл просто удаляется.
+    """
+    compacting_path = _compacting_path(user_id)
+    compacting_sig = _file_sig(compacting_path)
+    if compacting_sig is None:
+        return
+    snapshot_path = _snapshot_path(user_id)
+    snapshot_sig = _file_sig(snapshot_path)
+    try:
+        if snapshot_sig is None or compacting_sig[0] >= snapshot_sig[0]:
+            state = {"by_srid": _load_snapshot(snapshot_path), "log_offset": 0, "log_lines": 0}
+            _replay_log(state, compacting_path)
+            atomic_write_json(snapshot_path, state["by_srid"])
+            print(f"История статусов пользователя {user_id}: восстановлен журнал прерванного сжатия")
+        os.remove(compacting_path)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"Ошибка восстановления журнала статусов пользователя {user_id}: {e}")
+
+
+def _sync_locked(user_id: int) -> Dict[str, Any]:
+    _recover_compacting_locked(user_id)
+    snapshot_path = _snapshot_path(user_id)
+    log_path = _log_path(user_id)
+    snapshot_sig = _file_sig(snapshot_path)
+    log_sig = _file_sig(log_path)
+    log_size = log_sig[1] if log_sig else 0
+    state = _states.get(user_id)
+    # Снимок переписан или журнал усечён (сжатие в другом процессе) — перечитываем всё
+    if state is None or state["snapshot_sig"] != snapshot_sig or log_size < state["log_offset"]:
+        state = {
+            "by_srid": _load_snapshot(snapshot_path),
+            "snapshot_sig": snapshot_sig,
+            "log_offset": 0,
+            "log_lines": 0,
+        }
+        _states[user_id] = state
+    if log_size > state["log_offset"]:
+        _replay_log(state, log_path)
+    return state
+
+
+def load_status_history(user_id: int) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    История статусов {srid: [события]} (снимок + журнал): копия общего индекса процесса.
+    Её можно менять (apply_status_event) без _lock — общий индекс меняется только
+    через append_status_events.
+    """
+    with _lock:
+        return dict(_sync_locked(int(user_id))["by_srid"])
+
+
+def append_status_events(user_id: int, events: List[Tuple[str, Dict[str, Any]]]) -> None:
+    """Дописывает новые переходы статусов в журнал; при разрастании журнала — сжатие."""
+    if not events:
+        return
+    uid = int(user_id)
+    data = "".join(
+        json.dumps({"srid": srid, "event": event}, ensure_ascii=False) + "\n"
+        for srid, event in events
+        if srid
+    ).encode("utf-8")
+    if not data:
+        return
+    with _lock:
+        state = _sync_locked(uid)
+        try:
+            log_path = _log_path(uid)
+            with open(log_path, "ab") as f:
+                f.write(data)
+                end = f.tell()
+            record_cache_access(log_path)
+        except Exception as e:
+            print(f"Ошибка записи журнала статусов пользователя {uid}: {e}")
+            return
+        # Дочитываем то, что успели дописать другие процессы перед нашими строками,
+        # свои события применяем к индексу напрямую и перескакиваем через их строки
+        start = end - len(data)
+        if start > state["log_offset"]:
+            _replay_log(state, log_path, until=start)
+        if state["log_offset"] == start:
+            for srid, event in events:
+                if srid:
+                    apply_status_event(state["by_srid"], srid, event)
+            state["log_offset"] = end
+            state["log_lines"] += data.count(b"\n")
+        if state["log_lines"] >= ORDER_STATUS_HISTORY_COMPACT_LINES:
+            _compact_locked(uid, state)
+
+
+def _prune_expired(by_srid: Dict[str, List[Dict[str, Any]]]) -> int:
+    if ORDER_STATUS_HISTORY_RETENTION_DAYS <= 0:
+        return 0
+    cutoff = (datetime.now(MOSCOW_TZ) - timedelta(days=ORDER_STATUS_HISTORY_RETENTION_DAYS)).strftime("%Y-%m-%d %H:%M:%S")
+    expired = [
+        srid for srid, events in by_srid.items()
+        if not events or str(events[-1].get("seen_at") or events[-1].get("at") or "") < cutoff
+    ]
+    for srid in expired:
+        del by_srid[srid]
+    return len(expired)
+
+
+def _compact_locked(user_id: int, state: Dict[str, Any]) -> None:
+    snapshot_path = _snapshot_path(user_id)
+    log_path = _log_path(user_id)
+    compacting_path = _compacting_path(user_id)
+    try:
+        # Новые дозаписи (в т.ч. из других процессов) пойдут уже в свежий журнал
+        if os.path.exists(log_path):
+            os.replace(log_path, compacting_path)
+            _replay_log(state, compacting_path)
+        removed = _prune_expired(state["by_srid"])
+        atomic_write_json(snapshot_path, state["by_srid"])
+        if os.path.exists(compacting_path):
+            os.remove(compacting_path)
+        state["snapshot_sig"] = _file_sig(snapshot_path)
+        state["log_offset"] = 0
+        state["log_lines"] = 0
+        print(
+            f"История статусов пользователя {user_id} сжата: {len(state['by_srid'])} srid, "
+            f"удалено устаревших: {removed}"
+        )
+    except Exception as e:
+        print(f"Ошибка сжатия истории статусов пользователя {user_id}: {e}")
+
+
+def compact_status_history(user_id: int) -> None:
+    """Сворачивает журнал в снимок (можно звать из фоновых задач)."""
+    uid = int(user_id)
+    with _lock:
+        _compact_locked(uid, _sync_locked(uid))
+
+
+def save_status_history(user_id: int, history: Dict[str, List[Dict[str, Any]]]) -> None:
+    """Полная перезапись истории (снимок), журнал сбрасывается."""
+    uid = int(user_id)
+    with _lock:
+        try:
+            atomic_write_json(_snapshot_path(uid), history)
+            log_path = _log_path(uid)
+            if os.path.exists(log_path):
+                os.remove(log_path)
+        except Exception:
+            pass
+        _states.pop(uid, None)
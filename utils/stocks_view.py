@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""Готовое представление остатков для /stocks и /api/stocks/data: users/<id>/stocks_view.json."""
+import hashlib
+import json
+import os
+from collections import defaultdict
+from typing import Any, Dict, List
+
+from utils.cache_layout import user_cache_path
+from utils.helpers import enrich_stocks_from_products, stock_row_product_key
+from utils.memory_cache import MemoryBoundedCache
+
+# Версия формата снимка: при изменении состава полей старые снимки пересобираются
+STOCKS_VIEW_VERSION = 1
+
+# Разобранные снимки в памяти процесса: user_id -> снимок (сверяется с mtime файла)
+_VIEW_MEMO = MemoryBoundedCache(64 * 1024 * 1024, 3600, max_entries=64)
+
+
+def _mtime(path: str) -> float | None:
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def _nm_to_photo(products: List[Dict[str, Any]]) -> Dict[int, Any]:
+    nm_to_photo: Dict[int, Any] = {}
+    for it_p in products or []:
+        if not isinstance(it_p, dict):
+            continue
+        nmv = it_p.get("nm_id") or it_p.get("nmId") or it_p.get("nmID")
+        if nmv is None:
+            continue
+        photo = it_p.get("photo") or it_p.get("img")
+        if photo:
+            try:
+                nm_to_photo[int(nmv)] = photo
+            except (TypeError, ValueError):
+                continue
+    return nm_to_photo
+
+
+def _photo_for(nm_to_photo: Dict[int, Any], nm: Any) -> Any:
+    try:
+        return nm_to_photo.get(int(nm))
+    except Exception:
+        return nm_to_photo.get(nm)
+
+
+def build_stocks_view(
+    items: List[Dict[str, Any]],
+    products: List[Dict[str, Any]],
+    updated_at: Any = None,
+) -> Dict[str, Any]:
+    """Агрегаты остатков по товарам и по складам (то, что отдаёт /api/stocks/data)."""
+    items = enrich_stocks_from_products(items, products)
+    nm_to_photo = _nm_to_photo(products)
+    total_qty_all = 0
+    total_in_transit_all = 0
+
+    prod_map: Dict[tuple, Dict[str, Any]] = {}
+    wh_map: Dict[str, Dict[str, Any]] = {}
+    for it in items:
+        qty_i = int(it.get("qty", 0) or 0)
+        in_transit_i = int(it.get("in_transit", 0) or 0)
+        total_qty_all += qty_i
+        total_in_transit_all += in_transit_i
+
+        key = stock_row_product_key(it)
+        rec = prod_map.get(key)
+        if not rec:
+            rec = {
+                "vendor_code": it.get("vendor_code") or "",
+                "barcode": it.get("barcode") or "",
+                "nm_id": it.get("nm_id"),
+                "name": it.get("name") or "",
+                "total_qty": 0,
+                "total_in_transit": 0,
+                "warehouses": [],
+            }
+            prod_map[key] = rec
+        rec["total_qty"] += qty_i
+        if not rec.get("vendor_code") and it.get("vendor_code"):
+            rec["vendor_code"] = it.get("vendor_code")
+        if not rec.get("name") and it.get("name"):
+            rec["name"] = it.get("name")
+        if not rec.get("barcode") and it.get("barcode"):
+            rec["barcode"] = it.get("barcode")
+        if rec.get("nm_id") is None and it.get("nm_id") is not None:
+            rec["nm_id"] = it.get("nm_id")
+        rec["warehouses"].append((it.get("warehouse") or "", qty_i, in_transit_i))
+
+        w = it.get("warehouse") or ""
+        wrec = wh_map.get(w)
+        if not wrec:
+            wrec = wh_map[w] = {"warehouse": w, "total_qty": 0, "total_in_transit": 0, "products": []}
+        wrec["total_qty"] += qty_i
+        wrec["total_in_transit"] += in_transit_i
+        product = {
+            "vendor_code": it.get("vendor_code"),
+            "nm_id": it.get("nm_id"),
+            "barcode": it.get("barcode"),
+            "name": it.get("name") or "",
+            "qty": qty_i,
+            "in_transit": in_transit_i,
+        }
+        if product["nm_id"] is not None:
+            product["photo"] = _photo_for(nm_to_photo, product["nm_id"])
+        wrec["products"].append(product)
+
+    products_agg = []
+    for rec in prod_map.values():
+        qty_acc: Dict[str, int] = defaultdict(int)
+        transit_acc: Dict[str, int] = defaultdict(int)
+        for name, qty, in_transit in rec["warehouses"]:
+            qty_acc[name] += qty
+            transit_acc[name] += in_transit
+        rec["total_in_transit"] = sum(transit_acc.values())
+        rec["warehouses"] = [
+            {"warehouse": name, "qty": qty, "in_transit": transit_acc.get(name, 0)}
+            for name, qty in qty_acc.items()
+            if qty > 0 or transit_acc.get(name, 0) > 0
+        ]
+        rec["warehouses"].sort(key=lambda x: (-x["qty"], x["warehouse"]))
+        if rec.get("nm_id") is not None:
+            rec["photo"] = _photo_for(nm_to_photo, rec["nm_id"])
+        products_agg.append(rec)
+    products_agg.sort(key=lambda x: (-x["total_qty"], x["vendor_code"] or x.get("name") or ""))
+
+    for wrec in wh_map.values():
+        wrec["products"].sort(key=lambda x: (-x["qty"], x["vendor_code"] or x.get("name") or ""))
+    warehouses_agg = sorted(wh_map.values(), key=lambda x: (-x["total_qty"], x["warehouse"] or ""))
+
+    return {
+        "products": products_agg,
+        "warehouses": warehouses_agg,
+        "total_qty_all": total_qty_all,
+        "total_in_transit_all": total_in_transit_all,
+        "updated_at": updated_at,
+    }
+
+
+def _stocks_view_path(user_id: int) -> str:
+    return user_cache_path(user_id, "stocks_view")
+
+
+def _view_source(user_id: int) -> Dict[str, Any]:
+    return {
+        "stocks_mtime": _mtime(user_cache_path(user_id, "stocks")),
+        "products_mtime": _mtime(user_cache_path(user_id, "products")),
+    }
+
+
+def save_stocks_view_for_user(user_id: int, stocks_payload: Dict[str, Any] | None = None) -> Dict[str, Any] | None:
+    """Собирает и сохраняет снимок по кэшам остатков и товаров пользователя.
+
+    stocks_payload — только что сохранённые остатки (чтобы не читать файл заново).
+    Снимок: {"v": STOCKS_VIEW_VERSION, "etag", "source": {"stocks_mtime", "products_mtime"},
+    "data": {"products", "warehouses", "total_qty_all", "total_in_transit_all", "updated_at"}}.
+    """
+    from utils.cache import atomic_write_json, load_products_cache_for_user, load_stocks_cache_for_user
+
+    try:
+        source = _view_source(user_id)
+        if stocks_payload is None:
+            stocks_payload = load_stocks_cache_for_user(user_id)
+        if not stocks_payload:
+            return None
+        products = (load_products_cache_for_user(user_id) or {}).get("items") or []
+        data = build_stocks_view(
+            [dict(it) for it in (stocks_payload.get("items") or []) if isinstance(it, dict)],
+            products,
+            stocks_payload.get("updated_at"),
+        )
+        body = json.dumps(data, ensure_ascii=False, sort_keys=True)
+        view = {
+            "v": STOCKS_VIEW_VERSION,
+            "etag": hashlib.sha1(body.encode("utf-8")).hexdigest(),
+            "source": source,
+            "data": data,
+        }
+        path = _stocks_view_path(user_id)
+        atomic_write_json(path, view)
+        _VIEW_MEMO.put(int(user_id), (_mtime(path), view), size=len(body) * 3)
+        return view
+    except Exception as e:
+        print(f"Ошибка сборки снимка остатков для пользователя {user_id}: {e}")
+        return None
+
+
+def _load_stocks_view(user_id: int) -> Dict[str, Any] | None:
+    path = _stocks_view_path(user_id)
+    mtime = _mtime(path)
+    if mtime is None:
+        return None
+    memo = _VIEW_MEMO.get(int(user_id))
+    if memo is not None and memo[0] == mtime:
+        return memo[1]
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            view = json.load(f)
+    except Exception:
+        return None
+    _VIEW_MEMO.put(int(user_id), (mtime, view), size=os.path.getsize(path) * 3)
+    return view
+
+
+def stocks_view_for_user(user_id: int) -> Dict[str, Any] | None:
+    """Актуальный снимок остатков пользователя (пересобирается, если устарел или другой версии).
+
+    source — mtime кэшей остатков и товаров, из которых собран снимок: если их переписал
+    код, который не знает про снимок, он пересобирается при этом чтении.
+    """
+    view = _load_stocks_view(user_id)
+    if (
+        isinstance(view, dict)
+        and view.get("v") == STOCKS_VIEW_VERSION
+        and view.get("source") == _view_source(user_id)
+        and isinstance(view.get("data"), dict)
+    ):
+        return view
+    return save_stocks_view_for_user(user_id)
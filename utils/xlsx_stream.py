@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""Потоковая запись XLSX: книга отдаётся ответу кусками по мере записи строк."""
+import re
+import zipfile
+from datetime import date, datetime
+from math import isfinite
+from typing import Any, Iterable, Iterator, List, Optional, Sequence
+
+# Лимит строк листа Excel
+XLSX_MAX_ROWS = 1048576
+# Лимит символов в ячейке Excel
+XLSX_MAX_CELL_CHARS = 32767
+# Размер куска ответа, байт
+XLSX_STREAM_CHUNK = 256 * 1024
+# Строк в одной записи в ZIP (меньше вызовов write и сжатия мелкими порциями)
+_ROWS_PER_WRITE = 500
+# Быстрое сжатие: выгрузка упирается в CPU воркера, а не в сеть
+_COMPRESSLEVEL = 1
+
+# Управляющие символы, недопустимые в XML 1.0
+_ILLEGAL_XML_CHARS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+_XML_SPECIAL = re.compile(r"[&<>\x00-\x08\x0b\x0c\x0e-\x1f]")
+_END = object()
+
+_CONTENT_TYPES_HEAD = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+)
+_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+# Стиль 0 — обычный, 1 — жирный (шапка)
+_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+_SHEET_HEAD = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+)
+
+
+class _ChunkSink:
+    """Приёмник ZipFile без seek/tell: копит записанные байты до выдачи ответу."""
+
+    def __init__(self) -> None:
+        self._parts: List[bytes] = []
+        self.size = 0
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts = []
+        self.size = 0
+        return data
+
+
+def _escape(s: str) -> str:
+    if _ILLEGAL_XML_CHARS.search(s):
+        s = _ILLEGAL_XML_CHARS.sub("", s)
+    return s.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def _text_cell(s: str, style: str) -> str:
+    if len(s) > XLSX_MAX_CELL_CHARS:
+        s = s[:XLSX_MAX_CELL_CHARS]
+    if _XML_SPECIAL.search(s):
+        s = _escape(s)
+    if s[0].isspace() or s[-1].isspace():
+        return f'<c t="inlineStr"{style}><is><t xml:space="preserve">{s}</t></is></c>'
+    return f'<c t="inlineStr"{style}><is><t>{s}</t></is></c>'
+
+
+def _cell(v: Any, style: str = "") -> str:
+    t = type(v)
+    if t is float:
+        return f"<c{style}><v>{v!r}</v></c>" if isfinite(v) else "<c/>"
+    if t is int:
+        return f"<c{style}><v>{v}</v></c>"
+    if t is str:
+        return _text_cell(v, style) if v else "<c/>"
+    if v is None:
+        return "<c/>"
+    if t is bool:
+        return f'<c t="b"{style}><v>{int(v)}</v></c>'
+    if isinstance(v, (datetime, date)):
+        return _text_cell(v.isoformat(), style)
+    s = str(v)
+    return _text_cell(s, style) if s else "<c/>"
+
+
+def _row_xml(n: int, values: Iterable[Any]) -> str:
+    return f'<row r="{n}">' + "".join(map(_cell, values)) + "</row>"
+
+
+def _sheet_start(widths: Optional[Sequence[float]], header: Optional[Sequence[Any]]) -> str:
+    parts = [_SHEET_HEAD]
+    if widths:
+        parts.append("<cols>")
+        parts.extend(
+            f'<col min="{i}" max="{i}" width="{float(w):g}" customWidth="1"/>'
+            for i, w in enumerate(widths, 1)
+            if w
+        )
+        parts.append("</cols>")
+    parts.append("<sheetData>")
+    if header:
+        parts.append('<row r="1">' + "".join(_cell(h, ' s="1"') for h in header) + "</row>")
+    return "".join(parts)
+
+
+def _sheet_name(title: str, n: int) -> str:
+    # Запрещённые в имени листа символы и лимит 31 символ
+    title = re.sub(r"[\[\]:*?/\\]", " ", str(title or "")).strip() or "Sheet"
+    if n == 1:
+        return title[:31]
+    suffix = f" ({n})"
+    return title[:31 - len(suffix)] + suffix
+
+
+def iter_xlsx(
+    rows: Iterable[Sequence[Any]],
+    *,
+    header: Optional[Sequence[Any]] = None,
+    sheet_title: str = "Sheet1",
+    column_widths: Optional[Sequence[float]] = None,
+    chunk_size: int = XLSX_STREAM_CHUNK,
+) -> Iterator[bytes]:
+    """
+    Книга XLSX из одного листа (продолжение — на следующих листах, если строк больше
+    лимита Excel) кусками байт по ~chunk_size. rows читаются лениво, по одному разу:
+    это может быть генератор, загружающий данные по частям.
+    Числа (int/float) пишутся числами, None и "" — пустыми ячейками, остальное — текстом
+    (inlineStr: sharedStrings пришлось бы копить до конца листа). Шапка — жирным, остальное
+    без стилей. В памяти только текущая пачка строк и один кусок ответа.
+    """
+    sink = _ChunkSink()
+    zf = zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=_COMPRESSLEVEL)
+    first_data_row = 2 if header else 1
+    per_sheet = XLSX_MAX_ROWS - first_data_row + 1
+    sheet_names: List[str] = []
+    it = iter(rows)
+    exhausted = False
+    while not exhausted:
+        sheet_no = len(sheet_names) + 1
+        sheet_names.append(_sheet_name(sheet_title, sheet_no))
+        with zf.open(f"xl/worksheets/sheet{sheet_no}.xml", "w", force_zip64=True) as f:
+            f.write(_sheet_start(column_widths, header).encode("utf-8"))
+            row_no = first_data_row
+            last_row = first_data_row + per_sheet - 1
+            batch: List[str] = []
+            while True:
+                values = next(it, _END)
+                if values is _END:
+                    exhausted = True
+                    break
+                batch.append(_row_xml(row_no, values))
+                row_no += 1
+                if len(batch) >= _ROWS_PER_WRITE:
+                    f.write("".join(batch).encode("utf-8"))
+                    batch = []
+                    if sink.size >= chunk_size:
+                        yield sink.drain()
+                if row_no > last_row:
+                    break
+            if batch:
+                f.write("".join(batch).encode("utf-8"))
+            f.write(b"</sheetData></worksheet>")
+        if sink.size >= chunk_size:
+            yield sink.drain()
+        # Ровно на границе листа строки могли закончиться — пустой лист не добавляем
+        if not exhausted:
+            peek = next(it, _END)
+            if peek is _END:
+                exhausted = True
+            else:
+                it = _prepend(peek, it)
+
+    zf.writestr("xl/styles.xml", _STYLES)
+    zf.writestr("xl/workbook.xml", _workbook_xml(sheet_names))
+    zf.writestr("xl/_rels/workbook.xml.rels", _workbook_rels(len(sheet_names)))
+    zf.writestr("_rels/.rels", _ROOT_RELS)
+    zf.writestr("[Content_Types].xml", _content_types(len(sheet_names)))
+    zf.close()
+    yield sink.drain()
+
+
+def _prepend(first: Any, rest: Iterator[Any]) -> Iterator[Any]:
+    yield first
+    yield from rest
+
+
+def _workbook_xml(sheet_names: Sequence[str]) -> str:
+    sheets = "".join(
+        f'<sheet name="{_escape(name)}" sheetId="{i}" r:id="rId{i}"/>'
+        for i, name in enumerate(sheet_names, 1)
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        f"<sheets>{sheets}</sheets></workbook>"
+    )
+
+
+def _workbook_rels(sheets: int) -> str:
+    rels = "".join(
+        f'<Relationship Id="rId{i}" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        f'Target="worksheets/sheet{i}.xml"/>'
+        for i in range(1, sheets + 1)
+    )
+    rels += (
+        f'<Relationship Id="rId{sheets + 1}" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+        'Target="styles.xml"/>'
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        f"{rels}</Relationships>"
+    )
+
+
+def _content_types(sheets: int) -> str:
+    overrides = "".join(
+        f'<Override PartName="/xl/worksheets/sheet{i}.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        for i in range(1, sheets + 1)
+    )
+    return _CONTENT_TYPES_HEAD + overrides + "</Types>"